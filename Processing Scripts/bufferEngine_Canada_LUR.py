@@ -0,0 +1,222 @@
+################# bufferEngine_Canada_LUR.py ##################
+#
+# Concentric multi-ring buffer engine for the Canada LUR buffer variables.
+# Instead of creating one buffer shapefile per radius in BUFFER_DISTANCE and re-intersecting every variable
+# for every radius, each air monitor is treated as the centre of a nested set of rings (50m ... 20km).
+# The data around a monitor is read once for the largest radius, every element (e.g. raster cell) is assigned
+# to the smallest ring that contains it, and partial sums are accumulated ring by ring.  The statistics for
+# all radii are then obtained with a single cumulative sum, so the 20km result reuses the 15km partial sums.
+# Polyline variables (roads and rail) go through the same pass: their segments are clipped against every ring
+# at once by roadLength_Canada_LUR.py, so the ring engine covers both input types of the ArcGIS buffer workflow.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# ArcGIS (tested on ArcGIS v. 10.2) - used for RasterToNumPyArray and the data access module.  ArcGIS is optional
+#     when rasters are processed with the NumPy backend in zonalStatistics_Canada_LUR.py
+# numpy, pandas, fiona (polyline variables)
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+try:
+    import arcpy
+except ImportError:
+    arcpy = None # ring calculations are still available to the NumPy backend
+import numpy as np
+import constantValues as values
+import roadLength_Canada_LUR as roadLength
+import zonalStatistics_Canada_LUR as zonalStatistics
+import time
+############## end of module import ##################
+
+
+
+################# functions ##################################
+
+# create the sorted set of ring edges from a list of buffer distances
+# INPUTS:
+#    bufferDistances (int list) - buffer radii, in meters
+# OUTPUTS:
+#    ringEdges (float array) - unique buffer radii in ascending order
+def makeRingEdges(bufferDistances):
+    ringEdges = np.unique(np.asarray(bufferDistances, dtype=np.float64))
+    return ringEdges
+### end of makeRingEdges ###
+
+
+# assign each element to the smallest ring that contains it.  Elements that fall outside the largest ring
+# are assigned the index len(ringEdges)
+# INPUTS:
+#    distances (float array) - distance from the monitor to each element, in meters
+#    ringEdges (float array) - ring radii in ascending order
+# OUTPUTS:
+#    ringIndex (int array) - ring index of each element
+def assignRings(distances, ringEdges):
+    ringIndex = np.searchsorted(ringEdges, distances, side='left')
+    return ringIndex
+### end of assignRings ###
+
+
+# sum weights by ring and convert the per ring totals into cumulative totals for every radius
+# INPUTS:
+#    ringIndex (int array) - ring index of each element, as returned by assignRings
+#    weights (float array) - value to accumulate for each element.  If None, elements are counted
+#    numRings (int) - number of rings
+# OUTPUTS:
+#    cumulativeTotals (float array) - total of weights inside each radius
+def accumulateRings(ringIndex, weights, numRings):
+    ringTotals = np.bincount(ringIndex, weights=weights, minlength=numRings + 1)[0:numRings]
+    cumulativeTotals = np.cumsum(ringTotals)
+    return cumulativeTotals
+### end of accumulateRings ###
+
+
+# derive the variable identifier used for buffer fields, e.g. N6.tif with a 500m buffer becomes N6500m
+# INPUTS:
+#    variable (str) - variable filename as listed in constantValues
+#    bufferDistance (int) - buffer radius, in meters
+# OUTPUTS:
+#    variableIdent (str) - field name for the variable and buffer distance
+def determineVariableIdentifier(variable, bufferDistance):
+    variableIdent = variable[0] + variable[1] + str(int(bufferDistance)) + "m"
+    return variableIdent
+### end of determineVariableIdentifier ###
+
+
+# read the identifiers and coordinates of all air monitors in a shapefile
+# INPUTS:
+#    airMonitorFile (str) - full filepath to the air monitor shapefile
+# OUTPUTS:
+#    monitorIds (int array) - air monitor identifiers
+#    monitorX, monitorY (float arrays) - air monitor coordinates, in the units of the shapefile projection
+def readAirMonitorPoints(airMonitorFile):
+    monitorIds = []
+    monitorX = []
+    monitorY = []
+    with arcpy.da.SearchCursor(airMonitorFile, [values.AIRMONITOR_ID, "SHAPE@X", "SHAPE@Y"]) as cursor:
+        for row in cursor:
+            monitorIds.append(row[0])
+            monitorX.append(row[1])
+            monitorY.append(row[2])
+    return np.asarray(monitorIds), np.asarray(monitorX, dtype=np.float64), np.asarray(monitorY, dtype=np.float64)
+### end of readAirMonitorPoints ###
+
+
+# read the square window of raster cells that covers a circle around a single point
+# INPUTS:
+#    raster (arcpy.Raster) - raster to read from
+#    centreX, centreY (float) - coordinates of the circle centre
+#    radius (float) - circle radius, in meters
+# OUTPUTS:
+#    windowValues (float array) - raster values in the window, NoData cells are NaN
+#    cellX, cellY (float arrays) - coordinates of the window cell centres, same shape as windowValues
+def readRasterWindow(raster, centreX, centreY, radius):
+    cellWidth = raster.meanCellWidth
+    cellHeight = raster.meanCellHeight
+    extent = raster.extent
+    firstCol = max(0, int(np.floor((centreX - radius - extent.XMin) / cellWidth)))
+    lastCol = min(raster.width, int(np.ceil((centreX + radius - extent.XMin) / cellWidth)))
+    firstRow = max(0, int(np.floor((extent.YMax - centreY - radius) / cellHeight)))
+    lastRow = min(raster.height, int(np.ceil((extent.YMax - centreY + radius) / cellHeight)))
+    if lastCol <= firstCol or lastRow <= firstRow:
+        emptyWindow = np.zeros((0, 0))
+        return emptyWindow, emptyWindow, emptyWindow
+    numCols = lastCol - firstCol
+    numRows = lastRow - firstRow
+    lowerLeft = arcpy.Point(extent.XMin + firstCol * cellWidth, extent.YMax - lastRow * cellHeight)
+    windowValues = arcpy.RasterToNumPyArray(raster, lowerLeft, numCols, numRows, np.nan).astype(np.float64)
+    colCentres = extent.XMin + (firstCol + np.arange(numCols) + 0.5) * cellWidth
+    rowCentres = extent.YMax - (firstRow + np.arange(numRows) + 0.5) * cellHeight
+    cellX, cellY = np.meshgrid(colCentres, rowCentres)
+    return windowValues, cellX, cellY
+### end of readRasterWindow ###
+
+
+# calculate the mean raster value within every ring radius for every air monitor.  The raster window for each
+# monitor is read only once, for the largest radius, and cells crossed by a buffer edge are weighted by their
+# sub-cell coverage with zonalStatistics.diskStatistics, as the meanCellHeight/10 resampling of the ArcGIS path
+# INPUTS:
+#    rasterFile (str) - full filepath to the raster
+#    monitorX, monitorY (float arrays) - air monitor coordinates, in the raster projection
+#    ringEdges (float array) - ring radii in ascending order
+# OUTPUTS:
+#    ringMeans (float array) - mean raster value, with shape (number of monitors, number of rings).
+#                              NaN where a buffer contains no valid cells
+def rasterRingMeans(rasterFile, monitorX, monitorY, ringEdges):
+    raster = arcpy.Raster(rasterFile)
+    numRings = len(ringEdges)
+    ringMeans = np.full((len(monitorX), numRings), np.nan)
+    for monitorIndex in range(len(monitorX)):
+        windowValues, cellX, cellY = readRasterWindow(raster, monitorX[monitorIndex], monitorY[monitorIndex], ringEdges[-1])
+        if not np.isfinite(windowValues).any():
+            continue
+        ringSums, ringWeights = zonalStatistics.diskStatistics(windowValues[np.newaxis], cellX - monitorX[monitorIndex],
+                                                               cellY - monitorY[monitorIndex], raster.meanCellWidth,
+                                                               raster.meanCellHeight, ringEdges, values.COVERAGE_SUBSAMPLES)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ringMeans[monitorIndex] = np.where(ringWeights[0] > 0, ringSums[0] / ringWeights[0], np.nan)
+    del raster
+    return ringMeans
+### end of rasterRingMeans ###
+
+
+# calculate buffer statistics for all rasters and polylines and all buffer distances for one air monitor
+# partition.  Polyline lengths for all rings come from the segment index of roadLength_Canada_LUR.py
+# INPUTS:
+#    airMonitorFile (str) - full filepath to the air monitor partition shapefile
+#    rasterList (str list) - raster variables to process, relative to INPUT_FOLDER
+#    polylineList (str list) - polyline variables to process, relative to INPUT_FOLDER.  None for no polylines
+# OUTPUTS:
+#    monitorIds (int array) - air monitor identifiers
+#    results (dict) - maps each variable identifier (e.g. N6500m, aR500m) to an array of values, one per monitor
+def runRingEngine(airMonitorFile, rasterList, polylineList=None):
+    if polylineList is None:
+        polylineList = []
+    ringEdges = makeRingEdges(values.BUFFER_DISTANCE)
+    monitorIds, monitorX, monitorY = readAirMonitorPoints(airMonitorFile)
+    results = {}
+    for variable in rasterList:
+        startTime = time.time()
+        ringMeans = rasterRingMeans(values.INPUT_FOLDER + variable, monitorX, monitorY, ringEdges)
+        for ringNum in range(len(ringEdges)):
+            results[determineVariableIdentifier(variable, ringEdges[ringNum])] = ringMeans[:, ringNum]
+        print("completed all buffer distances for " + variable + " in " + str(time.time() - startTime) + " seconds")
+    for variable in polylineList:
+        startTime = time.time()
+        bufferLengths = roadLength.polylineFileBufferLengths(values.INPUT_FOLDER + variable, monitorX, monitorY, ringEdges)
+        for ringNum in range(len(ringEdges)):
+            results[determineVariableIdentifier(variable, ringEdges[ringNum])] = bufferLengths[:, ringNum]
+        print("completed all buffer distances for " + variable + " in " + str(time.time() - startTime) + " seconds")
+    return monitorIds, results
+### end of runRingEngine ###
+
+
+# write buffer statistics into the air monitor partition shapefile in a single update pass
+# INPUTS:
+#    airMonitorFile (str) - full filepath to the air monitor partition shapefile
+#    monitorIds (int array) - air monitor identifiers, as returned by runRingEngine
+#    results (dict) - maps each variable identifier to an array of values, one per monitor
+def writeRingResults(airMonitorFile, monitorIds, results):
+    fieldNames = sorted(results.keys())
+    existingFields = [field.name for field in arcpy.ListFields(airMonitorFile)]
+    for fieldName in fieldNames:
+        if fieldName not in existingFields:
+            arcpy.AddField_management(airMonitorFile, fieldName, "DOUBLE", "", "")
+    rowLookup = {}
+    for rowIndex in range(len(monitorIds)):
+        rowLookup[monitorIds[rowIndex]] = rowIndex
+    with arcpy.da.UpdateCursor(airMonitorFile, [values.AIRMONITOR_ID] + fieldNames) as cursor:
+        for row in cursor:
+            rowIndex = rowLookup[row[0]]
+            for fieldIndex in range(len(fieldNames)):
+                value = results[fieldNames[fieldIndex]][rowIndex]
+                row[fieldIndex + 1] = None if np.isnan(value) else float(value)
+            cursor.updateRow(row)
+    print("completed adding " + str(len(fieldNames)) + " buffer variables to " + airMonitorFile)
+### end of writeRingResults ###
+
+################# end of functions ############################
+
+
+############### end of bufferEngine_Canada_LUR.py ###############
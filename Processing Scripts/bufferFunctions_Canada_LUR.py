@@ -31,6 +31,12 @@ import time
 import sys
 import shutil
 import constantValues
+import bufferEngine_Canada_LUR as bufferEngine
+import sharedGeometry_Canada_LUR as sharedGeometry
+import pointSampler_Canada_LUR as pointSampler
+import nearestDistance_Canada_LUR as nearestDistance
+import zoneAssignment_Canada_LUR as zoneAssignment
+import mosaicCatalog_Canada_LUR as mosaicCatalog
 ############## end of module import ##################
 
 
@@ -47,53 +53,40 @@ def determineAirMonitorIdentifier(airMonitorPartitionFile):
 ### end of determineAirMonitorIdentifier
 
 
+# determine the variable identifier (e.g. N6500m) from the name of a buffer shapefile or in-memory buffer
+def determineBufferIdentifier(bufferFile):
+    bufferIndex = str(bufferFile).rfind("buffer") + 6
+    variableIdent = bufferFile[bufferIndex:]
+    if(variableIdent[-4:] == ".shp"):
+        variableIdent = variableIdent[0:-4]
+    return variableIdent
+### end of determineBufferIdentifier
+
+
+# assign each air monitor to the zone polygon containing it, or the closest zone polygon, with the in-memory
+# zone index (zoneAssignment_Canada_LUR.py), and write the monitors with a zone field to w_zones.shp
 def assignZones():
-    #relpath = os.path.dirname(os.path.realpath(__file__))
     zoneDefined = values.RESULTS_FOLDER + "w_zones.shp"
     print("defined zoneDefined")
-    arcpy.SpatialJoin_analysis(values.INPUT_FOLDER + values.MONITOR_FILE,values.INPUT_FOLDER + values.ZONE_DEFINITIONS,zoneDefined,"JOIN_ONE_TO_ONE","KEEP_ALL","#","CLOSEST","#","#")
+    zoneAssignment.writeMonitorZones(values.INPUT_FOLDER + values.MONITOR_FILE, values.INPUT_FOLDER + values.ZONE_DEFINITIONS, zoneDefined)
     print("completed zone assignments")
     return zoneDefined
 
 
-# calculate point values for air monitoring stations
+# calculate point values for air monitoring stations.  All point variables are sampled in one pass
+# (pointSampler_Canada_LUR.py), distances to the nearest port, coastline etc. are calculated for all layers in
+# DISTANCE_VARIABLES (nearestDistance_Canada_LUR.py), and both are written to the air monitor shapefile in a
+# single update
 def runPointAnalysis(airMonitorFile, pointList):
-    #calculate distance from coast to air monitor location
-    #arcpy.Near_analysis(values.INPUT_FOLDER + values.MONITOR_FILE, values.INPUT_FOLDER +  
-    #                    values.COAST_BOUNDARY,search_radius="#",location="NO_LOCATION",angle="NO_ANGLE",method="PLANAR")  
-    rasterArgumentsList = ""
-    # for each raster file used as point value data source, add it to the extract multivalues list and run extractMutliValues with arcpy
-    if(len(pointList) >0):
-        for pointFile in pointList:
-            rasterArgument = values.INPUT_FOLDER + pointFile
-            outputFile = values.RESULTS_FOLDER + "pointAnalysisTemp.shp"
-            arcpy.sa.ExtractValuesToPoints(airMonitorFile, rasterArgument,values.RESULTS_FOLDER + "pointAnalysisTemp.shp", "NONE")
-            arcpy.AddField_management(outputFile, pointFile[0:2], "DOUBLE", "", "")
-            expression2 = "!" + "RASTERVALU" + "! * 1"
-            arcpy.CalculateField_management(outputFile, pointFile[0:2], expression2, "PYTHON")
-            arcpy.DeleteField_management(outputFile, "RASTERVALU")
-            arcpy.CopyFeatures_management(outputFile, airMonitorFile)  
+    if(len(pointList) >0 or len(values.DISTANCE_VARIABLES) > 0):
+        monitorIds, results = pointSampler.runPointSampler(airMonitorFile, pointList)
+        results.update(nearestDistance.runDistanceAnalysis(airMonitorFile)[1])
+        bufferEngine.writeRingResults(airMonitorFile, monitorIds, results)
     else:
         print("there are no point variables to process")
     print("completed calculating point values for the air monitor data set")
 ### end runPointAnalysis ###
 
-def testProgress(result):
-    print("we're testing progress")
-    timeDif = 0
-    while(timeDif <values.RATER_PROCESS_WAIT_TIME):
-        try:
-            result.get(timeout=values.RATER_PROCESS_WAIT_TIME)
-            if(result.successful()==True):
-                break            
-        except Exception as e:
-            print("timeout" + str(e))
-        #print(os.path.getmtime("E:/pyResults2/tempStats/teworkfile.txt"))
-        timeDif = time.time() - os.path.getmtime(values.RESULTS_FOLDER + values.TEMP_STATS_WORKSPACE + "/" + values.TEST_PROGRESS_FILE)
-        print(timeDif)
-    print("multiprocessing has either completed or stopped progress")
-
-
 def determineAirMonitorZone(airMonitorPartitionFile):
     startLocation = airMonitorPartitionFile.rfind(values.ZONE_KEYWORD)
     endLocation = airMonitorPartitionFile.rfind(values.PARTITION_KEYWORD)
@@ -102,21 +95,12 @@ def determineAirMonitorZone(airMonitorPartitionFile):
 ### end of determineAirMonitorZone
 
 
+# look up the mosaic of a zone in the persisted catalog of the mosaic folder (mosaicCatalog_Canada_LUR.py).
+# The folder is only scanned again when it has changed
 def determineMosaicFile(mosaicFolder, zoneIdentifier, fileType):
-    selectFile=[]
-    fileList = os.listdir(values.INPUT_FOLDER + mosaicFolder)
-    if fileType == values.RASTER_TYPE or fileType == values.POINT_TYPE:
-        extension = ".tif"
-    elif(fileType == values.POLYLINE_TYPE):
-        extension = ".shp"
-    fileList = os.listdir(values.INPUT_FOLDER + mosaicFolder)
-    for file in fileList:
-        startLocation = file.rfind("z")
-        endLocation = file.rfind(extension)
-        zoneValue = file[startLocation+1:endLocation]
-        if zoneValue == zoneIdentifier:
-            #print("the file for the zone value is: " + file[0:endLocation] + extension)
-            selectFile = mosaicFolder + "/" + file[0:endLocation] + extension 
+    selectFile = mosaicCatalog.lookupMosaicFile(mosaicFolder, zoneIdentifier, fileType)
+    if selectFile is None:
+        return []
     return selectFile
 
 # partition a shapefile with a large number of air monitoring stations into several shapefiles with a smaller
@@ -155,19 +139,19 @@ def partitionShapefile(airMonitorFile):
 
 
 
-# add varaible values to the partition air monitor shapefile
+# add varaible values to the partition air monitor shapefile.  Polyline and point buffer values are joined on the
+# monitor FID that makeInMemoryBuffer writes to TABLE_ID, since in_memory object ids start at 1 and not at 0
 def addVariableToPartition(argument, airMonitor,valueType):
-    bufferIndex = str(argument[0]).rfind("buffer") + 6
-    variableIdent = argument[0][bufferIndex:-4]
+    variableIdent = determineBufferIdentifier(argument[0])
     if(valueType == values.RASTER_TYPE):
         valueFile = argument[2] + variableIdent + ".shp"
         arcpy.JoinField_management(airMonitor,"FID",valueFile,values.AIRMONITOR_ID,variableIdent)
     elif(valueType == values.POLYLINE_TYPE):
         valueFile = argument[2] + variableIdent + "d.shp"
-        arcpy.JoinField_management(airMonitor,"FID",valueFile,values.BUFFER_ID,variableIdent)
+        arcpy.JoinField_management(airMonitor,"FID",valueFile,values.TABLE_ID,variableIdent)
     elif(valueType == values.POINT_BUFFER_TYPE):
         valueFile = argument[2] + variableIdent + "d.shp"
-        arcpy.JoinField_management(airMonitor,"FID",valueFile,values.BUFFER_ID,variableIdent)        
+        arcpy.JoinField_management(airMonitor,"FID",valueFile,values.TABLE_ID,variableIdent)        
     print ("completed adding the " + variableIdent + " to the air monitor partition " + airMonitor)
 ### end of addVariableToPartition
 
@@ -201,24 +185,45 @@ def makeMultipleBuffers(partitionFile):
         makeBuffer(buffer,partitionFile, bufferFolder)
 ### end of makeBuffers
 
-# create a copy of the buffer file for each parallel processing thread
-def createBufferFileCopy(masterBufferFile, variable, identifier, buffer, partitionFolderOut):
-    tempFileName = "buffer" + variable[0] + variable[1] + buffer + "m.shp"
-    tempBufferFile = partitionFolderOut + values.BUFFER_EXTENSION + tempFileName
-    arcpy.CopyFeatures_management(masterBufferFile, tempBufferFile)
-    return tempBufferFile
-### end of createBufferFileCopy
-
-
-# create a list of arguments to pass into the wrapper function for parallel processing of a variable
-def createArgumentList(variableList, partitionFolderOut, masterBufferFile,identifier,buffer,airMonitor):
+# publish the coordinates of the air monitors in a partition to a memory-mapped file shared read-only by
+# all worker processes.  The file is only rewritten if the partition shapefile has changed
+def publishSharedCoordinates(airMonitorFile, partitionFolderOut):
+    sharedFile = partitionFolderOut + values.SHARED_COORDINATE_FILE
+    if not os.path.exists(partitionFolderOut): os.makedirs(partitionFolderOut)
+    if(not os.path.exists(sharedFile) or os.path.getmtime(sharedFile) < os.path.getmtime(airMonitorFile)):
+        monitorIds, monitorX, monitorY = bufferEngine.readAirMonitorPoints(airMonitorFile)
+        sharedGeometry.publishCoordinates(sharedFile, monitorIds, monitorX, monitorY)
+    return sharedFile
+### end of publishSharedCoordinates
+
+
+# create the buffer polygons for a task in the in_memory workspace of the worker process, from the shared
+# monitor coordinates.  Replaces the per task shapefile copy of the buffer file
+def makeInMemoryBuffer(inMemoryBuffer, sharedFile, bufferDistance, airMonitorFile):
+    if(arcpy.Exists(inMemoryBuffer)):
+        arcpy.Delete_management(inMemoryBuffer)
+    spatialReference = arcpy.Describe(airMonitorFile).spatialReference
+    arcpy.CreateFeatureclass_management("in_memory", inMemoryBuffer[inMemoryBuffer.rfind("/") + 1:], "POLYGON",
+                                        spatial_reference=spatialReference)
+    arcpy.AddField_management(inMemoryBuffer, values.TABLE_ID, "LONG", "", "")
+    monitorIds, monitorX, monitorY = sharedGeometry.readSharedMonitors(sharedFile)
+    with arcpy.da.InsertCursor(inMemoryBuffer, ["SHAPE@", values.TABLE_ID]) as cursor:
+        for monitorIndex in range(len(monitorIds)):
+            monitorPoint = arcpy.PointGeometry(arcpy.Point(monitorX[monitorIndex], monitorY[monitorIndex]), spatialReference)
+            cursor.insertRow([monitorPoint.buffer(float(bufferDistance)), int(monitorIds[monitorIndex])])
+    return inMemoryBuffer
+### end of makeInMemoryBuffer
+
+
+# create a list of arguments to pass into the wrapper function for parallel processing of a variable.
+# Each argument refers to an in_memory buffer that the worker builds from the shared coordinate file
+def createArgumentList(variableList, partitionFolderOut, sharedFile,identifier,buffer,airMonitor):
     argumentList = []
     for variable in variableList: # for each variable that we want to proces (i.e. included in the list)
-        variableIdent = variable[0] + variable[1]
         variableOutputFolder = partitionFolderOut + variable[0] + variable[1] + "/" 
-        tempBufferFile = createBufferFileCopy(masterBufferFile, variable, identifier, str(buffer), partitionFolderOut)
+        inMemoryBuffer = "in_memory/buffer" + variable[0] + variable[1] + str(buffer) + "m"
         # add the created list of arguments to the master list of arguments to be used in the call for parallel processing
-        argumentList.append([tempBufferFile, values.INPUT_FOLDER + variable, variableOutputFolder, airMonitor, str(buffer)]) 
+        argumentList.append([inMemoryBuffer, values.INPUT_FOLDER + variable, variableOutputFolder, airMonitor, str(buffer), sharedFile]) 
     print("completed making arguments for parallel processing of buffer varaible analysis")
     return argumentList
 ### end of createArguemntList
@@ -226,9 +231,8 @@ def createArgumentList(variableList, partitionFolderOut, masterBufferFile,identi
 
 # calculate average values of a polyline file within given buffer areas
 def polylineBufferIntersect(bufferFile, variableFile,  variableOutputFolder, airMonitorFile, bufferSize):
-    bufferIndex = str(bufferFile).rfind("buffer") + 6
     variableIndex = str(variableFile).rfind("/") + 1
-    variableIdent = bufferFile[bufferIndex:-4]
+    variableIdent = determineBufferIdentifier(bufferFile)
     fileList = []
     if(os.path.exists(variableOutputFolder)):
         fileList = os.listdir(variableOutputFolder)
@@ -249,8 +253,9 @@ def polylineBufferIntersect(bufferFile, variableFile,  variableOutputFolder, air
     # intersect the buffer
     arcpy.Intersect_analysis(bufferFile +";" + variableFile, intersectFile, "ALL", "", "INPUT")
    
-    # combine line segments within each buffer zone (overlapping areas are accounted for)
-    arcpy.Dissolve_management(intersectFile,dissolveFile,values.BUFFER_ID,"#","MULTI_PART","DISSOLVE_LINES") 
+    # combine line segments within each buffer zone (overlapping areas are accounted for).  Buffers are identified
+    # by the monitor FID in TABLE_ID, not by their in_memory object id
+    arcpy.Dissolve_management(intersectFile,dissolveFile,values.TABLE_ID,"#","MULTI_PART","DISSOLVE_LINES") 
    
     # create a new field in the dissolved feature class
     arcpy.AddField_management(dissolveFile, fieldName, "DOUBLE", "", "")
@@ -264,15 +269,14 @@ def polylineBufferIntersect(bufferFile, variableFile,  variableOutputFolder, air
     
     
     
-    del (bufferFile, variableFile, airMonitorFile, bufferSize, bufferIndex, variableIndex, 
+    del (bufferFile, variableFile, airMonitorFile, bufferSize, variableIndex, 
          variableIdent, variableOutputFolder, intersectFile, dissolveFile, tableFile, fieldName)
     gc.collect()    
 
 
 def pointBufferIntersect(bufferFile, variableFile,  variableOutputFolder, airMonitorFile, bufferSize):
-    bufferIndex = str(bufferFile).rfind("buffer") + 6
     variableIndex = str(variableFile).rfind("/") + 1
-    variableIdent = bufferFile[bufferIndex:-4]
+    variableIdent = determineBufferIdentifier(bufferFile)
     intersectFile = variableOutputFolder + variableIdent + ".shp"
     dissolveFile = variableOutputFolder + variableIdent + "d.shp"    
     if not os.path.exists(variableOutputFolder): os.makedirs(variableOutputFolder)   
@@ -287,7 +291,7 @@ def pointBufferIntersect(bufferFile, variableFile,  variableOutputFolder, airMon
     # combine line segments within each buffer zone (overlapping areas are accounted for)
     # Replace a layer/table view name with a path to a dataset (which can be a layer file) or create the layer/table view within the script
     # The following inputs are layers or table views: "powerPlants_Intersect"
-    arcpy.Dissolve_management(intersectFile,dissolveFile,values.BUFFER_ID,"carbon_200 SUM","MULTI_PART","DISSOLVE_LINES")    
+    arcpy.Dissolve_management(intersectFile,dissolveFile,values.TABLE_ID,"carbon_200 SUM","MULTI_PART","DISSOLVE_LINES")    
      
     # create a new field in the dissolved feature class
     arcpy.AddField_management(dissolveFile, fieldName, "DOUBLE", "", "")
@@ -295,15 +299,14 @@ def pointBufferIntersect(bufferFile, variableFile,  variableOutputFolder, airMon
     # calculate the total length of polyline segments in each unique buffer and store the result in the new field
     arcpy.CalculateField_management(dissolveFile, fieldName, values.CARBON_COMMAND, "PYTHON")   
     
-    del (bufferFile, variableFile, airMonitorFile, bufferIndex, variableIndex, 
+    del (bufferFile, variableFile, airMonitorFile, variableIndex, 
          variableIdent, variableOutputFolder, intersectFile, dissolveFile, tableFile, fieldName)
     gc.collect()    
 
 def testFileCompletion(argumentList):
     fileCompletion = True
     for argument in argumentList:
-        bufferIndex = str(argument[0]).rfind("buffer") + 6
-        variableIdent = argument[0][bufferIndex:-4]
+        variableIdent = determineBufferIdentifier(argument[0])
         valueFile = argument[2] + variableIdent + ".shp"
         testTemp = 0
         if(os.path.isfile(valueFile)):
@@ -318,23 +321,31 @@ def testFileCompletion(argumentList):
 # parallel processing natively only accepts a single argument for input.  
 # this is a wrapper function to accept a single list of inputs from the parall
 def multi_run_raster_wrapper(args):
-    return rasterBufferIntersect(*args)
+    makeInMemoryBuffer(args[0], args[5], args[4], args[3])
+    return rasterBufferIntersect(*args[0:5])
 ### end of multi_run_wrapper
 
 
 # parallel processing natively only accepts a single argument for input.  
 # this is a wrapper function to accept a single list of inputs from the parall
 def multi_run_polyline_wrapper(args):
-    return polylineBufferIntersect(*args)
+    makeInMemoryBuffer(args[0], args[5], args[4], args[3])
+    return polylineBufferIntersect(*args[0:5])
+### end of multi_run_wrapper
+
+
+# wrapper for point buffer variables, builds the in_memory buffer before running the intersect
+def multi_run_point_wrapper(args):
+    makeInMemoryBuffer(args[0], args[5], args[4], args[3])
+    return pointBufferIntersect(*args[0:5])
 ### end of multi_run_wrapper
 
 # calculate average values of a raster within various buffer zones in a shapefile
 def rasterBufferIntersect(bufferFile, variableFile, variableOutputFolder, airMonitorFile, bufferSize):
     continueVar = 1
     var1 = variableFile
-    bufferIndex = str(bufferFile).rfind("buffer") + 6
     variableIndex = str(variableFile).rfind("/") + 1
-    variableIdent = bufferFile[bufferIndex:-4]
+    variableIdent = determineBufferIdentifier(bufferFile)
     partitionIdentStart = variableOutputFolder.rfind("Partition") + len("Partition")
     partitionIdentEnd = variableOutputFolder.rfind("/")
     partitionId = variableOutputFolder[partitionIdentStart:partitionIdentEnd]
@@ -20,10 +20,23 @@
 ############## import required modules ###############
 import os
 import BufferVariables
+import bufferEngine_Canada_LUR as bufferEngine
+import zonalStatistics_Canada_LUR as zonalStatistics
+import roadLength_Canada_LUR as roadLength
+import taskScheduler_Canada_LUR as taskScheduler
+import taskSupervisor_Canada_LUR as taskSupervisor
+import resultStore_Canada_LUR as resultStore
+import compositeVariables_Canada_LUR as compositeVariables
+import pointSampler_Canada_LUR as pointSampler
+import nearestDistance_Canada_LUR as nearestDistance
+import zoneAssignment_Canada_LUR as zoneAssignment
+import mosaicCatalog_Canada_LUR as mosaicCatalog
+import pointSources_Canada_LUR as pointSources
 import multiprocessing
 import arcpy
 import constantValues as values
 import gc
+import numpy as np
 arcpy.env.overwriteOutput = True
 import shutil
 import time
@@ -80,11 +93,29 @@ def determinePointList(airMonitor, pointList):
             mosaicFilename = BufferVariables.determineMosaicFile(variable,zone,values.POINT_TYPE)
             pointList.append(mosaicFilename)
 
+# record variables that could not be calculated after all retries, so they are not silently missing from the
+# merged results.  Each failure is appended as a line of FAILED_VARIABLES_FILE
+# INPUTS:
+#    identifier (str) - air monitor partition number
+#    buffer (int) - buffer distance, in meters
+#    variableFiles (str list) - full filepaths of the failed variables
+#    errors (str list) - reason for the last failure of each variable
+def recordFailedVariables(identifier, buffer, variableFiles, errors):
+    with open(values.FAILED_VARIABLES_FILE, 'a') as f:
+        for variableNum in range(len(variableFiles)):
+            print("could not calculate " + variableFiles[variableNum] + " for buffer " + str(buffer) + " of air monitor partition " +
+                  str(identifier) + ": " + errors[variableNum])
+            f.write(str(identifier) + "," + str(buffer) + "," + variableFiles[variableNum] + ",\"" +
+                    errors[variableNum].replace('"', "'") + "\"\n")
+### end of recordFailedVariables ###
+
+
 # setup and calculate average values for a buffer zone
-def processBufferVariables(partitionFolderOut, masterBufferFile, identifier, buffer, airMonitor,variableType, fileList):
+def processBufferVariables(partitionFolderOut, sharedFile, identifier, buffer, airMonitor,variableType, fileList):
     readyToJoin = False
     continueVar = True
     while (continueVar):
+        pool = None
         try:
             argumentList = []
             argumentList2 = []
@@ -98,7 +129,7 @@ def processBufferVariables(partitionFolderOut, masterBufferFile, identifier, buf
                     pool = multiprocessing.Pool(len(polylineList))
                     if(len(polylineList) >0):
                         argumentList = []
-                        argumentList = BufferVariables.createArgumentList(polylineList, partitionFolderOut, masterBufferFile,identifier,buffer,airMonitor)  
+                        argumentList = BufferVariables.createArgumentList(polylineList, partitionFolderOut, sharedFile,identifier,buffer,airMonitor)  
                         #pool = multiprocessing.Pool(len(polylineList))
                         result = pool.map(BufferVariables.multi_run_polyline_wrapper,argumentList2)  # calculate average polyline values on parallel processors
                         pool.close()
@@ -108,26 +139,26 @@ def processBufferVariables(partitionFolderOut, masterBufferFile, identifier, buf
                     #readyToJoin = BufferVariables.testFileCompletion(argumentList2)  
             elif(variableType == values.RASTER_TYPE): # if the variable files are from rasters, run the raster wrapper function
                 if(len(fileList)>0):
-                    pool = multiprocessing.Pool(processes=2)
-                    #pool = multiprocessing.Pool(len(fileList))
-                    argumentList = BufferVariables.createArgumentList(fileList, partitionFolderOut, masterBufferFile,identifier,buffer,airMonitor)  
-                    
-                    result = pool.map_async(BufferVariables.multi_run_raster_wrapper,argumentList) # calculate average raster values on parellel processors
-                    #time.sleep(60)
-                    BufferVariables.testProgress(result)
+                    argumentList = BufferVariables.createArgumentList(fileList, partitionFolderOut, sharedFile,identifier,buffer,airMonitor)  
+                    # calculate average raster values on parallel processors.  Hung or failed variables are retried individually
+                    results, failures = taskSupervisor.runSupervisedTasks(BufferVariables.multi_run_raster_wrapper, argumentList)
+                    if(len(failures) > 0):
+                        recordFailedVariables(identifier, buffer, [argumentList[argumentIndex][1] for argumentIndex in failures],
+                                              [failures[argumentIndex] for argumentIndex in failures])
+                    argumentList = [argumentList[argumentIndex] for argumentIndex in range(len(argumentList)) if argumentIndex not in failures]
                     readyToJoin = BufferVariables.testFileCompletion(argumentList)
             elif(variableType == values.POLYLINE_TYPE): # if the variable files are from polyline shp files, ru nthe polyline wrapper function      
                 if(len(fileList)>0):
                     pool = multiprocessing.Pool(len(fileList))
-                    argumentList2 = BufferVariables.createArgumentList(fileList, partitionFolderOut, masterBufferFile,identifier,buffer,airMonitor)  
+                    argumentList2 = BufferVariables.createArgumentList(fileList, partitionFolderOut, sharedFile,identifier,buffer,airMonitor)  
                     result = pool.map(BufferVariables.multi_run_polyline_wrapper,argumentList2)  # calculate average polyline values on parallel processors
                     pool.close()
                     pool.join() 
                     readyToJoin=True
             elif(variableType==values.POINT_BUFFER_TYPE):
                 if(len(fileList)>0):
-                    argumentList3 = BufferVariables.createArgumentList(fileList, partitionFolderOut, masterBufferFile,identifier,buffer,airMonitor)
-                    BufferVariables.pointBufferIntersect(argumentList3[0][0], argumentList3[0][1],argumentList3[0][2], argumentList3[0][3], argumentList3[0][4])
+                    argumentList3 = BufferVariables.createArgumentList(fileList, partitionFolderOut, sharedFile,identifier,buffer,airMonitor)
+                    BufferVariables.multi_run_point_wrapper(argumentList3[0])
                     readyToJoin=True
             if(readyToJoin):
                 for argument in argumentList: # for each variable that was used to calculate an average values, add the value to the air monitor partition shp file
@@ -142,14 +173,16 @@ def processBufferVariables(partitionFolderOut, masterBufferFile, identifier, buf
             #print("sucessfully added buffer variables")
         except Exception as e:
             print("couldn't process variables, loop will cycle again" + str(e))
-            pool.terminate()
+            if pool is not None:
+                pool.terminate()
             continue
         finally:
             if(variableType == values.RASTER_TYPE) or(variableType == values.PARALLEL_PROCESSING):
-                try:
-                    pool.terminate()
-                except:
-                    print("could not terminate pool")
+                if pool is not None:
+                    try:
+                        pool.terminate()
+                    except:
+                        print("could not terminate pool")
                 try:
                     dirList = os.listdir(values.RESULTS_FOLDER + values.TEMP_STATS_WORKSPACE)
                     for dirFolder in dirList:
@@ -188,6 +221,127 @@ def processBufferVariables(partitionFolderOut, masterBufferFile, identifier, buf
         print("couldn't delete pool")
     
 ### end of processBufferVariables       
+
+
+# determine the variable prefixes of all configured raster and polyline layers, as used by composite variables.
+# Mosaic variables are named after their mosaic folder
+# OUTPUTS:
+#    configuredNames (str list) - first two characters of every configured layer, e.g. bR
+def determineConfiguredNames():
+    layerNames = values.RASTER_LIST + values.POLYLINE_LIST + values.MOSAIC_RASTER_LIST + values.POLLYLINE_MOSAIC_LIST
+    configuredNames = [layerName[0:2] for layerName in layerNames]
+    return configuredNames
+### end of determineConfiguredNames ###
+
+
+# group air monitors by the mosaic of a mosaic variable.  Mosaics are chosen by zone, or by the catalogued
+# mosaic extents if SELECT_MOSAIC_BY_EXTENT is set, with the zone mosaic used for monitors outside every extent
+# INPUTS:
+#    variable (str) - mosaic folder of the variable, relative to INPUT_FOLDER
+#    fileType (int) - RASTER_TYPE, POINT_TYPE or POLYLINE_TYPE
+#    monitorZones (int array) - zone of each air monitor
+#    monitorX, monitorY (float arrays) - air monitor coordinates
+#    margin (float) - half width of the area around each monitor the mosaic should cover
+# OUTPUTS:
+#    mosaicGroups (list) - (mosaic filename, monitor indices) for every mosaic that is used
+def groupMonitorsByMosaic(variable, fileType, monitorZones, monitorX, monitorY, margin):
+    monitorFiles = np.full(len(monitorZones), "", dtype=object)
+    if(values.SELECT_MOSAIC_BY_EXTENT):
+        mosaicFiles, monitorMosaics = mosaicCatalog.selectMosaicFiles(variable, fileType, monitorX, monitorY, margin)
+        for mosaicIndex in range(len(mosaicFiles)):
+            monitorFiles[monitorMosaics == mosaicIndex] = mosaicFiles[mosaicIndex]
+    for zone in np.unique(monitorZones):
+        zoneMonitors = (monitorZones == zone) & (monitorFiles == "")
+        if not zoneMonitors.any():
+            continue
+        mosaicFilename = BufferVariables.determineMosaicFile(variable, str(zone), fileType)
+        if len(mosaicFilename) == 0:
+            print("warning: " + variable + " has no mosaic for zone " + str(zone))
+            continue
+        monitorFiles[zoneMonitors] = mosaicFilename
+    mosaicGroups = []
+    for mosaicFilename in sorted(set(monitorFiles.tolist()) - set([""])):
+        mosaicGroups.append((mosaicFilename, np.where(monitorFiles == mosaicFilename)[0]))
+    return mosaicGroups
+### end of groupMonitorsByMosaic ###
+
+
+# create scheduler work groups for all raster and polyline variables.  Variables that are not zone specific
+# form one group containing every air monitor, mosaic variables form one group per mosaic
+# INPUTS:
+#    monitorZones (int array) - zone of each air monitor
+#    monitorX, monitorY (float arrays) - air monitor coordinates
+# OUTPUTS:
+#    workGroups (list) - work groups for taskScheduler.runScheduler
+def buildWorkGroups(monitorZones, monitorX, monitorY):
+    workGroups = []
+    allMonitors = np.arange(len(monitorZones))
+    for fileName in values.RASTER_LIST:
+        workGroups.append(taskScheduler.makeWorkGroup(values.RASTER_TYPE, fileName, allMonitors))
+    for fileName in values.POLYLINE_LIST:
+        workGroups.append(taskScheduler.makeWorkGroup(values.POLYLINE_TYPE, fileName, allMonitors))
+    for variable in values.MOSAIC_RASTER_LIST:
+        for mosaicFilename, mosaicMonitors in groupMonitorsByMosaic(variable, values.RASTER_TYPE, monitorZones,
+                                                                    monitorX, monitorY, max(values.BUFFER_DISTANCE)):
+            workGroups.append(taskScheduler.makeWorkGroup(values.RASTER_TYPE, mosaicFilename, mosaicMonitors))
+    for variable in values.POLLYLINE_MOSAIC_LIST:
+        for mosaicFilename, mosaicMonitors in groupMonitorsByMosaic(variable, values.POLYLINE_TYPE, monitorZones,
+                                                                    monitorX, monitorY, max(values.BUFFER_DISTANCE)):
+            workGroups.append(taskScheduler.makeWorkGroup(values.POLYLINE_TYPE, mosaicFilename, mosaicMonitors))
+    return workGroups
+### end of buildWorkGroups ###
+
+
+# sample all point variables and calculate all distance variables for all air monitors.  Mosaic variables are
+# sampled mosaic by mosaic
+# INPUTS:
+#    monitorX, monitorY (float arrays) - air monitor coordinates
+#    monitorZones (int array) - zone of each air monitor
+# OUTPUTS:
+#    pointResults (dict) - maps each point and distance variable identifier to an array with one value per monitor
+def samplePointVariables(monitorX, monitorY, monitorZones):
+    pointResults = pointSampler.samplePointVariables(monitorX, monitorY, values.POINT_LIST)
+    for variable in values.POINT_MOSAIC_LIST:
+        variableIdent = pointSampler.determinePointIdentifier(variable)
+        pointResults[variableIdent] = np.full(len(monitorX), np.nan)
+        for mosaicFilename, mosaicMonitors in groupMonitorsByMosaic(variable, values.POINT_TYPE, monitorZones,
+                                                                    monitorX, monitorY, 0):
+            mosaicResults = pointSampler.samplePointVariables(monitorX[mosaicMonitors], monitorY[mosaicMonitors], [mosaicFilename])
+            pointResults[variableIdent][mosaicMonitors] = mosaicResults[pointSampler.determinePointIdentifier(mosaicFilename)]
+    pointResults.update(nearestDistance.calcDistanceVariables(monitorX, monitorY))
+    return pointResults
+### end of samplePointVariables ###
+
+
+# calculate all buffer variables for all air monitors with the in-memory task scheduler.  The air monitor
+# shapefile is not partitioned.  Results are appended to the result store as tasks complete and compacted
+# once at the end, or written to final.shp in a single update pass if the result store is not used
+# INPUTS:
+#    zonesDefined (str) - full filepath to the air monitor shapefile with zone assignments
+def runScheduledBuffers(zonesDefined):
+    monitorIds, monitorX, monitorY = zonalStatistics.readAirMonitorPoints(zonesDefined)
+    monitorZones = zoneAssignment.readMonitorZones(zonesDefined)
+    workGroups = buildWorkGroups(monitorZones, monitorX, monitorY)
+    if(values.USE_RESULT_STORE):
+        napsIds = resultStore.readNapsIds(zonesDefined)
+        results = taskScheduler.runScheduler(workGroups, monitorIds, monitorX, monitorY, napsIds=napsIds)
+        finalResults = compositeVariables.evaluateComposites(values.COMPOSITE_VARIABLES, results, values.BUFFER_DISTANCE,
+                                                             determineConfiguredNames())
+        finalResults.update(samplePointVariables(monitorX, monitorY, monitorZones))
+        finalResults.update(pointSources.calcPointSourceBuffers(monitorX, monitorY))
+        if(len(finalResults) > 0):
+            resultStore.appendResults(napsIds, finalResults)
+        resultStore.compactResultStore()
+        return
+    results = taskScheduler.runScheduler(workGroups, monitorIds, monitorX, monitorY)
+    results.update(compositeVariables.evaluateComposites(values.COMPOSITE_VARIABLES, results, values.BUFFER_DISTANCE,
+                                                         determineConfiguredNames()))
+    results.update(samplePointVariables(monitorX, monitorY, monitorZones))
+    results.update(pointSources.calcPointSourceBuffers(monitorX, monitorY))
+    finalFile = values.RESULTS_FOLDER + "final.shp"
+    arcpy.CopyFeatures_management(zonesDefined, finalFile)
+    bufferEngine.writeRingResults(finalFile, monitorIds, results)
+### end of runScheduledBuffers ###
   
     
 ########## end of helper functions ###############
@@ -200,14 +354,18 @@ def processBufferVariables(partitionFolderOut, masterBufferFile, identifier, buf
 def main():
     print("running main")
     if not os.path.exists(values.RESULTS_FOLDER + values.TEMP_STATS_WORKSPACE): os.makedirs(values.RESULTS_FOLDER + values.TEMP_STATS_WORKSPACE)
+    if os.path.exists(values.FAILED_VARIABLES_FILE): os.remove(values.FAILED_VARIABLES_FILE)
     #BufferVariables.runPointAnalysis()  # get point values 
     zonesDefined = BufferVariables.assignZones()
     if not os.path.exists(constantValues.RESULTS_FOLDER + constantValues.TEMP_STATS_WORKSPACE): os.makedirs(constantValues.RESULTS_FOLDER + constantValues.TEMP_STATS_WORKSPACE)   
     print("defined buffer zones")
+    if(values.USE_TASK_SCHEDULER and values.BUFFER_ENGINE == values.RING_BUFFER_ENGINE):
+        runScheduledBuffers(zonesDefined)
+        print ("completed running the main script")
+        return
     airMonitorPartitions = BufferVariables.partitionShapefile(zonesDefined) # partition air monitor stations
     print("defined air monitor partitions")
     airMonitorPartitions = airMonitorPartitions[0:len(airMonitorPartitions)]
-    makeBufferZones(airMonitorPartitions) # make buffer zones for each partition
     i=0
     for airMonitor in airMonitorPartitions: # for each air monitor partition
         startTime = time.time()
@@ -221,29 +379,60 @@ def main():
             determinePointList(airMonitor, pointList)
             determinePointBufferList(airMonitor, pointBufferList)
             print(pointList)
-            #BufferVariables.runPointAnalysis(airMonitor, pointList)
             identifier = BufferVariables.determineAirMonitorIdentifier(airMonitor) # determine the partition number
             partitionFolderOut = values.RESULTS_FOLDER + values.KEYWORD + identifier + "/" 
+            if(values.BUFFER_ENGINE == values.RING_BUFFER_ENGINE):
+                # all buffer distances are calculated in one pass, so the per buffer loop below is skipped
+                if(values.RASTER_BACKEND == values.NUMPY_RASTER_BACKEND):
+                    monitorIds, results = zonalStatistics.runZonalStatistics(airMonitor, rasterList)
+                    if(len(polyLineList) > 0):
+                        monitorIds, polylineResults = roadLength.runRoadLengths(airMonitor, polyLineList)
+                        results.update(polylineResults)
+                else:
+                    monitorIds, results = bufferEngine.runRingEngine(airMonitor, rasterList, polyLineList)
+                results.update(compositeVariables.evaluateComposites(values.COMPOSITE_VARIABLES, results, values.BUFFER_DISTANCE,
+                                                         determineConfiguredNames()))
+                if(len(pointList) > 0):
+                    monitorIds, pointResults = pointSampler.runPointSampler(airMonitor, pointList)
+                    results.update(pointResults)
+                if(len(values.DISTANCE_VARIABLES) > 0):
+                    monitorIds, distanceResults = nearestDistance.runDistanceAnalysis(airMonitor)
+                    results.update(distanceResults)
+                if(len(values.POINT_SOURCE_LIST) > 0):
+                    monitorIds, pointSourceResults = pointSources.runPointSources(airMonitor)
+                    results.update(pointSourceResults)
+                if(values.USE_RESULT_STORE):
+                    resultStore.appendResults(resultStore.readNapsIds(airMonitor), results)
+                else:
+                    bufferEngine.writeRingResults(airMonitor, monitorIds, results)
+                print("time required to process partition " + str(identifier) + ": " + str(time.time()-startTime))
+                i+=1
+                continue
+            # buffers are created by each worker in memory from the shared monitor coordinates
+            sharedFile = BufferVariables.publishSharedCoordinates(airMonitor, partitionFolderOut)
             for buffer in values.BUFFER_DISTANCE: # for each buffer radius          
-                bufferFilename = "buffer" + str(buffer) + "m.shp" 
-                masterBufferFile = values.RESULTS_FOLDER + values.KEYWORD + identifier + values.BUFFER_EXTENSION + bufferFilename 
                 maxThreads = 1 #multiprocessing.cpu_count()*2 -2
                 if(1 > 5):#maxThreads >= len(rasterList) + len(polyLineList)):
                     print("running polyline and raster buffer variables in parallel")
                     parallelList = [rasterList,polyLineList]
-                    processBufferVariables(partitionFolderOut, masterBufferFile, identifier, buffer, airMonitor, values.PARALLEL_PROCESSING, parallelList)
-                    processBufferVariables(partitionFolderOut, masterBufferFile, identifier, buffer, airMonitor, values.POINT_BUFFER_TYPE, pointBufferList)
+                    processBufferVariables(partitionFolderOut, sharedFile, identifier, buffer, airMonitor, values.PARALLEL_PROCESSING, parallelList)
+                    processBufferVariables(partitionFolderOut, sharedFile, identifier, buffer, airMonitor, values.POINT_BUFFER_TYPE, pointBufferList)
                 else:
-                    processBufferVariables(partitionFolderOut, masterBufferFile, identifier, buffer, airMonitor,values.RASTER_TYPE, rasterList) # get average raster values
-                    #processBufferVariables(partitionFolderOut, masterBufferFile, identifier, buffer, airMonitor,values.POLYLINE_TYPE,polyLineList) # get average polyline values
-                    #processBufferVariables(partitionFolderOut, masterBufferFile, identifier, buffer, airMonitor,values.POINT_BUFFER_TYPE,pointBufferList) # get average point values
+                    processBufferVariables(partitionFolderOut, sharedFile, identifier, buffer, airMonitor,values.RASTER_TYPE, rasterList) # get average raster values
+                    #processBufferVariables(partitionFolderOut, sharedFile, identifier, buffer, airMonitor,values.POLYLINE_TYPE,polyLineList) # get average polyline values
+                    #processBufferVariables(partitionFolderOut, sharedFile, identifier, buffer, airMonitor,values.POINT_BUFFER_TYPE,pointBufferList) # get average point values
                 print ("completed buffer distance " + str(buffer) + " for air Monitor partition " + str(identifier))
             #print("completed gathering buffer values for air monitoring station partition " + str(identifier))
             print("time required to process partition " + str(identifier) + ": " + str(time.time()-startTime))
         i+=1
         print("completed gathering buffer values for all air monitoring station partitions")
-    arcpy.Merge_management(inputs=airMonitorPartitions,output=values.RESULTS_FOLDER + "final.shp",field_mappings="#")  
+    if(values.BUFFER_ENGINE == values.RING_BUFFER_ENGINE and values.USE_RESULT_STORE):
+        resultStore.compactResultStore()
+    else:
+        arcpy.Merge_management(inputs=airMonitorPartitions,output=values.RESULTS_FOLDER + "final.shp",field_mappings="#")  
     #arcpy.ExportXYv_stats
+    if os.path.exists(values.FAILED_VARIABLES_FILE):
+        print("warning: some buffer variables could not be calculated and are missing from the results, see " + values.FAILED_VARIABLES_FILE)
     print ("completed running the main script")
 
 ### end of main function ###
@@ -0,0 +1,175 @@
+################# compositeVariables_Canada_LUR.py ##################
+#
+# Declarative composite buffer variables, e.g. the total road length alRds = bR + cR + dR + eR.
+# sumRoadBuffers previously built each composite column by column, with one in-place += per component and
+# buffer distance, after the buffer variables had been written to csv and read back.
+#
+# A composite is written as a text definition such as "alRds = bR + cR + dR + eR" or "majRds = aR - fR", where
+# each term is a variable prefix (the first two characters of the input filename, as in
+# bufferEngine.determineVariableIdentifier) with an optional numeric coefficient (e.g. 0.5*bR).  All definitions
+# are converted into one coefficient matrix, and the component values for every monitor and buffer distance are
+# combined with a single matrix product, so any number of composites are evaluated in one pass.  The same
+# functions work on the in-memory results of the buffer engine and on a DataFrame read from csv or parquet.
+#
+# A composite is NaN wherever one of its components is NaN.  Tables read from csv (addComposites) count a
+# component without a column as zero, as sumRoadBuffers did, so e.g. alRds is still written when a province has
+# no eR layer.  The buffer engine passes the prefixes of the configured layers instead: composites with a
+# component that was never configured are skipped with a warning, and a configured component without a column
+# for a buffer distance (e.g. a failed task) makes the composite NaN.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, pandas
+
+
+############## import required modules ###############
+import re
+import numpy as np
+import pandas as ps
+############## end of module import ##################
+
+
+TERM_PATTERN = re.compile(r"([+-])\s*(?:([0-9]*\.?[0-9]+)\s*\*\s*)?([A-Za-z][A-Za-z0-9_]*)")
+
+
+################# functions ##################################
+
+# parse the text definition of one composite variable
+# INPUTS:
+#    definition (str) - composite definition, e.g. "alRds = bR + cR + dR + eR"
+# OUTPUTS:
+#    compositeName (str) - name of the composite, e.g. alRds
+#    coefficients (dict) - maps each component prefix to its coefficient
+def parseComposite(definition):
+    if definition.count("=") != 1:
+        raise Exception("composite definition must have the form name = term + term ...: " + definition)
+    compositeName, expression = [part.strip() for part in definition.split("=")]
+    expression = expression if expression[0] in "+-" else "+" + expression
+    terms = TERM_PATTERN.findall(expression)
+    if re.sub(r"\s", "", expression) != "".join([sign + (coef + "*" if coef else "") + name for sign, coef, name in terms]):
+        raise Exception("could not parse composite definition: " + definition)
+    coefficients = {}
+    for sign, coef, name in terms:
+        value = float(coef) if coef else 1.0
+        coefficients[name] = coefficients.get(name, 0.0) + (value if sign == "+" else -value)
+    return compositeName, coefficients
+### end of parseComposite ###
+
+
+# build the coefficient matrix of a set of composite variables
+# INPUTS:
+#    definitions (str list) - composite definitions, as accepted by parseComposite
+# OUTPUTS:
+#    compositeNames (str list) - name of each composite (matrix rows)
+#    componentNames (str list) - component prefixes used by any composite (matrix columns)
+#    coefficientMatrix (float array) - coefficients with shape (number of composites, number of components)
+def makeCoefficientMatrix(definitions):
+    parsed = [parseComposite(definition) for definition in definitions]
+    compositeNames = [compositeName for compositeName, coefficients in parsed]
+    componentNames = sorted(set([name for compositeName, coefficients in parsed for name in coefficients]))
+    coefficientMatrix = np.zeros((len(parsed), len(componentNames)))
+    for compositeIndex in range(len(parsed)):
+        for name, value in parsed[compositeIndex][1].items():
+            coefficientMatrix[compositeIndex, componentNames.index(name)] = value
+    return compositeNames, componentNames, coefficientMatrix
+### end of makeCoefficientMatrix ###
+
+
+# combine a block of component values into composites with a single matrix product
+# INPUTS:
+#    componentValues (float array) - values with shape (monitors, components, buffer distances), NaN if unknown
+#    coefficientMatrix (float array) - coefficients with shape (composites, components)
+# OUTPUTS:
+#    compositeValues (float array) - values with shape (monitors, composites, buffer distances)
+def combineComponents(componentValues, coefficientMatrix):
+    missingValues = np.isnan(componentValues)
+    compositeValues = np.einsum('kj,mjr->mkr', coefficientMatrix, np.where(missingValues, 0, componentValues))
+    missingComposites = np.einsum('kj,mjr->mkr', (coefficientMatrix != 0).astype(np.float64), missingValues.astype(np.float64)) > 0
+    compositeValues[missingComposites] = np.nan
+    return compositeValues
+### end of combineComponents ###
+
+
+# determine the field name of a component or composite for one buffer distance, e.g. alRds500m
+# INPUTS:
+#    name (str) - variable prefix or composite name
+#    bufferDistance (float) - buffer radius, in meters
+# OUTPUTS:
+#    fieldName (str) - field name
+def determineFieldName(name, bufferDistance):
+    fieldName = name + str(int(bufferDistance)) + "m"
+    return fieldName
+### end of determineFieldName ###
+
+
+# gather component values from named columns into a (monitors, components, buffer distances) block
+# INPUTS:
+#    columns (dict or DataFrame) - maps each field name to an array with one value per monitor
+#    componentNames (str list) - component prefixes
+#    bufferDistances (float list) - buffer radii, in meters
+#    numMonitors (int) - number of monitors
+#    absentValue (float) - value of columns that do not exist
+# OUTPUTS:
+#    componentValues (float array) - values with shape (monitors, components, buffer distances)
+def gatherComponents(columns, componentNames, bufferDistances, numMonitors, absentValue=np.nan):
+    componentValues = np.full((numMonitors, len(componentNames), len(bufferDistances)), absentValue, dtype=np.float64)
+    for componentIndex in range(len(componentNames)):
+        for distIndex in range(len(bufferDistances)):
+            fieldName = determineFieldName(componentNames[componentIndex], bufferDistances[distIndex])
+            if fieldName in columns:
+                componentValues[:, componentIndex, distIndex] = np.asarray(columns[fieldName], dtype=np.float64)
+    return componentValues
+### end of gatherComponents ###
+
+
+# calculate composite variables from buffer variable results
+# INPUTS:
+#    definitions (str list) - composite definitions, as accepted by parseComposite
+#    results (dict or DataFrame) - maps each variable identifier (e.g. bR500m) to an array with one value per monitor
+#    bufferDistances (float list) - buffer radii, in meters
+#    configuredNames (str list) - prefixes of the configured layers.  If None, components without a column are zero
+# OUTPUTS:
+#    compositeResults (dict) - maps each composite identifier (e.g. alRds500m) to an array with one value per monitor
+def evaluateComposites(definitions, results, bufferDistances, configuredNames=None):
+    fieldNames = list(results.keys())
+    if len(definitions) == 0 or len(fieldNames) == 0:
+        return {}
+    compositeNames, componentNames, coefficientMatrix = makeCoefficientMatrix(definitions)
+    numMonitors = len(results[fieldNames[0]])
+    absentValue = 0.0 if configuredNames is None else np.nan
+    compositeValues = combineComponents(gatherComponents(results, componentNames, bufferDistances, numMonitors, absentValue),
+                                        coefficientMatrix)
+    compositeResults = {}
+    for compositeIndex in range(len(compositeNames)):
+        usedNames = [componentNames[componentIndex] for componentIndex in np.nonzero(coefficientMatrix[compositeIndex])[0]]
+        missingNames = [] if configuredNames is None else [name for name in usedNames if name not in configuredNames]
+        if len(missingNames) > 0:
+            print("warning: skipped composite " + compositeNames[compositeIndex] + ", no layer configured for " + ", ".join(missingNames))
+            continue
+        for distIndex in range(len(bufferDistances)):
+            fieldName = determineFieldName(compositeNames[compositeIndex], bufferDistances[distIndex])
+            compositeResults[fieldName] = compositeValues[:, compositeIndex, distIndex]
+    return compositeResults
+### end of evaluateComposites ###
+
+
+# add composite variables to a table of buffer variables in a single concat.  Components without a column count
+# as zero.  Existing composite columns are replaced
+# INPUTS:
+#    inData (DataFrame) - buffer variables, one row per monitor
+#    definitions (str list) - composite definitions, as accepted by parseComposite
+#    bufferDistances (float list) - buffer radii, in meters
+# OUTPUTS:
+#    outData (DataFrame) - inData with the composite columns
+def addComposites(inData, definitions, bufferDistances):
+    compositeResults = evaluateComposites(definitions, inData, bufferDistances)
+    compositeData = ps.DataFrame(compositeResults, index=inData.index)
+    outData = ps.concat([inData.drop(columns=list(compositeData.columns), errors='ignore'), compositeData], axis=1)
+    return outData
+### end of addComposites ###
+
+################# end of functions ############################
+
+
+############### end of compositeVariables_Canada_LUR.py ###############
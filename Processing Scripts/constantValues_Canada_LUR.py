@@ -9,24 +9,55 @@ PARALLEL_PROCESSING = 2
 POINT_BUFFER_TYPE = 4
 BUFFER_EXTENSION = "/buffers/"
 AIRMONITOR_ID = "FID"
+NAPS_ID_FIELD = "NAPS_ID" # NAPS identifier field in the air monitor shapefile
+NAPS_ID = "NAPS ID" # NAPS identifier column in result tables and csv files
 TABLE_ID = "ORIG_FID"
 BUFFER_ID = "FID_buffer"
 LENGTH_COMMAND = "!shape.length@kilometers!" # command for field calculator operation
 CARBON_COMMAND = "!SUM_carbon! * 1"
 TEMP_STATS_WORKSPACE = "tempStats"
-RATER_PROCESS_WAIT_TIME = 60
-TEST_PROGRESS_FILE = "test_progress.txt"
+TASK_TIMEOUT_SECONDS = 1800 # a running task is cancelled and retried after this many seconds
+TASK_MAX_RETRIES = 3 # number of retries before a task is reported as failed
+RETRY_BACKOFF_SECONDS = 5 # delay before the first retry, doubled for every later retry
+MAX_BACKOFF_SECONDS = 300
+# the defaults run the original ArcGIS workflow.  The ring engine, NumPy backend, result cache, result store and task
+# scheduler below are opt-in
+ARCPY_BUFFER_ENGINE = 0 # one buffer shapefile and one intersect per buffer distance
+RING_BUFFER_ENGINE = 1 # all buffer distances for rasters and polylines computed in one pass with concentric rings (bufferEngine_Canada_LUR.py)
+BUFFER_ENGINE = ARCPY_BUFFER_ENGINE
+ARCPY_RASTER_BACKEND = 0 # read raster windows with arcpy.RasterToNumPyArray
+NUMPY_RASTER_BACKEND = 1 # read GeoTIFFs with rasterio, no ArcGIS license required (zonalStatistics_Canada_LUR.py)
+RASTER_BACKEND = ARCPY_RASTER_BACKEND
+COVERAGE_SUBSAMPLES = 10 # sub-cells per cell side for cells crossed by a buffer edge, equivalent to meanCellHeight/10
+# answer large buffers from a summed-area table (integralImage_Canada_LUR.py).  The table counts whole cells whose
+# centres fall within the buffer instead of the sub-cell coverage weights of the smaller buffers, so the *_MEAN
+# values of the two definitions differ by at most the share of the buffer held by the cells along its edge
+USE_INTEGRAL_IMAGE = False
+INTEGRAL_IMAGE_MIN_RADIUS = 5000 # smallest buffer distance, in meters, calculated from the summed-area table
+INTEGRAL_IMAGE_TILE_SIZE = 1024 # tile width and height, in cells, of each summed-area table (plus a halo of the largest buffer)
+PERSIST_INTEGRAL_IMAGE = False # save each tile's summed-area table next to its raster and memory-map it on reuse
+XY_TOLERANCE = 0.001 # distance, in meters, within which overlapping polyline segments are dissolved
+SEGMENT_GRID_SIZE = 2000 # cell size, in meters, of the grid index over polyline segments (roadLength_Canada_LUR.py)
+NEAREST_SEGMENT_LENGTH = 500 # longer segments are split before indexing for distance queries (nearestDistance_Canada_LUR.py)
 
 PARENT_FOLDER = "C:/users/larkinan/desktop/CanadaLUR/"#"S:/Restricted/PURE_AIR/Canada_LUR_NO2/"
 INPUT_FOLDER = PARENT_FOLDER + "screenedMax/"
 MONITOR_FILE= "AirMonitors_Screened_Albers.shp"
 RESULTS_FOLDER = PARENT_FOLDER + "Results/"
+USE_RESULT_CACHE = False # reuse buffer results for unchanged monitors and inputs (resultCache_Canada_LUR.py)
+RESULT_CACHE_FILE = RESULTS_FOLDER + "bufferResultCache.sqlite"
+RESULT_CACHE_MAX_BYTES = 2*1024**3 # least recently used results are evicted above this size
+USE_RESULT_STORE = False # write ring engine results to a parquet table instead of final.shp (resultStore_Canada_LUR.py)
+RESULT_STORE_FOLDER = RESULTS_FOLDER + "resultStore/" # append-only part files written as results complete
+RESULT_STORE_FILE = RESULTS_FOLDER + "envVariables.parquet" # compacted table with one row per NAPS ID
+FAILED_VARIABLES_FILE = RESULTS_FOLDER + "failedVariables.csv" # partition, buffer, variable and error of variables that failed all retries
 
 #MONITOR_FILE = "zone5.shp"
 #INPUT_FOLDER ="C:/users/larkinan/desktop/Global_LUR_processing/pyInput/"
 #RESULTS_FOLDER = "C:/users/larkinan/desktop/Global_LUR_processing/pyResults/"
 MOSAIC_RASTER_LIST = []
 POLLYLINE_MOSAIC_LIST = []
+SELECT_MOSAIC_BY_EXTENT = False # choose mosaics by the catalogued extent around each monitor instead of by zone (mosaicCatalog_Canada_LUR.py)
 
 #POLYLINE_LIST = ["RailAndTransitLine_Albers.shp",
 #                "aRDS_C123_Albers.shp", 
@@ -41,20 +72,34 @@ POLLYLINE_MOSAIC_LIST = []
 #                 "bLU_Open_Parksl_Albsers_Dissolve.shp",
 #                 "cLU_Residential_Albsers_Dissolve.shp"]
 POLYLINE_LIST = []
+COMPOSITE_VARIABLES = [] # composite buffer variables, e.g. "alRds = bR + cR + dR + eR" (compositeVariables_Canada_LUR.py)
 
 
                          
 POINT_BUFFER_LIST = []
+POINT_SOURCE_LIST = {} # point source layers and the attributes summed in each buffer, e.g. {"NPRI_Albers.shp": {"cb": "carbon_200"}} (pointSources_Canada_LUR.py)
+POINT_SOURCE_IDW_POWER = None # power of the inverse distance weighted point source totals, None to skip them
+POINT_SOURCE_MIN_DISTANCE = 1 # distances, in meters, are at least this large in the inverse distance weights
 POINT_MOSAIC_LIST = []
 POINT_LIST = [] #TODO include NO2 satellite raster?
+POINT_SAMPLING = "NONE" # "NONE" for the value of the cell containing each monitor, or "BILINEAR" (pointSampler_Canada_LUR.py)
 RASTER_LIST = ["N6.tif","water_body5.tif"]
 
 ZONE_DEFINITIONS = "zoneDef.shp"
+ZONE_FIELD = "zone" # zone attribute of ZONE_DEFINITIONS, copied to the air monitors by assignZones
+ZONE_GRID_SIZE = 10000 # cell size, in meters, of the grid index over zone polygon edges (zoneAssignment_Canada_LUR.py)
 #POLYLINE_LIST = []
 #COAST_BOUNDARY = "coastline.shp"
+DISTANCE_VARIABLES = {} # maps distance variables to point, polyline or polygon layers, e.g. {"port_dist": "ports_Albers.shp"} (nearestDistance_Canada_LUR.py)
 #BUFFER_DISTANCE =[2000,200]
 BUFFER_DISTANCE = [50,100,250,500,750,1000,2000,3000,4000,5000,10000,15000,20000]
 #BUFFER_DISTANCE = [100,1000,10000]
 PARTITION_SIZE = 50
+USE_TASK_SCHEDULER = False # replace shapefile partitions with the in-memory scheduler (taskScheduler_Canada_LUR.py)
+MAX_WORKERS = 4 # number of worker processes used by the scheduler
+PROBE_CHUNK_SIZE = 8 # monitors in the first task of each variable, used to measure its cost
+TARGET_TASK_SECONDS = 20 # desired duration of each scheduled task
+MAX_CHUNK_SIZE = 500 # maximum monitors in a scheduled task
+SHARED_COORDINATE_FILE = "sharedMonitors.npy" # memory-mapped monitor coordinates shared by worker processes
 
 ####### end of define settings and variables #########
\ No newline at end of file
@@ -0,0 +1,232 @@
+################# crossValidation_Canada_LUR.py ##################
+#
+# Repeated holdout cross-validation of a candidate NO2 LUR model.  Python counterpart of crossValidation in
+# modelSelection_Canada_LUR.R, which refits lm once per random train/test split and needs minutes for 10,000
+# repetitions.
+#
+# Splits are processed in batches.  For a batch of splits, the normal equations X'WX b = X'Wy of every
+# training set (W is the 0/1 training indicator of the split) are built with one einsum and solved with one
+# stacked np.linalg.solve.  Test set predictions and statistics (RMSE, MAE, R2, adj. R2, MB and MAB, as defined
+# in modelSelection_Canada_LUR.R) are then calculated for the whole batch with masked array operations.
+# Batches are spread across a pool of worker processes, each with its own random seed, so results are
+# reproducible for a given seed and number of repetitions.
+#
+# The adjusted R2 uses the number of predictors in the model as p.  The R code sets p <- 1 whatever the model
+# size, so pass numPredictors=1 (or set ADJ_RSQ_PREDICTORS = 1) to compare with earlier R runs.
+#
+# Leave-one-out cross-validation does not need any refits: the leave-one-out residual of monitor i is
+# e_i / (1 - h_ii), where e_i is the residual of the full model and h_ii the diagonal of the hat matrix.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, pandas
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+import multiprocessing
+import numpy as np
+import pandas as ps
+import constantValues as values
+############## end of module import ##################
+
+
+MODEL_DATA_FILE = values.PARENT_FOLDER + "Canada_LUR_preprocessed_Sep17_18_v2.csv"
+OUTCOME = "meanNO2_2014_2016"
+CV_BATCH_SIZE = 500 # number of train/test splits solved together
+CV_STATISTICS = ["rmse", "mae", "rsq", "adjRsq", "bias", "absBias"]
+ADJ_RSQ_PREDICTORS = None # p of the adjusted R2.  None uses the number of predictors, 1 matches modelSelection_Canada_LUR.R
+
+
+################# functions ##################################
+
+# load the outcome and predictors of a candidate model
+# INPUTS:
+#    inputFile (str) - full filepath to the preprocessed csv file
+#    predictors (str list) - predictor columns of the candidate model
+#    derived (str list) - optional derived predictors, as pandas eval assignments (e.g. "sqAr = sqrt(aR250m)")
+#    outcome (str) - outcome column
+# OUTPUTS:
+#    predictorValues (float array) - predictors with shape (monitors, predictors).  Monitors with missing
+#                                    values are removed
+#    outcomeValues (float array) - outcome of each monitor
+def loadModelData(inputFile, predictors, derived=None, outcome=OUTCOME):
+    rawData = ps.read_csv(inputFile)
+    rawData = rawData[rawData['elevation'] > -1] # same screen as modelSelection_Canada_LUR.R
+    derivedData = ps.DataFrame(index=rawData.index)
+    for expression in (derived or []):
+        name, formula = [part.strip() for part in expression.split("=", 1)]
+        derivedData[name] = ps.concat([rawData, derivedData], axis=1).eval(formula)
+    rawData = ps.concat([rawData, derivedData], axis=1)
+    modelData = rawData[[outcome] + list(predictors)].dropna()
+    print("loaded " + str(len(modelData)) + " of " + str(len(rawData)) + " air monitors with complete data")
+    return modelData[list(predictors)].values.astype(np.float64), modelData[outcome].values.astype(np.float64)
+### end of loadModelData ###
+
+
+# add an intercept column to a predictor matrix
+# INPUTS:
+#    predictorValues (float array) - predictors with shape (monitors, predictors)
+# OUTPUTS:
+#    designMatrix (float array) - predictors with a leading column of ones
+def makeDesignMatrix(predictorValues):
+    designMatrix = np.column_stack((np.ones(predictorValues.shape[0]), predictorValues))
+    return designMatrix
+### end of makeDesignMatrix ###
+
+
+# draw random training sets
+# INPUTS:
+#    randomState (numpy RandomState) - random number generator
+#    numReps (int) - number of train/test splits
+#    numMonitors (int) - number of monitors
+#    percTrain (float) - proportion of monitors in each training set
+# OUTPUTS:
+#    trainMasks (float array) - 1 for training and 0 for test monitors, with shape (splits, monitors)
+def drawTrainMasks(randomState, numReps, numMonitors, percTrain):
+    trainSize = int(np.floor(percTrain * numMonitors))
+    ranks = np.argsort(randomState.random_sample((numReps, numMonitors)), axis=1)
+    trainMasks = np.zeros((numReps, numMonitors))
+    np.put_along_axis(trainMasks, ranks[:, 0:trainSize], 1.0, axis=1)
+    return trainMasks
+### end of drawTrainMasks ###
+
+
+# fit a least squares model to every training set of a batch with stacked normal equation solves
+# INPUTS:
+#    designMatrix (float array) - predictors with an intercept column, shape (monitors, coefficients)
+#    outcomeValues (float array) - outcome of each monitor
+#    trainMasks (float array) - training indicators, shape (splits, monitors)
+# OUTPUTS:
+#    coefficients (float array) - model coefficients, shape (splits, coefficients)
+def batchLeastSquares(designMatrix, outcomeValues, trainMasks):
+    gramMatrices = np.einsum('rn,ni,nj->rij', trainMasks, designMatrix, designMatrix)
+    moments = np.dot(trainMasks * outcomeValues, designMatrix)
+    coefficients = np.linalg.solve(gramMatrices, moments[:, :, np.newaxis])[:, :, 0]
+    return coefficients
+### end of batchLeastSquares ###
+
+
+# calculate the evaluation statistics of every split from predictions and a set of monitors
+# INPUTS:
+#    predictions (float array) - predicted outcomes, shape (splits, monitors)
+#    outcomeValues (float array) - observed outcome of each monitor
+#    evalMasks (float array) - 1 for the monitors each statistic is calculated over, shape (splits, monitors)
+#    numPredictors (int) - p of the adjusted R2, usually the number of predictors in the model
+# OUTPUTS:
+#    statistics (dict) - rmse, mae, rsq, adjRsq, bias (MB, %) and absBias (MAB, %) for every split
+def evaluatePredictions(predictions, outcomeValues, evalMasks, numPredictors):
+    residuals = (outcomeValues - predictions) * evalMasks
+    numEval = evalMasks.sum(axis=1)
+    evalMeans = np.dot(evalMasks, outcomeValues) / numEval
+    sumSqErr = np.sum(residuals ** 2, axis=1)
+    sumTot = np.sum(((outcomeValues - evalMeans[:, np.newaxis]) * evalMasks) ** 2, axis=1)
+    rsq = 1 - sumSqErr / sumTot
+    statistics = {'rmse': np.sqrt(sumSqErr / numEval),
+                  'mae': np.sum(np.abs(residuals), axis=1) / numEval,
+                  'rsq': rsq,
+                  'adjRsq': 1 - ((1 - rsq) * (numEval - 1)) / (numEval - numPredictors - 1),
+                  'bias': (-100.0 / numEval) * np.sum(residuals / outcomeValues, axis=1),
+                  'absBias': (100.0 / numEval) * np.sum(np.abs(residuals) / outcomeValues, axis=1)}
+    return statistics
+### end of evaluatePredictions ###
+
+
+# run one batch of random train/test splits.  Runs on a worker process
+# INPUTS:
+#    batch (tuple) - (predictorValues, outcomeValues, numReps, percTrain, seed, numPredictors).  Passed as one
+#                    argument for Pool.map
+# OUTPUTS:
+#    statistics (dict) - evaluation statistics of every split in the batch, as returned by evaluatePredictions
+def runHoldoutBatch(batch):
+    predictorValues, outcomeValues, numReps, percTrain, seed, numPredictors = batch
+    designMatrix = makeDesignMatrix(predictorValues)
+    trainMasks = drawTrainMasks(np.random.RandomState(seed), numReps, len(outcomeValues), percTrain)
+    coefficients = batchLeastSquares(designMatrix, outcomeValues, trainMasks)
+    predictions = np.dot(coefficients, designMatrix.T)
+    statistics = evaluatePredictions(predictions, outcomeValues, 1 - trainMasks, numPredictors)
+    return statistics
+### end of runHoldoutBatch ###
+
+
+# perform repeated holdout cross-validation on many random train/test splits
+# INPUTS:
+#    predictorValues (float array) - predictors with shape (monitors, predictors)
+#    outcomeValues (float array) - outcome of each monitor
+#    numReps (int) - number of train/test splits
+#    percTrain (float) - proportion of monitors in each training set
+#    seed (int) - random seed.  Batch n uses seed + n
+#    numWorkers (int) - number of worker processes, defaults to the number of cores.  1 runs in this process
+#    numPredictors (int) - p of the adjusted R2.  None uses the number of predictors, 1 matches the R code
+# OUTPUTS:
+#    summary (DataFrame) - mean of each statistic over all splits, one row
+#    statistics (dict) - each statistic for every split
+def crossValidation(predictorValues, outcomeValues, numReps, percTrain=0.8, seed=0, numWorkers=None,
+                    numPredictors=ADJ_RSQ_PREDICTORS):
+    if numPredictors is None:
+        numPredictors = predictorValues.shape[1]
+    batches = []
+    for batchNum in range(int(np.ceil(numReps / float(CV_BATCH_SIZE)))):
+        batchReps = min(CV_BATCH_SIZE, numReps - batchNum * CV_BATCH_SIZE)
+        batches.append((predictorValues, outcomeValues, batchReps, percTrain, seed + batchNum, numPredictors))
+    if numWorkers is None:
+        numWorkers = multiprocessing.cpu_count()
+    if numWorkers <= 1 or len(batches) == 1:
+        batchResults = [runHoldoutBatch(batch) for batch in batches]
+    else:
+        pool = multiprocessing.Pool(min(numWorkers, len(batches)))
+        try:
+            batchResults = pool.map(runHoldoutBatch, batches)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    statistics = dict([(name, np.concatenate([result[name] for result in batchResults])) for name in CV_STATISTICS])
+    summary = ps.DataFrame(dict([(name, [np.mean(statistics[name])]) for name in CV_STATISTICS]), columns=CV_STATISTICS)
+    return summary, statistics
+### end of crossValidation ###
+
+
+# perform leave-one-out cross-validation from the hat matrix of the full model, without refitting
+# INPUTS:
+#    predictorValues (float array) - predictors with shape (monitors, predictors)
+#    outcomeValues (float array) - outcome of each monitor
+#    numPredictors (int) - p of the adjusted R2.  None uses the number of predictors, 1 matches the R code
+# OUTPUTS:
+#    summary (DataFrame) - statistics of the leave-one-out predictions, one row
+#    looPredictions (float array) - leave-one-out prediction of each monitor
+def leaveOneOut(predictorValues, outcomeValues, numPredictors=ADJ_RSQ_PREDICTORS):
+    if numPredictors is None:
+        numPredictors = predictorValues.shape[1]
+    designMatrix = makeDesignMatrix(predictorValues)
+    qMatrix = np.linalg.qr(designMatrix)[0]
+    leverage = np.sum(qMatrix ** 2, axis=1) # diagonal of the hat matrix
+    residuals = outcomeValues - np.dot(qMatrix, np.dot(qMatrix.T, outcomeValues))
+    looPredictions = outcomeValues - residuals / (1 - leverage)
+    statistics = evaluatePredictions(looPredictions[np.newaxis, :], outcomeValues, np.ones((1, len(outcomeValues))),
+                                     numPredictors)
+    summary = ps.DataFrame(dict([(name, statistics[name]) for name in CV_STATISTICS]), columns=CV_STATISTICS)
+    return summary, looPredictions
+### end of leaveOneOut ###
+
+################# end of functions ############################
+
+
+############## main function #################
+if __name__ == '__main__':
+    # candidate model from modelSelection_Canada_LUR.R
+    derived = ["sqTemp = (te_14_16 + 3) ** 2", "logSat = log(sat_10_12)", "sqAr = sqrt(aR250m)",
+               "sqRa = sqrt(Ra750m)", "sqPop = sqrt(PD20000)"]
+    keeps = ["aL2000m", "sqRa", "sqAr", "logSat", "sqPop", "sqTemp", "NDVI_14_16_250m"]
+    predictorValues, outcomeValues = loadModelData(MODEL_DATA_FILE, keeps, derived)
+    summary, statistics = crossValidation(predictorValues, outcomeValues, 10000, 0.8)
+    print("repeated holdout cross-validation (10000 splits, 80% training)")
+    print(summary)
+    summary, looPredictions = leaveOneOut(predictorValues, outcomeValues)
+    print("leave-one-out cross-validation")
+    print(summary)
+############## end of main function ##########
+
+
+############### end of crossValidation_Canada_LUR.py ###############
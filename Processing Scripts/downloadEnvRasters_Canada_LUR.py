@@ -9,25 +9,27 @@
 
 # Requirements:
 #      Active Google Earth Engine account associated with the installed version of Python.  
-#      ArcGIS with a liscence for the Spatial Analysis Library
+#      numpy and rasterio for mosaicking, masking and smoothing the downloaded rasters (no ArcGIS license is required)
 # Tested and developed on:
 #      Windows 10
 #      Python 2.7
-#      ArcGIS 10.3.2
 
 ################### setup ####################
 
 # import modules 
 import ee
-import time
 import datetime
 import math
 import os
 import sys
-import arcpy
-import urllib2
+import functools
 import zipfile
 import pandas as pd
+import downloadManager_Canada_LUR as downloadManager
+import tilePlanner_Canada_LUR as tilePlanner
+import mosaicBuilder_Canada_LUR as mosaicBuilder
+import nodataMask_Canada_LUR as nodataMask
+import focalMean_Canada_LUR as focalMean
 
 # folder paths and variables
 # the script, input csv need to be in the main folder.  Raster images should be downloaded to subfolders within the main folder
@@ -40,10 +42,11 @@ START_YEAR = 2016
 END_YEAR = 2016
 
 collectionName = 'LANDSAT/LC8_L1T_32DAY_NDVI' 
+MAX_DOWNLOAD_WORKERS = 8 # number of rasters downloaded at the same time (downloadManager_Canada_LUR.py)
+STATION_PADDING = 0.51 # amount of padding around each station to download, in decimal degrees
+TILE_PLAN_FILE = "tilePlan.csv" # stations and the grid tiles that cover them (tilePlanner_Canada_LUR.py)
 
-# environmental variables and checkout necessary extensions and libraries
-arcpy.CheckOutExtension("Spatial")
-arcpy.env.overwriteOutput = True
+# initialize Google Earth Engine
 ee.Initialize()
 
 # use a water mask to remove NDVI values over water bodies
@@ -65,81 +68,36 @@ def filterCatalogSet(byear,filterBoundaries,collection):
     datedCollect = datedCollect.filterBounds(filterBoundaries)
     return(datedCollect)
 
-# test if all raster images for all years for a specific location have been downloaded 
+# add the downloads of all missing grid tiles to a download list.  Each tile is downloaded once, no matter how
+# many stations it covers
 # INPUTS:
-#   inputParams (dict)
-#        startYear (int) - start year of data to download rasters for
-#        endYear (int) - end year of data to download rasters for
-#        randID (int) - random id for the community to identify exposures for
-#   folderToTest (str) - full filepath to the folder to test
-# OUTPUTS:
-#   boolean - True if folder contains all raster images, false otherwise
-def testComplete(inputParams,folderToTest):
-    startYear = inputParams['startYear']
-    endYear = inputParams['endYear']
-    randID = inputParams['randID']
-    startYear = inputParams['startYear']
-    endYear = inputParams['endYear']
-    randID = inputParams['randID']
-    for year in range(startYear,endYear+1):
-        yearFolder = folderToTest + str(year)
-        zipFile = yearFolder + "/"+ str(randID) + ".zip"            
-        if not(os.path.exists(zipFile)):
-            return False
-    return True
-
-# download all raster images for a single location 
-# INPUTS:
-#   inputParams (dict)
-#        startYear (int) - start year of data to download rasters for
-#        endYear (int) - end year of data to download rasters for
-#        randID (int) - random id for the community to identify exposures for
+#   tilePlan (dict) - tile plan created by tilePlanner.planTiles
 #   reducer (ee.reducer) - custom Google Earth Engine object
 #   outputFolder (str) - full filepath to where rasters should be saved  
-def downloadSinglePoint(inputParams, reducer,outputFolder):
-    isComplete = testComplete(inputParams,outputFolder)
-    if(isComplete):
-        return True
-    randID = inputParams['randID']
-    latit = inputParams['lat']
-    longit = inputParams['longit']
-    startYear = inputParams['startYear']
-    endYear = inputParams['endYear']
-    
-    
-    
-    padding = 0.51 # amount of padding around boundary to add to the raster
-    filterBoundaries = ee.Geometry.Rectangle(longit + padding,
-                                             latit + padding,
-                                             longit - padding,
-                                             latit - padding)  
-    for year in range(startYear,endYear+1):
-        yearFolder = outputFolder + str(year)
-        zipFile = yearFolder + "/"+ str(randID) + ".zip"           
-        download=False
-        timeToSleep=2
-        while download==False:       
+#   startYear (int) - start year of data to download rasters for
+#   endYear (int) - end year of data to download rasters for
+#   downloads (list) - (url, zipFile, postProcess) tuples for the download manager, appended in place
+def downloadTiles(tilePlan, reducer,outputFolder,startYear,endYear,downloads):
+    for tileName in sorted(tilePlan['tiles'].keys()):
+        west, south, east, north = tilePlan['tiles'][tileName]
+        filterBoundaries = ee.Geometry.Rectangle(west, south, east, north)
+        for year in range(startYear,endYear+1):
+            yearFolder = outputFolder + str(year)
+            zipFile = yearFolder + "/"+ tileName + ".zip"           
             if not(os.path.exists(zipFile)):
-                try:
-                    download = downloadSingleRaster(year,yearFolder,filterBoundaries,reducer,zipFile,timeToSleep)
-                except Exception as e:
-                    print(str(e))
-                finally:
-                    time.sleep(timeToSleep)
+                # the url is requested by the download worker, so url requests also run concurrently
+                downloads.append((functools.partial(determineDownloadURL,year,filterBoundaries,reducer),zipFile,extractZip))
             else:
                 print(zipFile + " already exists, did you already download this raster?")      
-                download=True
 
-# download one raster
+# determine the download url of one raster
 # INPUTS:
 #    year (str) - year of raster coverage
-#    yearFolder (str) - full filepath where image will be downloaded
 #    filterBoundaries (ee.Geometry.Rectangle) - spatial exxtent of raster to download
 #    reducer (ee.Reducer) - custom Google Earth Engine object - defines which type of summar stat to use (e.g. mean)
-#    zipFile (str) - full filepath where the zipped raster should be written to 
 # OUTPUTS:
-#    True if raster download was successful, false otherwise
-def downloadSingleRaster(year,yearFolder,filterBoundaries,reducer,zipFile,timeToSleep):      
+#    url (str) - url of the zipped raster
+def determineDownloadURL(year,filterBoundaries,reducer):      
     params = {'scale':'30'} # spatial resolution, in units of meters.  Finest possible reoslution for MODIS is 250m, for Landsat8 is 30m
     collection = ee.ImageCollection(collectionName)
     imageCatalog = filterCatalogSet(year,filterBoundaries,collection)
@@ -148,30 +106,16 @@ def downloadSingleRaster(year,yearFolder,filterBoundaries,reducer,zipFile,timeTo
     clippedImage = reducedImage.clip(filterBoundaries)
     url = clippedImage.getDownloadURL(params)
     print("the url to download is " + url)    
-    try:
-        if(os.path.exists(yearFolder) == False):
-            os.mkdir(yearFolder)        
-        f = open(zipFile ,'wb')
-        f.write(urllib2.urlopen(url,timeout= 10*6).read())
-        f.close()    
-        zip_ref = zipfile.ZipFile(zipFile, 'r')
-        zip_ref.extractall(yearFolder)
-        zip_ref.close()
-        return(True)   
-    except Exception as e:
-        print(str(e))
-        if(str(e) == "HTTP Error 400: Bad Request"):
-            return(True)
-        time.sleep(timeToSleep)
-        timeToSleep = min(60,timeToSleep+10)
-        print(timeToSleep)
-        try:
-            f.close()
-        except Exception as e:
-            print(e)
-        if(os.path.exists(zipFile)):
-            os.remove(zipFile)
-        return(False)
+    return(url)
+
+# extract a downloaded zip file into the folder containing it.  Corrupt zip files raise an exception, so the
+# download manager removes the file and downloads it again
+# INPUTS:
+#    zipFile (str) - full filepath to the zipped raster
+def extractZip(zipFile):
+    zip_ref = zipfile.ZipFile(zipFile, 'r')
+    zip_ref.extractall(os.path.dirname(zipFile))
+    zip_ref.close()
 
 # map an NDVI calculation and  mask function to apply to each image in the NDVI dataset
 # Inputs:
@@ -201,14 +145,13 @@ def mapMask(image):
 def createRasters(inputFolder,outputFolder):
     filesToProcess = os.listdir(inputFolder)
     fileList = []
-    # for each file in the folder, change exact 0 values to NULL
+    # for each file in the folder, change exact 0 values to NULL.  Files are processed in parallel, and files
+    # whose screened raster is already up to date are skipped
     for filename in filesToProcess:
         if(filename[len(filename)-3:len(filename)] == "tif"):
-            fileList.append(filename)
-    for filename in fileList:
-        outSetNull = arcpy.sa.SetNull(inputFolder + filename, inputFolder + filename, "VALUE = 0")    
-        outputName = outputFolder + filename[2:len(filename)-4] + "null"
-        outSetNull.save(outputName.replace('.','')+ ".tif")
+            outputName = filename[2:len(filename)-4] + "null"
+            fileList.append((inputFolder + filename, outputFolder + outputName.replace('.','') + ".tif"))
+    nodataMask.maskAllRasters(fileList)
 
 # get data from a single row of a pandas dataframe
 # INPUTS:
@@ -249,34 +192,32 @@ def cleanZip(inputFolder):
                 os.remove(inputFolder + "/" + candidate)
 
 
-# perform focal statistics on a single raster
-# INPUTS:
-#    inputRaster (str) - full filepath to the raster
-#    numCells (int) - radius of the focal statistics, in number of cells
-#    outputFile (str) - full filepath where the output focal statistics raster will be written
-def focalStatsOnOneRaster(inputRaster,numCells, outputFile):
-    outRaster = arcpy.sa.FocalStatistics(inputRaster, arcpy.sa.NbrCircle(numCells, "CELL"), "MEAN", "DATA")
-    outRaster.save(outputFile)
-
-# perform focal statistics on all rasters located within a given input folder
+# perform focal statistics for several radii on all rasters located within a given input folder.  Each raster
+# is read once for all radii, and only the radii whose output does not exist yet are calculated
 # INPUTS:
 #    inputFolder (str) - folder where rasters to perform focal stats on are stored
-#    numCells (int) - radius of the focal statistics, in number of cells
-#    outputFolder (str) - full filepath where the output focal statistics raster will be written
-def focalStatisticsAllRasters(inputFolder,numCells,outputFolder):
+#    radiusList (int list) - radius of each focal statistics, in number of cells
+#    outputFolderList (str list) - full filepath where the output focal statistics rasters for each radius will be written
+def focalStatisticsAllRasters(inputFolder,radiusList,outputFolderList):
     candidateFiles = os.listdir(inputFolder)
-    filesToProcess = []
     for candidateFile in candidateFiles:
         if(candidateFile[len(candidateFile)-3:len(candidateFile)] == "tif"):
-            outputFile = outputFolder + "/" + candidateFile[0:len(candidateFile)-8] + ".tif"
-            if not (os.path.exists(outputFile)):
-                print(outputFile)
-                focalStatsOnOneRaster(inputFolder + "/" + candidateFile, numCells,outputFile)
-            else:
-                print(outputFile + ' already exists')
-
-
-# merge multiple rasters into a single mosaiced raster
+            radiiToProcess = []
+            outputFiles = []
+            for radiusIndex in range(len(radiusList)):
+                outputFile = outputFolderList[radiusIndex] + "/" + candidateFile[0:len(candidateFile)-8] + ".tif"
+                if not (os.path.exists(outputFile)):
+                    print(outputFile)
+                    radiiToProcess.append(radiusList[radiusIndex])
+                    outputFiles.append(outputFile)
+                else:
+                    print(outputFile + ' already exists')
+            if(len(radiiToProcess) > 0):
+                focalMean.focalMeans(inputFolder + "/" + candidateFile, radiiToProcess, outputFiles)
+
+
+# merge multiple rasters into a single mosaiced raster, using the maximum value where rasters overlap.  If the
+# mosaic already exists, only rasters added since it was built are merged into it
 # INPUTS:
 #   inputFolder (str) - folder containing all rasters to merge
 #   year (int) - year all rasters represent - used in mosaic filename
@@ -287,16 +228,7 @@ def mergeRasters(inputFolder,year):
         if(candidateFile[len(candidateFile)-3:len(candidateFile)] == "tif"):
             filesToMerge.append(inputFolder + "/" + candidateFile)
     print(filesToMerge)
-    
-    arcpy.MosaicToNewRaster_management( 
-        input_rasters=filesToMerge, output_location=parentFolder, 
-        raster_dataset_name_with_extension="uNDVIx" + str(year) + ".tif", 
-        coordinate_system_for_the_raster="", 
-        pixel_type="32_BIT_FLOAT", cellsize="", 
-        number_of_bands="1", 
-        mosaic_method="MAXIMUM", 
-        mosaic_colormap_mode="FIRST"
-    )
+    mosaicBuilder.buildMosaic(filesToMerge, parentFolder + "uNDVIx" + str(year) + ".tif")
 
 
 #################### main function #############
@@ -316,8 +248,19 @@ def downloadNDVI_All_Years(rawData, reducerType,unscreenedRasterFolder,startYear
         reducer = ee.Reducer.mean()
     else:
         reducer = ee.Reducer.max()
+    stations = []
     for index in range(1,rawData.count()[1]):    
-        downloadSinglePoint(getRowData(rawData,index,startYear,endYear),reducer,unscreenedRasterFolder)
+        stations.append(getRowData(rawData,index,startYear,endYear))
+    tilePlan = tilePlanner.planTiles(stations,STATION_PADDING)
+    if not os.path.exists(unscreenedRasterFolder):
+        os.makedirs(unscreenedRasterFolder)
+    tilePlanner.writeTilePlan(tilePlan,unscreenedRasterFolder + TILE_PLAN_FILE)
+    downloads = []
+    downloadTiles(tilePlan,reducer,unscreenedRasterFolder,startYear,endYear,downloads)
+    print("downloading " + str(len(downloads)) + " rasters")
+    failures = downloadManager.runDownloads(downloads,MAX_DOWNLOAD_WORKERS)
+    for downloadIndex in failures:
+        print("could not download " + downloads[downloadIndex][1] + ": " + failures[downloadIndex])
     
     
 
@@ -334,18 +277,17 @@ def main():
 
 
 #for i in range(START_YEAR,END_YEAR+1):
-#    outputFile = parentFolder + "/uNDVIx" + str(i) + ".tif"
-#    if not os.path.exists(outputFile):
-#        mergeRasters(parentFolder + "unscreenedMax/" + str(i),i)
-screenedRasterFolder = parentFolder + "screenedMax/"
-unscreenedRasterFolder =parentFolder + "unscreenedMax/"    
-createRasters(unscreenedRasterFolder,screenedRasterFolder)
+#    mergeRasters(parentFolder + "unscreenedMax/" + str(i),i)
+# worker processes re-import this script on Windows, so the script only runs in the main process
+if __name__ == '__main__':
+    screenedRasterFolder = parentFolder + "screenedMax/"
+    unscreenedRasterFolder =parentFolder + "unscreenedMax/"    
+    createRasters(unscreenedRasterFolder,screenedRasterFolder)
 
 
             
-#focalStatisticsAllRasters(parentFolder + "/screenedMax", 1, parentFolder+ "MaxNDVIFocal/x250")
-#focalStatisticsAllRasters(parentFolder + "/screenedMax", 2, parentFolder + "MaxNDVIFocal/x500")
-#focalStatisticsAllRasters(parentFolder + "/screenedMax", 4, parentFolder+ "MaxNDVIFocal/x1000")
+#focalStatisticsAllRasters(parentFolder + "/screenedMax", [1,2,4], [parentFolder+ "MaxNDVIFocal/x250",
+#                          parentFolder + "MaxNDVIFocal/x500", parentFolder+ "MaxNDVIFocal/x1000"])
 
 
 ############### end of downloadGreenspace.py ################
\ No newline at end of file
@@ -0,0 +1,281 @@
+################# downloadManager_Canada_LUR.py ##################
+#
+# Concurrent download manager for rasters exported from Google Earth Engine.  Replaces the serial
+# station-by-station loop in downloadEnvRasters, which read every response fully into memory with
+# urllib2.urlopen(...).read() and retried with a hand-rolled sleep loop.
+#
+# Downloads are run by a bounded pool of worker threads.  Requests to the same host are rate limited to
+# REQUESTS_PER_SECOND, failed requests are retried with exponential backoff and jitter, and responses are
+# streamed to disk in DOWNLOAD_CHUNK_SIZE blocks.  Data is written to a .part file that is renamed when the
+# download completes; if a download is interrupted, the next attempt requests only the missing bytes with an
+# HTTP Range header.  Because many downloads are in flight at once, total time is limited by bandwidth
+# rather than by the round trip latency of each request.
+#
+# The download URL of a job can be a function that is called on the worker thread, so slow URL requests
+# (e.g. getDownloadURL) also run concurrently.  No Earth Engine or ArcGIS modules are required, so the manager
+# can be tested against a local HTTP server.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# Python 2.7 or 3 standard library only
+
+
+############## import required modules ###############
+import os
+import time
+import random
+import threading
+try:
+    import urllib2 as urlrequest
+    from urllib2 import HTTPError
+    from urlparse import urlparse
+    import Queue as queue
+except ImportError:
+    import urllib.request as urlrequest
+    from urllib.error import HTTPError
+    from urllib.parse import urlparse
+    import queue
+############## end of module import ##################
+
+
+DOWNLOAD_WORKERS = 8 # number of downloads in flight at the same time
+REQUESTS_PER_SECOND = 2.0 # maximum rate of new requests to a single host
+DOWNLOAD_RETRIES = 5 # number of retries before a download is reported as failed
+BACKOFF_SECONDS = 2 # delay before the first retry, doubled for every later retry
+MAX_BACKOFF_SECONDS = 60
+DOWNLOAD_TIMEOUT = 60 # seconds to wait for a response or for the next block of data
+DOWNLOAD_CHUNK_SIZE = 2**20 # bytes read from the response and written to disk at a time
+PART_EXTENSION = ".part"
+RETRY_STATUS_CODES = [408, 429, 500, 502, 503, 504] # HTTP errors that are retried, all others fail immediately
+
+
+################# functions ##################################
+
+# create a download manager and start its worker threads
+# INPUTS:
+#    numWorkers (int) - number of worker threads
+#    requestsPerSecond (float) - maximum rate of new requests to a single host
+#    maxRetries (int) - number of retries before a download is reported as failed
+#    timeout (float) - seconds to wait for a response or for the next block of data
+# OUTPUTS:
+#    manager (dict) - manager state used by submitDownload, waitForDownloads and closeDownloadManager
+def createDownloadManager(numWorkers=DOWNLOAD_WORKERS, requestsPerSecond=REQUESTS_PER_SECOND,
+                          maxRetries=DOWNLOAD_RETRIES, timeout=DOWNLOAD_TIMEOUT):
+    manager = {'jobs': queue.Queue(), 'lock': threading.Lock(), 'nextRequest': {}, 'results': {}, 'nextId': 0,
+               'requestInterval': 1.0 / requestsPerSecond, 'maxRetries': maxRetries, 'timeout': timeout,
+               'workers': [], 'bytesDownloaded': 0, 'startTime': time.time()}
+    for workerNum in range(numWorkers):
+        worker = threading.Thread(target=downloadWorker, args=(manager,))
+        worker.daemon = True
+        worker.start()
+        manager['workers'].append(worker)
+    return manager
+### end of createDownloadManager ###
+
+
+# add a download to the manager's queue
+# INPUTS:
+#    manager (dict) - manager created by createDownloadManager
+#    url (str or function) - url to download, or a function without arguments that returns the url.  A
+#                            function is called again for every attempt
+#    outputFile (str) - full filepath where the download will be written
+#    postProcess (function) - optional function called with outputFile after the download completes (e.g. to
+#                             unzip the download).  An exception in postProcess removes the file and retries
+# OUTPUTS:
+#    jobId (int) - identifier of the download, used as the key of its result
+def submitDownload(manager, url, outputFile, postProcess=None):
+    with manager['lock']:
+        jobId = manager['nextId']
+        manager['nextId'] += 1
+    manager['jobs'].put({'jobId': jobId, 'url': url, 'outputFile': outputFile, 'postProcess': postProcess})
+    return jobId
+### end of submitDownload ###
+
+
+# wait until a new request to a host is allowed by the rate limit.  Slots are reserved under the lock and
+# the wait happens outside of it, so workers requesting other hosts are not blocked
+# INPUTS:
+#    manager (dict) - manager created by createDownloadManager
+#    url (str) - url about to be requested
+def waitForHost(manager, url):
+    host = urlparse(url).netloc
+    with manager['lock']:
+        currentTime = time.time()
+        requestTime = max(currentTime, manager['nextRequest'].get(host, 0))
+        manager['nextRequest'][host] = requestTime + manager['requestInterval']
+    if requestTime > currentTime:
+        time.sleep(requestTime - currentTime)
+### end of waitForHost ###
+
+
+# determine the delay before retrying a download, using exponential backoff with jitter
+# INPUTS:
+#    attempt (int) - number of attempts already made
+# OUTPUTS:
+#    delay (float) - seconds to wait before the next attempt
+def determineBackoff(attempt):
+    delay = min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** (attempt - 1))
+    delay = delay * random.uniform(0.5, 1.0)
+    return delay
+### end of determineBackoff ###
+
+
+# stream a url to disk.  Data is written to a partial file, which is resumed with an HTTP Range request if it
+# already exists and renamed to outputFile once the download is complete
+# INPUTS:
+#    manager (dict) - manager created by createDownloadManager
+#    url (str) - url to download
+#    outputFile (str) - full filepath where the download will be written
+def streamDownload(manager, url, outputFile):
+    partFile = outputFile + PART_EXTENSION
+    startByte = os.path.getsize(partFile) if os.path.exists(partFile) else 0
+    request = urlrequest.Request(url)
+    if startByte > 0:
+        request.add_header('Range', 'bytes=' + str(startByte) + '-')
+    waitForHost(manager, url)
+    try:
+        response = urlrequest.urlopen(request, timeout=manager['timeout'])
+    except HTTPError as e:
+        # the partial file already holds the complete download
+        if e.code == 416 and startByte > 0:
+            os.rename(partFile, outputFile)
+            return
+        raise
+    try:
+        # servers that ignore the Range header send the whole file again
+        if startByte > 0 and response.getcode() != 206:
+            startByte = 0
+        expectedLength = response.info().get('Content-Length')
+        bytesWritten = 0
+        with open(partFile, 'ab' if startByte > 0 else 'wb') as f:
+            block = response.read(DOWNLOAD_CHUNK_SIZE)
+            while len(block) > 0:
+                f.write(block)
+                bytesWritten += len(block)
+                block = response.read(DOWNLOAD_CHUNK_SIZE)
+    finally:
+        response.close()
+    with manager['lock']:
+        manager['bytesDownloaded'] += bytesWritten
+    if expectedLength is not None and bytesWritten < int(expectedLength):
+        raise IOError("connection closed after " + str(bytesWritten) + " of " + expectedLength + " bytes")
+    if os.path.exists(outputFile):
+        os.remove(outputFile)
+    os.rename(partFile, outputFile)
+### end of streamDownload ###
+
+
+# download a single job, retrying failed attempts with backoff
+# INPUTS:
+#    manager (dict) - manager created by createDownloadManager
+#    job (dict) - job created by submitDownload
+# OUTPUTS:
+#    error (str) - None if the download succeeded, otherwise the reason for the last failure
+def runDownloadJob(manager, job):
+    outputFolder = os.path.dirname(job['outputFile'])
+    if len(outputFolder) > 0 and not os.path.exists(outputFolder):
+        try:
+            os.makedirs(outputFolder)
+        except OSError:
+            pass # created by another worker
+    attempt = 0
+    while True:
+        try:
+            url = job['url']() if callable(job['url']) else job['url']
+            streamDownload(manager, url, job['outputFile'])
+            if job['postProcess'] is not None:
+                try:
+                    job['postProcess'](job['outputFile'])
+                except Exception:
+                    os.remove(job['outputFile'])
+                    raise
+            return None
+        except HTTPError as e:
+            error = "HTTP Error " + str(e.code)
+            if e.code not in RETRY_STATUS_CODES:
+                return error
+        except Exception as e:
+            # connection errors, timeouts, incomplete downloads and corrupt files are retried
+            error = str(e)
+        attempt += 1
+        if attempt > manager['maxRetries']:
+            return error
+        delay = determineBackoff(attempt)
+        print("download of " + job['outputFile'] + " failed (" + error + "), retrying in %.1f seconds" % delay)
+        time.sleep(delay)
+### end of runDownloadJob ###
+
+
+# worker thread: run jobs from the queue until the stop signal (None) is received
+# INPUTS:
+#    manager (dict) - manager created by createDownloadManager
+def downloadWorker(manager):
+    while True:
+        job = manager['jobs'].get()
+        if job is None:
+            manager['jobs'].task_done()
+            return
+        try:
+            error = runDownloadJob(manager, job)
+        except Exception as e:
+            error = str(e)
+        with manager['lock']:
+            manager['results'][job['jobId']] = error
+        if error is not None:
+            print("could not download " + job['outputFile'] + ": " + error)
+        manager['jobs'].task_done()
+### end of downloadWorker ###
+
+
+# wait for all submitted downloads to complete and report throughput
+# INPUTS:
+#    manager (dict) - manager created by createDownloadManager
+# OUTPUTS:
+#    failures (dict) - maps the id of each failed download to the reason for its last failure
+def waitForDownloads(manager):
+    manager['jobs'].join()
+    elapsed = max(time.time() - manager['startTime'], 1e-6)
+    failures = {}
+    for jobId in manager['results']:
+        if manager['results'][jobId] is not None:
+            failures[jobId] = manager['results'][jobId]
+    print("downloaded " + str(len(manager['results']) - len(failures)) + " of " + str(len(manager['results'])) +
+          " files, %.1f MB at %.2f MB per second" % (manager['bytesDownloaded'] / 1e6, manager['bytesDownloaded'] / 1e6 / elapsed))
+    return failures
+### end of waitForDownloads ###
+
+
+# stop the worker threads once the queued downloads are complete
+# INPUTS:
+#    manager (dict) - manager created by createDownloadManager
+def closeDownloadManager(manager):
+    for worker in manager['workers']:
+        manager['jobs'].put(None)
+    for worker in manager['workers']:
+        worker.join()
+    manager['workers'] = []
+### end of closeDownloadManager ###
+
+
+# download a list of files concurrently and wait for all of them to complete
+# INPUTS:
+#    downloads (list) - (url, outputFile, postProcess) tuples, as described in submitDownload
+#    numWorkers (int) - number of worker threads
+# OUTPUTS:
+#    failures (dict) - maps the index of each failed download to the reason for its last failure
+def runDownloads(downloads, numWorkers=DOWNLOAD_WORKERS):
+    manager = createDownloadManager(numWorkers)
+    try:
+        for url, outputFile, postProcess in downloads:
+            submitDownload(manager, url, outputFile, postProcess)
+        failures = waitForDownloads(manager)
+    finally:
+        closeDownloadManager(manager)
+    return failures
+### end of runDownloads ###
+
+################# end of functions ############################
+
+
+############### end of downloadManager_Canada_LUR.py ###############
@@ -0,0 +1,137 @@
+################# focalMean_Canada_LUR.py ##################
+#
+# Circular focal means for several radii in one pass.  Replaces focalStatsOnOneRaster, which called
+# arcpy.sa.FocalStatistics(NbrCircle(numCells, "CELL"), "MEAN", "DATA") once per raster and radius, so the
+# 250, 500 and 1000m NDVI smoothings each needed a separate full pass over the raster.
+#
+# The raster is processed in FOCAL_TILE_SIZE x FOCAL_TILE_SIZE tiles, each read once with a halo as wide as the
+# largest radius, so memory stays bounded on national rasters.  Within a tile, prefix sums along each row
+# (a one dimensional integral image) give the sum of any horizontal run of cells with two lookups.  A circle
+# of radius r is the union of 2r + 1 horizontal runs, so each radius costs O(r) operations per cell no matter
+# how many cells the circle contains, and the prefix sums are shared by all radii.
+#
+# NoData follows the ArcGIS "DATA" option: NoData cells are ignored, the mean is taken over the valid cells in
+# the neighbourhood, and a cell is NoData only if its whole neighbourhood is NoData.  As with NbrCircle, a cell
+# is in the neighbourhood if its centre is within the radius (in cells) of the processing cell centre.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, rasterio (no ArcGIS license or extension is required)
+
+
+############## import required modules ###############
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+############## end of module import ##################
+
+
+FOCAL_TILE_SIZE = 1024 # cells per side of each tile, excluding the halo
+FOCAL_NODATA = -3.4028235e+38 # NoData value of the output rasters (ArcGIS default)
+
+
+################# functions ##################################
+
+# determine the half width of each row of a circular neighbourhood
+# INPUTS:
+#    numCells (int) - radius of the neighbourhood, in cells
+# OUTPUTS:
+#    halfWidths (int array) - half width, in cells, of the rows at offsets -numCells to numCells
+def circleHalfWidths(numCells):
+    rowOffsets = np.arange(-numCells, numCells + 1)
+    halfWidths = np.floor(np.sqrt(numCells ** 2 - rowOffsets ** 2) + 1e-9).astype(np.int64)
+    return halfWidths
+### end of circleHalfWidths ###
+
+
+# calculate prefix sums along each row, with a leading column of zeros
+# INPUTS:
+#    values (float array) - 2d array
+# OUTPUTS:
+#    rowSums (float array) - rowSums[:, c] is the sum of values[:, 0:c]
+def rowPrefixSums(values):
+    rowSums = np.zeros((values.shape[0], values.shape[1] + 1), dtype=np.float64)
+    np.cumsum(values, axis=1, out=rowSums[:, 1:])
+    return rowSums
+### end of rowPrefixSums ###
+
+
+# calculate the sum within a circular neighbourhood of every cell in the centre of a padded tile
+# INPUTS:
+#    rowSums (float array) - row prefix sums of the padded tile, as returned by rowPrefixSums
+#    halo (int) - width of the padding around the tile, at least numCells
+#    numCells (int) - radius of the neighbourhood, in cells
+# OUTPUTS:
+#    circleSums (float array) - neighbourhood sum of each unpadded cell
+def circleSums(rowSums, halo, numCells):
+    numRows = rowSums.shape[0] - 2 * halo
+    numColumns = rowSums.shape[1] - 1 - 2 * halo
+    circleSums = np.zeros((numRows, numColumns), dtype=np.float64)
+    halfWidths = circleHalfWidths(numCells)
+    for offsetIndex in range(len(halfWidths)):
+        rowStart = halo + offsetIndex - numCells
+        halfWidth = halfWidths[offsetIndex]
+        rowBlock = rowSums[rowStart:rowStart + numRows]
+        circleSums += (rowBlock[:, halo + halfWidth + 1:halo + halfWidth + 1 + numColumns] -
+                       rowBlock[:, halo - halfWidth:halo - halfWidth + numColumns])
+    return circleSums
+### end of circleSums ###
+
+
+# calculate focal means for several radii on one padded tile
+# INPUTS:
+#    paddedValues (float array) - tile values with a halo on every side, NaN for NoData
+#    halo (int) - width of the halo, at least the largest radius
+#    radiusList (int list) - neighbourhood radii, in cells
+# OUTPUTS:
+#    focalMeans (float array list) - mean of the valid cells within each radius, NaN where there are none
+def focalMeanTile(paddedValues, halo, radiusList):
+    validCells = ~np.isnan(paddedValues)
+    valueSums = rowPrefixSums(np.where(validCells, paddedValues, 0))
+    countSums = rowPrefixSums(validCells.astype(np.float64))
+    focalMeans = []
+    for numCells in radiusList:
+        totals = circleSums(valueSums, halo, numCells)
+        counts = np.rint(circleSums(countSums, halo, numCells))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            focalMeans.append(np.where(counts > 0, totals / counts, np.nan))
+    return focalMeans
+### end of focalMeanTile ###
+
+
+# calculate circular focal means of a raster for several radii, reading each tile of the raster only once
+# INPUTS:
+#    inputRaster (str) - full filepath to the raster
+#    radiusList (int list) - neighbourhood radii, in cells
+#    outputFiles (str list) - full filepath of the output raster for each radius
+#    tileSize (int) - cells per side of each tile
+def focalMeans(inputRaster, radiusList, outputFiles, tileSize=FOCAL_TILE_SIZE):
+    halo = int(max(radiusList))
+    with rasterio.open(inputRaster) as source:
+        profile = source.profile.copy()
+        profile.update(driver='GTiff', dtype='float32', count=1, nodata=FOCAL_NODATA, tiled=True,
+                       blockxsize=256, blockysize=256, compress='deflate', BIGTIFF='IF_SAFER')
+        destinations = [rasterio.open(outputFile, 'w', **profile) for outputFile in outputFiles]
+        try:
+            for rowOff in range(0, source.height, tileSize):
+                for colOff in range(0, source.width, tileSize):
+                    window = Window(colOff, rowOff, min(tileSize, source.width - colOff), min(tileSize, source.height - rowOff))
+                    paddedWindow = Window(colOff - halo, rowOff - halo, window.width + 2 * halo, window.height + 2 * halo)
+                    paddedValues = source.read(1, window=paddedWindow, boundless=True, masked=True)
+                    paddedValues = np.ma.filled(paddedValues.astype(np.float64), np.nan)
+                    tileMeans = focalMeanTile(paddedValues, halo, radiusList)
+                    for radiusIndex in range(len(radiusList)):
+                        tileMean = tileMeans[radiusIndex].astype(np.float32)
+                        tileMean[np.isnan(tileMean)] = FOCAL_NODATA
+                        destinations[radiusIndex].write(tileMean, 1, window=window)
+        finally:
+            for destination in destinations:
+                destination.close()
+    print("calculated focal means with radii of " + str(radiusList) + " cells for " + inputRaster)
+### end of focalMeans ###
+
+################# end of functions ############################
+
+
+############### end of focalMean_Canada_LUR.py ###############
@@ -0,0 +1,291 @@
+################# integralImage_Canada_LUR.py ##################
+#
+# Summed-area table (integral image) index for raster buffer sums.  The index stores cumulative sums of
+# raster values and of valid (non NoData) cells, so the sum over any rectangle of cells costs four lookups
+# regardless of its size.  Square and square-annulus sums use one and two rectangles.  Circular buffers are
+# decomposed into a small set of rectangles (consecutive rows of the circle with the same half-width), and the
+# decomposition is cached for each radius and cell size, so buffer sums for 10-20km radii cost a few hundred
+# lookups instead of reading hundreds of thousands of cells.
+#
+# The index is never built for a whole raster.  Monitors are grouped by raster tile and each tile's index covers
+# the tile plus a halo of the largest radius, so memory is bounded by INTEGRAL_IMAGE_TILE_SIZE and the largest
+# buffer, whatever the size of the raster.  If PERSIST_INTEGRAL_IMAGE is set, each tile and band index is saved
+# to a folder next to the raster (e.g. N6.tif -> N6_sat/) and memory-mapped when it is used again, so reruns
+# over the same rasters skip reading the tile and building the index.  Indexes older than their raster are rebuilt.
+#
+# Circles are evaluated at cell resolution: a cell is inside a buffer if its centre is within the radius of the
+# centre of the cell containing the monitor.  This is a different buffer definition from the sub-cell coverage
+# weights of zonalStatistics_Canada_LUR.py (see USE_INTEGRAL_IMAGE in constantValues.py)
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, rasterio
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+import os
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+import constantValues as values
+############## end of module import ##################
+
+
+# cache of circle rectangle decompositions, keyed by (radius, cell width, cell height)
+ROW_SPAN_CACHE = {}
+
+
+################# functions ##################################
+
+# build the integral images of raster values and valid cell counts.  Both images have a leading row and
+# column of zeros, so that rectangle sums need no boundary tests
+# INPUTS:
+#    rasterValues (float array) - raster values, NoData cells are NaN
+# OUTPUTS:
+#    integralImage (float array) - array with shape (2, rows + 1, cols + 1).  Index 0 holds cumulative sums
+#                                  of raster values, index 1 holds cumulative counts of valid cells
+def buildIntegralImage(rasterValues):
+    validCells = np.isfinite(rasterValues)
+    numRows, numCols = rasterValues.shape
+    integralImage = np.zeros((2, numRows + 1, numCols + 1), dtype=np.float64)
+    integralImage[0, 1:, 1:] = np.where(validCells, rasterValues, 0).cumsum(axis=0).cumsum(axis=1)
+    integralImage[1, 1:, 1:] = validCells.cumsum(axis=0).cumsum(axis=1)
+    return integralImage
+### end of buildIntegralImage ###
+
+
+# determine the filepath of the persisted index of one band for a window of raster cells
+# INPUTS:
+#    rasterFile (str) - full filepath to the raster
+#    firstRow, firstCol (int) - first row and column of the window
+#    lastRow, lastCol (int) - row and column after the end of the window
+#    bandNum (int) - band number, starting at 0
+# OUTPUTS:
+#    indexFile (str) - full filepath to the persisted index
+def determineIndexFile(rasterFile, firstRow, firstCol, lastRow, lastCol, bandNum):
+    indexFolder = os.path.splitext(rasterFile)[0] + "_sat"
+    indexFile = os.path.join(indexFolder, "r%d_%d_c%d_%d_b%d.npy" % (firstRow, lastRow, firstCol, lastCol, bandNum))
+    return indexFile
+### end of determineIndexFile ###
+
+
+# save an index to a temporary file and atomically move it into place, so that processes reading the same
+# tile never load a partial index
+# INPUTS:
+#    integralImage (float array) - integral images, as returned by buildIntegralImage
+#    indexFile (str) - full filepath to the persisted index
+def saveIndexFile(integralImage, indexFile):
+    indexFolder = os.path.dirname(indexFile)
+    if not os.path.exists(indexFolder):
+        try:
+            os.makedirs(indexFolder)
+        except OSError:
+            if not os.path.isdir(indexFolder):
+                raise
+    tempFile = indexFile[:-len(".npy")] + ".%d.tmp.npy" % os.getpid()
+    np.save(tempFile, integralImage)
+    os.replace(tempFile, indexFile)
+### end of saveIndexFile ###
+
+
+# build the integral image indexes of every band for a window of raster cells
+# INPUTS:
+#    dataset (rasterio dataset) - open raster
+#    firstRow, firstCol (int) - first row and column of the window, within the raster extent
+#    lastRow, lastCol (int) - row and column after the end of the window, within the raster extent
+#    persist (boolean) - if True, indexes are saved next to the raster and memory-mapped when already saved
+# OUTPUTS:
+#    bandIndexes (dict list) - one index per band, each holding
+#        integral (float array) - integral images of the window, as returned by buildIntegralImage
+#        originX, originY (float) - coordinates of the upper left corner of the window
+#        cellWidth, cellHeight (float) - cell dimensions
+def loadWindowIndexes(dataset, firstRow, firstCol, lastRow, lastCol, persist=False):
+    transform = dataset.transform
+    indexFiles = [determineIndexFile(dataset.name, firstRow, firstCol, lastRow, lastCol, bandNum) for bandNum in range(dataset.count)]
+    rasterMtime = os.path.getmtime(dataset.name) if persist else None
+    indexesAreCurrent = persist and all([os.path.exists(indexFile) and os.path.getmtime(indexFile) >= rasterMtime
+                                         for indexFile in indexFiles])
+    if indexesAreCurrent:
+        integralImages = [np.load(indexFile, mmap_mode='r') for indexFile in indexFiles]
+    else:
+        window = Window(firstCol, firstRow, lastCol - firstCol, lastRow - firstRow)
+        windowValues = dataset.read(window=window).astype(np.float64)
+        if dataset.nodata is not None:
+            windowValues[windowValues == dataset.nodata] = np.nan
+        integralImages = [buildIntegralImage(windowValues[bandNum]) for bandNum in range(windowValues.shape[0])]
+        del windowValues
+        if persist:
+            for bandNum in range(len(integralImages)):
+                saveIndexFile(integralImages[bandNum], indexFiles[bandNum])
+    bandIndexes = []
+    for bandNum in range(len(integralImages)):
+        bandIndexes.append({'integral': integralImages[bandNum],
+                            'originX': transform.c + firstCol * transform.a, 'originY': transform.f + firstRow * transform.e,
+                            'cellWidth': transform.a, 'cellHeight': -transform.e})
+    return bandIndexes
+### end of loadWindowIndexes ###
+
+
+# sum raster values within circles centred on each point, for every band and radius of a raster.  Points are
+# grouped by the tile of tileSize x tileSize cells that contains them, and one integral image is built for each
+# occupied tile plus a halo of the largest radius, so memory is bounded by the tile size rather than the raster
+# size
+# INPUTS:
+#    rasterFile (str) - full filepath to the raster
+#    pointX, pointY (float arrays) - point coordinates, in the raster projection
+#    radii (float array) - circle radii, in meters
+#    tileSize (int) - tile width and height, in cells
+#    persist (boolean) - if True, tile indexes are saved next to the raster and memory-mapped when already saved
+# OUTPUTS:
+#    circleTotals (float array) - sum of raster values, with shape (number of points, number of bands, number of radii)
+#    circleCounts (float array) - number of valid cells, with the same shape as circleTotals
+def tiledCircleSums(rasterFile, pointX, pointY, radii, tileSize=values.INTEGRAL_IMAGE_TILE_SIZE,
+                    persist=values.PERSIST_INTEGRAL_IMAGE):
+    pointX = np.asarray(pointX, dtype=np.float64)
+    pointY = np.asarray(pointY, dtype=np.float64)
+    with rasterio.open(rasterFile) as dataset:
+        transform = dataset.transform
+        rasterIndex = {'originX': transform.c, 'originY': transform.f, 'cellWidth': transform.a, 'cellHeight': -transform.e}
+        circleTotals = np.zeros((len(pointX), dataset.count, len(radii)))
+        circleCounts = np.zeros((len(pointX), dataset.count, len(radii)))
+        if len(pointX) == 0:
+            return circleTotals, circleCounts
+        haloCells = int(np.ceil(np.max(radii) / min(rasterIndex['cellWidth'], rasterIndex['cellHeight']))) + 1
+        centreRow, centreCol = determineCentreCells(rasterIndex, pointX, pointY)
+
+        # points outside the raster are grouped with the nearest edge tile, whose halo covers their circles
+        tileRows = np.clip(centreRow, 0, dataset.height - 1) // tileSize
+        tileCols = np.clip(centreCol, 0, dataset.width - 1) // tileSize
+        tileKeys = tileRows * (dataset.width // tileSize + 1) + tileCols
+        for tileKey in np.unique(tileKeys):
+            tilePoints = np.nonzero(tileKeys == tileKey)[0]
+            tileRow = tileRows[tilePoints[0]]
+            tileCol = tileCols[tilePoints[0]]
+            bandIndexes = loadWindowIndexes(dataset, max(0, tileRow * tileSize - haloCells), max(0, tileCol * tileSize - haloCells),
+                                            min(dataset.height, (tileRow + 1) * tileSize + haloCells),
+                                            min(dataset.width, (tileCol + 1) * tileSize + haloCells), persist)
+            for bandNum in range(len(bandIndexes)):
+                for radiusNum in range(len(radii)):
+                    circleTotals[tilePoints, bandNum, radiusNum], circleCounts[tilePoints, bandNum, radiusNum] = circleSums(
+                        bandIndexes[bandNum], pointX[tilePoints], pointY[tilePoints], radii[radiusNum])
+            del bandIndexes
+    return circleTotals, circleCounts
+### end of tiledCircleSums ###
+
+
+# sum raster values and valid cells within rectangles of cells.  Rectangles are clipped to the raster extent
+# INPUTS:
+#    integralImage (float array) - integral images, as returned by buildIntegralImage
+#    firstRow, firstCol (int arrays) - first row and column of each rectangle
+#    lastRow, lastCol (int arrays) - row and column after the end of each rectangle
+# OUTPUTS:
+#    rectSums (float array) - sum of raster values in each rectangle
+#    rectCounts (float array) - number of valid cells in each rectangle
+def rectangleSums(integralImage, firstRow, firstCol, lastRow, lastCol):
+    numRows = integralImage.shape[1] - 1
+    numCols = integralImage.shape[2] - 1
+    firstRow = np.clip(firstRow, 0, numRows)
+    lastRow = np.clip(lastRow, 0, numRows)
+    firstCol = np.clip(firstCol, 0, numCols)
+    lastCol = np.clip(lastCol, 0, numCols)
+    lastRow = np.maximum(lastRow, firstRow)
+    lastCol = np.maximum(lastCol, firstCol)
+    rectTotals = (integralImage[:, lastRow, lastCol] - integralImage[:, firstRow, lastCol]
+                  - integralImage[:, lastRow, firstCol] + integralImage[:, firstRow, firstCol])
+    return rectTotals[0], rectTotals[1]
+### end of rectangleSums ###
+
+
+# determine the row and column of the cell containing each point
+# INPUTS:
+#    rasterIndex (dict) - index returned by loadWindowIndexes
+#    pointX, pointY (float arrays) - point coordinates, in the raster projection
+# OUTPUTS:
+#    centreRow, centreCol (int arrays) - row and column of the cell containing each point
+def determineCentreCells(rasterIndex, pointX, pointY):
+    centreCol = np.floor((np.asarray(pointX) - rasterIndex['originX']) / rasterIndex['cellWidth']).astype(np.int64)
+    centreRow = np.floor((rasterIndex['originY'] - np.asarray(pointY)) / rasterIndex['cellHeight']).astype(np.int64)
+    return centreRow, centreCol
+### end of determineCentreCells ###
+
+
+# sum raster values within squares centred on each point
+# INPUTS:
+#    rasterIndex (dict) - index returned by loadWindowIndexes
+#    pointX, pointY (float arrays) - point coordinates, in the raster projection
+#    halfWidth (int) - number of cells between the centre cell and the edge of the square
+# OUTPUTS:
+#    squareTotals (float array) - sum of raster values in each square
+#    squareCounts (float array) - number of valid cells in each square
+def squareSums(rasterIndex, pointX, pointY, halfWidth):
+    centreRow, centreCol = determineCentreCells(rasterIndex, pointX, pointY)
+    squareTotals, squareCounts = rectangleSums(rasterIndex['integral'], centreRow - halfWidth, centreCol - halfWidth,
+                                               centreRow + halfWidth + 1, centreCol + halfWidth + 1)
+    return squareTotals, squareCounts
+### end of squareSums ###
+
+
+# sum raster values within square annuli centred on each point
+# INPUTS:
+#    rasterIndex (dict) - index returned by loadWindowIndexes
+#    pointX, pointY (float arrays) - point coordinates, in the raster projection
+#    innerHalfWidth (int) - half width of the excluded inner square, in cells
+#    outerHalfWidth (int) - half width of the outer square, in cells
+# OUTPUTS:
+#    annulusTotals (float array) - sum of raster values in each annulus
+#    annulusCounts (float array) - number of valid cells in each annulus
+def annulusSums(rasterIndex, pointX, pointY, innerHalfWidth, outerHalfWidth):
+    outerTotals, outerCounts = squareSums(rasterIndex, pointX, pointY, outerHalfWidth)
+    innerTotals, innerCounts = squareSums(rasterIndex, pointX, pointY, innerHalfWidth)
+    return outerTotals - innerTotals, outerCounts - innerCounts
+### end of annulusSums ###
+
+
+# decompose a circle into rectangles of cells.  Each row of the circle spans the cells whose centres are
+# within the radius, and consecutive rows with the same span are merged into a single rectangle.  Results
+# are cached for each radius and cell size
+# INPUTS:
+#    radius (float) - circle radius, in meters
+#    cellWidth, cellHeight (float) - cell dimensions, in meters
+# OUTPUTS:
+#    rowSpans (int array) - array with shape (number of rectangles, 3).  Each row holds the first row offset,
+#                           the row offset after the last row, and the column half-width of a rectangle
+def circleRowSpans(radius, cellWidth, cellHeight):
+    cacheKey = (float(radius), float(cellWidth), float(cellHeight))
+    if cacheKey in ROW_SPAN_CACHE:
+        return ROW_SPAN_CACHE[cacheKey]
+    maxRowOffset = int(np.floor(radius / cellHeight))
+    rowOffsets = np.arange(-maxRowOffset, maxRowOffset + 1)
+    halfWidths = np.floor(np.sqrt(np.maximum(radius ** 2 - (rowOffsets * cellHeight) ** 2, 0)) / cellWidth).astype(np.int64)
+    spanStarts = np.concatenate(([0], np.nonzero(np.diff(halfWidths))[0] + 1))
+    spanEnds = np.concatenate((spanStarts[1:], [len(rowOffsets)]))
+    rowSpans = np.column_stack((rowOffsets[spanStarts], rowOffsets[spanEnds - 1] + 1, halfWidths[spanStarts]))
+    ROW_SPAN_CACHE[cacheKey] = rowSpans
+    return rowSpans
+### end of circleRowSpans ###
+
+
+# sum raster values within circles centred on each point, using the cached circle decomposition
+# INPUTS:
+#    rasterIndex (dict) - index returned by loadWindowIndexes
+#    pointX, pointY (float arrays) - point coordinates, in the raster projection
+#    radius (float) - circle radius, in meters
+# OUTPUTS:
+#    circleTotals (float array) - sum of raster values in each circle
+#    circleCounts (float array) - number of valid cells in each circle
+def circleSums(rasterIndex, pointX, pointY, radius):
+    rowSpans = circleRowSpans(radius, rasterIndex['cellWidth'], rasterIndex['cellHeight'])
+    centreRow, centreCol = determineCentreCells(rasterIndex, pointX, pointY)
+    centreRow = centreRow[:, np.newaxis]
+    centreCol = centreCol[:, np.newaxis]
+    rectTotals, rectCounts = rectangleSums(rasterIndex['integral'], centreRow + rowSpans[:, 0], centreCol - rowSpans[:, 2],
+                                           centreRow + rowSpans[:, 1], centreCol + rowSpans[:, 2] + 1)
+    return rectTotals.sum(axis=1), rectCounts.sum(axis=1)
+### end of circleSums ###
+
+################# end of functions ############################
+
+
+############### end of integralImage_Canada_LUR.py ###############
@@ -0,0 +1,437 @@
+################# lassoPath_Canada_LUR.py ##################
+#
+# Non-negative lasso variable selection for the NO2 LUR model.  Python counterpart of createLassoModel in
+# modelSelection_Canada_LUR.R, which flips the sign of protective variables and calls
+# cv.glmnet(..., standardize=TRUE, lower.limit=0) again for every subset of the predictors (all variables,
+# subsetRoads, subsetBuiltEnv, dropNDVI).
+#
+# The lasso is solved by coordinate descent with covariance updates: once the Gram matrix X'X and X'y of the
+# standardized predictors are known, each coordinate update costs O(number of predictors) and never touches
+# the monitor data.  Coefficients are restricted to be non-negative, and each lambda on the path starts from
+# the solution of the previous lambda (warm start), iterating over the active set until it is stable.
+#
+# Raw moments (counts, sums, X'X and X'y) are calculated once per cross-validation fold for the pool of all
+# candidate columns.  The moments of any training set are the total minus one fold, and the moments of any
+# subset model are a submatrix of the pool, so cross-validating every subset of the sensitivity sweep reads
+# the data once.  Folds are fitted in parallel on a pool of worker processes.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, pandas
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+import multiprocessing
+import numpy as np
+import pandas as ps
+import constantValues as values
+############## end of module import ##################
+
+
+MODEL_DATA_FILE = values.PARENT_FOLDER + "Canada_LUR_preprocessed_Sep17_18_v2.csv"
+OUTCOME = "meanNO2_2014_2016"
+NON_PREDICTORS = ["Unnamed: 0", "NAPS ID", "percent completeness_2013", "percent completeness_2014",
+                  "percent completeness_2015", "percent completeness_2016", "mean_2013", "mean_2014", "mean_2015",
+                  "mean_2016", "numObs", "meanNO2_2014_2016"] # column names as read by pandas, not the R make.names versions
+# pr_14_16 remains a candidate predictor: modelSelection_Canada_LUR.R overwrites its drops list before it is used
+# and its final models include pr_14_16
+# variables with an expected negative association with NO2, matched on the first two characters of the column
+# name as switchList in modelSelection_Canada_LUR.R.  switchList also lists port_dist, but since R compares
+# two character prefixes port_dist is never flipped there, and it is not flipped here either
+PROTECTIVE_LABELS = ["bL", "ND", "wa", "pr"]
+BUFFER_DISTANCES = [50, 100, 250, 500, 750, 1000, 2000, 3000, 4000, 5000, 10000, 15000, 20000]
+NUM_LAMBDA = 100
+LAMBDA_MIN_RATIO = 0.01
+NUM_FOLDS = 10
+CD_TOLERANCE = 1e-7 # convergence threshold on the largest weighted squared coefficient change, relative to the outcome variance (as glmnet thresh)
+CD_MAX_SWEEPS = 100000
+
+
+################# functions ##################################
+
+# remove the .<n> suffix that duplicate column names are given when a table is written or read (e.g. dR500m.1).
+# A suffixed column is renamed to its base name when the base name is not already used, and dropped otherwise
+# INPUTS:
+#    inData (DataFrame) - candidate predictors
+# OUTPUTS:
+#    outData (DataFrame) - candidate predictors without suffixed column names
+def normaliseColumnNames(inData):
+    suffixed = inData.columns[inData.columns.str.contains(r"\.\d+$")]
+    baseNames = suffixed.str.replace(r"\.\d+$", "", regex=True)
+    dropCols = [col for col, baseName in zip(suffixed, baseNames) if baseName in inData.columns]
+    renameCols = dict([(col, baseName) for col, baseName in zip(suffixed, baseNames) if col not in dropCols])
+    if len(set(renameCols.values())) < len(renameCols):
+        raise Exception("columns " + str(sorted(renameCols.keys())) + " do not have unique base names")
+    if len(dropCols) > 0:
+        print("warning: dropping duplicate columns " + str(dropCols))
+    outData = inData.drop(columns=dropCols).rename(columns=renameCols)
+    return outData
+### end of normaliseColumnNames ###
+
+
+# load the outcome and the pool of candidate predictors.  Mirrors the setup in modelSelection_Canada_LUR.R
+# INPUTS:
+#    inputFile (str) - full filepath to the preprocessed csv file
+#    minNumObs (int) - variables with fewer than minNumObs values greater than 0 are removed
+#    outcome (str) - outcome column
+# OUTPUTS:
+#    predictorPool (DataFrame) - numeric candidate predictors, one row per monitor
+#    outcomeValues (float array) - outcome of each monitor
+def loadPredictorPool(inputFile, minNumObs=10, outcome=OUTCOME):
+    rawData = ps.read_csv(inputFile)
+    missingCols = [col for col in NON_PREDICTORS if col not in rawData.columns]
+    if len(missingCols) > 0:
+        raise Exception("non predictor columns " + str(missingCols) + " are not in " + inputFile)
+    rawData = rawData[(rawData['elevation'] > -1) & rawData[outcome].notnull()]
+    predictorPool = normaliseColumnNames(rawData.drop(columns=NON_PREDICTORS))
+    predictorPool = predictorPool.select_dtypes(include=[np.number]).dropna(axis=1)
+    numPositive = (predictorPool > 0).sum(axis=0)
+    predictorPool = predictorPool.loc[:, numPositive >= minNumObs]
+    print("loaded " + str(predictorPool.shape[1]) + " candidate predictors for " + str(len(predictorPool)) + " air monitors")
+    return predictorPool, rawData[outcome].values.astype(np.float64)
+### end of loadPredictorPool ###
+
+
+# flip the sign of protective variables, so that a non-negative coefficient on a flipped variable is a
+# negative association with the original variable
+# INPUTS:
+#    inData (DataFrame) - candidate predictors
+#    protectiveLabels (str list) - prefixes of protective variables
+# OUTPUTS:
+#    outData (DataFrame) - candidate predictors with flipped protective variables
+def flipProtectiveVariables(inData, protectiveLabels=PROTECTIVE_LABELS):
+    unmatchedLabels = [label for label in protectiveLabels if not any([col[0:2] == label for col in inData.columns])]
+    if len(unmatchedLabels) > 0:
+        raise Exception("protective labels " + str(unmatchedLabels) + " do not match any candidate predictor")
+    flipCols = [col for col in inData.columns if col[0:2] in protectiveLabels]
+    outData = inData.copy()
+    outData[flipCols] = -outData[flipCols]
+    return outData
+### end of flipProtectiveVariables ###
+
+
+# list the buffer variables with the given prefixes that exist in a set of columns
+# INPUTS:
+#    columns (str list) - available columns
+#    labels (str list) - variable prefixes, e.g. bR or NDVI_14_16_
+#    bufferDists (int list) - buffer distances, in meters
+# OUTPUTS:
+#    bufferCols (str list) - matching columns
+def selectBufferColumns(columns, labels, bufferDists=BUFFER_DISTANCES):
+    bufferCols = []
+    for label in labels:
+        for dist in bufferDists:
+            if label + str(dist) + "m" in columns:
+                bufferCols.append(label + str(dist) + "m")
+    return bufferCols
+### end of selectBufferColumns ###
+
+
+# road variables (and optionally satellite NO2) from a set of columns, as in subsetRoads
+def subsetRoads(columns, keepSat=True):
+    return selectBufferColumns(columns, ["bR", "cR", "dR", "eR", "fR", "alRds"]) + (["sat_10_12"] if keepSat and "sat_10_12" in columns else [])
+### end of subsetRoads ###
+
+
+# built environment variables (and optionally protective variables and satellite NO2), as in subsetBuiltEnv
+def subsetBuiltEnv(columns, keepProtectors=True, keepSat=True):
+    labels = ["aL", "bL", "cL"] + (["wa", "NDVI_14_16_"] if keepProtectors else [])
+    return selectBufferColumns(columns, labels) + (["sat_10_12"] if keepSat and "sat_10_12" in columns else [])
+### end of subsetBuiltEnv ###
+
+
+# all columns except NDVI buffers of 500m and larger, as in dropNDVI
+def dropNDVI(columns):
+    drops = selectBufferColumns(columns, ["NDVI_14_16_"], BUFFER_DISTANCES[3:])
+    return [col for col in columns if col not in drops]
+### end of dropNDVI ###
+
+
+# assign each monitor to a cross-validation fold
+# INPUTS:
+#    numRows (int) - number of monitors
+#    numFolds (int) - number of folds
+#    seed (int) - random seed
+# OUTPUTS:
+#    foldIds (int array) - fold of each monitor, from 0 to numFolds - 1
+def makeFoldIds(numRows, numFolds=NUM_FOLDS, seed=0):
+    foldIds = np.random.RandomState(seed).permutation(np.arange(numRows) % numFolds)
+    return foldIds
+### end of makeFoldIds ###
+
+
+# calculate the raw moments of every fold for the pool of candidate predictors
+# INPUTS:
+#    poolValues (float array) - candidate predictors with shape (monitors, predictors)
+#    outcomeValues (float array) - outcome of each monitor
+#    foldIds (int array) - fold of each monitor
+# OUTPUTS:
+#    momentCache (dict) - count, sumX, sumY, sumYY, XtX and Xty of each fold (first axis), and the totals over all folds
+def buildMomentCache(poolValues, outcomeValues, foldIds):
+    numFolds = int(foldIds.max()) + 1
+    numCols = poolValues.shape[1]
+    momentCache = {'count': np.zeros(numFolds), 'sumX': np.zeros((numFolds, numCols)), 'sumY': np.zeros(numFolds), 'sumYY': np.zeros(numFolds),
+                   'XtX': np.zeros((numFolds, numCols, numCols)), 'Xty': np.zeros((numFolds, numCols)), 'foldIds': foldIds}
+    for fold in range(numFolds):
+        foldX = poolValues[foldIds == fold]
+        foldY = outcomeValues[foldIds == fold]
+        momentCache['count'][fold] = len(foldY)
+        momentCache['sumX'][fold] = foldX.sum(axis=0)
+        momentCache['sumY'][fold] = foldY.sum()
+        momentCache['sumYY'][fold] = np.dot(foldY, foldY)
+        momentCache['XtX'][fold] = np.dot(foldX.T, foldX)
+        momentCache['Xty'][fold] = np.dot(foldX.T, foldY)
+    momentCache['total'] = dict([(name, momentCache[name].sum(axis=0)) for name in ['count', 'sumX', 'sumY', 'sumYY', 'XtX', 'Xty']])
+    return momentCache
+### end of buildMomentCache ###
+
+
+# extract the moments of a training set and subset of columns from the moment cache
+# INPUTS:
+#    momentCache (dict) - moments created by buildMomentCache
+#    colIndices (int array) - pool indices of the subset columns
+#    heldOutFold (int) - fold left out of the training set, or None for all monitors
+# OUTPUTS:
+#    moments (dict) - count, sumX, sumY, sumYY, XtX and Xty of the training set
+def selectMoments(momentCache, colIndices, heldOutFold=None):
+    moments = {}
+    for name in ['count', 'sumX', 'sumY', 'sumYY', 'XtX', 'Xty']:
+        moments[name] = momentCache['total'][name]
+        if heldOutFold is not None:
+            moments[name] = moments[name] - momentCache[name][heldOutFold]
+    moments['sumX'] = moments['sumX'][colIndices]
+    moments['XtX'] = moments['XtX'][np.ix_(colIndices, colIndices)]
+    moments['Xty'] = moments['Xty'][colIndices]
+    return moments
+### end of selectMoments ###
+
+
+# standardize moments as glmnet does with standardize=TRUE: predictors are centred and scaled by their
+# standard deviation (with denominator n), and the outcome is centred
+# INPUTS:
+#    moments (dict) - raw moments, as returned by selectMoments
+# OUTPUTS:
+#    standardized (dict)
+#        gram (float array) - X'X / n of the standardized predictors
+#        corr (float array) - X'y / n of the standardized predictors and centred outcome
+#        means, scales (float arrays) - predictor means and standard deviations (1 for constant predictors)
+#        meanY, varY (float) - outcome mean and variance
+#        constant (boolean array) - True for predictors without variance, which are kept at 0
+def standardizeMoments(moments):
+    count = moments['count']
+    means = moments['sumX'] / count
+    meanY = moments['sumY'] / count
+    covariance = moments['XtX'] / count - np.outer(means, means)
+    variances = np.maximum(np.diag(covariance), 0)
+    constant = variances <= 1e-12 * np.maximum(np.abs(np.diag(moments['XtX'])) / count, 1e-300)
+    scales = np.where(constant, 1.0, np.sqrt(variances))
+    standardized = {'gram': covariance / np.outer(scales, scales),
+                    'corr': (moments['Xty'] / count - means * meanY) / scales,
+                    'means': means, 'scales': scales, 'meanY': meanY,
+                    'varY': max(moments['sumYY'] / count - meanY ** 2, 1e-300), 'constant': constant}
+    return standardized
+### end of standardizeMoments ###
+
+
+# determine a decreasing lambda path, from the smallest lambda at which all coefficients are 0
+# INPUTS:
+#    corr (float array) - standardized X'y / n
+#    numLambda (int) - number of lambdas
+#    minRatio (float) - ratio of the smallest to the largest lambda
+# OUTPUTS:
+#    lambdas (float array) - lambdas in decreasing order
+def makeLambdaPath(corr, numLambda=NUM_LAMBDA, minRatio=LAMBDA_MIN_RATIO):
+    lambdaMax = max(np.max(corr), 1e-12) # only positive correlations can enter a non-negative model
+    lambdas = lambdaMax * np.logspace(0, np.log10(minRatio), numLambda)
+    return lambdas
+### end of makeLambdaPath ###
+
+
+# solve the non-negative lasso restricted to a working set of coordinates by cyclic coordinate descent with
+# covariance updates.  Only the working set block of the Gram matrix is used, so each update costs O(size of
+# the working set)
+# INPUTS:
+#    gram (float array) - standardized X'X / n
+#    corr (float array) - standardized X'y / n
+#    coefs (float array) - standardized coefficients, used as the warm start and updated in place
+#    workingSet (int array) - coordinates that may be non-zero
+#    lam (float) - lambda
+#    threshold (float) - convergence threshold on the largest weighted squared coefficient change of a sweep
+def solveWorkingSet(gram, corr, coefs, workingSet, lam, threshold):
+    subGram = gram[np.ix_(workingSet, workingSet)]
+    subCoefs = coefs[workingSet].copy()
+    gradient = corr[workingSet] - np.dot(gram[workingSet][:, workingSet], subCoefs)
+    diagonal = np.diag(subGram)
+    for sweep in range(CD_MAX_SWEEPS):
+        maxChange = 0.0
+        for j in range(len(workingSet)):
+            updated = max(0.0, subCoefs[j] + (gradient[j] - lam) / diagonal[j])
+            change = updated - subCoefs[j]
+            if change != 0.0:
+                gradient -= change * subGram[:, j]
+                subCoefs[j] = updated
+                maxChange = max(maxChange, diagonal[j] * change * change)
+        if maxChange <= threshold:
+            break
+    coefs[workingSet] = subCoefs
+### end of solveWorkingSet ###
+
+
+# fit non-negative lasso coefficients along a lambda path by warm started coordinate descent.  For each lambda
+# the problem is solved on a working set (the active coordinates of the previous lambda), and coordinates that
+# violate the optimality conditions of the full problem are added until there are none left
+# INPUTS:
+#    standardized (dict) - standardized moments, as returned by standardizeMoments
+#    lambdas (float array) - lambdas in decreasing order
+# OUTPUTS:
+#    coefPath (float array) - standardized coefficients, with shape (lambdas, predictors)
+def coordinateDescentPath(standardized, lambdas):
+    gram = standardized['gram']
+    corr = standardized['corr']
+    candidates = ~standardized['constant']
+    threshold = CD_TOLERANCE * standardized['varY']
+    coefs = np.zeros(gram.shape[0])
+    coefPath = np.zeros((len(lambdas), gram.shape[0]))
+    for lambdaIndex in range(len(lambdas)):
+        lam = lambdas[lambdaIndex]
+        workingSet = coefs > 0
+        while True:
+            if workingSet.any():
+                solveWorkingSet(gram, corr, coefs, np.where(workingSet)[0], lam, threshold)
+            # a zero coefficient is optimal only if its gradient is at most lambda
+            gradient = corr - np.dot(gram, coefs)
+            violators = candidates & ~workingSet & (gradient > lam)
+            if not violators.any():
+                break
+            workingSet |= violators
+        coefPath[lambdaIndex] = coefs
+    return coefPath
+### end of coordinateDescentPath ###
+
+
+# convert standardized coefficients to coefficients and intercepts on the original scale
+# INPUTS:
+#    coefPath (float array) - standardized coefficients, with shape (lambdas, predictors)
+#    standardized (dict) - standardized moments, as returned by standardizeMoments
+# OUTPUTS:
+#    coefficients (float array) - coefficients, with shape (lambdas, predictors)
+#    intercepts (float array) - intercept of each lambda
+def unstandardizeCoefficients(coefPath, standardized):
+    coefficients = coefPath / standardized['scales']
+    intercepts = standardized['meanY'] - np.dot(coefficients, standardized['means'])
+    return coefficients, intercepts
+### end of unstandardizeCoefficients ###
+
+
+# fit the lambda path on all folds but one and calculate the mean squared error on the held-out fold.  Runs on
+# a worker process
+# INPUTS:
+#    foldTask (tuple) - (training moments, held-out predictors, held-out outcome, lambdas).  Passed as one
+#                       argument for Pool.map
+# OUTPUTS:
+#    foldMse (float array) - held-out mean squared error of each lambda
+def runLassoFold(foldTask):
+    moments, testX, testY, lambdas = foldTask
+    standardized = standardizeMoments(moments)
+    coefficients, intercepts = unstandardizeCoefficients(coordinateDescentPath(standardized, lambdas), standardized)
+    predictions = np.dot(coefficients, testX.T) + intercepts[:, np.newaxis]
+    foldMse = np.mean((testY - predictions) ** 2, axis=1)
+    return foldMse
+### end of runLassoFold ###
+
+
+# cross-validate a non-negative lasso for one subset of the predictor pool, as cv.glmnet with lower.limit=0
+# INPUTS:
+#    momentCache (dict) - moments of the predictor pool, as returned by buildMomentCache
+#    poolValues (float array) - candidate predictors with shape (monitors, pool predictors)
+#    outcomeValues (float array) - outcome of each monitor
+#    colIndices (int array) - pool indices of the subset columns
+#    pool (multiprocessing Pool) - worker processes for the folds, or None to run the folds in this process
+# OUTPUTS:
+#    lassoFit (dict)
+#        lambdas, cvm, cvsd (float arrays) - lambda path, and the mean and standard error of the cv error
+#        lambdaMin, lambda1se (float) - lambda with the smallest cv error, and the largest lambda within one
+#                                       standard error of it
+#        coefficients (float array) - coefficients of the full data path, with shape (lambdas, predictors)
+#        intercepts (float array) - intercepts of the full data path
+def cvLasso(momentCache, poolValues, outcomeValues, colIndices, pool=None):
+    colIndices = np.asarray(colIndices)
+    standardized = standardizeMoments(selectMoments(momentCache, colIndices))
+    lambdas = makeLambdaPath(standardized['corr'])
+    foldIds = momentCache['foldIds']
+    foldTasks = []
+    for fold in range(len(momentCache['count'])):
+        foldTasks.append((selectMoments(momentCache, colIndices, fold), poolValues[foldIds == fold][:, colIndices],
+                          outcomeValues[foldIds == fold], lambdas))
+    if pool is None:
+        foldMse = np.asarray([runLassoFold(foldTask) for foldTask in foldTasks])
+    else:
+        foldMse = np.asarray(pool.map(runLassoFold, foldTasks))
+    # fold errors are weighted by fold size, as in cv.glmnet
+    foldWeights = momentCache['count'] / momentCache['count'].sum()
+    cvm = np.dot(foldWeights, foldMse)
+    cvsd = np.sqrt(np.dot(foldWeights, (foldMse - cvm) ** 2) / (len(foldWeights) - 1))
+    minIndex = int(np.argmin(cvm))
+    coefficients, intercepts = unstandardizeCoefficients(coordinateDescentPath(standardized, lambdas), standardized)
+    lassoFit = {'lambdas': lambdas, 'cvm': cvm, 'cvsd': cvsd, 'lambdaMin': lambdas[minIndex],
+                'lambda1se': lambdas[np.where(cvm <= cvm[minIndex] + cvsd[minIndex])[0][0]],
+                'coefficients': coefficients, 'intercepts': intercepts}
+    return lassoFit
+### end of cvLasso ###
+
+
+# run the lasso for every subset of a sensitivity sweep, reusing the moments of the predictor pool
+# INPUTS:
+#    predictorPool (DataFrame) - candidate predictors, with protective variables already flipped
+#    outcomeValues (float array) - outcome of each monitor
+#    subsets (dict) - maps the name of each subset model to its columns
+#    numFolds (int) - number of cross-validation folds
+#    seed (int) - random seed for the fold assignment.  All subsets use the same folds
+#    numWorkers (int) - number of worker processes, defaults to the number of cores.  1 runs in this process
+# OUTPUTS:
+#    sweepResults (dict) - maps the name of each subset model to its lassoFit (see cvLasso), with the added
+#                          key selected (dict mapping each variable selected at lambda1se to its coefficient)
+def lassoSensitivity(predictorPool, outcomeValues, subsets, numFolds=NUM_FOLDS, seed=0, numWorkers=None):
+    poolColumns = list(predictorPool.columns)
+    poolValues = predictorPool.values.astype(np.float64)
+    momentCache = buildMomentCache(poolValues, outcomeValues, makeFoldIds(len(outcomeValues), numFolds, seed))
+    if numWorkers is None:
+        numWorkers = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(min(numWorkers, numFolds)) if numWorkers > 1 else None
+    sweepResults = {}
+    try:
+        for subsetName in subsets:
+            subsetCols = [col for col in subsets[subsetName] if col in poolColumns]
+            lassoFit = cvLasso(momentCache, poolValues, outcomeValues, [poolColumns.index(col) for col in subsetCols], pool)
+            coefs = lassoFit['coefficients'][list(lassoFit['lambdas']).index(lassoFit['lambda1se'])]
+            lassoFit['selected'] = dict([(subsetCols[i], coefs[i]) for i in range(len(subsetCols)) if coefs[i] > 0])
+            sweepResults[subsetName] = lassoFit
+            print(subsetName + ": " + str(len(lassoFit['selected'])) + " of " + str(len(subsetCols)) + " variables selected")
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return sweepResults
+### end of lassoSensitivity ###
+
+################# end of functions ############################
+
+
+############## main function #################
+if __name__ == '__main__':
+    predictorPool, outcomeValues = loadPredictorPool(MODEL_DATA_FILE)
+    predictorPool = flipProtectiveVariables(predictorPool)
+    columns = list(predictorPool.columns)
+    subsets = {'all': dropNDVI(columns), 'roads': subsetRoads(columns), 'builtEnv': subsetBuiltEnv(columns),
+               'builtEnvNoProtectors': subsetBuiltEnv(columns, keepProtectors=False)}
+    sweepResults = lassoSensitivity(predictorPool, outcomeValues, subsets)
+    for subsetName in sorted(sweepResults.keys()):
+        print(subsetName + ": " + str(sorted(sweepResults[subsetName]['selected'].keys())))
+############## end of main function ##########
+
+
+############### end of lassoPath_Canada_LUR.py ###############
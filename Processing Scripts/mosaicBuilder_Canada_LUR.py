@@ -0,0 +1,286 @@
+################# mosaicBuilder_Canada_LUR.py ##################
+#
+# Streaming mosaic builder for downloaded raster tiles.  Replaces arcpy.MosaicToNewRaster_management in
+# mergeRasters, which required ArcGIS and held far more of the national extent in memory as the number of
+# stations grew.
+#
+# The mosaic is written block by block as a tiled, compressed GeoTIFF.  For each MOSAIC_BLOCK_SIZE x
+# MOSAIC_BLOCK_SIZE output block, only the input tiles that intersect the block are read, resampled to the
+# mosaic grid with the nearest cell centre, and combined with the MAXIMUM rule (cells that are NoData in every
+# tile stay NoData).  Peak memory therefore depends on the block size, not on the national extent.  Blocks
+# that no tile touches are never written and are stored as sparse NoData blocks.
+#
+# The tiles used to build a mosaic are recorded in a manifest next to the mosaic.  When new tiles arrive, the
+# blocks they touch are updated in place; because MAXIMUM does not depend on the order tiles are added, the
+# result is identical to a full rebuild.  If a new tile lies outside the mosaic extent, the mosaic is rebuilt
+# with the old mosaic as one of its inputs.  If a recorded tile has changed, the mosaic is rebuilt from scratch.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, rasterio (no ArcGIS license or extension is required)
+
+
+############## import required modules ###############
+import os
+import json
+import math
+import collections
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+from rasterio.windows import Window
+############## end of module import ##################
+
+
+MOSAIC_BLOCK_SIZE = 512 # cells per side of each output block, must be a multiple of 16
+MOSAIC_NODATA = -3.4028235e+38 # NoData value of the 32 bit float mosaic (ArcGIS default)
+MOSAIC_COMPRESSION = "deflate"
+MANIFEST_EXTENSION = ".tiles.json"
+OPEN_TILE_LIMIT = 64 # maximum number of input tiles kept open at the same time
+
+
+################# functions ##################################
+
+# read the georeferencing of an input tile without reading its cells
+# INPUTS:
+#    tileFile (str) - full filepath to the tile
+# OUTPUTS:
+#    tileInfo (dict) - path, mtime, bounds (west, south, east, north), cellWidth, cellHeight, crs and nodata
+def readTileInfo(tileFile):
+    with rasterio.open(tileFile) as dataset:
+        tileInfo = {'path': tileFile, 'mtime': os.path.getmtime(tileFile), 'bounds': tuple(dataset.bounds),
+                    'cellWidth': dataset.transform.a, 'cellHeight': -dataset.transform.e,
+                    'crs': dataset.crs.to_string() if dataset.crs is not None else None, 'nodata': dataset.nodata}
+    return tileInfo
+### end of readTileInfo ###
+
+
+# determine the grid of a mosaic covering a set of tiles.  The mosaic uses the cell size of the first tile and
+# is aligned to its cells, so tiles on the same grid are copied without resampling
+# INPUTS:
+#    tileInfos (dict list) - tiles as returned by readTileInfo
+# OUTPUTS:
+#    grid (dict) - transform (Affine), width, height and crs of the mosaic
+def determineMosaicGrid(tileInfos):
+    firstTile = tileInfos[0]
+    for tileInfo in tileInfos:
+        if tileInfo['crs'] != firstTile['crs']:
+            raise Exception("cannot mosaic " + tileInfo['path'] + ": its projection differs from " + firstTile['path'])
+    cellWidth = firstTile['cellWidth']
+    cellHeight = firstTile['cellHeight']
+    west = min([tileInfo['bounds'][0] for tileInfo in tileInfos])
+    south = min([tileInfo['bounds'][1] for tileInfo in tileInfos])
+    east = max([tileInfo['bounds'][2] for tileInfo in tileInfos])
+    north = max([tileInfo['bounds'][3] for tileInfo in tileInfos])
+    west = firstTile['bounds'][0] + math.floor(round((west - firstTile['bounds'][0]) / cellWidth, 6)) * cellWidth
+    north = firstTile['bounds'][3] + math.ceil(round((north - firstTile['bounds'][3]) / cellHeight, 6)) * cellHeight
+    width = int(math.ceil(round((east - west) / cellWidth, 6)))
+    height = int(math.ceil(round((north - south) / cellHeight, 6)))
+    grid = {'transform': Affine(cellWidth, 0, west, 0, -cellHeight, north), 'width': width, 'height': height,
+            'crs': firstTile['crs']}
+    return grid
+### end of determineMosaicGrid ###
+
+
+# open an input tile, keeping at most OPEN_TILE_LIMIT tiles open at once
+# INPUTS:
+#    openTiles (OrderedDict) - open datasets keyed by filepath, least recently used first
+#    tileFile (str) - full filepath to the tile
+# OUTPUTS:
+#    dataset (rasterio dataset) - open tile
+def openTile(openTiles, tileFile):
+    if tileFile in openTiles:
+        dataset = openTiles.pop(tileFile)
+    else:
+        if len(openTiles) >= OPEN_TILE_LIMIT:
+            oldestFile, oldestDataset = openTiles.popitem(last=False)
+            oldestDataset.close()
+        dataset = rasterio.open(tileFile)
+    openTiles[tileFile] = dataset
+    return dataset
+### end of openTile ###
+
+
+# combine all tiles that intersect one block of the mosaic with the MAXIMUM rule.  Each tile is read only
+# within the block and resampled to the mosaic cell centres with the nearest cell
+# INPUTS:
+#    grid (dict) - mosaic grid created by determineMosaicGrid
+#    window (rasterio Window) - block of the mosaic to calculate
+#    tileInfos (dict list) - tiles that intersect the block
+#    openTiles (OrderedDict) - open datasets keyed by filepath, see openTile
+#    blockValues (float array) - optional existing values of the block, NaN where there is no data
+# OUTPUTS:
+#    blockValues (float array) - maximum of all tiles in each cell of the block, NaN where there is no data
+def mosaicBlock(grid, window, tileInfos, openTiles, blockValues=None):
+    if blockValues is None:
+        blockValues = np.full((int(window.height), int(window.width)), np.nan, dtype=np.float32)
+    transform = grid['transform']
+    centreX = transform.c + (window.col_off + np.arange(window.width) + 0.5) * transform.a
+    centreY = transform.f + (window.row_off + np.arange(window.height) + 0.5) * transform.e
+    for tileInfo in tileInfos:
+        west, south, east, north = tileInfo['bounds']
+        tileColumns = np.floor((centreX - west) / tileInfo['cellWidth']).astype(np.int64)
+        tileRows = np.floor((north - centreY) / tileInfo['cellHeight']).astype(np.int64)
+        insideColumns = np.nonzero((centreX >= west) & (centreX < east))[0]
+        insideRows = np.nonzero((centreY > south) & (centreY <= north))[0]
+        if len(insideColumns) == 0 or len(insideRows) == 0:
+            continue
+        dataset = openTile(openTiles, tileInfo['path'])
+        tileColumns = np.clip(tileColumns[insideColumns], 0, dataset.width - 1)
+        tileRows = np.clip(tileRows[insideRows], 0, dataset.height - 1)
+        tileWindow = Window(tileColumns[0], tileRows[0], tileColumns[-1] - tileColumns[0] + 1, tileRows[-1] - tileRows[0] + 1)
+        tileValues = dataset.read(1, window=tileWindow).astype(np.float32)
+        if tileInfo['nodata'] is not None:
+            tileValues[tileValues == tileInfo['nodata']] = np.nan
+        tileValues = tileValues[np.ix_(tileRows - tileRows[0], tileColumns - tileColumns[0])]
+        blockIndex = np.ix_(insideRows, insideColumns)
+        blockValues[blockIndex] = np.fmax(blockValues[blockIndex], tileValues)
+    return blockValues
+### end of mosaicBlock ###
+
+
+# list the blocks of a mosaic and the tiles that intersect each block.  Blocks without tiles are not listed
+# INPUTS:
+#    grid (dict) - mosaic grid created by determineMosaicGrid
+#    tileInfos (dict list) - tiles as returned by readTileInfo
+# OUTPUTS:
+#    blocks (list) - (rasterio Window, tile list) tuples
+def determineBlocks(grid, tileInfos):
+    transform = grid['transform']
+    tileBounds = np.asarray([tileInfo['bounds'] for tileInfo in tileInfos], dtype=np.float64).reshape(-1, 4)
+    blocks = []
+    for rowOff in range(0, grid['height'], MOSAIC_BLOCK_SIZE):
+        blockHeight = min(MOSAIC_BLOCK_SIZE, grid['height'] - rowOff)
+        blockNorth = transform.f + rowOff * transform.e
+        blockSouth = blockNorth + blockHeight * transform.e
+        for colOff in range(0, grid['width'], MOSAIC_BLOCK_SIZE):
+            blockWidth = min(MOSAIC_BLOCK_SIZE, grid['width'] - colOff)
+            blockWest = transform.c + colOff * transform.a
+            blockEast = blockWest + blockWidth * transform.a
+            intersects = ((tileBounds[:, 0] < blockEast) & (tileBounds[:, 2] > blockWest) &
+                          (tileBounds[:, 1] < blockNorth) & (tileBounds[:, 3] > blockSouth))
+            if np.any(intersects):
+                blocks.append((Window(colOff, rowOff, blockWidth, blockHeight),
+                               [tileInfos[tileIndex] for tileIndex in np.nonzero(intersects)[0]]))
+    return blocks
+### end of determineBlocks ###
+
+
+# write a mosaic of tiles to a new tiled, compressed GeoTIFF, one block at a time
+# INPUTS:
+#    outputFile (str) - full filepath of the mosaic
+#    tileInfos (dict list) - tiles as returned by readTileInfo
+def writeMosaic(outputFile, tileInfos):
+    grid = determineMosaicGrid(tileInfos)
+    profile = {'driver': 'GTiff', 'width': grid['width'], 'height': grid['height'], 'count': 1, 'dtype': 'float32',
+               'crs': grid['crs'], 'transform': grid['transform'], 'nodata': MOSAIC_NODATA, 'tiled': True,
+               'blockxsize': MOSAIC_BLOCK_SIZE, 'blockysize': MOSAIC_BLOCK_SIZE, 'compress': MOSAIC_COMPRESSION,
+               'BIGTIFF': 'IF_SAFER', 'SPARSE_OK': 'TRUE'}
+    openTiles = collections.OrderedDict()
+    try:
+        with rasterio.open(outputFile, 'w', **profile) as mosaic:
+            for window, blockTiles in determineBlocks(grid, tileInfos):
+                blockValues = mosaicBlock(grid, window, blockTiles, openTiles)
+                blockValues[np.isnan(blockValues)] = MOSAIC_NODATA
+                mosaic.write(blockValues, 1, window=window)
+    finally:
+        for dataset in openTiles.values():
+            dataset.close()
+    print("wrote a " + str(grid['width']) + " x " + str(grid['height']) + " cell mosaic of " + str(len(tileInfos)) +
+          " tiles to " + outputFile)
+### end of writeMosaic ###
+
+
+# add new tiles to an existing mosaic in place.  Only the blocks that the new tiles touch are read and written
+# INPUTS:
+#    mosaicFile (str) - full filepath of the mosaic
+#    tileInfos (dict list) - new tiles, all within the extent of the mosaic
+def updateMosaic(mosaicFile, tileInfos):
+    openTiles = collections.OrderedDict()
+    try:
+        with rasterio.open(mosaicFile, 'r+') as mosaic:
+            grid = {'transform': mosaic.transform, 'width': mosaic.width, 'height': mosaic.height}
+            for window, blockTiles in determineBlocks(grid, tileInfos):
+                blockValues = mosaic.read(1, window=window).astype(np.float32)
+                blockValues[blockValues == MOSAIC_NODATA] = np.nan
+                blockValues = mosaicBlock(grid, window, blockTiles, openTiles, blockValues)
+                blockValues[np.isnan(blockValues)] = MOSAIC_NODATA
+                mosaic.write(blockValues, 1, window=window)
+    finally:
+        for dataset in openTiles.values():
+            dataset.close()
+    print("added " + str(len(tileInfos)) + " tiles to " + mosaicFile)
+### end of updateMosaic ###
+
+
+# read the manifest of tiles already included in a mosaic
+# INPUTS:
+#    mosaicFile (str) - full filepath of the mosaic
+# OUTPUTS:
+#    manifest (dict) - maps the filepath of each included tile to its modification time
+def readManifest(mosaicFile):
+    manifestFile = mosaicFile + MANIFEST_EXTENSION
+    if not os.path.exists(mosaicFile) or not os.path.exists(manifestFile):
+        return {}
+    with open(manifestFile, 'r') as f:
+        manifest = json.load(f)
+    return manifest
+### end of readManifest ###
+
+
+# save the manifest of tiles included in a mosaic
+# INPUTS:
+#    mosaicFile (str) - full filepath of the mosaic
+#    manifest (dict) - maps the filepath of each included tile to its modification time
+def writeManifest(mosaicFile, manifest):
+    with open(mosaicFile + MANIFEST_EXTENSION, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+### end of writeManifest ###
+
+
+# build or update the MAXIMUM mosaic of a set of tiles.  Tiles already in the mosaic are skipped, new tiles
+# within the mosaic extent are added in place, and the mosaic is rebuilt when its extent must grow or when
+# a tile it contains has changed
+# INPUTS:
+#    tileFiles (str list) - full filepaths of all tiles that make up the mosaic
+#    mosaicFile (str) - full filepath of the mosaic
+def buildMosaic(tileFiles, mosaicFile):
+    manifest = readManifest(mosaicFile)
+    tileInfos = [readTileInfo(tileFile) for tileFile in tileFiles]
+    changedTiles = [tileInfo for tileInfo in tileInfos
+                    if tileInfo['path'] in manifest and manifest[tileInfo['path']] != tileInfo['mtime']]
+    newTiles = [tileInfo for tileInfo in tileInfos if tileInfo['path'] not in manifest]
+    if len(manifest) > 0 and len(changedTiles) > 0:
+        print(str(len(changedTiles)) + " tiles have changed since " + mosaicFile + " was built, rebuilding the mosaic")
+        manifest = {}
+        newTiles = tileInfos
+    if len(newTiles) == 0:
+        print(mosaicFile + " is up to date")
+        return
+    if len(manifest) == 0:
+        writeMosaic(mosaicFile, newTiles)
+    else:
+        mosaicInfo = readTileInfo(mosaicFile)
+        mosaicBounds = mosaicInfo['bounds']
+        outsideTiles = [tileInfo for tileInfo in newTiles if
+                        tileInfo['bounds'][0] < mosaicBounds[0] or tileInfo['bounds'][1] < mosaicBounds[1] or
+                        tileInfo['bounds'][2] > mosaicBounds[2] or tileInfo['bounds'][3] > mosaicBounds[3]]
+        if len(outsideTiles) == 0:
+            updateMosaic(mosaicFile, newTiles)
+        else:
+            # the extent grows: the existing mosaic becomes one input of the new mosaic
+            mosaicInfo['nodata'] = MOSAIC_NODATA
+            tempFile = mosaicFile[0:len(mosaicFile) - 4] + "_rebuild.tif"
+            writeMosaic(tempFile, [mosaicInfo] + newTiles)
+            os.remove(mosaicFile)
+            os.rename(tempFile, mosaicFile)
+    for tileInfo in newTiles:
+        manifest[tileInfo['path']] = tileInfo['mtime']
+    writeManifest(mosaicFile, manifest)
+### end of buildMosaic ###
+
+################# end of functions ############################
+
+
+############### end of mosaicBuilder_Canada_LUR.py ###############
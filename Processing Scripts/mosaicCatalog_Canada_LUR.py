@@ -0,0 +1,254 @@
+################# mosaicCatalog_Canada_LUR.py ##################
+#
+# Persisted catalog of the zone mosaics in a mosaic folder.  Replaces the directory scans of
+# determineMosaicFile, which listed the mosaic folder twice and parsed the z<zone> suffix of every filename for
+# each partition and each mosaic variable.
+#
+# A catalog records, for every mosaic in a folder, its zone, its filepath relative to INPUT_FOLDER and its
+# extent and grid (rasters) or extent and feature count (shapefiles).  It is written once as
+# <mosaic folder>.catalog.json next to the folder and kept in memory, so zone lookups are dictionary hits.
+# The catalog is rebuilt when the folder has changed (files added, removed or renamed) or when a catalogued
+# file has been modified since the catalog was written.
+#
+# Because the catalog holds the extent of every mosaic, mosaics can also be selected by monitor location
+# instead of by the zone in the filename: selectMosaicFiles picks the mosaic that covers the whole buffer
+# around each monitor.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, rasterio, fiona (no ArcGIS license is required)
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+import os
+import json
+import tempfile
+import numpy as np
+import rasterio
+import fiona
+import constantValues as values
+############## end of module import ##################
+
+
+CATALOG_EXTENSION = ".catalog.json"
+CATALOG_VERSION = 1
+MOSAIC_EXTENSIONS = {values.RASTER_TYPE: ".tif", values.POINT_TYPE: ".tif", values.POLYLINE_TYPE: ".shp"}
+
+# catalogs already loaded in this process, keyed by mosaic folder
+CATALOG_CACHE = {}
+
+
+################# functions ##################################
+
+# determine the zone of a mosaic from its filename, e.g. N6z12.tif is zone 12.  Same convention as
+# determineMosaicFile
+# INPUTS:
+#    fileName (str) - mosaic filename
+# OUTPUTS:
+#    zoneIdentifier (str) - zone of the mosaic, or None if the file is not a mosaic
+def determineFileZone(fileName):
+    extension = os.path.splitext(fileName)[1].lower()
+    if extension not in MOSAIC_EXTENSIONS.values() or fileName.rfind("z") < 0:
+        return None
+    zoneIdentifier = fileName[fileName.rfind("z") + 1:len(fileName) - len(extension)]
+    return zoneIdentifier
+### end of determineFileZone ###
+
+
+# read the extent and grid of a raster mosaic
+# INPUTS:
+#    mosaicFile (str) - full filepath to the raster
+# OUTPUTS:
+#    entry (dict) - bounds (west, south, east, north), crs, transform, width, height, count and nodata
+def readRasterEntry(mosaicFile):
+    with rasterio.open(mosaicFile) as dataset:
+        entry = {'bounds': list(dataset.bounds), 'crs': dataset.crs.to_string() if dataset.crs is not None else None,
+                 'transform': list(dataset.transform)[0:6], 'width': dataset.width, 'height': dataset.height,
+                 'count': dataset.count, 'nodata': dataset.nodata}
+    return entry
+### end of readRasterEntry ###
+
+
+# read the extent of a shapefile mosaic
+# INPUTS:
+#    mosaicFile (str) - full filepath to the shapefile
+# OUTPUTS:
+#    entry (dict) - bounds (west, south, east, north), crs and number of features
+def readShapefileEntry(mosaicFile):
+    with fiona.open(mosaicFile) as source:
+        entry = {'bounds': list(source.bounds), 'crs': source.crs_wkt or None, 'count': len(source)}
+    return entry
+### end of readShapefileEntry ###
+
+
+# scan a mosaic folder and record every mosaic it contains
+# INPUTS:
+#    mosaicFolder (str) - mosaic folder, relative to INPUT_FOLDER
+# OUTPUTS:
+#    catalog (dict)
+#        version (int) - CATALOG_VERSION
+#        folderMtime (float) - modification time of the folder when it was scanned
+#        entries (dict) - maps each file extension (.tif or .shp) to a dict of zone -> entry.  Each entry holds
+#                         the file (relative to INPUT_FOLDER), its mtime and the metadata of readRasterEntry or
+#                         readShapefileEntry
+def scanMosaicFolder(mosaicFolder):
+    folderPath = values.INPUT_FOLDER + mosaicFolder
+    catalog = {'version': CATALOG_VERSION, 'folderMtime': os.path.getmtime(folderPath), 'entries': {}}
+    for fileName in sorted(os.listdir(folderPath)):
+        zoneIdentifier = determineFileZone(fileName)
+        if zoneIdentifier is None:
+            continue
+        extension = os.path.splitext(fileName)[1].lower()
+        filePath = folderPath + "/" + fileName
+        entry = readShapefileEntry(filePath) if extension == ".shp" else readRasterEntry(filePath)
+        entry.update({'file': mosaicFolder + "/" + fileName, 'mtime': os.path.getmtime(filePath)})
+        catalog['entries'].setdefault(extension, {})[zoneIdentifier] = entry
+    return catalog
+### end of scanMosaicFolder ###
+
+
+# determine the filepath of the persisted catalog of a mosaic folder.  The catalog is kept next to the folder,
+# so writing it does not change the folder
+# INPUTS:
+#    mosaicFolder (str) - mosaic folder, relative to INPUT_FOLDER
+# OUTPUTS:
+#    catalogFile (str) - full filepath of the catalog
+def determineCatalogFile(mosaicFolder):
+    catalogFile = values.INPUT_FOLDER + mosaicFolder.rstrip("/") + CATALOG_EXTENSION
+    return catalogFile
+### end of determineCatalogFile ###
+
+
+# check whether a catalog still describes its mosaic folder
+# INPUTS:
+#    catalog (dict) - catalog returned by scanMosaicFolder
+#    mosaicFolder (str) - mosaic folder, relative to INPUT_FOLDER
+# OUTPUTS:
+#    isCurrent (bool) - True if no file has been added, removed, renamed or modified since the catalog was built
+def isCatalogCurrent(catalog, mosaicFolder):
+    if catalog.get('version') != CATALOG_VERSION:
+        return False
+    if catalog['folderMtime'] != os.path.getmtime(values.INPUT_FOLDER + mosaicFolder):
+        return False
+    for zoneEntries in catalog['entries'].values():
+        for entry in zoneEntries.values():
+            filePath = values.INPUT_FOLDER + entry['file']
+            if not os.path.exists(filePath) or os.path.getmtime(filePath) != entry['mtime']:
+                return False
+    return True
+### end of isCatalogCurrent ###
+
+
+# write a catalog to a temporary file unique to this writer and atomically move it into place, so processes
+# that rebuild the same catalog at the same time never read a partial file or remove each other's output
+# INPUTS:
+#    catalog (dict) - catalog returned by scanMosaicFolder
+#    catalogFile (str) - full filepath of the catalog
+def writeCatalog(catalog, catalogFile):
+    tempHandle, tempFile = tempfile.mkstemp(suffix=".tmp", prefix=os.path.basename(catalogFile) + ".",
+                                            dir=os.path.dirname(os.path.abspath(catalogFile)))
+    try:
+        with os.fdopen(tempHandle, 'w') as f:
+            json.dump(catalog, f, indent=1, sort_keys=True)
+        os.replace(tempFile, catalogFile)
+    except:
+        if os.path.exists(tempFile):
+            os.remove(tempFile)
+        raise
+### end of writeCatalog ###
+
+
+# load the catalog of a mosaic folder, rebuilding and saving it if the folder has changed.  Catalogs are kept
+# in memory after the first load
+# INPUTS:
+#    mosaicFolder (str) - mosaic folder, relative to INPUT_FOLDER
+# OUTPUTS:
+#    catalog (dict) - catalog returned by scanMosaicFolder
+def loadCatalog(mosaicFolder):
+    if mosaicFolder in CATALOG_CACHE:
+        return CATALOG_CACHE[mosaicFolder]
+    catalogFile = determineCatalogFile(mosaicFolder)
+    catalog = None
+    if os.path.exists(catalogFile):
+        with open(catalogFile, 'r') as f:
+            catalog = json.load(f)
+        if not isCatalogCurrent(catalog, mosaicFolder):
+            print("mosaic folder " + mosaicFolder + " has changed, rebuilding its catalog")
+            catalog = None
+    if catalog is None:
+        catalog = scanMosaicFolder(mosaicFolder)
+        writeCatalog(catalog, catalogFile)
+        print("catalogued " + str(sum([len(zoneEntries) for zoneEntries in catalog['entries'].values()])) +
+              " mosaics in " + mosaicFolder)
+    CATALOG_CACHE[mosaicFolder] = catalog
+    return catalog
+### end of loadCatalog ###
+
+
+# list the catalogued mosaics of one file type
+# INPUTS:
+#    mosaicFolder (str) - mosaic folder, relative to INPUT_FOLDER
+#    fileType (int) - RASTER_TYPE, POINT_TYPE or POLYLINE_TYPE
+# OUTPUTS:
+#    zoneEntries (dict) - maps each zone to its catalog entry
+def listMosaics(mosaicFolder, fileType):
+    zoneEntries = loadCatalog(mosaicFolder)['entries'].get(MOSAIC_EXTENSIONS[fileType], {})
+    return zoneEntries
+### end of listMosaics ###
+
+
+# look up the mosaic of a zone
+# INPUTS:
+#    mosaicFolder (str) - mosaic folder, relative to INPUT_FOLDER
+#    zoneIdentifier (str) - zone of the mosaic
+#    fileType (int) - RASTER_TYPE, POINT_TYPE or POLYLINE_TYPE
+# OUTPUTS:
+#    mosaicFile (str) - mosaic filepath relative to INPUT_FOLDER, or None if the zone has no mosaic
+def lookupMosaicFile(mosaicFolder, zoneIdentifier, fileType):
+    entry = listMosaics(mosaicFolder, fileType).get(str(zoneIdentifier))
+    if entry is None:
+        return None
+    return entry['file']
+### end of lookupMosaicFile ###
+
+
+# select a mosaic for every monitor from the catalogued extents.  The mosaic that contains the whole square
+# around the monitor is preferred, then any mosaic that contains the monitor itself.  Where several mosaics
+# qualify, the one whose edge is furthest from the monitor is used
+# INPUTS:
+#    mosaicFolder (str) - mosaic folder, relative to INPUT_FOLDER
+#    fileType (int) - RASTER_TYPE, POINT_TYPE or POLYLINE_TYPE
+#    monitorX, monitorY (float arrays) - air monitor coordinates, in the mosaic projection
+#    margin (float) - half width of the square, e.g. the largest buffer distance
+# OUTPUTS:
+#    mosaicFiles (str list) - the selected mosaic filepaths, relative to INPUT_FOLDER
+#    monitorMosaics (int array) - position in mosaicFiles of the mosaic selected for each monitor, -1 if no
+#                                 mosaic contains the monitor
+def selectMosaicFiles(mosaicFolder, fileType, monitorX, monitorY, margin=0):
+    zoneEntries = listMosaics(mosaicFolder, fileType)
+    zones = sorted(zoneEntries.keys())
+    mosaicFiles = [zoneEntries[zone]['file'] for zone in zones]
+    if len(zones) == 0:
+        return mosaicFiles, np.full(len(monitorX), -1, dtype=np.int64)
+    bounds = np.asarray([zoneEntries[zone]['bounds'] for zone in zones], dtype=np.float64)
+    monitorX = np.asarray(monitorX, dtype=np.float64)[:, np.newaxis]
+    monitorY = np.asarray(monitorY, dtype=np.float64)[:, np.newaxis]
+
+    # distance from each monitor to the nearest edge of each mosaic, negative outside the mosaic
+    edgeDistance = np.minimum(np.minimum(monitorX - bounds[:, 0], bounds[:, 2] - monitorX),
+                              np.minimum(monitorY - bounds[:, 1], bounds[:, 3] - monitorY))
+    edgeDistance = np.where(edgeDistance >= 0, edgeDistance, -np.inf)
+    monitorMosaics = np.argmax(edgeDistance, axis=1)
+    monitorMosaics[np.isinf(edgeDistance.max(axis=1))] = -1
+    numPartial = np.sum((monitorMosaics >= 0) & (edgeDistance.max(axis=1) < margin))
+    if numPartial > 0:
+        print("warning: no mosaic in " + mosaicFolder + " covers the full buffer of " + str(numPartial) + " monitors")
+    return mosaicFiles, monitorMosaics
+### end of selectMosaicFiles ###
+
+################# end of functions ############################
+
+
+############### end of mosaicCatalog_Canada_LUR.py ###############
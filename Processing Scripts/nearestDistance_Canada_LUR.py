@@ -0,0 +1,369 @@
+################# nearestDistance_Canada_LUR.py ##################
+#
+# Nearest feature distance engine for distance based predictors such as port_dist and distance to the coastline
+# or major roads.  Replaces arcpy.Near_analysis, which processed one monitor file and one feature layer at a
+# time.
+#
+# Each feature layer (points, polylines or polygon boundaries) is loaded once into an array of line segments,
+# with points stored as zero length segments.  Long segments are split so no segment is longer than
+# NEAREST_SEGMENT_LENGTH, and the segment midpoints are indexed with a KD-tree.  Because every point of a
+# segment is within half the longest segment length (maxHalfLength) of its midpoint, the midpoint distance
+# bounds the exact distance:
+#
+#     |query - midpoint| - maxHalfLength <= distance(query, segment) <= |query - midpoint| + maxHalfLength
+#
+# A query therefore first finds its nearest midpoint, takes the exact distance to that segment as an upper
+# bound, and then only calculates exact point to segment distances for the midpoints within
+# upper bound + maxHalfLength.  All query points are processed together in chunks with vectorized numpy
+# operations, so distances for thousands of monitors or a whole cohort address list take seconds.
+# k-nearest feature and within-radius queries use the same bound.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, scipy, fiona
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+import time
+import numpy as np
+import fiona
+from scipy.spatial import cKDTree
+import constantValues as values
+import zonalStatistics_Canada_LUR as zonalStatistics
+############## end of module import ##################
+
+
+# feature indices that have already been loaded, keyed by feature filepath
+FEATURE_INDEX_CACHE = {}
+QUERY_CHUNK_SIZE = 5000 # query points processed together
+
+
+################# functions ##################################
+
+# list the vertex sequences of a geometry.  Points become single vertex sequences and polygons their rings
+# INPUTS:
+#    geometry (dict) - GeoJSON-like geometry read by fiona
+# OUTPUTS:
+#    partList (list) - coordinate sequences of the geometry
+def determineGeometryParts(geometry):
+    geometryType = geometry['type']
+    coordinates = geometry['coordinates']
+    if geometryType == 'Point':
+        return [[coordinates]]
+    if geometryType == 'MultiPoint':
+        return [[point] for point in coordinates]
+    if geometryType == 'LineString':
+        return [coordinates]
+    if geometryType == 'MultiLineString' or geometryType == 'Polygon':
+        return list(coordinates)
+    if geometryType == 'MultiPolygon':
+        return [ring for polygon in coordinates for ring in polygon]
+    raise Exception("unsupported geometry type for distance calculations: " + geometryType)
+### end of determineGeometryParts ###
+
+
+# read all features of a shapefile as line segments.  Points are zero length segments
+# INPUTS:
+#    featureFile (str) - full filepath to the point, polyline or polygon shapefile
+# OUTPUTS:
+#    segments (float array) - array with shape (number of segments, 4) holding x0, y0, x1, y1 for each segment
+#    featureIds (int array) - feature (record) number of each segment
+def loadFeatureSegments(featureFile):
+    segmentList = []
+    featureList = []
+    with fiona.open(featureFile) as source:
+        for featureNum, feature in enumerate(source):
+            if feature['geometry'] is None:
+                continue
+            for part in determineGeometryParts(feature['geometry']):
+                vertices = np.asarray(part, dtype=np.float64).reshape(-1, len(part[0]))[:, 0:2]
+                if len(vertices) == 1:
+                    vertices = np.vstack((vertices, vertices))
+                segmentList.append(np.hstack((vertices[0:-1], vertices[1:])))
+                featureList.append(np.full(len(vertices) - 1, featureNum, dtype=np.int64))
+    if len(segmentList) == 0:
+        return np.zeros((0, 4)), np.zeros(0, dtype=np.int64)
+    return np.vstack(segmentList), np.concatenate(featureList)
+### end of loadFeatureSegments ###
+
+
+# split segments into equal pieces no longer than a maximum length.  Distances to the split segments are the
+# same as distances to the original segments
+# INPUTS:
+#    segments (float array) - array with shape (number of segments, 4)
+#    featureIds (int array) - feature number of each segment
+#    maxLength (float) - maximum segment length, in meters
+# OUTPUTS:
+#    splitSegments (float array) - array with shape (number of split segments, 4)
+#    splitIds (int array) - feature number of each split segment
+def splitSegments(segments, featureIds, maxLength=values.NEAREST_SEGMENT_LENGTH):
+    segmentLength = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+    numPieces = np.maximum(np.ceil(segmentLength / maxLength), 1).astype(np.int64)
+    sourceIds = np.repeat(np.arange(len(segments)), numPieces)
+    pieceNumber = np.arange(len(sourceIds)) - np.repeat(np.cumsum(numPieces) - numPieces, numPieces)
+    startT = (pieceNumber / numPieces[sourceIds].astype(np.float64))[:, np.newaxis]
+    endT = ((pieceNumber + 1) / numPieces[sourceIds].astype(np.float64))[:, np.newaxis]
+    startPoints = segments[sourceIds, 0:2]
+    deltas = segments[sourceIds, 2:4] - startPoints
+    splitSegments = np.ascontiguousarray(np.hstack((startPoints + startT * deltas, startPoints + endT * deltas)))
+    return splitSegments, featureIds[sourceIds]
+### end of splitSegments ###
+
+
+# build a KD-tree index over the midpoints of line segments
+# INPUTS:
+#    segments (float array) - array with shape (number of segments, 4)
+#    featureIds (int array) - feature number of each segment
+# OUTPUTS:
+#    featureIndex (dict)
+#        segments (float array) - the indexed segments, split to at most NEAREST_SEGMENT_LENGTH
+#        featureIds (int array) - feature number of each indexed segment
+#        numFeatures (int) - number of distinct features
+#        tree (cKDTree) - KD-tree over the segment midpoints
+#        maxHalfLength (float) - half the length of the longest indexed segment
+#        vertexTree (cKDTree) - KD-tree over one vertex of each feature
+def buildFeatureIndex(segments, featureIds):
+    if len(segments) == 0:
+        raise Exception("cannot calculate distances to a layer without features")
+    segments, featureIds = splitSegments(segments, featureIds)
+    midpoints = (segments[:, 0:2] + segments[:, 2:4]) / 2.0
+    halfLengths = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1]) / 2.0
+    firstSegments = np.unique(featureIds, return_index=True)[1]
+    featureIndex = {'segments': segments, 'featureIds': featureIds, 'numFeatures': len(firstSegments),
+                    'tree': cKDTree(midpoints), 'maxHalfLength': float(halfLengths.max()),
+                    'vertexTree': cKDTree(segments[firstSegments, 0:2])}
+    return featureIndex
+### end of buildFeatureIndex ###
+
+
+# load and index a feature layer, reusing the index if the layer was already loaded
+# INPUTS:
+#    featureFile (str) - full filepath to the point, polyline or polygon shapefile
+# OUTPUTS:
+#    featureIndex (dict) - index returned by buildFeatureIndex
+def loadFeatureIndex(featureFile):
+    if featureFile not in FEATURE_INDEX_CACHE:
+        segments, featureIds = loadFeatureSegments(featureFile)
+        FEATURE_INDEX_CACHE[featureFile] = buildFeatureIndex(segments, featureIds)
+        print("indexed " + str(len(FEATURE_INDEX_CACHE[featureFile]['segments'])) + " segments of " +
+              str(FEATURE_INDEX_CACHE[featureFile]['numFeatures']) + " features from " + featureFile)
+    return FEATURE_INDEX_CACHE[featureFile]
+### end of loadFeatureIndex ###
+
+
+# calculate exact distances between points and segments, pair by pair
+# INPUTS:
+#    pointX, pointY (float arrays) - point coordinates
+#    segments (float array) - array with shape (number of points, 4), one segment per point
+# OUTPUTS:
+#    distances (float array) - distance from each point to its segment
+def pointSegmentDistances(pointX, pointY, segments):
+    deltaX = segments[:, 2] - segments[:, 0]
+    deltaY = segments[:, 3] - segments[:, 1]
+    offsetX = pointX - segments[:, 0]
+    offsetY = pointY - segments[:, 1]
+    lengthSq = deltaX ** 2 + deltaY ** 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        projection = np.where(lengthSq > 0, np.clip((offsetX * deltaX + offsetY * deltaY) / lengthSq, 0, 1), 0)
+    distances = np.hypot(offsetX - projection * deltaX, offsetY - projection * deltaY)
+    return distances
+### end of pointSegmentDistances ###
+
+
+# find the indexed segments whose midpoints are within a search radius of each query point
+# INPUTS:
+#    featureIndex (dict) - index returned by buildFeatureIndex
+#    queryX, queryY (float arrays) - query point coordinates
+#    searchRadius (float array) - search radius of each query point
+# OUTPUTS:
+#    queryIds (int array) - query point number of each candidate pair
+#    segmentIds (int array) - indexed segment number of each candidate pair
+#    distances (float array) - exact distance between the query point and segment of each candidate pair
+def findCandidatePairs(featureIndex, queryX, queryY, searchRadius):
+    neighbours = featureIndex['tree'].query_ball_point(np.column_stack((queryX, queryY)), searchRadius)
+    numCandidates = np.asarray([len(neighbourList) for neighbourList in neighbours], dtype=np.int64)
+    queryIds = np.repeat(np.arange(len(queryX)), numCandidates)
+    if len(queryIds) == 0:
+        return queryIds, np.zeros(0, dtype=np.int64), np.zeros(0)
+    segmentIds = np.concatenate([np.asarray(neighbourList, dtype=np.int64) for neighbourList in neighbours])
+    distances = pointSegmentDistances(queryX[queryIds], queryY[queryIds], featureIndex['segments'][segmentIds])
+    return queryIds, segmentIds, distances
+### end of findCandidatePairs ###
+
+
+# keep the closest segment of every (query point, feature) combination in a set of candidate pairs
+# INPUTS:
+#    queryIds, segmentIds (int arrays) - query point and segment of each candidate pair
+#    distances (float array) - distance of each candidate pair
+#    featureIds (int array) - feature number of each indexed segment
+# OUTPUTS:
+#    queryIds, featureIds (int arrays) - query point and feature of each remaining pair, sorted by query point
+#                                        and then by distance
+#    distances (float array) - distance from the query point to the feature
+def reduceToFeatures(queryIds, segmentIds, distances, featureIds):
+    pairFeatures = featureIds[segmentIds]
+    sortOrder = np.lexsort((distances, pairFeatures, queryIds))
+    queryIds, pairFeatures, distances = queryIds[sortOrder], pairFeatures[sortOrder], distances[sortOrder]
+    firstOfFeature = np.ones(len(queryIds), dtype=bool)
+    firstOfFeature[1:] = (queryIds[1:] != queryIds[:-1]) | (pairFeatures[1:] != pairFeatures[:-1])
+    queryIds, pairFeatures, distances = queryIds[firstOfFeature], pairFeatures[firstOfFeature], distances[firstOfFeature]
+    sortOrder = np.lexsort((distances, queryIds))
+    return queryIds[sortOrder], pairFeatures[sortOrder], distances[sortOrder]
+### end of reduceToFeatures ###
+
+
+# rank pairs within each query point, starting at 0, for pairs sorted by query point
+# INPUTS:
+#    queryIds (int array) - sorted query point number of each pair
+# OUTPUTS:
+#    ranks (int array) - position of each pair within its query point
+def rankWithinQuery(queryIds):
+    firstPair = np.searchsorted(queryIds, queryIds, side='left')
+    ranks = np.arange(len(queryIds)) - firstPair
+    return ranks
+### end of rankWithinQuery ###
+
+
+# calculate the k nearest features of a chunk of query points
+# INPUTS:
+#    featureIndex (dict) - index returned by buildFeatureIndex
+#    queryX, queryY (float arrays) - query point coordinates
+#    numNearest (int) - number of nearest features, k
+# OUTPUTS:
+#    distances (float array) - distance to the k nearest features, shape (query points, k).  inf if the layer
+#                              has fewer than k features
+#    nearestIds (int array) - feature number of the k nearest features, -1 if there is no such feature
+def nearestChunk(featureIndex, queryX, queryY, numNearest):
+    numQueries = len(queryX)
+    numNearest = min(numNearest, featureIndex['numFeatures'])
+    queryPoints = np.column_stack((queryX, queryY))
+
+    # upper bound on the distance of the kth nearest feature, from the kth distinct feature among the k nearest
+    # midpoints and from the kth nearest feature vertex (each vertex lies on its feature)
+    vertexDistances = featureIndex['vertexTree'].query(queryPoints, k=numNearest)[0]
+    upperBound = np.asarray(vertexDistances).reshape(numQueries, numNearest)[:, -1]
+    midpointIds = featureIndex['tree'].query(queryPoints, k=numNearest)[1]
+    queryIds = np.repeat(np.arange(numQueries), numNearest)
+    segmentIds = np.asarray(midpointIds, dtype=np.int64).ravel()
+    distances = pointSegmentDistances(queryX[queryIds], queryY[queryIds], featureIndex['segments'][segmentIds])
+    queryIds, pairFeatures, distances = reduceToFeatures(queryIds, segmentIds, distances, featureIndex['featureIds'])
+    kthPairs = rankWithinQuery(queryIds) == numNearest - 1
+    upperBound[queryIds[kthPairs]] = np.minimum(upperBound[queryIds[kthPairs]], distances[kthPairs])
+
+    # every feature closer than the bound has a midpoint within bound + maxHalfLength
+    searchRadius = upperBound + featureIndex['maxHalfLength'] + values.XY_TOLERANCE
+    queryIds, segmentIds, distances = findCandidatePairs(featureIndex, queryX, queryY, searchRadius)
+    queryIds, pairFeatures, distances = reduceToFeatures(queryIds, segmentIds, distances, featureIndex['featureIds'])
+    ranks = rankWithinQuery(queryIds)
+    keep = ranks < numNearest
+    nearestDistances = np.full((numQueries, numNearest), np.inf)
+    nearestIds = np.full((numQueries, numNearest), -1, dtype=np.int64)
+    nearestDistances[queryIds[keep], ranks[keep]] = distances[keep]
+    nearestIds[queryIds[keep], ranks[keep]] = pairFeatures[keep]
+    return nearestDistances, nearestIds
+### end of nearestChunk ###
+
+
+# calculate the distance from every query point to its k nearest features
+# INPUTS:
+#    featureIndex (dict) - index returned by buildFeatureIndex
+#    queryX, queryY (float arrays) - query point coordinates, in the feature projection
+#    numNearest (int) - number of nearest features, k
+# OUTPUTS:
+#    distances (float array) - distance to the k nearest features in ascending order, shape (query points, k)
+#    nearestIds (int array) - feature number of the k nearest features, shape (query points, k)
+def nearestFeatures(featureIndex, queryX, queryY, numNearest=1):
+    queryX = np.asarray(queryX, dtype=np.float64)
+    queryY = np.asarray(queryY, dtype=np.float64)
+    distances = np.full((len(queryX), numNearest), np.inf)
+    nearestIds = np.full((len(queryX), numNearest), -1, dtype=np.int64)
+    for chunkStart in range(0, len(queryX), QUERY_CHUNK_SIZE):
+        chunk = slice(chunkStart, chunkStart + QUERY_CHUNK_SIZE)
+        chunkDistances, chunkIds = nearestChunk(featureIndex, queryX[chunk], queryY[chunk], numNearest)
+        distances[chunk, 0:chunkDistances.shape[1]] = chunkDistances
+        nearestIds[chunk, 0:chunkIds.shape[1]] = chunkIds
+    return distances, nearestIds
+### end of nearestFeatures ###
+
+
+# calculate the distance from every query point to the nearest feature
+# INPUTS:
+#    featureIndex (dict) - index returned by buildFeatureIndex
+#    queryX, queryY (float arrays) - query point coordinates, in the feature projection
+# OUTPUTS:
+#    distances (float array) - distance to the nearest feature, one per query point
+def nearestDistances(featureIndex, queryX, queryY):
+    distances = nearestFeatures(featureIndex, queryX, queryY, 1)[0][:, 0]
+    return distances
+### end of nearestDistances ###
+
+
+# find every feature within a radius of each query point
+# INPUTS:
+#    featureIndex (dict) - index returned by buildFeatureIndex
+#    queryX, queryY (float arrays) - query point coordinates, in the feature projection
+#    radius (float) - search radius, in meters
+# OUTPUTS:
+#    queryIds (int array) - query point number of each (query point, feature) pair, sorted by query point and
+#                           then by distance
+#    featureIds (int array) - feature number of each pair
+#    distances (float array) - distance from the query point to the feature
+def featuresWithinRadius(featureIndex, queryX, queryY, radius):
+    queryX = np.asarray(queryX, dtype=np.float64)
+    queryY = np.asarray(queryY, dtype=np.float64)
+    queryList, featureList, distanceList = [], [], []
+    for chunkStart in range(0, len(queryX), QUERY_CHUNK_SIZE):
+        chunk = slice(chunkStart, chunkStart + QUERY_CHUNK_SIZE)
+        searchRadius = radius + featureIndex['maxHalfLength'] + values.XY_TOLERANCE
+        queryIds, segmentIds, distances = findCandidatePairs(featureIndex, queryX[chunk], queryY[chunk], searchRadius)
+        inside = distances <= radius
+        queryIds, pairFeatures, distances = reduceToFeatures(queryIds[inside], segmentIds[inside], distances[inside],
+                                                             featureIndex['featureIds'])
+        queryList.append(queryIds + chunkStart)
+        featureList.append(pairFeatures)
+        distanceList.append(distances)
+    if len(queryList) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    return np.concatenate(queryList), np.concatenate(featureList), np.concatenate(distanceList)
+### end of featuresWithinRadius ###
+
+
+# calculate every distance variable at a set of coordinates
+# INPUTS:
+#    monitorX, monitorY (float arrays) - air monitor or address coordinates
+#    distanceVariables (dict) - maps each variable identifier (e.g. port_dist) to a feature layer, relative to
+#                               INPUT_FOLDER
+# OUTPUTS:
+#    results (dict) - maps each variable identifier to the distance, in meters, to the nearest feature
+def calcDistanceVariables(monitorX, monitorY, distanceVariables=values.DISTANCE_VARIABLES):
+    results = {}
+    for variableIdent in sorted(distanceVariables.keys()):
+        startTime = time.time()
+        featureIndex = loadFeatureIndex(values.INPUT_FOLDER + distanceVariables[variableIdent])
+        results[variableIdent] = nearestDistances(featureIndex, monitorX, monitorY)
+        print("calculated " + variableIdent + " for " + str(len(monitorX)) + " locations in " +
+              str(time.time() - startTime) + " seconds")
+    return results
+### end of calcDistanceVariables ###
+
+
+# calculate every distance variable for the air monitors in a shapefile
+# INPUTS:
+#    airMonitorFile (str) - full filepath to the air monitor shapefile
+#    distanceVariables (dict) - maps each variable identifier (e.g. port_dist) to a feature layer, relative to
+#                               INPUT_FOLDER
+# OUTPUTS:
+#    monitorIds (int array) - air monitor identifiers
+#    results (dict) - maps each variable identifier to an array with one distance per monitor
+def runDistanceAnalysis(airMonitorFile, distanceVariables=values.DISTANCE_VARIABLES):
+    monitorIds, monitorX, monitorY = zonalStatistics.readAirMonitorPoints(airMonitorFile)
+    results = calcDistanceVariables(monitorX, monitorY, distanceVariables)
+    return monitorIds, results
+### end of runDistanceAnalysis ###
+
+################# end of functions ############################
+
+
+############### end of nearestDistance_Canada_LUR.py ###############
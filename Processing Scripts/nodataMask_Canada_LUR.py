@@ -0,0 +1,107 @@
+################# nodataMask_Canada_LUR.py ##################
+#
+# Sets exact zero cells of downloaded rasters to NoData.  Replaces the serial arcpy.sa.SetNull(..., "VALUE = 0")
+# loop in createRasters, which made one ArcGIS call per file.
+#
+# Each raster is streamed block by block with rasterio: cells equal to 0 (and cells that were already NoData)
+# are set to the output NoData value, and the result is written as a tiled, compressed GeoTIFF with the NoData
+# value recorded in its metadata, so ArcGIS and rasterio both read the cells as NULL.  Files are processed in
+# parallel on a pool of worker processes, and files whose output is newer than their input are skipped.
+# Outputs are written to a temporary file and renamed when complete, so an interrupted run never leaves an
+# output that looks up to date.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, rasterio (no ArcGIS license or extension is required)
+
+
+############## import required modules ###############
+import os
+import multiprocessing
+import numpy as np
+import rasterio
+############## end of module import ##################
+
+
+FLOAT_NODATA = -3.4028235e+38 # NoData value of floating point outputs (ArcGIS default)
+TEMP_SUFFIX = "_temp.tif"
+
+
+################# functions ##################################
+
+# determine the NoData value used for an output data type
+# INPUTS:
+#    dtype (str) - numpy data type of the raster
+# OUTPUTS:
+#    nodata (float or int) - NoData value
+def determineNodataValue(dtype):
+    if np.issubdtype(np.dtype(dtype), np.floating):
+        return FLOAT_NODATA
+    return np.iinfo(np.dtype(dtype)).min
+### end of determineNodataValue ###
+
+
+# test whether an output raster is newer than its input raster
+# INPUTS:
+#    inputFile (str) - full filepath to the input raster
+#    outputFile (str) - full filepath to the output raster
+# OUTPUTS:
+#    boolean - True if the output exists and is at least as new as the input
+def isUpToDate(inputFile, outputFile):
+    return os.path.exists(outputFile) and os.path.getmtime(outputFile) >= os.path.getmtime(inputFile)
+### end of isUpToDate ###
+
+
+# set exact zero cells of one raster to NoData, one block at a time
+# INPUTS:
+#    files (tuple) - (inputFile, outputFile) full filepaths.  Passed as one argument for Pool.imap_unordered
+# OUTPUTS:
+#    outputFile (str) - full filepath to the output raster
+def maskZeroCells(files):
+    inputFile, outputFile = files
+    tempFile = outputFile[0:len(outputFile) - 4] + TEMP_SUFFIX
+    with rasterio.open(inputFile) as source:
+        profile = source.profile.copy()
+        nodata = determineNodataValue(profile['dtype'])
+        profile.update(driver='GTiff', nodata=nodata, tiled=True, blockxsize=256, blockysize=256, compress='deflate')
+        with rasterio.open(tempFile, 'w', **profile) as destination:
+            for blockIndex, window in source.block_windows(1):
+                blockValues = source.read(window=window)
+                screen = blockValues == 0
+                if source.nodata is not None:
+                    screen |= blockValues == source.nodata
+                blockValues[screen] = nodata
+                destination.write(blockValues, window=window)
+    if os.path.exists(outputFile):
+        os.remove(outputFile)
+    os.rename(tempFile, outputFile)
+    return outputFile
+### end of maskZeroCells ###
+
+
+# set exact zero cells to NoData for every tif in a folder, in parallel
+# INPUTS:
+#    fileList (tuple list) - (inputFile, outputFile) full filepaths of each raster to process
+#    numWorkers (int) - number of worker processes, defaults to the number of cores
+def maskAllRasters(fileList, numWorkers=None):
+    filesToProcess = [files for files in fileList if not isUpToDate(files[0], files[1])]
+    print(str(len(fileList) - len(filesToProcess)) + " of " + str(len(fileList)) + " screened rasters are already up to date")
+    if len(filesToProcess) == 0:
+        return
+    if numWorkers is None:
+        numWorkers = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(min(numWorkers, len(filesToProcess)))
+    try:
+        for outputFile in pool.imap_unordered(maskZeroCells, filesToProcess):
+            print("screened " + outputFile)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+### end of maskAllRasters ###
+
+################# end of functions ############################
+
+
+############### end of nodataMask_Canada_LUR.py ###############
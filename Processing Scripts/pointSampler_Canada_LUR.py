@@ -0,0 +1,173 @@
+################# pointSampler_Canada_LUR.py ##################
+#
+# Samples point variables (e.g. sat_10_12, elevation, pr_ and te_ climate rasters) at the air monitor locations.
+# Replaces runPointAnalysis, which ran ExtractValuesToPoints into pointAnalysisTemp.shp, added and calculated a
+# field, deleted RASTERVALU and then overwrote the monitor shapefile with CopyFeatures, so the shapefile was
+# rewritten once for every point variable.
+#
+# Monitor coordinates are converted to pixel positions once per raster grid, and rasters that share a grid reuse
+# the conversion.  Only the raster blocks that contain a needed pixel are read, each block once, and only the
+# needed pixels are kept: the pixel containing each monitor, or the 2x2 pixels around it for bilinear
+# interpolation.  Every point variable is returned in one dictionary so all columns can be written in a single
+# final step with bufferEngine.writeRingResults or the result store.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, rasterio (no ArcGIS license or extension is required)
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+import os
+import time
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+import constantValues as values
+import zonalStatistics_Canada_LUR as zonalStatistics
+############## end of module import ##################
+
+
+NEAREST_SAMPLING = "NONE" # value of the cell containing the point, as ExtractValuesToPoints with "NONE"
+BILINEAR_SAMPLING = "BILINEAR" # bilinear interpolation of the four nearest cell centres
+MAX_FIELD_LENGTH = 10 # maximum length of shapefile field names
+
+
+################# functions ##################################
+
+# determine the field name of a point variable from its filename, e.g. sat_10_12.tif becomes sat_10_12.  Mosaics
+# in a POINT_MOSAIC_LIST folder are named after the folder, so every zone's mosaic writes the same field
+# INPUTS:
+#    pointFile (str) - raster filename or mosaic folder, relative to INPUT_FOLDER
+# OUTPUTS:
+#    variableIdent (str) - field name of the point variable
+def determinePointIdentifier(pointFile):
+    pointFile = pointFile.rstrip("/")
+    mosaicFolder = os.path.dirname(pointFile)
+    if mosaicFolder != "" and mosaicFolder in [variable.rstrip("/") for variable in values.POINT_MOSAIC_LIST]:
+        pointFile = mosaicFolder
+    variableIdent = os.path.splitext(os.path.basename(pointFile))[0][0:MAX_FIELD_LENGTH]
+    return variableIdent
+### end of determinePointIdentifier ###
+
+
+# convert monitor coordinates to fractional pixel positions, reusing the result for rasters on the same grid
+# INPUTS:
+#    dataset (rasterio dataset) - open raster
+#    monitorX, monitorY (float arrays) - air monitor coordinates, in the raster projection
+#    gridCache (dict) - pixel positions already calculated, keyed by grid.  Updated in place
+# OUTPUTS:
+#    pixelCols, pixelRows (float arrays) - fractional column and row of each monitor, measured from the upper
+#                                          left corner of the raster
+def determinePixelPositions(dataset, monitorX, monitorY, gridCache):
+    gridKey = (tuple(dataset.transform)[0:6], dataset.width, dataset.height)
+    if gridKey not in gridCache:
+        inverse = ~dataset.transform
+        pixelCols = inverse.a * monitorX + inverse.b * monitorY + inverse.c
+        pixelRows = inverse.d * monitorX + inverse.e * monitorY + inverse.f
+        gridCache[gridKey] = (pixelCols, pixelRows)
+    return gridCache[gridKey]
+### end of determinePixelPositions ###
+
+
+# read individual pixels of a raster band, reading each raster block that contains a requested pixel once
+# INPUTS:
+#    dataset (rasterio dataset) - open raster
+#    rows, cols (int arrays) - pixel indices.  Pixels outside the raster are NaN
+#    band (int) - raster band, starting at 1
+# OUTPUTS:
+#    pixelValues (float array) - value of each pixel, NaN for NoData
+def readPixels(dataset, rows, cols, band=1):
+    pixelValues = np.full(len(rows), np.nan)
+    inside = (rows >= 0) & (rows < dataset.height) & (cols >= 0) & (cols < dataset.width)
+    blockHeight, blockWidth = dataset.block_shapes[band - 1]
+    blockRows = rows // blockHeight
+    blockCols = cols // blockWidth
+    blockKeys = set(zip(blockRows[inside].tolist(), blockCols[inside].tolist()))
+    for blockRow, blockCol in blockKeys:
+        rowOff = blockRow * blockHeight
+        colOff = blockCol * blockWidth
+        window = Window(colOff, rowOff, min(blockWidth, dataset.width - colOff), min(blockHeight, dataset.height - rowOff))
+        blockValues = dataset.read(band, window=window).astype(np.float64)
+        if dataset.nodata is not None:
+            blockValues[blockValues == dataset.nodata] = np.nan
+        inBlock = np.where(inside & (blockRows == blockRow) & (blockCols == blockCol))[0]
+        pixelValues[inBlock] = blockValues[rows[inBlock] - rowOff, cols[inBlock] - colOff]
+    return pixelValues
+### end of readPixels ###
+
+
+# sample a raster at every monitor
+# INPUTS:
+#    dataset (rasterio dataset) - open raster
+#    monitorX, monitorY (float arrays) - air monitor coordinates, in the raster projection
+#    method (str) - NEAREST_SAMPLING or BILINEAR_SAMPLING
+#    gridCache (dict) - pixel positions already calculated, keyed by grid
+# OUTPUTS:
+#    pointValues (float array) - raster value at each monitor, NaN outside the raster or on NoData
+def sampleRaster(dataset, monitorX, monitorY, method, gridCache):
+    pixelCols, pixelRows = determinePixelPositions(dataset, monitorX, monitorY, gridCache)
+    if method == NEAREST_SAMPLING:
+        return readPixels(dataset, np.floor(pixelRows).astype(np.int64), np.floor(pixelCols).astype(np.int64))
+
+    # bilinear weights of the four cell centres around each monitor.  NoData cells are left out and the
+    # remaining weights renormalised
+    firstRows = np.floor(pixelRows - 0.5).astype(np.int64)
+    firstCols = np.floor(pixelCols - 0.5).astype(np.int64)
+    fracRows = pixelRows - 0.5 - firstRows
+    fracCols = pixelCols - 0.5 - firstCols
+    weightedSum = np.zeros(len(monitorX))
+    weightTotal = np.zeros(len(monitorX))
+    for rowStep, colStep in [(0, 0), (0, 1), (1, 0), (1, 1)]:
+        cornerValues = readPixels(dataset, firstRows + rowStep, firstCols + colStep)
+        cornerWeights = (fracRows if rowStep else 1 - fracRows) * (fracCols if colStep else 1 - fracCols)
+        valid = ~np.isnan(cornerValues)
+        weightedSum[valid] += cornerWeights[valid] * cornerValues[valid]
+        weightTotal[valid] += cornerWeights[valid]
+    # a monitor inside a NoData cell is NoData, as with nearest sampling
+    centreValues = readPixels(dataset, np.floor(pixelRows).astype(np.int64), np.floor(pixelCols).astype(np.int64))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pointValues = np.where((weightTotal > 0) & ~np.isnan(centreValues), weightedSum / weightTotal, np.nan)
+    return pointValues
+### end of sampleRaster ###
+
+
+# sample every point variable at a set of monitor coordinates
+# INPUTS:
+#    monitorX, monitorY (float arrays) - air monitor coordinates
+#    pointList (str list) - point variable rasters, relative to INPUT_FOLDER
+#    method (str) - NEAREST_SAMPLING or BILINEAR_SAMPLING
+# OUTPUTS:
+#    results (dict) - maps each point variable identifier (e.g. sat_10_12) to an array with one value per monitor
+def samplePointVariables(monitorX, monitorY, pointList, method=values.POINT_SAMPLING):
+    results = {}
+    gridCache = {}
+    startTime = time.time()
+    for pointFile in pointList:
+        with rasterio.open(values.INPUT_FOLDER + pointFile) as dataset:
+            results[determinePointIdentifier(pointFile)] = sampleRaster(dataset, monitorX, monitorY, method, gridCache)
+    print("sampled " + str(len(pointList)) + " point variables on " + str(len(gridCache)) + " raster grids in " +
+          str(time.time() - startTime) + " seconds")
+    return results
+### end of samplePointVariables ###
+
+
+# sample every point variable for the air monitors in a shapefile
+# INPUTS:
+#    airMonitorFile (str) - full filepath to the air monitor shapefile
+#    pointList (str list) - point variable rasters, relative to INPUT_FOLDER
+#    method (str) - NEAREST_SAMPLING or BILINEAR_SAMPLING
+# OUTPUTS:
+#    monitorIds (int array) - air monitor identifiers
+#    results (dict) - maps each point variable identifier (e.g. sat_10_12) to an array with one value per monitor
+def runPointSampler(airMonitorFile, pointList, method=values.POINT_SAMPLING):
+    monitorIds, monitorX, monitorY = zonalStatistics.readAirMonitorPoints(airMonitorFile)
+    results = samplePointVariables(monitorX, monitorY, pointList, method)
+    return monitorIds, results
+### end of runPointSampler ###
+
+################# end of functions ############################
+
+
+############### end of pointSampler_Canada_LUR.py ###############
@@ -0,0 +1,247 @@
+################# pointSources_Canada_LUR.py ##################
+#
+# Multi-radius aggregation of point emission sources (e.g. NPRI facilities).  Replaces pointBufferIntersect,
+# which intersected every buffer shapefile with the point layer and dissolved the result with a hardcoded
+# "carbon_200 SUM", once per buffer distance.
+#
+# The emitter locations and attributes of a point layer are loaded once and indexed with a KD-tree.  For each
+# air monitor, the emitters within the largest buffer distance are found with a single radius query, each
+# emitter is assigned to the smallest ring that contains it (bufferEngine.assignRings), and per ring totals are
+# turned into totals for every radius with one cumulative sum, as in the ring buffer engine.  Counts and sums
+# of any set of attribute columns are calculated in the same pass, optionally with inverse distance weighted
+# totals sum(value / max(distance, POINT_SOURCE_MIN_DISTANCE) ** POINT_SOURCE_IDW_POWER).
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, scipy, fiona (no ArcGIS license is required)
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+import time
+import numpy as np
+import fiona
+from scipy.spatial import cKDTree
+import constantValues as values
+import bufferEngine_Canada_LUR as bufferEngine
+import zonalStatistics_Canada_LUR as zonalStatistics
+############## end of module import ##################
+
+
+# point source indices that have already been loaded, keyed by (filepath, attribute fields)
+POINT_SOURCE_CACHE = {}
+MONITOR_CHUNK_SIZE = 5000 # monitors queried together
+
+
+################# functions ##################################
+
+# read the locations and attribute values of all point sources in a shapefile.  Multipoint features are placed
+# at the mean of their points, and missing attribute values are treated as zero, as in a SUM dissolve
+# INPUTS:
+#    pointFile (str) - full filepath to the point shapefile
+#    attributeFields (str list) - attribute columns to aggregate, e.g. ["carbon_200"]
+# OUTPUTS:
+#    sourceX, sourceY (float arrays) - point source coordinates
+#    attributeValues (float array) - attribute values with shape (point sources, attribute fields)
+def loadPointSources(pointFile, attributeFields):
+    sourceX = []
+    sourceY = []
+    attributeValues = []
+    with fiona.open(pointFile) as source:
+        for feature in source:
+            geometry = feature['geometry']
+            if geometry is None:
+                continue
+            coordinates = [geometry['coordinates']] if geometry['type'] == 'Point' else geometry['coordinates']
+            location = np.mean(np.asarray(coordinates, dtype=np.float64)[:, 0:2], axis=0)
+            sourceX.append(location[0])
+            sourceY.append(location[1])
+            attributeValues.append([feature['properties'][field] for field in attributeFields])
+    attributeValues = np.asarray(attributeValues, dtype=np.float64).reshape(len(sourceX), len(attributeFields))
+    attributeValues[np.isnan(attributeValues)] = 0
+    return np.asarray(sourceX, dtype=np.float64), np.asarray(sourceY, dtype=np.float64), attributeValues
+### end of loadPointSources ###
+
+
+# build the KD-tree index of a set of point sources
+# INPUTS:
+#    sourceX, sourceY (float arrays) - point source coordinates
+#    attributeValues (float array) - attribute values with shape (point sources, attribute fields)
+# OUTPUTS:
+#    sourceIndex (dict)
+#        tree (cKDTree) - KD-tree over the point source locations, None if there are no point sources
+#        attributeValues (float array) - attribute values of the point sources
+def buildPointSourceIndex(sourceX, sourceY, attributeValues):
+    tree = cKDTree(np.column_stack((sourceX, sourceY))) if len(sourceX) > 0 else None
+    sourceIndex = {'tree': tree, 'attributeValues': attributeValues}
+    return sourceIndex
+### end of buildPointSourceIndex ###
+
+
+# load and index a point source layer, reusing the index if the layer was already loaded
+# INPUTS:
+#    pointFile (str) - full filepath to the point shapefile
+#    attributeFields (str list) - attribute columns to aggregate
+# OUTPUTS:
+#    sourceIndex (dict) - index returned by buildPointSourceIndex
+def loadPointSourceIndex(pointFile, attributeFields):
+    cacheKey = (pointFile, tuple(attributeFields))
+    if cacheKey not in POINT_SOURCE_CACHE:
+        sourceX, sourceY, attributeValues = loadPointSources(pointFile, attributeFields)
+        POINT_SOURCE_CACHE[cacheKey] = buildPointSourceIndex(sourceX, sourceY, attributeValues)
+        print("indexed " + str(len(sourceX)) + " point sources from " + pointFile)
+    return POINT_SOURCE_CACHE[cacheKey]
+### end of loadPointSourceIndex ###
+
+
+# find the point sources within the largest radius of each monitor and assign them to rings
+# INPUTS:
+#    sourceIndex (dict) - index returned by buildPointSourceIndex
+#    monitorX, monitorY (float arrays) - air monitor coordinates, in the point source projection
+#    ringEdges (float array) - buffer radii in ascending order
+# OUTPUTS:
+#    monitorNums (int array) - monitor number of each (monitor, point source) pair
+#    sourceIds (int array) - point source of each pair
+#    distances (float array) - distance between the monitor and point source of each pair
+#    ringIndex (int array) - ring of each pair, as returned by bufferEngine.assignRings
+def findSourcePairs(sourceIndex, monitorX, monitorY, ringEdges):
+    neighbours = sourceIndex['tree'].query_ball_point(np.column_stack((monitorX, monitorY)), ringEdges[-1])
+    numSources = np.asarray([len(neighbourList) for neighbourList in neighbours], dtype=np.int64)
+    monitorNums = np.repeat(np.arange(len(monitorX)), numSources)
+    sourceIds = np.zeros(0, dtype=np.int64)
+    if len(monitorNums) > 0:
+        sourceIds = np.concatenate([np.asarray(neighbourList, dtype=np.int64) for neighbourList in neighbours])
+    sourceData = sourceIndex['tree'].data
+    distances = np.hypot(sourceData[sourceIds, 0] - monitorX[monitorNums], sourceData[sourceIds, 1] - monitorY[monitorNums])
+    ringIndex = bufferEngine.assignRings(distances, ringEdges)
+    return monitorNums, sourceIds, distances, ringIndex
+### end of findSourcePairs ###
+
+
+# total a value over the point sources within every radius of every monitor, with one bincount over
+# (monitor, ring) and one cumulative sum over rings
+# INPUTS:
+#    monitorNums (int array) - monitor number of each (monitor, point source) pair
+#    ringIndex (int array) - ring of each pair
+#    weights (float array) - value of each pair.  If None, pairs are counted
+#    numMonitors (int) - number of monitors
+#    numRings (int) - number of rings
+# OUTPUTS:
+#    cumulativeTotals (float array) - total inside each radius, shape (monitors, radii)
+def accumulateMonitorRings(monitorNums, ringIndex, weights, numMonitors, numRings):
+    ringTotals = np.bincount(monitorNums * (numRings + 1) + ringIndex, weights=weights,
+                             minlength=numMonitors * (numRings + 1)).reshape(numMonitors, numRings + 1)
+    cumulativeTotals = np.cumsum(ringTotals[:, 0:numRings], axis=1)
+    return cumulativeTotals
+### end of accumulateMonitorRings ###
+
+
+# calculate point source counts, attribute sums and optional inverse distance weighted attribute totals for
+# every buffer distance
+# INPUTS:
+#    sourceIndex (dict) - index returned by buildPointSourceIndex
+#    monitorX, monitorY (float arrays) - air monitor coordinates, in the point source projection
+#    ringEdges (float array) - buffer radii in ascending order
+#    idwPower (float) - power of the inverse distance weights.  None skips the weighted totals
+# OUTPUTS:
+#    bufferTotals (dict)
+#        count (float array) - number of point sources, shape (monitors, radii)
+#        sum (float array) - attribute sums, shape (monitors, attribute fields, radii)
+#        idw (float array) - inverse distance weighted attribute totals, shape (monitors, attribute fields,
+#                            radii).  Only present if idwPower is given
+def pointSourceBufferTotals(sourceIndex, monitorX, monitorY, ringEdges, idwPower=values.POINT_SOURCE_IDW_POWER):
+    monitorX = np.asarray(monitorX, dtype=np.float64)
+    monitorY = np.asarray(monitorY, dtype=np.float64)
+    numRings = len(ringEdges)
+    numFields = sourceIndex['attributeValues'].shape[1]
+    bufferTotals = {'count': np.zeros((len(monitorX), numRings)), 'sum': np.zeros((len(monitorX), numFields, numRings))}
+    if idwPower is not None:
+        bufferTotals['idw'] = np.zeros((len(monitorX), numFields, numRings))
+    if sourceIndex['tree'] is None:
+        return bufferTotals
+    for chunkStart in range(0, len(monitorX), MONITOR_CHUNK_SIZE):
+        chunk = slice(chunkStart, chunkStart + MONITOR_CHUNK_SIZE)
+        chunkX, chunkY = monitorX[chunk], monitorY[chunk]
+        monitorNums, sourceIds, distances, ringIndex = findSourcePairs(sourceIndex, chunkX, chunkY, ringEdges)
+        bufferTotals['count'][chunk] = accumulateMonitorRings(monitorNums, ringIndex, None, len(chunkX), numRings)
+        idwWeights = None
+        if idwPower is not None:
+            idwWeights = np.maximum(distances, values.POINT_SOURCE_MIN_DISTANCE) ** -float(idwPower)
+        for fieldNum in range(numFields):
+            pairValues = sourceIndex['attributeValues'][sourceIds, fieldNum]
+            bufferTotals['sum'][chunk, fieldNum] = accumulateMonitorRings(monitorNums, ringIndex, pairValues,
+                                                                          len(chunkX), numRings)
+            if idwPower is not None:
+                bufferTotals['idw'][chunk, fieldNum] = accumulateMonitorRings(monitorNums, ringIndex,
+                                                                              pairValues * idwWeights,
+                                                                              len(chunkX), numRings)
+    return bufferTotals
+### end of pointSourceBufferTotals ###
+
+
+# determine the variable identifiers of a point source layer for one buffer distance
+# INPUTS:
+#    variable (str) - point source filename, e.g. NPRI_Albers.shp
+#    fieldAliases (dict) - maps a short alias (e.g. cb) to each attribute column to aggregate
+#    bufferDistance (float) - buffer radius, in meters
+# OUTPUTS:
+#    countIdent (str) - identifier of the point source count, e.g. NPn500m
+#    sumIdents (dict) - maps each alias to the identifier of its sum, e.g. cb500m
+#    idwIdents (dict) - maps each alias to the identifier of its inverse distance weighted total, e.g. cbi500m
+def determinePointSourceIdentifiers(variable, fieldAliases, bufferDistance):
+    distanceLabel = str(int(bufferDistance)) + "m"
+    countIdent = variable[0:2] + "n" + distanceLabel
+    sumIdents = dict([(alias, alias + distanceLabel) for alias in fieldAliases])
+    idwIdents = dict([(alias, alias + "i" + distanceLabel) for alias in fieldAliases])
+    return countIdent, sumIdents, idwIdents
+### end of determinePointSourceIdentifiers ###
+
+
+# calculate all point source variables for all buffer distances at a set of coordinates
+# INPUTS:
+#    monitorX, monitorY (float arrays) - air monitor coordinates
+#    pointSourceList (dict) - maps each point source layer, relative to INPUT_FOLDER, to a dict of
+#                             alias -> attribute column, e.g. {"NPRI_Albers.shp": {"cb": "carbon_200"}}
+# OUTPUTS:
+#    results (dict) - maps each variable identifier (e.g. NPn500m, cb500m, cbi500m) to an array with one value
+#                     per monitor
+def calcPointSourceBuffers(monitorX, monitorY, pointSourceList=values.POINT_SOURCE_LIST):
+    ringEdges = bufferEngine.makeRingEdges(values.BUFFER_DISTANCE)
+    results = {}
+    for variable in sorted(pointSourceList.keys()):
+        startTime = time.time()
+        fieldAliases = pointSourceList[variable]
+        aliases = sorted(fieldAliases.keys())
+        sourceIndex = loadPointSourceIndex(values.INPUT_FOLDER + variable, [fieldAliases[alias] for alias in aliases])
+        bufferTotals = pointSourceBufferTotals(sourceIndex, monitorX, monitorY, ringEdges)
+        for ringNum in range(len(ringEdges)):
+            countIdent, sumIdents, idwIdents = determinePointSourceIdentifiers(variable, aliases, ringEdges[ringNum])
+            results[countIdent] = bufferTotals['count'][:, ringNum]
+            for fieldNum in range(len(aliases)):
+                results[sumIdents[aliases[fieldNum]]] = bufferTotals['sum'][:, fieldNum, ringNum]
+                if 'idw' in bufferTotals:
+                    results[idwIdents[aliases[fieldNum]]] = bufferTotals['idw'][:, fieldNum, ringNum]
+        print("completed all buffer distances for " + variable + " in " + str(time.time() - startTime) + " seconds")
+    return results
+### end of calcPointSourceBuffers ###
+
+
+# calculate all point source variables for all buffer distances for the air monitors in a shapefile
+# INPUTS:
+#    airMonitorFile (str) - full filepath to the air monitor shapefile
+#    pointSourceList (dict) - maps each point source layer, relative to INPUT_FOLDER, to a dict of
+#                             alias -> attribute column
+# OUTPUTS:
+#    monitorIds (int array) - air monitor identifiers
+#    results (dict) - maps each variable identifier to an array with one value per monitor
+def runPointSources(airMonitorFile, pointSourceList=values.POINT_SOURCE_LIST):
+    monitorIds, monitorX, monitorY = zonalStatistics.readAirMonitorPoints(airMonitorFile)
+    results = calcPointSourceBuffers(monitorX, monitorY, pointSourceList)
+    return monitorIds, results
+### end of runPointSources ###
+
+################# end of functions ############################
+
+
+############### end of pointSources_Canada_LUR.py ###############
@@ -0,0 +1,150 @@
+################# rasterCube_Canada_LUR.py ##################
+#
+# Band-stacked raster cubes for multi-year inputs such as yearly NDVI (N3 ... N7) and climate rasters.
+# Previously each yearly raster was buffer-summarised on its own and the years were only combined afterwards
+# in calcEnvThreeYearAvgs.  A cube stores one band per year in a single GeoTIFF, with the time index saved as
+# the BAND_LABELS tag and as band descriptions, so the zonal statistics backend reads the window around each
+# monitor once and returns every year together.  This divides raster I/O by the number of years.
+#
+# Rolling multi-year means can also be calculated at the raster level: rollingMeanCube writes a cube with one
+# band per window (e.g. 2013_2015), using the mean of the years with valid data in each cell.
+#
+# Cubes are built and processed block by block, so memory depends on the block size and number of years.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, rasterio (no ArcGIS license or extension is required)
+
+
+############## import required modules ###############
+import numpy as np
+import rasterio
+############## end of module import ##################
+
+
+BAND_LABELS_TAG = "BAND_LABELS"
+CUBE_NODATA = -3.4028235e+38 # NoData value of cube bands (ArcGIS default)
+CUBE_BLOCK_SIZE = 256
+
+
+################# functions ##################################
+
+# create the profile of a new cube, based on the profile of a template raster
+# INPUTS:
+#    templateProfile (dict) - rasterio profile of a raster on the cube grid
+#    numBands (int) - number of bands in the cube
+# OUTPUTS:
+#    profile (dict) - rasterio profile of the cube
+def makeCubeProfile(templateProfile, numBands):
+    profile = templateProfile.copy()
+    profile.update(driver='GTiff', count=numBands, dtype='float32', nodata=CUBE_NODATA, tiled=True,
+                   blockxsize=CUBE_BLOCK_SIZE, blockysize=CUBE_BLOCK_SIZE, compress='deflate', interleave='pixel',
+                   BIGTIFF='IF_SAFER')
+    return profile
+### end of makeCubeProfile ###
+
+
+# write the time index of a cube
+# INPUTS:
+#    dataset (rasterio dataset) - cube open for writing
+#    bandLabels (str list) - label of each band, e.g. 2013 or 2013_2015
+def writeBandLabels(dataset, bandLabels):
+    dataset.update_tags(**{BAND_LABELS_TAG: ",".join(bandLabels)})
+    for bandIndex in range(len(bandLabels)):
+        dataset.set_band_description(bandIndex + 1, bandLabels[bandIndex])
+### end of writeBandLabels ###
+
+
+# read the time index of a cube
+# INPUTS:
+#    cubeFile (str) - full filepath to the raster
+# OUTPUTS:
+#    bandLabels (str list) - label of each band, or None if the raster is not a cube
+def readBandLabels(cubeFile):
+    with rasterio.open(cubeFile) as dataset:
+        tags = dataset.tags()
+    if BAND_LABELS_TAG not in tags:
+        return None
+    return tags[BAND_LABELS_TAG].split(",")
+### end of readBandLabels ###
+
+
+# determine the variable identifier of one band and buffer distance of a cube.  Yearly bands follow the
+# naming used in threeYearAverages (N3500m for 2013), rolling windows are named by their first and last year
+# (N_13_15_500m for 2013-2015)
+# INPUTS:
+#    variable (str) - cube filename, e.g. NDVI_cube.tif
+#    bandLabel (str) - label of the band, e.g. 2013 or 2013_2015
+#    bufferDistance (float) - buffer radius, in meters
+# OUTPUTS:
+#    variableIdent (str) - variable identifier
+def determineCubeIdentifier(variable, bandLabel, bufferDistance):
+    years = bandLabel.split("_")
+    if len(years) == 1:
+        return variable[0] + years[0][-1] + str(int(bufferDistance)) + "m"
+    return variable[0] + "_" + years[0][-2:] + "_" + years[-1][-2:] + "_" + str(int(bufferDistance)) + "m"
+### end of determineCubeIdentifier ###
+
+
+# stack yearly rasters into a cube with one band per year.  All rasters must share the same grid
+# INPUTS:
+#    yearFiles (dict) - maps each year (int) to the full filepath of its raster
+#    cubeFile (str) - full filepath of the cube to write
+def buildRasterCube(yearFiles, cubeFile):
+    years = sorted(yearFiles.keys())
+    sources = [rasterio.open(yearFiles[year]) for year in years]
+    try:
+        for source in sources[1:]:
+            if (source.transform != sources[0].transform or source.shape != sources[0].shape or
+                    source.crs != sources[0].crs):
+                raise Exception("cannot stack " + source.name + ": its grid differs from " + sources[0].name)
+        with rasterio.open(cubeFile, 'w', **makeCubeProfile(sources[0].profile, len(years))) as cube:
+            writeBandLabels(cube, [str(year) for year in years])
+            for blockIndex, window in cube.block_windows(1):
+                for bandIndex in range(len(sources)):
+                    blockValues = sources[bandIndex].read(1, window=window, masked=True).astype(np.float32)
+                    cube.write(np.ma.filled(blockValues, CUBE_NODATA), bandIndex + 1, window=window)
+    finally:
+        for source in sources:
+            source.close()
+    print("stacked " + str(len(years)) + " years (" + str(years[0]) + "-" + str(years[-1]) + ") into " + cubeFile)
+### end of buildRasterCube ###
+
+
+# calculate rolling means of consecutive years of a cube.  Each cell is the mean of the years with valid data
+# in the window, and NoData if fewer than minYears years are valid
+# INPUTS:
+#    cubeFile (str) - full filepath to a yearly cube
+#    windowLength (int) - number of consecutive years in each window
+#    outputFile (str) - full filepath of the rolling mean cube to write, one band per window
+#    minYears (int) - minimum number of valid years needed for a mean
+def rollingMeanCube(cubeFile, windowLength, outputFile, minYears=1):
+    years = readBandLabels(cubeFile)
+    numWindows = len(years) - windowLength + 1
+    if numWindows < 1:
+        raise Exception(cubeFile + " has fewer than " + str(windowLength) + " years")
+    windowLabels = [years[windowNum] + "_" + years[windowNum + windowLength - 1] for windowNum in range(numWindows)]
+    with rasterio.open(cubeFile) as cube:
+        with rasterio.open(outputFile, 'w', **makeCubeProfile(cube.profile, numWindows)) as rollingCube:
+            writeBandLabels(rollingCube, windowLabels)
+            for blockIndex, window in cube.block_windows(1):
+                blockValues = cube.read(window=window, masked=True)
+                validYears = (~np.ma.getmaskarray(blockValues)).astype(np.float64)
+                yearValues = np.ma.filled(blockValues.astype(np.float64), 0)
+
+                # cumulative sums over years give every window with one subtraction
+                cumulativeValues = np.concatenate([np.zeros((1,) + yearValues.shape[1:]), np.cumsum(yearValues, axis=0)])
+                cumulativeCounts = np.concatenate([np.zeros((1,) + yearValues.shape[1:]), np.cumsum(validYears, axis=0)])
+                windowSums = cumulativeValues[windowLength:] - cumulativeValues[0:numWindows]
+                windowCounts = cumulativeCounts[windowLength:] - cumulativeCounts[0:numWindows]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    windowMeans = np.where(windowCounts >= max(minYears, 1), windowSums / windowCounts, CUBE_NODATA)
+                rollingCube.write(windowMeans.astype(np.float32), window=window)
+    print("calculated " + str(windowLength) + " year rolling means for " + str(numWindows) + " windows of " + cubeFile)
+### end of rollingMeanCube ###
+
+################# end of functions ############################
+
+
+############### end of rasterCube_Canada_LUR.py ###############
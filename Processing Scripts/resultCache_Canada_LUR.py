@@ -0,0 +1,235 @@
+################# resultCache_Canada_LUR.py ##################
+#
+# Persistent, content-addressed cache for buffer variable results.  The file-exists checks in
+# rasterBufferIntersect and pointBufferIntersect cannot tell when an input raster changes, a monitor moves,
+# or the cell size changes.  Here each result is keyed by a hash of the monitor coordinates, the content of the
+# input dataset, the buffer radius, and the statistic (including any settings that change the statistic),
+# so stale results are never reused and unchanged monitor x variable pairs are never recomputed.
+#
+# Results are stored in a single SQLite file.  Dataset content hashes are memoized by file size and
+# modification time so large rasters are only re-hashed when they change.  When the file grows beyond
+# RESULT_CACHE_MAX_BYTES the least recently used results are evicted.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, sqlite3 (included with python)
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+import os
+import glob
+import hashlib
+import sqlite3
+import time
+import numpy as np
+import constantValues as values
+############## end of module import ##################
+
+
+SHAPEFILE_EXTENSIONS = [".shp", ".shx", ".dbf", ".prj"]
+HASH_BLOCK_SIZE = 2**20
+SQLITE_MAX_VARIABLES = 900
+
+
+################# functions ##################################
+
+# open the result cache, creating the cache tables if they do not exist
+# INPUTS:
+#    cacheFile (str) - full filepath to the SQLite cache file
+# OUTPUTS:
+#    cacheConnection (sqlite3 connection) - open connection to the cache
+def openResultCache(cacheFile=values.RESULT_CACHE_FILE):
+    cacheConnection = sqlite3.connect(cacheFile, timeout=60)
+    cacheConnection.execute("CREATE TABLE IF NOT EXISTS results (cacheKey TEXT PRIMARY KEY, value REAL, lastAccess REAL)")
+    cacheConnection.execute("CREATE INDEX IF NOT EXISTS resultsAccess ON results (lastAccess)")
+    cacheConnection.execute("CREATE TABLE IF NOT EXISTS datasets (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, digest TEXT)")
+    cacheConnection.commit()
+    return cacheConnection
+### end of openResultCache ###
+
+
+# list the files that make up a dataset.  Shapefiles are made of several files, rasters of one
+# INPUTS:
+#    datasetPath (str) - full filepath to the dataset
+# OUTPUTS:
+#    datasetFiles (str list) - full filepaths of all files in the dataset, in sorted order
+def determineDatasetFiles(datasetPath):
+    basePath, extension = os.path.splitext(datasetPath)
+    if extension.lower() != ".shp":
+        return [datasetPath]
+    datasetFiles = []
+    for candidateFile in sorted(glob.glob(basePath + ".*")):
+        if os.path.splitext(candidateFile)[1].lower() in SHAPEFILE_EXTENSIONS:
+            datasetFiles.append(candidateFile)
+    return datasetFiles
+### end of determineDatasetFiles ###
+
+
+# calculate a hash of the content of a dataset.  The hash is memoized in the cache by file size and
+# modification time, so unchanged datasets are not re-read
+# INPUTS:
+#    cacheConnection (sqlite3 connection) - open connection to the cache
+#    datasetPath (str) - full filepath to the dataset
+# OUTPUTS:
+#    digest (str) - hexadecimal content hash of the dataset
+def datasetDigest(cacheConnection, datasetPath):
+    datasetFiles = determineDatasetFiles(datasetPath)
+    totalSize = sum([os.path.getsize(datasetFile) for datasetFile in datasetFiles])
+    latestTime = max([os.path.getmtime(datasetFile) for datasetFile in datasetFiles])
+    row = cacheConnection.execute("SELECT size, mtime, digest FROM datasets WHERE path = ?", (datasetPath,)).fetchone()
+    if row is not None and row[0] == totalSize and row[1] == latestTime:
+        return row[2]
+    hasher = hashlib.sha1()
+    for datasetFile in datasetFiles:
+        hasher.update(os.path.splitext(datasetFile)[1].lower().encode('utf-8'))
+        with open(datasetFile, 'rb') as f:
+            block = f.read(HASH_BLOCK_SIZE)
+            while len(block) > 0:
+                hasher.update(block)
+                block = f.read(HASH_BLOCK_SIZE)
+    digest = hasher.hexdigest()
+    cacheConnection.execute("INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?)", (datasetPath, totalSize, latestTime, digest))
+    cacheConnection.commit()
+    return digest
+### end of datasetDigest ###
+
+
+# calculate a hash of each monitor location, rounded to the millimeter
+# INPUTS:
+#    monitorX, monitorY (float arrays) - air monitor coordinates
+# OUTPUTS:
+#    monitorDigests (str list) - hexadecimal hash of each monitor location
+def monitorDigests(monitorX, monitorY):
+    monitorDigests = []
+    for monitorIndex in range(len(monitorX)):
+        location = "%.3f,%.3f" % (monitorX[monitorIndex], monitorY[monitorIndex])
+        monitorDigests.append(hashlib.sha1(location.encode('utf-8')).hexdigest())
+    return monitorDigests
+### end of monitorDigests ###
+
+
+# create the cache key for every monitor, band and buffer distance
+# INPUTS:
+#    monitorHashes (str list) - monitor location hashes, as returned by monitorDigests
+#    datasetHash (str) - dataset content hash, as returned by datasetDigest
+#    ringEdges (float array) - buffer radii
+#    statistic (str) - statistic and settings that determine the cached value, e.g. MEAN|10
+#    numBands (int) - number of bands in the dataset.  Band numbers are only added to the keys of multi-band
+#                     datasets, so single band keys are unchanged
+# OUTPUTS:
+#    cacheKeys (str list of lists) - cache key for each monitor (outer list) and band and buffer distance (inner
+#                                    list, band-major)
+def makeCacheKeys(monitorHashes, datasetHash, ringEdges, statistic, numBands=1):
+    cacheKeys = []
+    for monitorHash in monitorHashes:
+        monitorKeys = []
+        for bandNum in range(numBands):
+            for radius in ringEdges:
+                keyParts = [monitorHash, datasetHash, "%.3f" % radius, statistic]
+                if numBands > 1:
+                    keyParts.append("B" + str(bandNum + 1))
+                keyText = "|".join(keyParts)
+                monitorKeys.append(hashlib.sha1(keyText.encode('utf-8')).hexdigest())
+        cacheKeys.append(monitorKeys)
+    return cacheKeys
+### end of makeCacheKeys ###
+
+
+# look up cached values and refresh their access time
+# INPUTS:
+#    cacheConnection (sqlite3 connection) - open connection to the cache
+#    cacheKeys (str list) - keys to look up
+# OUTPUTS:
+#    cachedValues (dict) - maps each key that was found to its value
+def lookupResults(cacheConnection, cacheKeys):
+    cachedValues = {}
+    for startIndex in range(0, len(cacheKeys), SQLITE_MAX_VARIABLES):
+        keyBatch = cacheKeys[startIndex:startIndex + SQLITE_MAX_VARIABLES]
+        placeholders = ",".join(["?"] * len(keyBatch))
+        for row in cacheConnection.execute("SELECT cacheKey, value FROM results WHERE cacheKey IN (" + placeholders + ")", keyBatch):
+            cachedValues[row[0]] = np.nan if row[1] is None else row[1]
+        cacheConnection.execute("UPDATE results SET lastAccess = ? WHERE cacheKey IN (" + placeholders + ")", [time.time()] + keyBatch)
+    cacheConnection.commit()
+    return cachedValues
+### end of lookupResults ###
+
+
+# store values in the cache
+# INPUTS:
+#    cacheConnection (sqlite3 connection) - open connection to the cache
+#    cacheKeys (str list) - keys to store
+#    resultValues (float list) - value for each key.  NaN values are stored as NULL
+def storeResults(cacheConnection, cacheKeys, resultValues):
+    accessTime = time.time()
+    rows = []
+    for keyIndex in range(len(cacheKeys)):
+        value = resultValues[keyIndex]
+        rows.append((cacheKeys[keyIndex], None if np.isnan(value) else float(value), accessTime))
+    cacheConnection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", rows)
+    cacheConnection.commit()
+### end of storeResults ###
+
+
+# evict the least recently used results until the cache uses no more than maxBytes
+# INPUTS:
+#    cacheConnection (sqlite3 connection) - open connection to the cache
+#    maxBytes (int) - maximum size of the cache, in bytes
+def evictResults(cacheConnection, maxBytes=values.RESULT_CACHE_MAX_BYTES):
+    pageSize = cacheConnection.execute("PRAGMA page_size").fetchone()[0]
+    pageCount = cacheConnection.execute("PRAGMA page_count").fetchone()[0]
+    freePages = cacheConnection.execute("PRAGMA freelist_count").fetchone()[0]
+    usedBytes = (pageCount - freePages) * pageSize
+    if usedBytes <= maxBytes:
+        return
+    numResults = cacheConnection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+    if numResults == 0:
+        return
+    bytesPerResult = float(usedBytes) / numResults
+    numToEvict = int(np.ceil((usedBytes - maxBytes) / bytesPerResult))
+    cacheConnection.execute("DELETE FROM results WHERE cacheKey IN (SELECT cacheKey FROM results ORDER BY lastAccess LIMIT ?)", (numToEvict,))
+    cacheConnection.commit()
+    print("evicted " + str(numToEvict) + " results from the buffer result cache")
+### end of evictResults ###
+
+
+# return buffer statistics for every monitor and buffer distance, calculating only the monitors that are not
+# already cached.  A monitor is recalculated if any of its buffer distances is missing from the cache
+# INPUTS:
+#    cacheConnection (sqlite3 connection) - open connection to the cache
+#    datasetPath (str) - full filepath to the input dataset
+#    monitorX, monitorY (float arrays) - air monitor coordinates
+#    ringEdges (float array) - buffer radii in ascending order
+#    statistic (str) - statistic and settings that determine the value, e.g. MEAN|10
+#    calcFunction (function) - called as calcFunction(datasetPath, monitorX, monitorY, ringEdges) for the
+#                              monitors that are not cached.  Must return an array with shape
+#                              (number of monitors, number of bands x number of radii)
+#    numBands (int) - number of bands returned for each buffer distance
+# OUTPUTS:
+#    bufferValues (float array) - values with shape (number of monitors, number of bands x number of radii)
+def cachedBufferStatistics(cacheConnection, datasetPath, monitorX, monitorY, ringEdges, statistic, calcFunction, numBands=1):
+    datasetHash = datasetDigest(cacheConnection, datasetPath)
+    cacheKeys = makeCacheKeys(monitorDigests(monitorX, monitorY), datasetHash, ringEdges, statistic, numBands)
+    cachedValues = lookupResults(cacheConnection, [key for monitorKeys in cacheKeys for key in monitorKeys])
+    bufferValues = np.full((len(monitorX), numBands * len(ringEdges)), np.nan)
+    missingMonitors = []
+    for monitorIndex in range(len(monitorX)):
+        if all([key in cachedValues for key in cacheKeys[monitorIndex]]):
+            bufferValues[monitorIndex] = [cachedValues[key] for key in cacheKeys[monitorIndex]]
+        else:
+            missingMonitors.append(monitorIndex)
+    print(str(len(monitorX) - len(missingMonitors)) + " of " + str(len(monitorX)) + " monitors found in the result cache for " + datasetPath)
+    if len(missingMonitors) > 0:
+        missingMonitors = np.asarray(missingMonitors)
+        bufferValues[missingMonitors] = calcFunction(datasetPath, monitorX[missingMonitors], monitorY[missingMonitors], ringEdges)
+        missingKeys = [key for monitorIndex in missingMonitors for key in cacheKeys[monitorIndex]]
+        storeResults(cacheConnection, missingKeys, bufferValues[missingMonitors].ravel())
+        evictResults(cacheConnection)
+    return bufferValues
+### end of cachedBufferStatistics ###
+
+################# end of functions ############################
+
+
+############### end of resultCache_Canada_LUR.py ###############
@@ -0,0 +1,182 @@
+################# resultStore_Canada_LUR.py ##################
+#
+# Columnar result store for buffer variables.  Replaces attaching each variable to an air monitor partition
+# with addVariableToPartition (one JoinField_management per variable) and merging every partition into
+# final.shp, whose DBF format limits field names to 10 characters and becomes slow with hundreds of fields.
+#
+# Results are stored in Parquet format, keyed by NAPS ID with one column per variable and buffer distance
+# (e.g. N6500m).  Writers only ever append: each completed task or partition writes a new part file to
+# RESULT_STORE_FOLDER, so concurrent writers never modify the same file and a crashed run keeps all completed
+# parts.  A single compaction step combines the parts with any existing compacted table into RESULT_STORE_FILE.
+# When the same NAPS ID and variable appear in more than one part, the most recently written value is kept as
+# is, even if it is missing (NaN), so a rerun that no longer produces a value replaces the old one.  Air monitors
+# that share a NAPS ID cannot be told apart in the store, so a warning is printed and the last one is kept.
+#
+# The compacted table can be read directly by threeYearAverages and sumRoadBuffers with pandas.read_parquet.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pandas, pyarrow, fiona
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+import os
+import glob
+import time
+import uuid
+import numpy as np
+import pandas as ps
+import fiona
+import constantValues as values
+############## end of module import ##################
+
+
+PART_PREFIX = "part_"
+PART_EXTENSION = ".parquet"
+TEMP_EXTENSION = ".tmp"
+
+
+################# functions ##################################
+
+# read the NAPS ID of every air monitor in a shapefile, in the same order as zonalStatistics.readAirMonitorPoints
+# INPUTS:
+#    airMonitorFile (str) - full filepath to the air monitor shapefile
+# OUTPUTS:
+#    napsIds (int array) - NAPS ID of each air monitor
+def readNapsIds(airMonitorFile):
+    napsIds = []
+    with fiona.open(airMonitorFile) as source:
+        for feature in source:
+            napsIds.append(int(feature['properties'][values.NAPS_ID_FIELD]))
+    return np.asarray(napsIds, dtype=np.int64)
+### end of readNapsIds ###
+
+
+# write a parquet file to a temporary name and atomically move it into place, so readers never see a partial
+# or missing file
+# INPUTS:
+#    table (pandas dataframe) - table to write
+#    outputFile (str) - full filepath of the parquet file
+def writeParquet(table, outputFile):
+    tempFile = outputFile + TEMP_EXTENSION
+    table.to_parquet(tempFile, index=False)
+    os.replace(tempFile, outputFile)
+### end of writeParquet ###
+
+
+# print a warning if more than one air monitor has the same NAPS ID.  Only the last of them is kept in the store
+# INPUTS:
+#    napsIds (int array) - NAPS ID of each air monitor
+def warnDuplicateIds(napsIds):
+    uniqueIds, idCounts = np.unique(np.asarray(napsIds, dtype=np.int64), return_counts=True)
+    duplicateIds = uniqueIds[idCounts > 1]
+    if len(duplicateIds) > 0:
+        print("warning: duplicate NAPS IDs " + ", ".join([str(napsId) for napsId in duplicateIds]) +
+              ", only the last air monitor with each ID is kept in the result store")
+### end of warnDuplicateIds ###
+
+
+# append buffer variables for a set of air monitors to the result store as a new part file
+# INPUTS:
+#    napsIds (int array) - NAPS ID of each air monitor
+#    results (dict) - maps each variable identifier (e.g. N6500m) to an array of values, one per monitor
+#    storeFolder (str) - full filepath to the folder containing the part files
+# OUTPUTS:
+#    partFile (str) - full filepath of the part file that was written
+def appendResults(napsIds, results, storeFolder=values.RESULT_STORE_FOLDER):
+    warnDuplicateIds(napsIds)
+    if not os.path.exists(storeFolder):
+        os.makedirs(storeFolder)
+    table = ps.DataFrame(dict([(fieldName, np.asarray(results[fieldName], dtype=np.float64)) for fieldName in results]))
+    table = table[sorted(results.keys())]
+    table.insert(0, values.NAPS_ID, np.asarray(napsIds, dtype=np.int64))
+    # parts are named by write time so they can be combined in the order they were written
+    partName = PART_PREFIX + "%020d_%d_%s" % (int(time.time() * 1e6), os.getpid(), uuid.uuid4().hex[0:8])
+    partFile = os.path.join(storeFolder, partName + PART_EXTENSION)
+    writeParquet(table, partFile)
+    return partFile
+### end of appendResults ###
+
+
+# list the part files in the result store, in the order they were written
+# INPUTS:
+#    storeFolder (str) - full filepath to the folder containing the part files
+# OUTPUTS:
+#    partFiles (str list) - full filepaths of the part files
+def listParts(storeFolder=values.RESULT_STORE_FOLDER):
+    partFiles = sorted(glob.glob(os.path.join(storeFolder, PART_PREFIX + "*" + PART_EXTENSION)))
+    return partFiles
+### end of listParts ###
+
+
+# combine result tables into one table with one row per NAPS ID.  Where a NAPS ID and variable appear in more
+# than one table, the value from the latest table is kept, including missing (NaN) values
+# INPUTS:
+#    tables (pandas dataframe list) - tables with a NAPS ID column, in the order they were written
+# OUTPUTS:
+#    combinedTable (pandas dataframe) - NAPS ID column followed by variable columns in sorted order
+def combineTables(tables):
+    if len(tables) == 0:
+        return ps.DataFrame(columns=[values.NAPS_ID])
+    longTables = []
+    for table in tables:
+        longTables.append(table.melt(id_vars=[values.NAPS_ID], var_name='variable', value_name='value'))
+    allValues = ps.concat(longTables, ignore_index=True)
+    allValues = allValues.drop_duplicates(subset=[values.NAPS_ID, 'variable'], keep='last')
+    combinedTable = allValues.pivot(index=values.NAPS_ID, columns='variable', values='value')
+
+    # sort monitors and variables, and keep tables without any variables
+    allIds = np.unique(np.concatenate([table[values.NAPS_ID].values for table in tables]))
+    allFields = sorted(set([fieldName for table in tables for fieldName in table.columns if fieldName != values.NAPS_ID]))
+    combinedTable = combinedTable.reindex(index=allIds, columns=allFields)
+    combinedTable.index.name = values.NAPS_ID
+    combinedTable.columns.name = None
+    return combinedTable.reset_index()
+### end of combineTables ###
+
+
+# read the result store, including any parts that have not been compacted yet
+# INPUTS:
+#    storeFile (str) - full filepath to the compacted parquet file
+#    storeFolder (str) - full filepath to the folder containing the part files
+# OUTPUTS:
+#    resultTable (pandas dataframe) - NAPS ID column followed by one column per variable and buffer distance
+def readResultStore(storeFile=values.RESULT_STORE_FILE, storeFolder=values.RESULT_STORE_FOLDER):
+    tables = []
+    if os.path.exists(storeFile):
+        tables.append(ps.read_parquet(storeFile))
+    for partFile in listParts(storeFolder):
+        tables.append(ps.read_parquet(partFile))
+    return combineTables(tables)
+### end of readResultStore ###
+
+
+# combine all part files and the existing compacted table into the compacted table, then remove the parts.
+# Parts appended while compaction is running are kept for the next compaction
+# INPUTS:
+#    storeFile (str) - full filepath to the compacted parquet file
+#    storeFolder (str) - full filepath to the folder containing the part files
+# OUTPUTS:
+#    resultTable (pandas dataframe) - the compacted table
+def compactResultStore(storeFile=values.RESULT_STORE_FILE, storeFolder=values.RESULT_STORE_FOLDER):
+    partFiles = listParts(storeFolder)
+    tables = []
+    if os.path.exists(storeFile):
+        tables.append(ps.read_parquet(storeFile))
+    for partFile in partFiles:
+        tables.append(ps.read_parquet(partFile))
+    resultTable = combineTables(tables)
+    writeParquet(resultTable, storeFile)
+    for partFile in partFiles:
+        os.remove(partFile)
+    print("compacted " + str(len(partFiles)) + " result parts into " + storeFile + " (" + str(len(resultTable)) +
+          " air monitors, " + str(len(resultTable.columns) - 1) + " variables)")
+    return resultTable
+### end of compactResultStore ###
+
+################# end of functions ############################
+
+
+############### end of resultStore_Canada_LUR.py ###############
@@ -0,0 +1,300 @@
+################# roadLength_Canada_LUR.py ##################
+#
+# Vectorized road length in buffer engine.  Replaces the Intersect_analysis + Dissolve_management +
+# !shape.length@kilometers! workflow of polylineBufferIntersect for the road and rail layers in POLYLINE_LIST.
+#
+# Each polyline layer is loaded once into contiguous arrays of line segments.  Collinear segments that overlap
+# are merged before any lengths are calculated, matching the dissolve step of the ArcGIS workflow where
+# overlapping segments are only counted once.  Segments are indexed with a uniform grid, and the segments near
+# each air monitor are clipped analytically against the circles of all buffer distances at the same time.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, pandas, fiona
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+import numpy as np
+import pandas as ps
+import fiona
+import time
+import constantValues as values
+import bufferEngine_Canada_LUR as bufferEngine
+import zonalStatistics_Canada_LUR as zonalStatistics
+import resultCache_Canada_LUR as resultCache
+############## end of module import ##################
+
+
+# segment indices that have already been loaded, keyed by polyline filepath
+SEGMENT_INDEX_CACHE = {}
+
+
+################# functions ##################################
+
+# read all line segments from a polyline shapefile
+# INPUTS:
+#    polylineFile (str) - full filepath to the polyline shapefile
+# OUTPUTS:
+#    segments (float array) - array with shape (number of segments, 4) holding x0, y0, x1, y1 for each segment.
+#                             Zero length segments are removed
+def loadPolylineSegments(polylineFile):
+    segmentList = []
+    with fiona.open(polylineFile) as source:
+        for feature in source:
+            geometry = feature['geometry']
+            if geometry is None:
+                continue
+            if geometry['type'] == 'LineString':
+                partList = [geometry['coordinates']]
+            else:
+                partList = geometry['coordinates']
+            for part in partList:
+                vertices = np.asarray(part, dtype=np.float64)[:, 0:2]
+                if len(vertices) > 1:
+                    segmentList.append(np.hstack((vertices[0:-1], vertices[1:])))
+    if len(segmentList) == 0:
+        return np.zeros((0, 4))
+    segments = np.ascontiguousarray(np.vstack(segmentList))
+    segments = segments[np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1]) > 0]
+    return segments
+### end of loadPolylineSegments ###
+
+
+# merge collinear segments that overlap so that shared lengths are only counted once.  Segments are grouped into
+# lines with tolerance grouping rather than rounding, so lines that fall on either side of a rounding boundary
+# are still merged: directions are sorted and split where consecutive directions differ by more than the
+# tolerance (directions just below 180 degrees join those just above 0 degrees), and the offsets within each
+# direction group are split the same way.  Every segment is projected onto the direction of its group and the
+# intervals along each line are merged
+# INPUTS:
+#    segments (float array) - array with shape (number of segments, 4), as returned by loadPolylineSegments
+#    tolerance (float) - distance, in meters, within which two lines are considered the same
+# OUTPUTS:
+#    dissolvedSegments (float array) - array with shape (number of merged segments, 4)
+def dissolveSegments(segments, tolerance=values.XY_TOLERANCE):
+    if len(segments) == 0:
+        return segments
+    deltaX = segments[:, 2] - segments[:, 0]
+    deltaY = segments[:, 3] - segments[:, 1]
+    angle = np.mod(np.arctan2(deltaY, deltaX), np.pi)
+
+    # group directions whose segment ends differ by less than the tolerance over the longest segment
+    angleTolerance = tolerance / np.hypot(deltaX, deltaY).max()
+    angleOrder = np.argsort(angle, kind='mergesort')
+    sortedAngles = angle[angleOrder]
+    newAngleGroup = np.concatenate(([True], np.diff(sortedAngles) > angleTolerance))
+    referenceAngles = sortedAngles[newAngleGroup]
+    angleGroup = np.empty(len(segments), dtype=np.int64)
+    angleGroup[angleOrder] = np.cumsum(newAngleGroup) - 1
+    if len(referenceAngles) > 1 and sortedAngles[0] + np.pi - sortedAngles[-1] <= angleTolerance:
+        angleGroup[angleGroup == len(referenceAngles) - 1] = 0
+    unitX = np.cos(referenceAngles[angleGroup])
+    unitY = np.sin(referenceAngles[angleGroup])
+    lineOffset = unitX * (segments[:, 1] + segments[:, 3]) / 2 - unitY * (segments[:, 0] + segments[:, 2]) / 2
+    alongStart = unitX * segments[:, 0] + unitY * segments[:, 1]
+    alongEnd = unitX * segments[:, 2] + unitY * segments[:, 3]
+    lines = ps.DataFrame({'angleGroup': angleGroup, 'start': np.minimum(alongStart, alongEnd),
+                          'end': np.maximum(alongStart, alongEnd), 'unitX': unitX, 'unitY': unitY, 'offset': lineOffset})
+
+    # group offsets within each direction group, then merge the intervals along each line
+    lines = lines.sort_values(['angleGroup', 'offset'], kind='mergesort').reset_index(drop=True)
+    newLine = (lines['angleGroup'].diff() != 0) | (lines['offset'].diff() > tolerance)
+    lines['lineGroup'] = newLine.cumsum()
+    lines = lines.sort_values(['lineGroup', 'start'], kind='mergesort').reset_index(drop=True)
+    lines['runEnd'] = lines.groupby('lineGroup', sort=False)['end'].cummax()
+    previousEnd = lines.groupby('lineGroup', sort=False)['runEnd'].shift(1)
+    newInterval = previousEnd.isnull() | (lines['start'] > previousEnd + tolerance)
+    intervalId = newInterval.cumsum()
+    merged = lines.groupby(intervalId).agg({'start': 'min', 'end': 'max', 'unitX': 'first', 'unitY': 'first', 'offset': 'mean'})
+    dissolvedSegments = np.column_stack((
+        merged['start'] * merged['unitX'] - merged['offset'] * merged['unitY'],
+        merged['start'] * merged['unitY'] + merged['offset'] * merged['unitX'],
+        merged['end'] * merged['unitX'] - merged['offset'] * merged['unitY'],
+        merged['end'] * merged['unitY'] + merged['offset'] * merged['unitX']))
+    return np.ascontiguousarray(dissolvedSegments)
+### end of dissolveSegments ###
+
+
+# build a uniform grid index over line segments.  Each segment is registered in every grid cell its bounding
+# box touches
+# INPUTS:
+#    segments (float array) - array with shape (number of segments, 4)
+#    cellSize (float) - grid cell size, in meters
+# OUTPUTS:
+#    segmentIndex (dict)
+#        segments (float array) - the indexed segments
+#        cellSize (float) - grid cell size
+#        cellKeys (int array) - sorted grid cell keys, one entry per segment and cell
+#        segmentIds (int array) - segment id for each entry in cellKeys
+def buildSegmentGrid(segments, cellSize=values.SEGMENT_GRID_SIZE):
+    firstCol = np.floor(np.minimum(segments[:, 0], segments[:, 2]) / cellSize).astype(np.int64)
+    lastCol = np.floor(np.maximum(segments[:, 0], segments[:, 2]) / cellSize).astype(np.int64)
+    firstRow = np.floor(np.minimum(segments[:, 1], segments[:, 3]) / cellSize).astype(np.int64)
+    lastRow = np.floor(np.maximum(segments[:, 1], segments[:, 3]) / cellSize).astype(np.int64)
+    numCols = lastCol - firstCol + 1
+    numCells = numCols * (lastRow - firstRow + 1)
+    segmentIds = np.repeat(np.arange(len(segments)), numCells)
+    cellNumber = np.arange(len(segmentIds)) - np.repeat(np.cumsum(numCells) - numCells, numCells)
+    cellCols = firstCol[segmentIds] + cellNumber % numCols[segmentIds]
+    cellRows = firstRow[segmentIds] + cellNumber // numCols[segmentIds]
+    cellKeys = determineCellKeys(cellRows, cellCols)
+    sortOrder = np.argsort(cellKeys, kind='mergesort')
+    segmentIndex = {'segments': segments, 'cellSize': float(cellSize),
+                    'cellKeys': cellKeys[sortOrder], 'segmentIds': segmentIds[sortOrder]}
+    return segmentIndex
+### end of buildSegmentGrid ###
+
+
+# combine grid rows and columns into a single integer key
+# INPUTS:
+#    cellRows, cellCols (int arrays) - grid rows and columns
+# OUTPUTS:
+#    cellKeys (int array) - unique key for each grid cell
+def determineCellKeys(cellRows, cellCols):
+    cellKeys = (cellRows.astype(np.int64) << 32) + (cellCols.astype(np.int64) & 0xFFFFFFFF)
+    return cellKeys
+### end of determineCellKeys ###
+
+
+# find all segments registered in the grid cells that intersect a square around a point
+# INPUTS:
+#    segmentIndex (dict) - index returned by buildSegmentGrid
+#    centreX, centreY (float) - coordinates of the square centre
+#    halfWidth (float) - half width of the square, in meters
+# OUTPUTS:
+#    candidateIds (int array) - unique ids of the candidate segments
+def querySegmentGrid(segmentIndex, centreX, centreY, halfWidth):
+    cellSize = segmentIndex['cellSize']
+    cellCols = np.arange(int(np.floor((centreX - halfWidth) / cellSize)), int(np.floor((centreX + halfWidth) / cellSize)) + 1)
+    cellRows = np.arange(int(np.floor((centreY - halfWidth) / cellSize)), int(np.floor((centreY + halfWidth) / cellSize)) + 1)
+    gridRows, gridCols = np.meshgrid(cellRows, cellCols, indexing='ij')
+    queryKeys = determineCellKeys(gridRows.ravel(), gridCols.ravel())
+    firstEntry = np.searchsorted(segmentIndex['cellKeys'], queryKeys, side='left')
+    lastEntry = np.searchsorted(segmentIndex['cellKeys'], queryKeys, side='right')
+    numEntries = lastEntry - firstEntry
+    if numEntries.sum() == 0:
+        return np.zeros(0, dtype=np.int64)
+    entryNumber = np.arange(numEntries.sum()) - np.repeat(np.cumsum(numEntries) - numEntries, numEntries)
+    candidateIds = np.unique(segmentIndex['segmentIds'][np.repeat(firstEntry, numEntries) + entryNumber])
+    return candidateIds
+### end of querySegmentGrid ###
+
+
+# calculate the length of each segment inside circles of several radii around a single point
+# INPUTS:
+#    segments (float array) - array with shape (number of segments, 4)
+#    centreX, centreY (float) - coordinates of the circle centre
+#    ringEdges (float array) - circle radii in ascending order
+# OUTPUTS:
+#    clippedLengths (float array) - array with shape (number of segments, number of radii)
+def circleClipLengths(segments, centreX, centreY, ringEdges):
+    deltaX = (segments[:, 2] - segments[:, 0])[:, np.newaxis]
+    deltaY = (segments[:, 3] - segments[:, 1])[:, np.newaxis]
+    startX = (segments[:, 0] - centreX)[:, np.newaxis]
+    startY = (segments[:, 1] - centreY)[:, np.newaxis]
+
+    # solve |start + t * delta| = radius for t, the position along each segment where it crosses each circle
+    quadA = deltaX ** 2 + deltaY ** 2
+    quadB = 2 * (startX * deltaX + startY * deltaY)
+    quadC = startX ** 2 + startY ** 2 - ringEdges[np.newaxis, :] ** 2
+    discriminant = quadB ** 2 - 4 * quadA * quadC
+    rootDisc = np.sqrt(np.maximum(discriminant, 0))
+    enterT = np.clip((-quadB - rootDisc) / (2 * quadA), 0, 1)
+    exitT = np.clip((-quadB + rootDisc) / (2 * quadA), 0, 1)
+    clippedLengths = np.where(discriminant > 0, (exitT - enterT) * np.sqrt(quadA), 0)
+    return clippedLengths
+### end of circleClipLengths ###
+
+
+# load, dissolve and index a polyline layer, reusing the index if the layer was already loaded
+# INPUTS:
+#    polylineFile (str) - full filepath to the polyline shapefile
+# OUTPUTS:
+#    segmentIndex (dict) - index returned by buildSegmentGrid
+def loadSegmentIndex(polylineFile):
+    if polylineFile not in SEGMENT_INDEX_CACHE:
+        segments = dissolveSegments(loadPolylineSegments(polylineFile))
+        SEGMENT_INDEX_CACHE[polylineFile] = buildSegmentGrid(segments)
+        print("indexed " + str(len(segments)) + " dissolved segments from " + polylineFile)
+    return SEGMENT_INDEX_CACHE[polylineFile]
+### end of loadSegmentIndex ###
+
+
+# calculate polyline length, in kilometers, within every buffer distance for every air monitor
+# INPUTS:
+#    segmentIndex (dict) - index returned by buildSegmentGrid
+#    monitorX, monitorY (float arrays) - air monitor coordinates, in the polyline projection
+#    ringEdges (float array) - buffer radii in ascending order
+# OUTPUTS:
+#    bufferLengths (float array) - polyline length in kilometers, with shape (number of monitors, number of radii)
+def polylineBufferLengths(segmentIndex, monitorX, monitorY, ringEdges):
+    bufferLengths = np.zeros((len(monitorX), len(ringEdges)))
+    for monitorIndex in range(len(monitorX)):
+        candidateIds = querySegmentGrid(segmentIndex, monitorX[monitorIndex], monitorY[monitorIndex], ringEdges[-1])
+        if len(candidateIds) == 0:
+            continue
+        clippedLengths = circleClipLengths(segmentIndex['segments'][candidateIds], monitorX[monitorIndex],
+                                           monitorY[monitorIndex], ringEdges)
+        bufferLengths[monitorIndex] = clippedLengths.sum(axis=0) / 1000.0
+    return bufferLengths
+### end of polylineBufferLengths ###
+
+
+# calculate polyline length within every buffer distance for every air monitor, loading the polyline layer
+# from file.  Used as the calculation function for the result cache
+# INPUTS:
+#    polylineFile (str) - full filepath to the polyline shapefile
+#    monitorX, monitorY (float arrays) - air monitor coordinates, in the polyline projection
+#    ringEdges (float array) - buffer radii in ascending order
+# OUTPUTS:
+#    bufferLengths (float array) - polyline length in kilometers, with shape (number of monitors, number of radii)
+def polylineFileBufferLengths(polylineFile, monitorX, monitorY, ringEdges):
+    bufferLengths = polylineBufferLengths(loadSegmentIndex(polylineFile), monitorX, monitorY, ringEdges)
+    return bufferLengths
+### end of polylineFileBufferLengths ###
+
+
+# determine the statistic label used to cache polyline lengths
+# OUTPUTS:
+#    statistic (str) - cache statistic label
+def determineCacheStatistic():
+    statistic = "LENGTH_KM|" + str(values.XY_TOLERANCE)
+    return statistic
+### end of determineCacheStatistic ###
+
+
+# calculate polyline lengths for all polyline variables and all buffer distances for one set of air monitors.
+# If USE_RESULT_CACHE is set, only monitors missing from the result cache are calculated
+# INPUTS:
+#    airMonitorFile (str) - full filepath to the air monitor shapefile
+#    polylineList (str list) - polyline variables to process, relative to INPUT_FOLDER
+# OUTPUTS:
+#    monitorIds (int array) - air monitor identifiers
+#    results (dict) - maps each variable identifier (e.g. aR500m) to an array of lengths, one per monitor
+def runRoadLengths(airMonitorFile, polylineList):
+    ringEdges = bufferEngine.makeRingEdges(values.BUFFER_DISTANCE)
+    monitorIds, monitorX, monitorY = zonalStatistics.readAirMonitorPoints(airMonitorFile)
+    if values.USE_RESULT_CACHE:
+        cacheConnection = resultCache.openResultCache()
+    results = {}
+    for variable in polylineList:
+        startTime = time.time()
+        if values.USE_RESULT_CACHE:
+            bufferLengths = resultCache.cachedBufferStatistics(cacheConnection, values.INPUT_FOLDER + variable, monitorX, monitorY,
+                                                               ringEdges, determineCacheStatistic(), polylineFileBufferLengths)
+        else:
+            bufferLengths = polylineFileBufferLengths(values.INPUT_FOLDER + variable, monitorX, monitorY, ringEdges)
+        for ringNum in range(len(ringEdges)):
+            results[bufferEngine.determineVariableIdentifier(variable, ringEdges[ringNum])] = bufferLengths[:, ringNum]
+        print("completed all buffer distances for " + variable + " in " + str(time.time() - startTime) + " seconds")
+    if values.USE_RESULT_CACHE:
+        cacheConnection.close()
+    return monitorIds, results
+### end of runRoadLengths ###
+
+################# end of functions ############################
+
+
+############### end of roadLength_Canada_LUR.py ###############
@@ -0,0 +1,71 @@
+################# sharedGeometry_Canada_LUR.py ##################
+#
+# Read-only air monitor geometry shared between worker processes.  Buffer polygons are fully defined by the
+# monitor coordinates and the buffer distance, so instead of copying the buffer shapefile for every
+# variable x buffer x partition (createBufferFileCopy), the monitor identifiers and coordinates are written
+# once to a memory-mapped array.  Worker processes attach to the array read-only, so all workers share the
+# same pages of the operating system file cache and only monitor indices need to be passed to each task.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy
+
+
+############## import required modules ###############
+import os
+import numpy as np
+############## end of module import ##################
+
+
+# arrays already attached by this process, keyed by filepath
+ATTACHED_COORDINATES = {}
+
+
+################# functions ##################################
+
+# write air monitor identifiers and coordinates to a file that can be memory-mapped by worker processes
+# INPUTS:
+#    sharedFile (str) - full filepath to the shared coordinate file (.npy)
+#    monitorIds (int array) - air monitor identifiers
+#    monitorX, monitorY (float arrays) - air monitor coordinates
+def publishCoordinates(sharedFile, monitorIds, monitorX, monitorY):
+    coordinates = np.column_stack((np.asarray(monitorIds, dtype=np.float64), monitorX, monitorY))
+    np.save(sharedFile, np.ascontiguousarray(coordinates))
+    print("published " + str(len(monitorIds)) + " air monitor coordinates to " + sharedFile)
+### end of publishCoordinates ###
+
+
+# attach to a shared coordinate file as a read-only memory map.  The map is reused for later tasks on the
+# same process, and is re-attached if the file has been published again
+# INPUTS:
+#    sharedFile (str) - full filepath to the shared coordinate file (.npy)
+# OUTPUTS:
+#    coordinates (float array) - read-only array with shape (number of monitors, 3) holding the identifier,
+#                                x and y coordinate of each monitor
+def attachCoordinates(sharedFile):
+    fileTime = os.path.getmtime(sharedFile)
+    if sharedFile not in ATTACHED_COORDINATES or ATTACHED_COORDINATES[sharedFile][0] != fileTime:
+        ATTACHED_COORDINATES[sharedFile] = (fileTime, np.load(sharedFile, mmap_mode='r'))
+    return ATTACHED_COORDINATES[sharedFile][1]
+### end of attachCoordinates ###
+
+
+# read the identifiers and coordinates of a subset of the shared air monitors
+# INPUTS:
+#    sharedFile (str) - full filepath to the shared coordinate file (.npy)
+#    monitorIndices (int array) - indices of the monitors to read.  If None, all monitors are read
+# OUTPUTS:
+#    monitorIds (int array) - air monitor identifiers
+#    monitorX, monitorY (float arrays) - air monitor coordinates
+def readSharedMonitors(sharedFile, monitorIndices=None):
+    coordinates = attachCoordinates(sharedFile)
+    if monitorIndices is not None:
+        coordinates = coordinates[monitorIndices]
+    return coordinates[:, 0].astype(np.int64), np.array(coordinates[:, 1]), np.array(coordinates[:, 2])
+### end of readSharedMonitors ###
+
+################# end of functions ############################
+
+
+############### end of sharedGeometry_Canada_LUR.py ###############
@@ -0,0 +1,221 @@
+################# taskScheduler_Canada_LUR.py ##################
+#
+# In-memory work scheduler for buffer variables.  Replaces the partition-per-zone shapefile fan-out of
+# partitionShapefile and the serial partition loop in calcEnvBuffers main.
+#
+# Work is described as groups of air monitors that share a variable (e.g. all monitors in zone 3 for a
+# zone-specific mosaic raster).  Each group is split into tasks of monitors x one variable, with all buffer
+# distances calculated together by the ring engines.  Because a raster task with a 20km buffer costs far more
+# per monitor than a polyline task or a small buffer, chunk sizes are not fixed: the first task of each variable
+# is a small probe, and later chunks are sized from the measured cost per monitor so that each task takes
+# roughly TARGET_TASK_SECONDS.  Tasks are dispatched through the task supervisor (taskSupervisor_Canada_LUR.py), and progress and throughput are reported
+# as tasks complete.  No per-partition copies of the monitor shapefile are written: monitor coordinates are
+# published once to a memory-mapped file (sharedGeometry_Canada_LUR.py) and tasks only carry monitor indices.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+import time
+import numpy as np
+import constantValues as values
+import bufferEngine_Canada_LUR as bufferEngine
+import zonalStatistics_Canada_LUR as zonalStatistics
+import roadLength_Canada_LUR as roadLength
+import resultCache_Canada_LUR as resultCache
+import sharedGeometry_Canada_LUR as sharedGeometry
+import taskSupervisor_Canada_LUR as taskSupervisor
+import resultStore_Canada_LUR as resultStore
+############## end of module import ##################
+
+
+# buffer calculation and cache statistic label for each variable type
+BUFFER_FUNCTIONS = {values.RASTER_TYPE: zonalStatistics.rasterBufferMeans,
+                    values.POLYLINE_TYPE: roadLength.polylineFileBufferLengths}
+CACHE_STATISTICS = {values.RASTER_TYPE: zonalStatistics.determineCacheStatistic,
+                    values.POLYLINE_TYPE: roadLength.determineCacheStatistic}
+
+
+################# functions ##################################
+
+# create a work group: a set of air monitors that share one variable file
+# INPUTS:
+#    variableType (int) - RASTER_TYPE or POLYLINE_TYPE
+#    variable (str) - variable file, relative to INPUT_FOLDER
+#    monitorIndices (int array) - indices of the monitors in the group
+# OUTPUTS:
+#    workGroup (dict) - work group used by runScheduler
+def makeWorkGroup(variableType, variable, monitorIndices):
+    workGroup = {'type': variableType, 'variable': variable, 'monitors': np.asarray(monitorIndices, dtype=np.int64), 'next': 0}
+    return workGroup
+### end of makeWorkGroup ###
+
+
+# determine the key of the cost estimate of a work group.  Estimates are kept per variable file, since two
+# files with the same two character prefix (e.g. different years of one variable) or the zone mosaics of one
+# variable can differ widely in resolution and extent
+# INPUTS:
+#    workGroup (dict) - work group created by makeWorkGroup
+# OUTPUTS:
+#    costKey (str) - cost estimate key
+def determineCostKey(workGroup):
+    costKey = str(workGroup['type']) + ":" + workGroup['variable']
+    return costKey
+### end of determineCostKey ###
+
+
+# determine the number of monitors in the next task of a work group from the measured cost per monitor
+# INPUTS:
+#    costPerMonitor (float) - measured seconds per monitor, or None if no task has completed yet
+# OUTPUTS:
+#    chunkSize (int) - number of monitors in the next task
+def determineChunkSize(costPerMonitor):
+    if costPerMonitor is None:
+        return values.PROBE_CHUNK_SIZE
+    chunkSize = int(values.TARGET_TASK_SECONDS / max(costPerMonitor, 1e-6))
+    chunkSize = min(max(chunkSize, 1), values.MAX_CHUNK_SIZE)
+    return chunkSize
+### end of determineChunkSize ###
+
+
+# calculate buffer values for one task.  Runs on a worker process
+# INPUTS:
+#    task (dict)
+#        type (int) - RASTER_TYPE or POLYLINE_TYPE
+#        variable (str) - variable file, relative to INPUT_FOLDER
+#        monitorIndices (int array) - indices of the monitors in the task
+#        sharedFile (str) - full filepath to the shared monitor coordinate file
+#        costKey (str) - cost estimate key of the task's work group
+# OUTPUTS:
+#    taskResult (dict) - bufferValues (float array with shape (monitors, bands x radii)) and elapsed (float, seconds)
+def runBufferTask(task):
+    startTime = time.time()
+    ringEdges = bufferEngine.makeRingEdges(values.BUFFER_DISTANCE)
+    datasetPath = values.INPUT_FOLDER + task['variable']
+    calcFunction = BUFFER_FUNCTIONS[task['type']]
+    monitorIds, monitorX, monitorY = sharedGeometry.readSharedMonitors(task['sharedFile'], task['monitorIndices'])
+    if values.USE_RESULT_CACHE:
+        numBands = 1
+        if task['type'] == values.RASTER_TYPE:
+            numBands = zonalStatistics.determineBandCount(datasetPath)
+        cacheConnection = resultCache.openResultCache()
+        bufferValues = resultCache.cachedBufferStatistics(cacheConnection, datasetPath, monitorX, monitorY,
+                                                          ringEdges, CACHE_STATISTICS[task['type']](), calcFunction, numBands)
+        cacheConnection.close()
+    else:
+        bufferValues = calcFunction(datasetPath, monitorX, monitorY, ringEdges)
+    taskResult = {'bufferValues': bufferValues, 'elapsed': time.time() - startTime}
+    return taskResult
+### end of runBufferTask ###
+
+
+# determine the variable identifier of each column of a task's buffer values
+# INPUTS:
+#    task (dict) - task submitted by runScheduler
+#    ringEdges (float array) - buffer radii in ascending order
+# OUTPUTS:
+#    variableIdents (str list) - variable identifier of each column
+def determineTaskIdentifiers(task, ringEdges):
+    if task['type'] == values.RASTER_TYPE:
+        return zonalStatistics.determineResultIdentifiers(task['variable'], ringEdges)
+    return [bufferEngine.determineVariableIdentifier(task['variable'], radius) for radius in ringEdges]
+### end of determineTaskIdentifiers ###
+
+
+# print progress and throughput of the scheduler
+# INPUTS:
+#    pairsCompleted (int) - number of monitor x variable pairs completed
+#    pairsTotal (int) - total number of monitor x variable pairs
+#    startTime (float) - time the scheduler started
+def reportThroughput(pairsCompleted, pairsTotal, startTime):
+    elapsed = max(time.time() - startTime, 1e-6)
+    throughput = pairsCompleted / elapsed
+    remaining = (pairsTotal - pairsCompleted) / throughput if throughput > 0 else float('nan')
+    print("completed " + str(pairsCompleted) + " of " + str(pairsTotal) + " monitor x variable pairs, " +
+          "%.2f pairs per second, approximately %.0f seconds remaining" % (throughput, remaining))
+### end of reportThroughput ###
+
+
+# run all work groups under the task supervisor, sizing tasks adaptively from their measured cost.  Tasks that
+# still fail after their retries are reported and their monitors are left as NaN, the remaining tasks continue
+# INPUTS:
+#    workGroups (list) - work groups created by makeWorkGroup
+#    monitorIds (int array) - identifiers of all air monitors
+#    monitorX, monitorY (float arrays) - coordinates of all air monitors
+#    numWorkers (int) - number of worker processes
+#    napsIds (int array) - NAPS ID of each air monitor.  If given, the results of every completed task are
+#                          appended to the result store
+# OUTPUTS:
+#    results (dict) - maps each variable identifier (e.g. N6500m) to an array of values, one per monitor.
+#                     Monitors not included in a variable's work groups are NaN
+def runScheduler(workGroups, monitorIds, monitorX, monitorY, numWorkers=values.MAX_WORKERS, napsIds=None):
+    ringEdges = bufferEngine.makeRingEdges(values.BUFFER_DISTANCE)
+    sharedFile = values.RESULTS_FOLDER + values.SHARED_COORDINATE_FILE
+    sharedGeometry.publishCoordinates(sharedFile, monitorIds, monitorX, monitorY)
+    results = {}
+    costEstimates = {}
+    probesInFlight = set()
+    submittedTasks = {}
+    failedTasks = []
+    pairsTotal = sum([len(workGroup['monitors']) for workGroup in workGroups])
+    pairsCompleted = 0
+    startTime = time.time()
+    supervisor = taskSupervisor.createSupervisor(runBufferTask, numWorkers)
+    try:
+        while pairsCompleted < pairsTotal:
+            # dispatch tasks until every worker has a task queued behind the one it is running
+            for workGroup in workGroups:
+                costKey = determineCostKey(workGroup)
+                while taskSupervisor.countPendingTasks(supervisor) < 2 * numWorkers and workGroup['next'] < len(workGroup['monitors']):
+                    if costKey in probesInFlight:
+                        break
+                    if costKey not in costEstimates:
+                        probesInFlight.add(costKey)
+                    chunkSize = determineChunkSize(costEstimates.get(costKey))
+                    monitorIndices = workGroup['monitors'][workGroup['next']:workGroup['next'] + chunkSize]
+                    workGroup['next'] += len(monitorIndices)
+                    task = {'type': workGroup['type'], 'variable': workGroup['variable'], 'monitorIndices': monitorIndices,
+                            'sharedFile': sharedFile, 'costKey': costKey}
+                    submittedTasks[taskSupervisor.submitTask(supervisor, task)] = task
+
+            # wait for a task to complete and update the cost estimate for its variable
+            taskId, error, taskResult = taskSupervisor.collectResult(supervisor)
+            task = submittedTasks.pop(taskId)
+            monitorIndices = task['monitorIndices']
+            costKey = task['costKey']
+            pairsCompleted += len(monitorIndices)
+            if error is not None:
+                failedTasks.append(task)
+                probesInFlight.discard(costKey)
+                continue
+            measuredCost = taskResult['elapsed'] / len(monitorIndices)
+            if costKey in costEstimates:
+                measuredCost = 0.5 * costEstimates[costKey] + 0.5 * measuredCost
+            costEstimates[costKey] = measuredCost
+            probesInFlight.discard(costKey)
+            taskValues = {}
+            variableIdents = determineTaskIdentifiers(task, ringEdges)
+            for columnNum in range(len(variableIdents)):
+                variableIdent = variableIdents[columnNum]
+                if variableIdent not in results:
+                    results[variableIdent] = np.full(len(monitorX), np.nan)
+                results[variableIdent][monitorIndices] = taskResult['bufferValues'][:, columnNum]
+                taskValues[variableIdent] = taskResult['bufferValues'][:, columnNum]
+            if napsIds is not None:
+                resultStore.appendResults(napsIds[monitorIndices], taskValues)
+            reportThroughput(pairsCompleted, pairsTotal, startTime)
+    finally:
+        taskSupervisor.closeSupervisor(supervisor)
+    for task in failedTasks:
+        print("warning: " + task['variable'] + " could not be calculated for " + str(len(task['monitorIndices'])) + " monitors")
+    return results
+### end of runScheduler ###
+
+################# end of functions ############################
+
+
+############### end of taskScheduler_Canada_LUR.py ###############
@@ -0,0 +1,298 @@
+################# taskSupervisor_Canada_LUR.py ##################
+#
+# Structured supervision of parallel buffer tasks.  Replaces the testProgress watchdog, which polled the
+# modification time of tempStats/test_progress.txt and terminated the whole pool when progress stopped, and the
+# retry loop in processBufferVariables, which recomputed every variable in a partition whenever one failed.
+#
+# Tasks run on a persistent set of worker processes, each connected to the supervisor by its own pipe, so the
+# per-process caches of the buffer engines (e.g. the segment index of roadLength_Canada_LUR.py) are kept from one
+# task to the next.  A hung task can be terminated without affecting any other task: only the worker that timed
+# out or crashed is replaced.  Tasks that fail, crash or exceed TASK_TIMEOUT_SECONDS are retried up to
+# TASK_MAX_RETRIES times with exponential backoff and jitter.  Completed tasks are placed on a results queue
+# that is read with collectResult.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+import time
+import random
+import collections
+import multiprocessing
+import constantValues as values
+############## end of module import ##################
+
+
+POLL_INTERVAL = 0.05 # seconds between checks of running tasks
+WORKER_EXIT_SECONDS = 5 # seconds an idle worker is given to exit when the supervisor is closed
+
+
+################# functions ##################################
+
+# run tasks received through a pipe until the supervisor sends None, and send each result (or error) back
+# INPUTS:
+#    taskFunction (function) - function called with each task as its only argument
+#    connection (multiprocessing connection) - worker end of the worker's pipe
+def runWorker(taskFunction, connection):
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        try:
+            result = taskFunction(task)
+            connection.send((None, result))
+        except Exception as e:
+            connection.send((str(e), None))
+    connection.close()
+### end of runWorker ###
+
+
+# start a worker process
+# INPUTS:
+#    supervisor (dict) - supervisor created by createSupervisor
+# OUTPUTS:
+#    worker (dict) - the worker process, the supervisor end of its pipe and the task entry it is running (None
+#                    while it is idle)
+def startWorker(supervisor):
+    supervisorEnd, workerEnd = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=runWorker, args=(supervisor['taskFunction'], workerEnd))
+    process.daemon = True
+    process.start()
+    workerEnd.close()
+    worker = {'process': process, 'connection': supervisorEnd, 'entry': None}
+    return worker
+### end of startWorker ###
+
+
+# stop a worker process, terminating it if it is still running
+# INPUTS:
+#    worker (dict) - worker created by startWorker
+def stopWorker(worker):
+    if worker['process'].is_alive():
+        worker['process'].terminate()
+    worker['process'].join()
+    worker['connection'].close()
+### end of stopWorker ###
+
+
+# stop a worker that timed out or crashed and start a new worker in its place
+# INPUTS:
+#    supervisor (dict) - supervisor created by createSupervisor
+#    workerIndex (int) - position of the worker in the supervisor's workers
+# OUTPUTS:
+#    exitCode (int) - exit code of the stopped worker
+def replaceWorker(supervisor, workerIndex):
+    worker = supervisor['workers'][workerIndex]
+    stopWorker(worker)
+    supervisor['workers'][workerIndex] = startWorker(supervisor)
+    return worker['process'].exitcode
+### end of replaceWorker ###
+
+
+# create a supervisor for running tasks in parallel
+# INPUTS:
+#    taskFunction (function) - function run for every task.  Must be defined at module level
+#    numWorkers (int) - maximum number of tasks running at the same time
+#    timeout (float) - seconds after which a running task is terminated and retried
+#    maxRetries (int) - number of times a failed task is retried before it is reported as failed
+# OUTPUTS:
+#    supervisor (dict) - supervisor state used by submitTask, collectResult and closeSupervisor.  Workers are
+#                        started when the first tasks are submitted
+def createSupervisor(taskFunction, numWorkers=values.MAX_WORKERS, timeout=values.TASK_TIMEOUT_SECONDS,
+                     maxRetries=values.TASK_MAX_RETRIES):
+    supervisor = {'taskFunction': taskFunction, 'numWorkers': numWorkers, 'timeout': timeout, 'maxRetries': maxRetries,
+                  'waiting': collections.deque(), 'workers': [], 'results': collections.deque(), 'nextId': 0}
+    return supervisor
+### end of createSupervisor ###
+
+
+# add a task to the supervisor.  The task starts as soon as a worker is available
+# INPUTS:
+#    supervisor (dict) - supervisor created by createSupervisor
+#    task (any) - task argument passed to the task function
+# OUTPUTS:
+#    taskId (int) - identifier of the task, returned with its result
+def submitTask(supervisor, task):
+    taskId = supervisor['nextId']
+    supervisor['nextId'] += 1
+    supervisor['waiting'].append({'taskId': taskId, 'task': task, 'attempt': 0, 'notBefore': 0})
+    return taskId
+### end of submitTask ###
+
+
+# determine the delay before retrying a task, using exponential backoff with jitter
+# INPUTS:
+#    attempt (int) - number of attempts already made
+# OUTPUTS:
+#    delay (float) - seconds to wait before the next attempt
+def determineBackoff(attempt):
+    delay = min(values.MAX_BACKOFF_SECONDS, values.RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+    delay = delay * random.uniform(0.5, 1.0)
+    return delay
+### end of determineBackoff ###
+
+
+# retry a task that failed, or report it as failed if it has no retries left
+# INPUTS:
+#    supervisor (dict) - supervisor created by createSupervisor
+#    entry (dict) - the failed task entry
+#    error (str) - reason for the failure
+def handleFailure(supervisor, entry, error):
+    entry['attempt'] += 1
+    if entry['attempt'] > supervisor['maxRetries']:
+        print("task " + str(entry['taskId']) + " failed after " + str(entry['attempt']) + " attempts: " + error)
+        supervisor['results'].append((entry['taskId'], error, None))
+        return
+    delay = determineBackoff(entry['attempt'])
+    print("task " + str(entry['taskId']) + " failed (" + error + "), retrying in %.1f seconds" % delay)
+    entry['notBefore'] = time.time() + delay
+    supervisor['waiting'].append(entry)
+### end of handleFailure ###
+
+
+# start waiting tasks on idle workers, and check running tasks for results, crashes and timeouts.  Workers
+# that crash or time out are replaced by new workers
+# INPUTS:
+#    supervisor (dict) - supervisor created by createSupervisor
+def checkTasks(supervisor):
+    currentTime = time.time()
+
+    # check running tasks
+    for workerIndex in range(len(supervisor['workers'])):
+        worker = supervisor['workers'][workerIndex]
+        entry = worker['entry']
+        if entry is None:
+            if not worker['process'].is_alive():
+                replaceWorker(supervisor, workerIndex)
+            continue
+        if worker['connection'].poll():
+            try:
+                error, result = worker['connection'].recv()
+                worker['entry'] = None
+            except EOFError:
+                error, result = "worker exited with code " + str(replaceWorker(supervisor, workerIndex)), None
+            if error is None:
+                supervisor['results'].append((entry['taskId'], None, result))
+            else:
+                handleFailure(supervisor, entry, error)
+        elif not worker['process'].is_alive():
+            if worker['connection'].poll():
+                # the worker sent its result and exited between the two checks, it is collected on the next check
+                continue
+            handleFailure(supervisor, entry, "worker exited with code " + str(replaceWorker(supervisor, workerIndex)))
+        elif currentTime - entry['startTime'] > supervisor['timeout']:
+            # only the hung task is cancelled, all other tasks keep running
+            replaceWorker(supervisor, workerIndex)
+            handleFailure(supervisor, entry, "timed out after " + str(supervisor['timeout']) + " seconds")
+
+    # start waiting tasks whose backoff has expired, starting workers up to numWorkers
+    numWaiting = len(supervisor['waiting'])
+    for waitIndex in range(numWaiting):
+        idleWorkers = [worker for worker in supervisor['workers'] if worker['entry'] is None]
+        if len(idleWorkers) == 0 and len(supervisor['workers']) >= supervisor['numWorkers']:
+            break
+        entry = supervisor['waiting'].popleft()
+        if entry['notBefore'] > currentTime:
+            supervisor['waiting'].append(entry)
+            continue
+        if len(idleWorkers) > 0:
+            worker = idleWorkers[0]
+        else:
+            worker = startWorker(supervisor)
+            supervisor['workers'].append(worker)
+        worker['connection'].send(entry['task'])
+        entry['startTime'] = time.time()
+        worker['entry'] = entry
+### end of checkTasks ###
+
+
+# determine the number of tasks running on workers
+# INPUTS:
+#    supervisor (dict) - supervisor created by createSupervisor
+# OUTPUTS:
+#    numRunning (int) - number of workers with a task
+def countRunningTasks(supervisor):
+    numRunning = len([worker for worker in supervisor['workers'] if worker['entry'] is not None])
+    return numRunning
+### end of countRunningTasks ###
+
+
+# determine the number of tasks that have been submitted but whose results have not been collected
+# INPUTS:
+#    supervisor (dict) - supervisor created by createSupervisor
+# OUTPUTS:
+#    numPending (int) - number of waiting, running and completed but uncollected tasks
+def countPendingTasks(supervisor):
+    numPending = len(supervisor['waiting']) + countRunningTasks(supervisor) + len(supervisor['results'])
+    return numPending
+### end of countPendingTasks ###
+
+
+# wait for the next completed task
+# INPUTS:
+#    supervisor (dict) - supervisor created by createSupervisor
+# OUTPUTS:
+#    taskId (int) - identifier of the task
+#    error (str) - None if the task succeeded, otherwise the reason for the last failure
+#    result (any) - return value of the task function, None if the task failed
+def collectResult(supervisor):
+    if countPendingTasks(supervisor) == 0:
+        raise Exception("there are no pending tasks to collect")
+    while len(supervisor['results']) == 0:
+        checkTasks(supervisor)
+        if len(supervisor['results']) == 0:
+            time.sleep(POLL_INTERVAL)
+    return supervisor['results'].popleft()
+### end of collectResult ###
+
+
+# stop all workers, terminating any running tasks, and discard waiting tasks
+# INPUTS:
+#    supervisor (dict) - supervisor created by createSupervisor
+def closeSupervisor(supervisor):
+    for worker in supervisor['workers']:
+        if worker['entry'] is None and worker['process'].is_alive():
+            try:
+                worker['connection'].send(None)
+                worker['process'].join(WORKER_EXIT_SECONDS)
+            except (IOError, OSError):
+                pass
+        stopWorker(worker)
+    supervisor['workers'] = []
+    supervisor['waiting'].clear()
+### end of closeSupervisor ###
+
+
+# run a list of tasks under supervision and wait for all of them to complete
+# INPUTS:
+#    taskFunction (function) - function run for every task.  Must be defined at module level
+#    tasks (list) - task arguments
+#    numWorkers (int) - maximum number of tasks running at the same time
+# OUTPUTS:
+#    results (list) - return value of each task, in the order of tasks.  None for failed tasks
+#    failures (dict) - maps the index of each failed task to the reason for its last failure
+def runSupervisedTasks(taskFunction, tasks, numWorkers=values.MAX_WORKERS):
+    supervisor = createSupervisor(taskFunction, numWorkers)
+    results = [None] * len(tasks)
+    failures = {}
+    try:
+        for task in tasks:
+            submitTask(supervisor, task)
+        for taskNum in range(len(tasks)):
+            taskId, error, result = collectResult(supervisor)
+            if error is None:
+                results[taskId] = result
+            else:
+                failures[taskId] = error
+    finally:
+        closeSupervisor(supervisor)
+    return results, failures
+### end of runSupervisedTasks ###
+
+################# end of functions ############################
+
+
+############### end of taskSupervisor_Canada_LUR.py ###############
@@ -0,0 +1,58 @@
+################# conftest.py ##################
+#
+# Shared setup for the regression tests of the Canada LUR processing scripts.  The scripts import their settings
+# as constantValues, so constantValues_Canada_LUR.py is registered under that name before any script is imported.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, numpy, rasterio
+
+
+############## import required modules ###############
+import os
+import sys
+import importlib
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+import pytest
+############## end of module import ##################
+
+
+SCRIPTS_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_FOLDER not in sys.path:
+    sys.path.insert(0, SCRIPTS_FOLDER)
+sys.modules.setdefault('constantValues', importlib.import_module('constantValues_Canada_LUR'))
+
+
+################# functions ##################################
+
+# write a single band GeoTIFF with square cells
+# INPUTS:
+#    rasterFile (str) - full filepath of the GeoTIFF
+#    rasterValues (float array) - raster values, with shape (rows, columns)
+#    originX, originY (float) - coordinates of the upper left corner
+#    cellSize (float) - cell width and height
+#    nodata (float) - NoData value, or None
+def writeTestRaster(rasterFile, rasterValues, originX, originY, cellSize, nodata=None):
+    with rasterio.open(rasterFile, 'w', driver='GTiff', height=rasterValues.shape[0], width=rasterValues.shape[1],
+                       count=1, dtype='float64', transform=from_origin(originX, originY, cellSize, cellSize),
+                       nodata=nodata) as dataset:
+        dataset.write(rasterValues.astype(np.float64), 1)
+### end of writeTestRaster ###
+
+
+@pytest.fixture
+def randomRaster(tmp_path):
+    randomState = np.random.RandomState(3)
+    rasterValues = randomState.uniform(0, 100, size=(120, 150))
+    rasterValues[randomState.uniform(size=rasterValues.shape) < 0.05] = -9999
+    rasterFile = str(tmp_path / "random.tif")
+    writeTestRaster(rasterFile, rasterValues, 1000.0, 5000.0, 30.0, nodata=-9999)
+    return rasterFile, np.where(rasterValues == -9999, np.nan, rasterValues), 1000.0, 5000.0, 30.0
+
+################# end of functions ############################
+
+
+############### end of conftest.py ###############
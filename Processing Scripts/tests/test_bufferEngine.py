@@ -0,0 +1,39 @@
+################# test_bufferEngine.py ##################
+#
+# Tests of the ArcGIS ring engine in bufferEngine_Canada_LUR.py: buffer means read with arcpy must weight the
+# cells crossed by a buffer edge by their sub-cell coverage, as the NumPy backend does.  Skipped where arcpy is
+# not available.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, numpy, rasterio, ArcGIS with spatial extension
+
+
+############## import required modules ###############
+import numpy as np
+import pytest
+pytest.importorskip("arcpy")
+import bufferEngine_Canada_LUR as bufferEngine
+import zonalStatistics_Canada_LUR as zonalStatistics
+############## end of module import ##################
+
+
+RADII = np.asarray([50.0, 100.0, 250.0, 500.0, 1000.0])
+
+
+################# functions ##################################
+
+def test_ringMeansMatchNumpyBackend(randomRaster):
+    rasterFile, rasterValues, originX, originY, cellSize = randomRaster
+    randomState = np.random.RandomState(11)
+    monitorX = originX + randomState.uniform(0, rasterValues.shape[1] * cellSize, 20)
+    monitorY = originY - randomState.uniform(0, rasterValues.shape[0] * cellSize, 20)
+    ringMeans = bufferEngine.rasterRingMeans(rasterFile, monitorX, monitorY, RADII)
+    numpyMeans = zonalStatistics.rasterBufferMeans(rasterFile, monitorX, monitorY, RADII)
+    np.testing.assert_allclose(ringMeans, numpyMeans, rtol=1e-10)
+
+################# end of functions ############################
+
+
+############### end of test_bufferEngine.py ###############
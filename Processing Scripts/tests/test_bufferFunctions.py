@@ -0,0 +1,59 @@
+################# test_bufferFunctions.py ##################
+#
+# Tests of the ArcGIS buffer path in bufferFunctions_Canada_LUR.py: polyline lengths calculated in the in_memory
+# buffers must be joined back to the monitor they were buffered from.  Skipped where arcpy is not available.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, ArcGIS with spatial extension
+
+
+############## import required modules ###############
+import pytest
+arcpy = pytest.importorskip("arcpy")
+pytest.importorskip("StatisticsForOverlappingZones")
+import constantValues as values
+import bufferFunctions_Canada_LUR as bufferFunctions
+############## end of module import ##################
+
+
+MONITOR_X = [0.0, 1000.0, 2000.0]
+ROAD_LENGTHS = [50.0, 100.0, 150.0] # meters of road crossing the 100m buffer of each monitor
+
+
+################# functions ##################################
+
+# write the air monitors and one road centred on each monitor to shapefiles in a folder
+def writeTestLayers(folder):
+    spatialReference = arcpy.SpatialReference(3978)
+    arcpy.CreateFeatureclass_management(folder, "monitors.shp", "POINT", spatial_reference=spatialReference)
+    with arcpy.da.InsertCursor(folder + "monitors.shp", ["SHAPE@XY"]) as cursor:
+        for monitorX in MONITOR_X:
+            cursor.insertRow([(monitorX, 0.0)])
+    arcpy.CreateFeatureclass_management(folder, "aRoads.shp", "POLYLINE", spatial_reference=spatialReference)
+    with arcpy.da.InsertCursor(folder + "aRoads.shp", ["SHAPE@"]) as cursor:
+        for monitorX, roadLength in zip(MONITOR_X, ROAD_LENGTHS):
+            roadPoints = arcpy.Array([arcpy.Point(monitorX - roadLength/2, 0.0), arcpy.Point(monitorX + roadLength/2, 0.0)])
+            cursor.insertRow([arcpy.Polyline(roadPoints, spatialReference)])
+    return folder + "monitors.shp"
+
+
+def test_polylineValuesJoinToTheirMonitor(tmp_path, monkeypatch):
+    folder = str(tmp_path).replace("\\", "/") + "/"
+    monkeypatch.setattr(values, "INPUT_FOLDER", folder)
+    monitorFile = writeTestLayers(folder)
+    sharedFile = bufferFunctions.publishSharedCoordinates(monitorFile, folder + "partition/")
+    argument = bufferFunctions.createArgumentList(["aRoads.shp"], folder + "partition/", sharedFile, "0", 100, monitorFile)[0]
+    bufferFunctions.multi_run_polyline_wrapper(argument)
+    bufferFunctions.addVariableToPartition(argument, monitorFile, values.POLYLINE_TYPE)
+    with arcpy.da.SearchCursor(monitorFile, ["FID", "aR100m"]) as cursor:
+        joinedLengths = dict([(row[0], row[1]) for row in cursor])
+    assert sorted(joinedLengths.keys()) == [0, 1, 2]
+    for monitorFid, roadLength in enumerate(ROAD_LENGTHS):
+        assert joinedLengths[monitorFid] == pytest.approx(roadLength/1000.0, rel=1e-6)
+
+################# end of functions ############################
+
+
+############### end of test_bufferFunctions.py ###############
@@ -0,0 +1,60 @@
+################# test_compositeVariables.py ##################
+#
+# Tests of the declarative composite variables in compositeVariables_Canada_LUR.py: coefficients, NaN
+# propagation, absent columns in tables, and composites whose components were never configured.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, numpy, pandas
+
+
+############## import required modules ###############
+import numpy as np
+import pandas as ps
+import compositeVariables_Canada_LUR as compositeVariables
+############## end of module import ##################
+
+
+BUFFER_DISTANCES = [50, 500]
+
+
+################# functions ##################################
+
+def test_compositeCoefficients():
+    results = {'bR50m': np.asarray([1.0, 2.0]), 'bR500m': np.asarray([3.0, 4.0]),
+               'cR50m': np.asarray([10.0, np.nan]), 'cR500m': np.asarray([30.0, 40.0])}
+    composites = compositeVariables.evaluateComposites(["tot = bR + 0.5*cR", "diff = cR - bR"], results, BUFFER_DISTANCES)
+    np.testing.assert_allclose(composites['tot50m'], [6.0, np.nan])
+    np.testing.assert_allclose(composites['tot500m'], [18.0, 24.0])
+    np.testing.assert_allclose(composites['diff500m'], [27.0, 36.0])
+
+
+def test_absentColumnsAreZeroInTables():
+    # as in sumRoadBuffers, a table without eR columns still gets alRds
+    results = {'bR50m': np.asarray([1.0]), 'bR500m': np.asarray([3.0]), 'dR500m': np.asarray([np.nan])}
+    composites = compositeVariables.evaluateComposites(["alRds = bR + dR + eR"], results, BUFFER_DISTANCES)
+    assert composites['alRds50m'][0] == 1.0
+    assert np.isnan(composites['alRds500m'][0])
+
+
+def test_unconfiguredComponentsAreSkipped():
+    # dR was configured but only processed for one buffer distance, eR was never configured
+    results = {'bR50m': np.asarray([1.0]), 'bR500m': np.asarray([3.0]), 'dR500m': np.asarray([5.0])}
+    composites = compositeVariables.evaluateComposites(["alRds = bR + dR", "allRds = bR + dR + eR"], results,
+                                                       BUFFER_DISTANCES, ['bR', 'dR'])
+    assert sorted(composites.keys()) == ['alRds500m', 'alRds50m']
+    assert np.isnan(composites['alRds50m'][0])
+    assert composites['alRds500m'][0] == 8.0
+
+
+def test_addCompositesToTable():
+    inData = ps.DataFrame({'bR50m': [1.0, 2.0], 'cR50m': [3.0, 4.0], 'alRds50m': [0.0, 0.0]})
+    outData = compositeVariables.addComposites(inData, ["alRds = bR + cR + eR"], [50])
+    assert list(outData['alRds50m']) == [4.0, 6.0]
+    assert list(outData.columns).count('alRds50m') == 1
+
+################# end of functions ############################
+
+
+############### end of test_compositeVariables.py ###############
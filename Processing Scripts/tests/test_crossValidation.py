@@ -0,0 +1,95 @@
+################# test_crossValidation.py ##################
+#
+# Tests of the batched cross-validation in crossValidation_Canada_LUR.py against a brute-force refit of every
+# train/test split (and every left out monitor) with np.linalg.lstsq, and of the p of the adjusted R2.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, numpy, pandas
+
+
+############## import required modules ###############
+import numpy as np
+import crossValidation_Canada_LUR as crossValidation
+############## end of module import ##################
+
+
+NUM_MONITORS = 120
+NUM_PREDICTORS = 5
+
+
+################# functions ##################################
+
+# simulate a model dataset with positive outcomes, as needed by the bias statistics
+# INPUTS:
+#    randomState (numpy RandomState) - random number generator
+# OUTPUTS:
+#    predictorValues (float array) - predictors with shape (monitors, predictors)
+#    outcomeValues (float array) - outcome of each monitor
+def makeModelData(randomState):
+    predictorValues = randomState.normal(size=(NUM_MONITORS, NUM_PREDICTORS))
+    outcomeValues = 20 + np.dot(predictorValues, randomState.uniform(-3, 3, NUM_PREDICTORS)) + randomState.normal(size=NUM_MONITORS)
+    return predictorValues, outcomeValues
+### end of makeModelData ###
+
+
+# calculate the evaluation statistics of one set of predictions, one monitor at a time
+# INPUTS:
+#    predictions, observed (float arrays) - predicted and observed outcomes of the evaluated monitors
+#    numPredictors (int) - p of the adjusted R2
+# OUTPUTS:
+#    statistics (dict) - rmse, mae, rsq, adjRsq, bias and absBias
+def bruteForceStatistics(predictions, observed, numPredictors):
+    numEval = len(observed)
+    residuals = observed - predictions
+    rsq = 1 - np.sum(residuals ** 2) / np.sum((observed - observed.mean()) ** 2)
+    statistics = {'rmse': np.sqrt(np.mean(residuals ** 2)), 'mae': np.mean(np.abs(residuals)), 'rsq': rsq,
+                  'adjRsq': 1 - ((1 - rsq) * (numEval - 1)) / (numEval - numPredictors - 1),
+                  'bias': -100.0 * np.mean(residuals / observed), 'absBias': 100.0 * np.mean(np.abs(residuals) / observed)}
+    return statistics
+### end of bruteForceStatistics ###
+
+
+def test_holdoutMatchesRefit():
+    predictorValues, outcomeValues = makeModelData(np.random.RandomState(41))
+    summary, statistics = crossValidation.crossValidation(predictorValues, outcomeValues, 60, 0.8, seed=7, numWorkers=1)
+    trainMasks = crossValidation.drawTrainMasks(np.random.RandomState(7), 60, NUM_MONITORS, 0.8)
+    designMatrix = crossValidation.makeDesignMatrix(predictorValues)
+    for splitNum in range(60):
+        train = trainMasks[splitNum] == 1
+        coefficients = np.linalg.lstsq(designMatrix[train], outcomeValues[train], rcond=None)[0]
+        expected = bruteForceStatistics(np.dot(designMatrix[~train], coefficients), outcomeValues[~train], NUM_PREDICTORS)
+        for name in crossValidation.CV_STATISTICS:
+            np.testing.assert_allclose(statistics[name][splitNum], expected[name], rtol=1e-12, atol=1e-13)
+    np.testing.assert_allclose(summary['rmse'][0], np.mean(statistics['rmse']))
+
+
+def test_leaveOneOutMatchesRefit():
+    predictorValues, outcomeValues = makeModelData(np.random.RandomState(43))
+    summary, looPredictions = crossValidation.leaveOneOut(predictorValues, outcomeValues)
+    designMatrix = crossValidation.makeDesignMatrix(predictorValues)
+    expectedPredictions = np.zeros(NUM_MONITORS)
+    for monitorNum in range(NUM_MONITORS):
+        train = np.arange(NUM_MONITORS) != monitorNum
+        coefficients = np.linalg.lstsq(designMatrix[train], outcomeValues[train], rcond=None)[0]
+        expectedPredictions[monitorNum] = np.dot(designMatrix[monitorNum], coefficients)
+    np.testing.assert_allclose(looPredictions, expectedPredictions, rtol=1e-13)
+    expected = bruteForceStatistics(expectedPredictions, outcomeValues, NUM_PREDICTORS)
+    for name in crossValidation.CV_STATISTICS:
+        np.testing.assert_allclose(summary[name][0], expected[name], rtol=1e-12)
+
+
+def test_adjustedRsqPredictors():
+    predictorValues, outcomeValues = makeModelData(np.random.RandomState(47))
+    modelSize = crossValidation.leaveOneOut(predictorValues, outcomeValues)[0]
+    rCode = crossValidation.leaveOneOut(predictorValues, outcomeValues, numPredictors=1)[0]
+    rsq = modelSize['rsq'][0]
+    assert np.isclose(modelSize['adjRsq'][0], 1 - (1 - rsq) * (NUM_MONITORS - 1) / (NUM_MONITORS - NUM_PREDICTORS - 1))
+    assert np.isclose(rCode['adjRsq'][0], 1 - (1 - rsq) * (NUM_MONITORS - 1) / (NUM_MONITORS - 2))
+    assert rCode['rsq'][0] == rsq
+
+################# end of functions ############################
+
+
+############### end of test_crossValidation.py ###############
@@ -0,0 +1,151 @@
+################# test_downloadManager.py ##################
+#
+# Tests of downloadManager_Canada_LUR.py against a local HTTP server: retries of transient errors, resuming an
+# interrupted download with an HTTP Range request, completing a partial file on 416 (Range Not Satisfiable),
+# failing immediately on errors that are not retried, and the per-host request rate limit.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest
+
+
+############## import required modules ###############
+import os
+import time
+import threading
+import pytest
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+import downloadManager_Canada_LUR as downloadManager
+############## end of module import ##################
+
+
+CONTENT = bytes(bytearray(range(256))) * 400
+
+
+################# functions ##################################
+
+# request handler whose behaviour depends on the path and on the number of earlier requests for that path.
+# Every request is recorded in the server's request log
+class LocalRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        return None
+
+    def sendContent(self, startByte):
+        body = CONTENT[startByte:]
+        self.send_response(200 if startByte == 0 else 206)
+        self.send_header('Content-Length', str(len(body)))
+        if startByte > 0:
+            self.send_header('Content-Range', 'bytes ' + str(startByte) + '-' + str(len(CONTENT) - 1) + '/' + str(len(CONTENT)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        rangeHeader = self.headers.get('Range')
+        with self.server.lock:
+            self.server.requestLog.append((self.path, rangeHeader, time.time()))
+            numRequests = len([entry for entry in self.server.requestLog if entry[0] == self.path])
+        startByte = int(rangeHeader[len('bytes='):-1]) if rangeHeader is not None else 0
+        if self.path == '/flaky' and numRequests <= 2:
+            self.send_error(503)
+        elif self.path == '/missing':
+            self.send_error(404)
+        elif self.path == '/truncated' and numRequests == 1:
+            # promise the whole file but close the connection half way through
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(CONTENT)))
+            self.end_headers()
+            self.wfile.write(CONTENT[0:len(CONTENT) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+        elif self.path == '/complete' and startByte >= len(CONTENT):
+            self.send_error(416)
+        else:
+            self.sendContent(startByte)
+
+
+@pytest.fixture
+def testServer():
+    server = HTTPServer(('127.0.0.1', 0), LocalRequestHandler)
+    server.lock = threading.Lock()
+    server.requestLog = []
+    serverThread = threading.Thread(target=server.serve_forever)
+    serverThread.daemon = True
+    serverThread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def shortBackoff(monkeypatch):
+    monkeypatch.setattr(downloadManager, 'BACKOFF_SECONDS', 0.01)
+
+
+# determine the url of a path on the test server
+def serverUrl(server, path):
+    return 'http://127.0.0.1:' + str(server.server_address[1]) + path
+
+
+# read a downloaded file
+def readFile(fileName):
+    with open(fileName, 'rb') as f:
+        return f.read()
+
+
+def test_transientErrorsAreRetried(testServer, tmp_path):
+    outputFile = str(tmp_path / 'flaky.bin')
+    failures = downloadManager.runDownloads([(serverUrl(testServer, '/flaky'), outputFile, None)], 2)
+    assert failures == {}
+    assert readFile(outputFile) == CONTENT
+    assert len(testServer.requestLog) == 3
+    assert not os.path.exists(outputFile + downloadManager.PART_EXTENSION)
+
+
+def test_interruptedDownloadResumesWithRange(testServer, tmp_path):
+    outputFile = str(tmp_path / 'truncated.bin')
+    failures = downloadManager.runDownloads([(serverUrl(testServer, '/truncated'), outputFile, None)], 1)
+    assert failures == {}
+    assert readFile(outputFile) == CONTENT
+    rangeHeaders = [entry[1] for entry in testServer.requestLog]
+    assert rangeHeaders == [None, 'bytes=' + str(len(CONTENT) // 2) + '-']
+
+
+def test_completePartFileIsKeptOnRangeNotSatisfiable(testServer, tmp_path):
+    outputFile = str(tmp_path / 'complete.bin')
+    with open(outputFile + downloadManager.PART_EXTENSION, 'wb') as f:
+        f.write(CONTENT)
+    failures = downloadManager.runDownloads([(serverUrl(testServer, '/complete'), outputFile, None)], 1)
+    assert failures == {}
+    assert readFile(outputFile) == CONTENT
+    assert [entry[1] for entry in testServer.requestLog] == ['bytes=' + str(len(CONTENT)) + '-']
+
+
+def test_clientErrorsAreNotRetried(testServer, tmp_path):
+    outputFile = str(tmp_path / 'missing.bin')
+    failures = downloadManager.runDownloads([(serverUrl(testServer, '/missing'), outputFile, None)], 1)
+    assert failures == {0: 'HTTP Error 404'}
+    assert len(testServer.requestLog) == 1
+    assert not os.path.exists(outputFile)
+
+
+def test_requestsToOneHostAreRateLimited(testServer, tmp_path):
+    manager = downloadManager.createDownloadManager(4, requestsPerSecond=20.0)
+    try:
+        for fileNum in range(8):
+            downloadManager.submitDownload(manager, serverUrl(testServer, '/file' + str(fileNum)), str(tmp_path / (str(fileNum) + '.bin')))
+        failures = downloadManager.waitForDownloads(manager)
+    finally:
+        downloadManager.closeDownloadManager(manager)
+    assert failures == {}
+    requestTimes = sorted([entry[2] for entry in testServer.requestLog])
+    # 8 requests at 20 per second are spread over at least 7 intervals of 0.05 seconds
+    assert requestTimes[-1] - requestTimes[0] >= 7 * 0.05 * 0.9
+
+################# end of functions ############################
+
+
+############### end of test_downloadManager.py ###############
@@ -0,0 +1,158 @@
+################# test_integralImage.py ##################
+#
+# Regression tests for the tiled summed-area table index in integralImage_Canada_LUR.py.  Circle sums are
+# compared with a brute-force sum over cell centres, and the difference between the summed-area table means
+# and the sub-cell coverage means of zonalStatistics_Canada_LUR.py is bounded by the cells along the buffer edge.
+# Persisted tile indexes are checked to be reused and rebuilt when their raster changes.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, numpy, rasterio
+
+
+############## import required modules ###############
+import os
+import numpy as np
+import rasterio
+import constantValues as values
+import integralImage_Canada_LUR as integralImage
+import zonalStatistics_Canada_LUR as zonalStatistics
+############## end of module import ##################
+
+
+RADII = np.asarray([50.0, 200.0, 475.0, 900.0])
+
+
+################# functions ##################################
+
+# sum the cells whose centres are within each radius of the centre of the cell containing each point
+# INPUTS:
+#    rasterValues (float array) - raster values, NoData cells are NaN
+#    originX, originY, cellSize (float) - upper left corner and cell size of the raster
+#    pointX, pointY (float arrays) - point coordinates
+#    radii (float array) - circle radii
+# OUTPUTS:
+#    totals, counts (float arrays) - sums and valid cell counts, with shape (number of points, number of radii)
+def bruteForceCircleSums(rasterValues, originX, originY, cellSize, pointX, pointY, radii):
+    numRows, numCols = rasterValues.shape
+    cellRows, cellCols = np.meshgrid(np.arange(numRows), np.arange(numCols), indexing='ij')
+    validCells = np.isfinite(rasterValues)
+    totals = np.zeros((len(pointX), len(radii)))
+    counts = np.zeros((len(pointX), len(radii)))
+    for pointNum in range(len(pointX)):
+        centreCol = np.floor((pointX[pointNum] - originX) / cellSize)
+        centreRow = np.floor((originY - pointY[pointNum]) / cellSize)
+        distances = np.hypot((cellRows - centreRow) * cellSize, (cellCols - centreCol) * cellSize)
+        for radiusNum in range(len(radii)):
+            inside = validCells & (distances <= radii[radiusNum])
+            totals[pointNum, radiusNum] = rasterValues[inside].sum()
+            counts[pointNum, radiusNum] = inside.sum()
+    return totals, counts
+### end of bruteForceCircleSums ###
+
+
+# draw points inside the test raster, near its edges and just outside it
+# INPUTS:
+#    randomState (numpy RandomState) - random number generator
+#    numPoints (int) - number of points
+# OUTPUTS:
+#    pointX, pointY (float arrays) - point coordinates
+def makeTestPoints(randomState, numPoints):
+    pointX = randomState.uniform(1000.0 - 300.0, 1000.0 + 150 * 30.0 + 300.0, numPoints)
+    pointY = randomState.uniform(5000.0 - 120 * 30.0 - 300.0, 5000.0 + 300.0, numPoints)
+    return pointX, pointY
+### end of makeTestPoints ###
+
+
+def test_tiledCircleSumsMatchBruteForce(randomRaster):
+    rasterFile, rasterValues, originX, originY, cellSize = randomRaster
+    pointX, pointY = makeTestPoints(np.random.RandomState(5), 60)
+    expectedTotals, expectedCounts = bruteForceCircleSums(rasterValues, originX, originY, cellSize, pointX, pointY, RADII)
+    for tileSize in [7, 32, 1024]:
+        circleTotals, circleCounts = integralImage.tiledCircleSums(rasterFile, pointX, pointY, RADII, tileSize)
+        np.testing.assert_allclose(circleTotals[:, 0, :], expectedTotals, rtol=1e-9, atol=1e-6)
+        np.testing.assert_array_equal(circleCounts[:, 0, :], expectedCounts)
+
+
+def test_squareAndAnnulusSums(randomRaster):
+    rasterFile, rasterValues, originX, originY, cellSize = randomRaster
+    with rasterio.open(rasterFile) as dataset:
+        rasterIndex = integralImage.loadWindowIndexes(dataset, 0, 0, dataset.height, dataset.width)[0]
+    filledValues = np.where(np.isfinite(rasterValues), rasterValues, 0)
+    pointX = np.asarray([originX + 40.5 * cellSize])
+    pointY = np.asarray([originY - 60.5 * cellSize])
+    squareTotals, squareCounts = integralImage.squareSums(rasterIndex, pointX, pointY, 3)
+    assert np.isclose(squareTotals[0], filledValues[57:64, 37:44].sum())
+    assert squareCounts[0] == np.isfinite(rasterValues[57:64, 37:44]).sum()
+    annulusTotals, annulusCounts = integralImage.annulusSums(rasterIndex, pointX, pointY, 1, 3)
+    assert np.isclose(annulusTotals[0], filledValues[57:64, 37:44].sum() - filledValues[59:62, 39:42].sum())
+
+
+def test_integralImageMeansWithinEdgeBound(randomRaster):
+    rasterFile, rasterValues, originX, originY, cellSize = randomRaster
+    # monitors far enough inside the raster that every buffer is complete
+    randomState = np.random.RandomState(8)
+    pointX = randomState.uniform(originX + 1000.0, originX + 150 * cellSize - 1000.0, 25)
+    pointY = randomState.uniform(originY - 120 * cellSize + 1000.0, originY - 1000.0, 25)
+    circleTotals, circleCounts = integralImage.tiledCircleSums(rasterFile, pointX, pointY, RADII, 16)
+    integralMeans = circleTotals[:, 0, :] / circleCounts[:, 0, :]
+    coverageSums, coverageWeights = zonalStatistics.rasterBufferStatistics(rasterFile, pointX, pointY, RADII, 10)
+    coverageMeans = coverageSums[:, 0, :] / coverageWeights[:, 0, :]
+
+    # the two buffer definitions only disagree on cells within a cell diagonal of the buffer edge
+    valueRange = np.nanmax(rasterValues) - np.nanmin(rasterValues)
+    numRows, numCols = rasterValues.shape
+    cellX = originX + (np.arange(numCols) + 0.5) * cellSize
+    cellY = originY - (np.arange(numRows) + 0.5) * cellSize
+    for pointNum in range(len(pointX)):
+        distances = np.hypot(cellX[np.newaxis, :] - pointX[pointNum], cellY[:, np.newaxis] - pointY[pointNum])
+        for radiusNum in range(len(RADII)):
+            edgeCells = np.sum(np.abs(distances - RADII[radiusNum]) <= 1.5 * cellSize * np.sqrt(2))
+            bound = 2 * valueRange * edgeCells / min(circleCounts[pointNum, 0, radiusNum], coverageWeights[pointNum, 0, radiusNum])
+            assert abs(integralMeans[pointNum, radiusNum] - coverageMeans[pointNum, radiusNum]) <= bound
+    # for large buffers the edge share is small, so the means agree closely
+    assert np.max(np.abs(integralMeans[:, -1] - coverageMeans[:, -1])) < 0.05 * valueRange
+
+
+def test_persistedIndexesAreReused(randomRaster, monkeypatch):
+    rasterFile, rasterValues, originX, originY, cellSize = randomRaster
+    pointX, pointY = makeTestPoints(np.random.RandomState(13), 30)
+    expectedTotals, expectedCounts = integralImage.tiledCircleSums(rasterFile, pointX, pointY, RADII, 32)
+    integralImage.tiledCircleSums(rasterFile, pointX, pointY, RADII, 32, persist=True)
+    indexFolder = os.path.splitext(rasterFile)[0] + "_sat"
+    indexFiles = sorted(os.listdir(indexFolder))
+    assert len(indexFiles) > 1 and all([indexFile.endswith("_b0.npy") for indexFile in indexFiles])
+
+    # the saved indexes are memory-mapped instead of rebuilt
+    buildIntegralImage = integralImage.buildIntegralImage
+    monkeypatch.setattr(integralImage, 'buildIntegralImage', None)
+    circleTotals, circleCounts = integralImage.tiledCircleSums(rasterFile, pointX, pointY, RADII, 32, persist=True)
+    np.testing.assert_array_equal(circleTotals, expectedTotals)
+    np.testing.assert_array_equal(circleCounts, expectedCounts)
+
+    # indexes older than the raster are rebuilt
+    for indexFile in indexFiles:
+        os.utime(os.path.join(indexFolder, indexFile), (0, 0))
+    builtImages = []
+    monkeypatch.setattr(integralImage, 'buildIntegralImage', lambda rasterValues: builtImages.append(1) or buildIntegralImage(rasterValues))
+    circleTotals, circleCounts = integralImage.tiledCircleSums(rasterFile, pointX, pointY, RADII, 32, persist=True)
+    assert len(builtImages) == len(indexFiles)
+    np.testing.assert_array_equal(circleTotals, expectedTotals)
+    assert sorted(os.listdir(indexFolder)) == indexFiles
+
+
+def test_zonalStatisticsUsesIntegralImageForLargeBuffers(randomRaster, monkeypatch):
+    rasterFile, rasterValues, originX, originY, cellSize = randomRaster
+    pointX, pointY = makeTestPoints(np.random.RandomState(11), 20)
+    monkeypatch.setattr(values, 'USE_INTEGRAL_IMAGE', True)
+    monkeypatch.setattr(values, 'INTEGRAL_IMAGE_MIN_RADIUS', 400)
+    bufferSums, bufferWeights = zonalStatistics.rasterBufferStatistics(rasterFile, pointX, pointY, RADII, 10)
+    circleTotals, circleCounts = integralImage.tiledCircleSums(rasterFile, pointX, pointY, RADII[2:])
+    np.testing.assert_allclose(bufferSums[:, :, 2:], circleTotals)
+    np.testing.assert_array_equal(bufferWeights[:, :, 2:], circleCounts)
+
+################# end of functions ############################
+
+
+############### end of test_integralImage.py ###############
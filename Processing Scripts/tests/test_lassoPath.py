@@ -0,0 +1,208 @@
+################# test_lassoPath.py ##################
+#
+# Tests of the predictor pool setup in lassoPath_Canada_LUR.py (non predictor columns, suffixed column names and
+# protective variables), and of the lasso solver against a reference optimiser: the coordinate descent path,
+# warm starts, the fold moment cache and the cross-validated lambda1se.  The reference is bounded L-BFGS from
+# scipy if it is installed, and a projected gradient descent otherwise.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, numpy, pandas
+
+
+############## import required modules ###############
+import numpy as np
+import pandas as ps
+import pytest
+import lassoPath_Canada_LUR as lassoPath
+try:
+    from scipy.optimize import minimize
+except ImportError:
+    minimize = None
+############## end of module import ##################
+
+
+NUM_MONITORS = 90
+NUM_PREDICTORS = 8
+
+
+################# functions ##################################
+
+def writeModelData(tmpdir, dropCol=None):
+    numMonitors = 20
+    rawData = ps.DataFrame({col: np.arange(numMonitors, dtype=np.float64) for col in lassoPath.NON_PREDICTORS})
+    rawData['elevation'] = 100.0
+    rawData['meanNO2_2014_2016'] = np.linspace(5, 25, numMonitors)
+    for col in ["bR50m", "dR500m.1", "dR750m", "dR750m.1", "bL50m", "NDVI_14_16_50m", "water50m", "pr_14_16", "port_dist"]:
+        rawData[col] = np.arange(1, numMonitors + 1, dtype=np.float64)
+    if dropCol is not None:
+        rawData = rawData.drop(columns=[dropCol])
+    inputFile = str(tmpdir.join("modelData.csv"))
+    rawData.to_csv(inputFile, index=False)
+    return inputFile
+
+
+def test_predictorPoolColumns(tmpdir):
+    predictorPool, outcomeValues = lassoPath.loadPredictorPool(writeModelData(tmpdir))
+    assert sorted(predictorPool.columns) == sorted(["elevation", "bR50m", "dR500m", "dR750m", "bL50m", "NDVI_14_16_50m",
+                                                    "water50m", "pr_14_16", "port_dist"])
+    assert len(outcomeValues) == 20
+
+
+def test_missingNonPredictorFails(tmpdir):
+    with pytest.raises(Exception, match="NAPS ID"):
+        lassoPath.loadPredictorPool(writeModelData(tmpdir, dropCol="NAPS ID"))
+
+
+def test_flipProtectiveVariables(tmpdir):
+    predictorPool = lassoPath.loadPredictorPool(writeModelData(tmpdir))[0]
+    flipped = lassoPath.flipProtectiveVariables(predictorPool)
+    for col in ["bL50m", "NDVI_14_16_50m", "water50m", "pr_14_16"]:
+        assert (flipped[col] == -predictorPool[col]).all()
+    for col in ["bR50m", "dR500m", "port_dist", "elevation"]:
+        assert (flipped[col] == predictorPool[col]).all()
+    with pytest.raises(Exception, match="us"):
+        lassoPath.flipProtectiveVariables(predictorPool, lassoPath.PROTECTIVE_LABELS + ["us"])
+
+
+# simulate candidate predictors with correlated, constant and negatively associated columns
+# INPUTS:
+#    randomState (numpy RandomState) - random number generator
+# OUTPUTS:
+#    poolValues (float array) - predictors with shape (monitors, predictors)
+#    outcomeValues (float array) - outcome of each monitor
+def makeLassoData(randomState):
+    poolValues = randomState.normal(size=(NUM_MONITORS, NUM_PREDICTORS))
+    poolValues[:, 1] = poolValues[:, 0] + 0.3 * randomState.normal(size=NUM_MONITORS)
+    poolValues[:, 5] = 2.0
+    poolValues = poolValues * randomState.uniform(0.5, 20, NUM_PREDICTORS) + randomState.uniform(-5, 50, NUM_PREDICTORS)
+    outcomeValues = (10 + 0.5 * poolValues[:, 0] + 1.5 * poolValues[:, 2] - 0.8 * poolValues[:, 3] + 0.2 * poolValues[:, 4] +
+                     3 * randomState.normal(size=NUM_MONITORS))
+    return poolValues, outcomeValues
+### end of makeLassoData ###
+
+
+# solve the non-negative lasso on standardized predictors directly from the monitor data, with bounded L-BFGS
+# or, without scipy, projected gradient descent
+# INPUTS:
+#    poolValues (float array) - predictors with shape (monitors, predictors)
+#    outcomeValues (float array) - outcome of each monitor
+#    lam (float) - lambda
+# OUTPUTS:
+#    coefs (float array) - standardized coefficients, 0 for constant predictors
+def referenceLasso(poolValues, outcomeValues, lam):
+    scales = poolValues.std(axis=0)
+    keep = scales > 1e-9
+    scaledValues = (poolValues[:, keep] - poolValues[:, keep].mean(axis=0)) / scales[keep]
+    centredOutcome = outcomeValues - outcomeValues.mean()
+    coefs = np.zeros(poolValues.shape[1])
+    if minimize is not None:
+        def objective(beta):
+            residuals = centredOutcome - np.dot(scaledValues, beta)
+            return (0.5 * np.mean(residuals ** 2) + lam * beta.sum(),
+                    -np.dot(scaledValues.T, residuals) / len(residuals) + lam)
+        result = minimize(objective, np.zeros(keep.sum()), jac=True, method='L-BFGS-B', bounds=[(0, None)] * keep.sum(),
+                          options={'ftol': 1e-15, 'gtol': 1e-12, 'maxiter': 20000, 'maxcor': 30})
+        coefs[keep] = result.x
+        return coefs
+    gram = np.dot(scaledValues.T, scaledValues) / len(centredOutcome)
+    corr = np.dot(scaledValues.T, centredOutcome) / len(centredOutcome)
+    stepSize = 1.0 / np.linalg.eigvalsh(gram).max()
+    beta = np.zeros(keep.sum())
+    for iteration in range(200000):
+        updated = np.maximum(beta - stepSize * (np.dot(gram, beta) - corr + lam), 0)
+        if np.max(np.abs(updated - beta)) < 1e-13:
+            break
+        beta = updated
+    coefs[keep] = updated
+    return coefs
+### end of referenceLasso ###
+
+
+def test_pathMatchesReferenceOptimiser(monkeypatch):
+    poolValues, outcomeValues = makeLassoData(np.random.RandomState(3))
+    momentCache = lassoPath.buildMomentCache(poolValues, outcomeValues, lassoPath.makeFoldIds(NUM_MONITORS, 10, 1))
+    standardized = lassoPath.standardizeMoments(lassoPath.selectMoments(momentCache, np.arange(NUM_PREDICTORS)))
+    lambdas = lassoPath.makeLambdaPath(standardized['corr'])
+    defaultPath = lassoPath.coordinateDescentPath(standardized, lambdas)
+    monkeypatch.setattr(lassoPath, 'CD_TOLERANCE', 1e-16)
+    coefPath = lassoPath.coordinateDescentPath(standardized, lambdas)
+    assert not coefPath[0].any() and (coefPath[-1] > 0).sum() >= 3
+    for lambdaIndex in range(0, len(lambdas), 9):
+        reference = referenceLasso(poolValues, outcomeValues, lambdas[lambdaIndex])
+        np.testing.assert_allclose(coefPath[lambdaIndex], reference, atol=1e-6)
+        # the default tolerance stops within the glmnet threshold of the solution
+        np.testing.assert_allclose(defaultPath[lambdaIndex], reference, atol=1e-3)
+
+    # warm starts along the path give the same solutions as cold starts at each lambda
+    for lambdaIndex in [5, 40, 99]:
+        coldStart = lassoPath.coordinateDescentPath(standardized, lambdas[lambdaIndex:lambdaIndex + 1])[0]
+        np.testing.assert_allclose(coefPath[lambdaIndex], coldStart, atol=1e-9)
+
+    # coefficients on the original scale reproduce the standardized fit
+    coefficients, intercepts = lassoPath.unstandardizeCoefficients(coefPath, standardized)
+    scaledValues = (poolValues - standardized['means']) / standardized['scales']
+    np.testing.assert_allclose(np.dot(poolValues, coefficients[-1]) + intercepts[-1],
+                               outcomeValues.mean() + np.dot(scaledValues, coefPath[-1]), rtol=1e-10)
+
+
+def test_momentCacheMatchesTrainingRows():
+    poolValues, outcomeValues = makeLassoData(np.random.RandomState(5))
+    foldIds = lassoPath.makeFoldIds(NUM_MONITORS, 10, 2)
+    momentCache = lassoPath.buildMomentCache(poolValues, outcomeValues, foldIds)
+    colIndices = np.asarray([4, 0, 2, 5])
+    trainX = poolValues[foldIds != 3][:, colIndices]
+    trainY = outcomeValues[foldIds != 3]
+    moments = lassoPath.selectMoments(momentCache, colIndices, 3)
+    assert moments['count'] == len(trainY)
+    np.testing.assert_allclose(moments['XtX'], np.dot(trainX.T, trainX), rtol=1e-12)
+    np.testing.assert_allclose(moments['Xty'], np.dot(trainX.T, trainY), rtol=1e-12)
+    standardized = lassoPath.standardizeMoments(moments)
+    np.testing.assert_allclose(standardized['means'], trainX.mean(axis=0), rtol=1e-12)
+    np.testing.assert_allclose(standardized['scales'][0:3], trainX.std(axis=0)[0:3], rtol=1e-9)
+    assert list(standardized['constant']) == [False, False, False, True]
+
+
+def test_cvLassoMatchesReferenceRefits(monkeypatch):
+    monkeypatch.setattr(lassoPath, 'CD_TOLERANCE', 1e-16)
+    poolValues, outcomeValues = makeLassoData(np.random.RandomState(7))
+    foldIds = lassoPath.makeFoldIds(NUM_MONITORS, 5, 4)
+    momentCache = lassoPath.buildMomentCache(poolValues, outcomeValues, foldIds)
+    colIndices = np.asarray([0, 1, 2, 3, 5])
+    lassoFit = lassoPath.cvLasso(momentCache, poolValues, outcomeValues, colIndices)
+    lambdas = lassoFit['lambdas'][::3]
+
+    # refit every fold from its training rows with the reference optimiser
+    foldMse = np.zeros((5, len(lambdas)))
+    for fold in range(5):
+        trainX, trainY = poolValues[foldIds != fold][:, colIndices], outcomeValues[foldIds != fold]
+        testX, testY = poolValues[foldIds == fold][:, colIndices], outcomeValues[foldIds == fold]
+        scales = np.where(trainX.std(axis=0) > 1e-9, trainX.std(axis=0), 1.0)
+        for lambdaIndex in range(len(lambdas)):
+            coefficients = referenceLasso(trainX, trainY, lambdas[lambdaIndex]) / scales
+            predictions = trainY.mean() + np.dot(testX - trainX.mean(axis=0), coefficients)
+            foldMse[fold, lambdaIndex] = np.mean((testY - predictions) ** 2)
+    foldWeights = np.bincount(foldIds) / float(NUM_MONITORS)
+    cvm = np.dot(foldWeights, foldMse)
+    cvsd = np.sqrt(np.dot(foldWeights, (foldMse - cvm) ** 2) / 4)
+    np.testing.assert_allclose(lassoFit['cvm'][::3], cvm, rtol=1e-7)
+    np.testing.assert_allclose(lassoFit['cvsd'][::3], cvsd, rtol=1e-5)
+
+    # lambda1se is the largest lambda whose cv error is within one standard error of the minimum
+    cvm, cvsd = lassoFit['cvm'], lassoFit['cvsd']
+    minIndex = int(np.argmin(cvm))
+    assert lassoFit['lambdaMin'] == lassoFit['lambdas'][minIndex]
+    within = [lam for lam, error in zip(lassoFit['lambdas'], cvm) if error <= cvm[minIndex] + cvsd[minIndex]]
+    assert lassoFit['lambda1se'] == max(within)
+    assert lassoFit['lambda1se'] > lassoFit['lambdaMin']
+    oneSeIndex = list(lassoFit['lambdas']).index(lassoFit['lambda1se'])
+    scales = np.where(poolValues[:, colIndices].std(axis=0) > 1e-9, poolValues[:, colIndices].std(axis=0), 1.0)
+    np.testing.assert_allclose(lassoFit['coefficients'][oneSeIndex],
+                               referenceLasso(poolValues[:, colIndices], outcomeValues, lassoFit['lambda1se']) / scales,
+                               atol=1e-6)
+
+################# end of functions ############################
+
+
+############### end of test_lassoPath.py ###############
@@ -0,0 +1,76 @@
+################# test_mosaicCatalog.py ##################
+#
+# Tests of the persisted mosaic catalog in mosaicCatalog_Canada_LUR.py: zone lookups, rebuilding when the
+# folder changes, and writing the catalog through a unique temporary file.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, numpy, rasterio
+
+
+############## import required modules ###############
+import os
+import json
+import numpy as np
+import pytest
+import mosaicCatalog_Canada_LUR as mosaicCatalog
+import constantValues as values
+from conftest import writeTestRaster
+############## end of module import ##################
+
+
+################# functions ##################################
+
+@pytest.fixture
+def mosaicFolder(tmp_path, monkeypatch):
+    monkeypatch.setattr(values, 'INPUT_FOLDER', str(tmp_path) + "/")
+    monkeypatch.setattr(mosaicCatalog, 'CATALOG_CACHE', {})
+    os.makedirs(str(tmp_path / "N6"))
+    writeTestRaster(str(tmp_path / "N6" / "N6z1.tif"), np.ones((10, 10)), 0.0, 100.0, 10.0)
+    writeTestRaster(str(tmp_path / "N6" / "N6z2.tif"), np.ones((10, 10)), 100.0, 100.0, 10.0)
+    return "N6"
+
+
+def test_lookupAndPersist(mosaicFolder):
+    assert mosaicCatalog.lookupMosaicFile(mosaicFolder, 2, values.RASTER_TYPE) == "N6/N6z2.tif"
+    assert mosaicCatalog.lookupMosaicFile(mosaicFolder, 3, values.RASTER_TYPE) is None
+    catalogFile = mosaicCatalog.determineCatalogFile(mosaicFolder)
+    with open(catalogFile, 'r') as f:
+        catalog = json.load(f)
+    assert catalog['entries']['.tif']['1']['bounds'] == [0.0, 0.0, 100.0, 100.0]
+    # only the catalog is left next to the folder, no temporary files
+    assert sorted(os.listdir(values.INPUT_FOLDER)) == ["N6", "N6" + mosaicCatalog.CATALOG_EXTENSION]
+
+
+def test_rebuildWhenFolderChanges(mosaicFolder):
+    mosaicCatalog.loadCatalog(mosaicFolder)
+    writeTestRaster(values.INPUT_FOLDER + "N6/N6z3.tif", np.ones((10, 10)), 200.0, 100.0, 10.0)
+    os.utime(values.INPUT_FOLDER + "N6", (0, 0))
+    mosaicCatalog.CATALOG_CACHE.clear()
+    assert mosaicCatalog.lookupMosaicFile(mosaicFolder, 3, values.RASTER_TYPE) == "N6/N6z3.tif"
+
+
+def test_otherWritersAreNotDisturbed(mosaicFolder):
+    # a temporary file left by another process rebuilding the same catalog is not reused or removed
+    catalogFile = mosaicCatalog.determineCatalogFile(mosaicFolder)
+    with open(catalogFile + ".tmp", 'w') as f:
+        f.write("{")
+    mosaicCatalog.loadCatalog(mosaicFolder)
+    with open(catalogFile + ".tmp", 'r') as f:
+        assert f.read() == "{"
+    with open(catalogFile, 'r') as f:
+        assert json.load(f)['version'] == mosaicCatalog.CATALOG_VERSION
+
+    # a failed write leaves the existing catalog in place
+    with pytest.raises(TypeError):
+        mosaicCatalog.writeCatalog({'bad': object()}, catalogFile)
+    with open(catalogFile, 'r') as f:
+        assert json.load(f)['version'] == mosaicCatalog.CATALOG_VERSION
+    assert sorted(os.listdir(values.INPUT_FOLDER)) == ["N6", "N6" + mosaicCatalog.CATALOG_EXTENSION,
+                                                       "N6" + mosaicCatalog.CATALOG_EXTENSION + ".tmp"]
+
+################# end of functions ############################
+
+
+############### end of test_mosaicCatalog.py ###############
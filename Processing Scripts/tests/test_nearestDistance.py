@@ -0,0 +1,110 @@
+################# test_nearestDistance.py ##################
+#
+# Brute-force regression tests for the KD-tree nearest feature engine in nearestDistance_Canada_LUR.py.
+# Distances to the k nearest features and the features within a radius are compared with the distance from
+# every query point to every segment.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, numpy, scipy
+
+
+############## import required modules ###############
+import numpy as np
+import nearestDistance_Canada_LUR as nearestDistance
+############## end of module import ##################
+
+
+################# functions ##################################
+
+# create random polylines of a few segments each, long roads that need splitting, and point features stored as
+# zero length segments
+# INPUTS:
+#    randomState (numpy RandomState) - random number generator
+# OUTPUTS:
+#    segments (float array) - array with shape (number of segments, 4)
+#    featureIds (int array) - feature number of each segment
+def makeTestFeatures(randomState):
+    segmentList = []
+    idList = []
+    for featureNum in range(120):
+        numVertices = randomState.randint(2, 6)
+        stepLength = 20000.0 if featureNum < 10 else 800.0
+        vertices = np.cumsum(np.vstack((randomState.uniform(0, 50000, (1, 2)),
+                                        randomState.uniform(-stepLength, stepLength, (numVertices - 1, 2)))), axis=0)
+        segmentList.append(np.hstack((vertices[0:-1], vertices[1:])))
+        idList.append(np.full(numVertices - 1, featureNum))
+    points = randomState.uniform(0, 50000, (30, 2))
+    segmentList.append(np.hstack((points, points)))
+    idList.append(np.arange(120, 150))
+    return np.vstack(segmentList), np.concatenate(idList)
+### end of makeTestFeatures ###
+
+
+# distance from every query point to every feature
+# INPUTS:
+#    segments (float array) - array with shape (number of segments, 4)
+#    featureIds (int array) - feature number of each segment
+#    queryX, queryY (float arrays) - query point coordinates
+# OUTPUTS:
+#    featureDistances (float array) - distances with shape (query points, features)
+def bruteForceFeatureDistances(segments, featureIds, queryX, queryY):
+    deltaX = segments[:, 2] - segments[:, 0]
+    deltaY = segments[:, 3] - segments[:, 1]
+    squaredLength = np.maximum(deltaX ** 2 + deltaY ** 2, 1e-300)
+    along = ((queryX[:, np.newaxis] - segments[:, 0]) * deltaX + (queryY[:, np.newaxis] - segments[:, 1]) * deltaY) / squaredLength
+    along = np.clip(along, 0, 1)
+    segmentDistances = np.hypot(segments[:, 0] + along * deltaX - queryX[:, np.newaxis],
+                                segments[:, 1] + along * deltaY - queryY[:, np.newaxis])
+    featureDistances = np.full((len(queryX), featureIds.max() + 1), np.inf)
+    for featureNum in np.unique(featureIds):
+        featureDistances[:, featureNum] = segmentDistances[:, featureIds == featureNum].min(axis=1)
+    return featureDistances
+### end of bruteForceFeatureDistances ###
+
+
+def test_nearestFeaturesMatchBruteForce():
+    randomState = np.random.RandomState(17)
+    segments, featureIds = makeTestFeatures(randomState)
+    queryX = randomState.uniform(-10000, 60000, 400)
+    queryY = randomState.uniform(-10000, 60000, 400)
+    featureIndex = nearestDistance.buildFeatureIndex(segments, featureIds)
+    expected = np.sort(bruteForceFeatureDistances(segments, featureIds, queryX, queryY), axis=1)
+    np.testing.assert_allclose(nearestDistance.nearestDistances(featureIndex, queryX, queryY), expected[:, 0], rtol=1e-9, atol=1e-6)
+    distances, nearestIds = nearestDistance.nearestFeatures(featureIndex, queryX, queryY, 5)
+    np.testing.assert_allclose(distances, expected[:, 0:5], rtol=1e-9, atol=1e-6)
+    # every reported feature is a distinct feature at the reported distance
+    featureDistances = bruteForceFeatureDistances(segments, featureIds, queryX, queryY)
+    np.testing.assert_allclose(featureDistances[np.arange(len(queryX))[:, np.newaxis], nearestIds], distances, rtol=1e-9, atol=1e-6)
+    assert all([len(np.unique(row)) == 5 for row in nearestIds])
+
+
+def test_featuresWithinRadiusMatchBruteForce():
+    randomState = np.random.RandomState(19)
+    segments, featureIds = makeTestFeatures(randomState)
+    queryX = randomState.uniform(0, 50000, 200)
+    queryY = randomState.uniform(0, 50000, 200)
+    featureIndex = nearestDistance.buildFeatureIndex(segments, featureIds)
+    queryIds, nearIds, distances = nearestDistance.featuresWithinRadius(featureIndex, queryX, queryY, 3000.0)
+    featureDistances = bruteForceFeatureDistances(segments, featureIds, queryX, queryY)
+    expectedQueries, expectedFeatures = np.nonzero(featureDistances <= 3000.0)
+    assert sorted(zip(queryIds, nearIds)) == sorted(zip(expectedQueries, expectedFeatures))
+    np.testing.assert_allclose(distances, featureDistances[queryIds, nearIds], rtol=1e-9, atol=1e-6)
+    # pairs are sorted by query point and then by distance
+    assert np.all(np.diff(queryIds) >= 0)
+    sameQuery = np.diff(queryIds) == 0
+    assert np.all(np.diff(distances)[sameQuery] >= 0)
+
+
+def test_fewerFeaturesThanRequested():
+    segments = np.asarray([[0.0, 0.0, 10.0, 0.0], [0.0, 5.0, 10.0, 5.0]])
+    featureIndex = nearestDistance.buildFeatureIndex(segments, np.asarray([0, 1]))
+    distances, nearestIds = nearestDistance.nearestFeatures(featureIndex, np.asarray([5.0]), np.asarray([-1.0]), 3)
+    np.testing.assert_allclose(distances[0, 0:2], [1.0, 6.0])
+    assert np.isinf(distances[0, 2]) and nearestIds[0, 2] == -1
+
+################# end of functions ############################
+
+
+############### end of test_nearestDistance.py ###############
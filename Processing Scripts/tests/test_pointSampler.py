@@ -0,0 +1,95 @@
+################# test_pointSampler.py ##################
+#
+# Tests of the point sampler in pointSampler_Canada_LUR.py: nearest and bilinear samples are compared with the
+# raster array, block reads of tiled rasters with untiled reads, and zone mosaics of a POINT_MOSAIC_LIST folder
+# must all be written to the folder's variable.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, numpy, rasterio
+
+
+############## import required modules ###############
+import os
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+import constantValues as values
+import pointSampler_Canada_LUR as pointSampler
+from conftest import writeTestRaster
+############## end of module import ##################
+
+
+################# functions ##################################
+
+# random monitor locations inside a raster, plus one monitor outside it
+def randomMonitors(originX, originY, cellSize, numRows, numCols, numMonitors=200):
+    randomState = np.random.RandomState(17)
+    monitorX = originX + randomState.uniform(0, numCols * cellSize, numMonitors)
+    monitorY = originY - randomState.uniform(0, numRows * cellSize, numMonitors)
+    return np.append(monitorX, originX - 10 * cellSize), np.append(monitorY, originY)
+
+
+def test_nearestSamplesMatchRaster(randomRaster):
+    rasterFile, rasterValues, originX, originY, cellSize = randomRaster
+    monitorX, monitorY = randomMonitors(originX, originY, cellSize, *rasterValues.shape)
+    with rasterio.open(rasterFile) as dataset:
+        pointValues = pointSampler.sampleRaster(dataset, monitorX, monitorY, pointSampler.NEAREST_SAMPLING, {})
+    cols = np.floor((monitorX[:-1] - originX) / cellSize).astype(np.int64)
+    rows = np.floor((originY - monitorY[:-1]) / cellSize).astype(np.int64)
+    np.testing.assert_array_equal(pointValues[:-1], rasterValues[rows, cols])
+    assert np.isnan(pointValues[-1])
+
+
+def test_tiledBlockReadsMatchStripReads(randomRaster, tmp_path):
+    rasterFile, rasterValues, originX, originY, cellSize = randomRaster
+    tiledFile = str(tmp_path / "tiled.tif")
+    with rasterio.open(tiledFile, 'w', driver='GTiff', height=rasterValues.shape[0], width=rasterValues.shape[1],
+                       count=1, dtype='float64', transform=from_origin(originX, originY, cellSize, cellSize),
+                       nodata=-9999, tiled=True, blockxsize=16, blockysize=16) as dataset:
+        dataset.write(np.where(np.isnan(rasterValues), -9999, rasterValues), 1)
+    monitorX, monitorY = randomMonitors(originX, originY, cellSize, *rasterValues.shape)
+    for method in [pointSampler.NEAREST_SAMPLING, pointSampler.BILINEAR_SAMPLING]:
+        with rasterio.open(rasterFile) as dataset:
+            stripValues = pointSampler.sampleRaster(dataset, monitorX, monitorY, method, {})
+        with rasterio.open(tiledFile) as dataset:
+            tiledValues = pointSampler.sampleRaster(dataset, monitorX, monitorY, method, {})
+        np.testing.assert_array_equal(tiledValues, stripValues)
+
+
+def test_bilinearSamplesOfAPlane(tmp_path):
+    # bilinear interpolation reproduces a plane exactly between cell centres
+    cellSize = 10.0
+    rows, cols = np.mgrid[0:40, 0:50]
+    planeValues = 3.0 + 0.5 * cols - 0.25 * rows
+    rasterFile = str(tmp_path / "plane.tif")
+    writeTestRaster(rasterFile, planeValues, 0.0, 400.0, cellSize)
+    randomState = np.random.RandomState(2)
+    monitorX = randomState.uniform(cellSize, 49 * cellSize, 100)
+    monitorY = 400.0 - randomState.uniform(cellSize, 39 * cellSize, 100)
+    with rasterio.open(rasterFile) as dataset:
+        pointValues = pointSampler.sampleRaster(dataset, monitorX, monitorY, pointSampler.BILINEAR_SAMPLING, {})
+    expected = 3.0 + 0.5 * (monitorX / cellSize - 0.5) - 0.25 * ((400.0 - monitorY) / cellSize - 0.5)
+    np.testing.assert_allclose(pointValues, expected, rtol=1e-12)
+
+
+def test_zoneMosaicsShareTheFolderVariable(tmp_path, monkeypatch):
+    inputFolder = str(tmp_path) + "/"
+    os.makedirs(inputFolder + "satMosaic")
+    writeTestRaster(inputFolder + "satMosaic/satz3.tif", np.full((10, 10), 3.0), 0.0, 100.0, 10.0)
+    writeTestRaster(inputFolder + "satMosaic/satz4.tif", np.full((10, 10), 4.0), 100.0, 100.0, 10.0)
+    monkeypatch.setattr(values, 'INPUT_FOLDER', inputFolder)
+    monkeypatch.setattr(values, 'POINT_MOSAIC_LIST', ["satMosaic"])
+    assert pointSampler.determinePointIdentifier("satMosaic/satz3.tif") == "satMosaic"
+    assert pointSampler.determinePointIdentifier("satMosaic/") == "satMosaic"
+    assert pointSampler.determinePointIdentifier("sat_10_12.tif") == "sat_10_12"
+    for mosaicFile, expected in [("satMosaic/satz3.tif", 3.0), ("satMosaic/satz4.tif", 4.0)]:
+        results = pointSampler.samplePointVariables(np.asarray([50.0, 150.0]), np.asarray([50.0, 50.0]), [mosaicFile])
+        assert list(results.keys()) == ["satMosaic"]
+        assert expected in results["satMosaic"]
+
+################# end of functions ############################
+
+
+############### end of test_pointSampler.py ###############
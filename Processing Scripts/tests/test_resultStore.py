@@ -0,0 +1,59 @@
+################# test_resultStore.py ##################
+#
+# Tests of the append-only Parquet result store in resultStore_Canada_LUR.py: latest part wins (including
+# missing values), compaction, and air monitors that share a NAPS ID.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, numpy, pandas, pyarrow
+
+
+############## import required modules ###############
+import os
+import numpy as np
+import pytest
+pytest.importorskip("pyarrow")
+import resultStore_Canada_LUR as resultStore
+import constantValues as values
+############## end of module import ##################
+
+
+################# functions ##################################
+
+def test_latestPartIsKept(tmp_path):
+    storeFolder = str(tmp_path / "parts")
+    storeFile = str(tmp_path / "results.parquet")
+    resultStore.appendResults([10, 20], {'N6500m': [1.0, 2.0], 'bR50m': [5.0, 6.0]}, storeFolder)
+    resultStore.appendResults([20, 30], {'N6500m': [np.nan, 3.0]}, storeFolder)
+    resultTable = resultStore.compactResultStore(storeFile, storeFolder)
+    assert list(resultTable[values.NAPS_ID]) == [10, 20, 30]
+    assert list(resultTable.columns) == [values.NAPS_ID, 'N6500m', 'bR50m']
+    # the latest value replaces the earlier one even when it is missing
+    np.testing.assert_array_equal(resultTable['N6500m'].values, [1.0, np.nan, 3.0])
+    np.testing.assert_array_equal(resultTable['bR50m'].values, [5.0, 6.0, np.nan])
+    assert resultStore.listParts(storeFolder) == []
+    assert not os.path.exists(storeFile + resultStore.TEMP_EXTENSION)
+
+
+def test_compactedTableIsOlderThanParts(tmp_path):
+    storeFolder = str(tmp_path / "parts")
+    storeFile = str(tmp_path / "results.parquet")
+    resultStore.appendResults([10], {'N6500m': [1.0]}, storeFolder)
+    resultStore.compactResultStore(storeFile, storeFolder)
+    resultStore.appendResults([10], {'N6500m': [4.0]}, storeFolder)
+    assert resultStore.readResultStore(storeFile, storeFolder)['N6500m'].tolist() == [4.0]
+    assert resultStore.compactResultStore(storeFile, storeFolder)['N6500m'].tolist() == [4.0]
+
+
+def test_duplicateNapsIdsWarn(tmp_path, capsys):
+    storeFolder = str(tmp_path / "parts")
+    resultStore.appendResults([10, 10, 20], {'N6500m': [1.0, 2.0, 3.0]}, storeFolder)
+    assert "duplicate NAPS IDs 10" in capsys.readouterr().out
+    resultTable = resultStore.readResultStore(str(tmp_path / "results.parquet"), storeFolder)
+    assert resultTable['N6500m'].tolist() == [2.0, 3.0]
+
+################# end of functions ############################
+
+
+############### end of test_resultStore.py ###############
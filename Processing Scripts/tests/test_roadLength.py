@@ -0,0 +1,99 @@
+################# test_roadLength.py ##################
+#
+# Regression tests for the segment dissolve of roadLength_Canada_LUR.py.  Overlapping segments that are
+# collinear within the xy tolerance must be counted once, including lines that fall on either side of a
+# rounding boundary of their offset or direction and lines whose directions are just below 180 and just above
+# 0 degrees.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, numpy, pandas, fiona
+
+
+############## import required modules ###############
+import numpy as np
+import roadLength_Canada_LUR as roadLength
+############## end of module import ##################
+
+
+TOLERANCE = 0.001
+
+
+################# functions ##################################
+
+# total length of a set of segments
+# INPUTS:
+#    segments (float array) - array with shape (number of segments, 4)
+# OUTPUTS:
+#    totalLength (float) - sum of the segment lengths
+def totalLength(segments):
+    return np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1]).sum()
+### end of totalLength ###
+
+
+def test_overlapAcrossOffsetBoundary():
+    # offsets of 0.49 and 0.51 tolerances rounded to different keys with the previous rounding
+    segments = np.asarray([[0.0, 0.00049, 100.0, 0.00049],
+                           [50.0, 0.00051, 150.0, 0.00051]])
+    assert np.isclose(totalLength(roadLength.dissolveSegments(segments, TOLERANCE)), 150.0, atol=1e-6)
+
+
+def test_overlapAcrossAngleWrap():
+    # the second segment points just below 180 degrees, the first at 0 degrees
+    segments = np.asarray([[0.0, 0.0, 100.0, 0.0],
+                           [150.0, 0.0, 50.0, 1e-7]])
+    assert np.isclose(totalLength(roadLength.dissolveSegments(segments, TOLERANCE)), 150.0, atol=1e-6)
+    segments = np.asarray([[0.0, 0.0, 100.0, -1e-7],
+                           [150.0, 0.0, 50.0, 1e-7]])
+    assert np.isclose(totalLength(roadLength.dissolveSegments(segments, TOLERANCE)), 150.0, atol=1e-6)
+
+
+def test_overlapAcrossAngleBoundary():
+    # directions either side of a rounding boundary of the previous angle key, which scaled the direction by the
+    # longest segment (600m) over the tolerance
+    angleStep = TOLERANCE / 600.0
+    boundaryAngle = (np.round(0.7 / angleStep) + 0.5) * angleStep
+    segmentList = []
+    for angle, start in [(boundaryAngle - 0.01 * angleStep, 0.0), (boundaryAngle + 0.01 * angleStep, 400.0)]:
+        segmentList.append([start * np.cos(angle), start * np.sin(angle), (start + 600.0) * np.cos(angle), (start + 600.0) * np.sin(angle)])
+    segments = np.asarray(segmentList)
+    assert np.isclose(totalLength(roadLength.dissolveSegments(segments, TOLERANCE)), 1000.0, atol=1e-6)
+
+
+def test_randomNearCollinearSegments():
+    # pieces of a few long lines, each shifted off its line by less than the tolerance and drawn in either
+    # direction, must dissolve to the union of their intervals
+    randomState = np.random.RandomState(21)
+    expectedLength = 0.0
+    segmentList = []
+    for lineNum in range(20):
+        angle = [0.0, np.pi / 2, np.pi - 1e-9, randomState.uniform(0, np.pi)][lineNum % 4]
+        offset = randomState.uniform(-5000, 5000)
+        starts = np.round(randomState.uniform(0, 2000, 15), 1)
+        ends = starts + np.round(randomState.uniform(10, 300, 15), 1)
+        covered = np.zeros(23000, dtype=bool)
+        for start, end in zip(starts, ends):
+            covered[int(round(start * 10)):int(round(end * 10))] = True
+        expectedLength += covered.sum() / 10.0
+        for start, end in zip(starts, ends):
+            shiftedOffset = offset + randomState.uniform(-0.4, 0.4) * TOLERANCE
+            x0 = start * np.cos(angle) - shiftedOffset * np.sin(angle)
+            y0 = start * np.sin(angle) + shiftedOffset * np.cos(angle)
+            x1 = end * np.cos(angle) - shiftedOffset * np.sin(angle)
+            y1 = end * np.sin(angle) + shiftedOffset * np.cos(angle)
+            segmentList.append([x0, y0, x1, y1] if randomState.uniform() < 0.5 else [x1, y1, x0, y0])
+    segments = np.asarray(segmentList)
+    assert abs(totalLength(roadLength.dissolveSegments(segments, TOLERANCE)) - expectedLength) < 1e-3
+
+
+def test_parallelLinesAreKept():
+    segments = np.asarray([[0.0, 0.0, 100.0, 0.0],
+                           [0.0, 1.0, 100.0, 1.0],
+                           [0.0, 0.0, 0.0, 100.0]])
+    assert np.isclose(totalLength(roadLength.dissolveSegments(segments, TOLERANCE)), 300.0)
+
+################# end of functions ############################
+
+
+############### end of test_roadLength.py ###############
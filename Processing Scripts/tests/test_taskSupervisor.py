@@ -0,0 +1,122 @@
+################# test_taskSupervisor.py ##################
+#
+# Regression tests for taskSupervisor_Canada_LUR.py.  A worker that sends its result and exits between the
+# result poll and the liveness check must not be reported as crashed, and a worker that really crashes must be
+# retried and then reported as failed.  Workers are kept between tasks, and only a worker that crashes or times
+# out is replaced.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest
+
+
+############## import required modules ###############
+import os
+import time
+import multiprocessing
+import taskSupervisor_Canada_LUR as taskSupervisor
+############## end of module import ##################
+
+
+################# functions ##################################
+
+# task functions run on worker processes
+def squareTask(task):
+    return task * task
+
+
+def crashTask(task):
+    os._exit(3)
+
+
+def processTask(task):
+    if task == "crash":
+        os._exit(3)
+    if task == "hang":
+        time.sleep(60)
+    return os.getpid()
+
+
+# stand-in for a worker process that has already exited
+class ExitedProcess(object):
+    exitcode = 0
+
+    def is_alive(self):
+        return False
+
+    def join(self):
+        return None
+
+
+# stand-in for the receiving end of a task pipe whose result arrives just after the first poll
+class LateConnection(object):
+    def __init__(self, result):
+        self.receiveEnd, self.sendEnd = multiprocessing.Pipe(duplex=False)
+        self.result = result
+        self.numPolls = 0
+
+    def poll(self):
+        self.numPolls += 1
+        if self.numPolls == 1:
+            self.sendEnd.send((None, self.result))
+            return False
+        return self.receiveEnd.poll()
+
+    def recv(self):
+        return self.receiveEnd.recv()
+
+    def close(self):
+        self.receiveEnd.close()
+        self.sendEnd.close()
+
+
+def test_resultSentJustBeforeExitIsCollected():
+    supervisor = taskSupervisor.createSupervisor(squareTask, 1, 60, 0)
+    entry = {'taskId': 0, 'task': 7, 'attempt': 0, 'notBefore': 0, 'startTime': time.time()}
+    supervisor['workers'].append({'process': ExitedProcess(), 'connection': LateConnection(49), 'entry': entry})
+    supervisor['nextId'] = 1
+    assert taskSupervisor.collectResult(supervisor) == (0, None, 49)
+
+
+def test_supervisedTasksReturnInOrder():
+    results, failures = taskSupervisor.runSupervisedTasks(squareTask, list(range(12)), 4)
+    assert failures == {}
+    assert results == [task * task for task in range(12)]
+
+
+def test_crashedTaskIsRetriedThenReported(monkeypatch):
+    monkeypatch.setattr(taskSupervisor.values, 'RETRY_BACKOFF_SECONDS', 0)
+    supervisor = taskSupervisor.createSupervisor(crashTask, 1, 60, 1)
+    taskSupervisor.submitTask(supervisor, 0)
+    taskId, error, result = taskSupervisor.collectResult(supervisor)
+    assert taskId == 0 and result is None and error is not None
+    taskSupervisor.closeSupervisor(supervisor)
+
+
+def test_workersAreKeptBetweenTasks():
+    results, failures = taskSupervisor.runSupervisedTasks(processTask, list(range(20)), 2)
+    assert failures == {}
+    assert len(set(results)) <= 2
+
+
+def test_onlyFailedWorkersAreReplaced(monkeypatch):
+    monkeypatch.setattr(taskSupervisor.values, 'RETRY_BACKOFF_SECONDS', 0)
+    supervisor = taskSupervisor.createSupervisor(processTask, 2, 2, 0)
+    for task in ["hang", "crash"] + list(range(10)):
+        taskSupervisor.submitTask(supervisor, task)
+    try:
+        collected = dict([(taskId, (error, result)) for taskId, error, result in
+                          [taskSupervisor.collectResult(supervisor) for taskNum in range(12)]])
+    finally:
+        taskSupervisor.closeSupervisor(supervisor)
+    assert "timed out" in collected[0][0]
+    assert "exited" in collected[1][0]
+    assert all([collected[taskId][0] is None for taskId in range(2, 12)])
+    # the worker left after the crash ran the remaining tasks until the hung worker was replaced
+    assert len(set([collected[taskId][1] for taskId in range(2, 12)])) <= 3
+
+################# end of functions ############################
+
+
+############### end of test_taskSupervisor.py ###############
@@ -0,0 +1,80 @@
+################# test_tilePlanner.py ##################
+#
+# Tests of the download plan in tilePlanner_Canada_LUR.py: an isolated station is a single request of about
+# the size of its window, clustered stations share their requests, and every station window is covered by
+# non-overlapping request rectangles.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, numpy
+
+
+############## import required modules ###############
+import numpy as np
+import tilePlanner_Canada_LUR as tilePlanner
+############## end of module import ##################
+
+
+PADDING = 0.51
+
+
+################# functions ##################################
+
+def rectangleArea(bounds):
+    return (bounds[2] - bounds[0]) * (bounds[3] - bounds[1])
+
+
+# check that the rectangles of each station cover its window and that no two rectangles overlap
+def checkCoverage(stations, tilePlan):
+    tiles = tilePlan['tiles']
+    tileNames = sorted(tiles.keys())
+    for firstIndex in range(len(tileNames)):
+        for secondIndex in range(firstIndex + 1, len(tileNames)):
+            first, second = tiles[tileNames[firstIndex]], tiles[tileNames[secondIndex]]
+            overlapWidth = min(first[2], second[2]) - max(first[0], second[0])
+            overlapHeight = min(first[3], second[3]) - max(first[1], second[1])
+            assert overlapWidth <= 1e-9 or overlapHeight <= 1e-9
+    for station in stations:
+        window = (station['longit'] - PADDING, station['lat'] - PADDING, station['longit'] + PADDING, station['lat'] + PADDING)
+        coveredArea = 0.0
+        for tileName in tilePlan['stationTiles'][station['randID']]:
+            bounds = tiles[tileName]
+            coveredArea += (max(0.0, min(bounds[2], window[2]) - max(bounds[0], window[0])) *
+                            max(0.0, min(bounds[3], window[3]) - max(bounds[1], window[1])))
+        assert abs(coveredArea - rectangleArea(window)) < 1e-9
+
+
+def test_isolatedStationIsOneRequest():
+    for lat, longit in [(43.65, -79.38), (49.0, -123.0), (45.5012, -73.5673)]:
+        stations = [{'randID': 0, 'lat': lat, 'longit': longit}]
+        tilePlan = tilePlanner.planTiles(stations, PADDING)
+        assert len(tilePlan['tiles']) == 1
+        requestArea = rectangleArea(list(tilePlan['tiles'].values())[0])
+        assert requestArea <= 1.2 * (2 * PADDING) ** 2
+        checkCoverage(stations, tilePlan)
+
+
+def test_clusteredStationsShareRequests():
+    randomState = np.random.RandomState(5)
+    stations = [{'randID': stationIndex, 'lat': 43.7 + randomState.uniform(-0.4, 0.4),
+                 'longit': -79.4 + randomState.uniform(-0.6, 0.6)} for stationIndex in range(40)]
+    stations.append({'randID': 40, 'lat': 53.5, 'longit': -113.5})
+    tilePlan = tilePlanner.planTiles(stations, PADDING)
+    checkCoverage(stations, tilePlan)
+    # the cluster is downloaded as its union, at most its padded bounding box plus a grid cell on every side
+    cellSize = tilePlanner.TILE_SIZE_DEGREES
+    clusterLat = [station['lat'] for station in stations[0:40]]
+    clusterLongit = [station['longit'] for station in stations[0:40]]
+    clusterArea = ((max(clusterLongit) - min(clusterLongit) + 2 * PADDING + 2 * cellSize) *
+                   (max(clusterLat) - min(clusterLat) + 2 * PADDING + 2 * cellSize))
+    requestArea = sum([rectangleArea(bounds) for bounds in tilePlan['tiles'].values()])
+    assert requestArea <= clusterArea + 1.2 * (2 * PADDING) ** 2
+    assert len(tilePlan['tiles']) < 20
+    maxSide = max([max(bounds[2] - bounds[0], bounds[3] - bounds[1]) for bounds in tilePlan['tiles'].values()])
+    assert maxSide <= 2 * PADDING + 2 * tilePlanner.TILE_SIZE_DEGREES + 1e-9
+
+################# end of functions ############################
+
+
+############### end of test_tilePlanner.py ###############
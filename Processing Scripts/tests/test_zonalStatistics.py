@@ -0,0 +1,85 @@
+################# test_zonalStatistics.py ##################
+#
+# Brute-force regression tests for the NumPy zonal statistics backend in zonalStatistics_Canada_LUR.py.  Buffer
+# sums and weights are compared with the sub-cell coverage of every cell of the raster, and buffer means with
+# the coverage weighted mean of the valid cells.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, numpy, rasterio
+
+
+############## import required modules ###############
+import numpy as np
+import constantValues as values
+import zonalStatistics_Canada_LUR as zonalStatistics
+############## end of module import ##################
+
+
+RADII = np.asarray([50.0, 100.0, 250.0, 500.0, 1000.0])
+SUB_SAMPLES = 6
+
+
+################# functions ##################################
+
+# sum raster values within circles using the sub-cell coverage of every cell of the raster
+# INPUTS:
+#    rasterValues (float array) - raster values, NoData cells are NaN
+#    originX, originY, cellSize (float) - upper left corner and cell size of the raster
+#    pointX, pointY (float arrays) - point coordinates
+#    radii (float array) - circle radii
+#    subSamples (int) - number of sub-cells along each side of a cell
+# OUTPUTS:
+#    sums, weights (float arrays) - coverage weighted sums and valid cell weights, shape (points, radii)
+def bruteForceCoverageSums(rasterValues, originX, originY, cellSize, pointX, pointY, radii, subSamples):
+    numRows, numCols = rasterValues.shape
+    subOffsets = ((np.arange(subSamples) + 0.5) / subSamples - 0.5) * cellSize
+    subX = (originX + (np.arange(numCols) + 0.5) * cellSize)[:, np.newaxis] + subOffsets[np.newaxis, :]
+    subY = (originY - (np.arange(numRows) + 0.5) * cellSize)[:, np.newaxis] + subOffsets[np.newaxis, :]
+    validCells = np.isfinite(rasterValues)
+    filledValues = np.where(validCells, rasterValues, 0)
+    sums = np.zeros((len(pointX), len(radii)))
+    weights = np.zeros((len(pointX), len(radii)))
+    for pointNum in range(len(pointX)):
+        # squared distance of every sub-cell centre, with shape (rows, sub rows, columns, sub columns)
+        distanceX = (subX - pointX[pointNum]) ** 2
+        distanceY = (subY - pointY[pointNum]) ** 2
+        squaredDistance = distanceY[:, :, np.newaxis, np.newaxis] + distanceX[np.newaxis, np.newaxis, :, :]
+        for radiusNum in range(len(radii)):
+            coverage = (squaredDistance <= radii[radiusNum] ** 2).mean(axis=(1, 3))
+            sums[pointNum, radiusNum] = np.sum(coverage * filledValues)
+            weights[pointNum, radiusNum] = np.sum(coverage * validCells)
+    return sums, weights
+### end of bruteForceCoverageSums ###
+
+
+def test_bufferStatisticsMatchBruteForce(randomRaster, monkeypatch):
+    rasterFile, rasterValues, originX, originY, cellSize = randomRaster
+    monkeypatch.setattr(values, 'USE_INTEGRAL_IMAGE', False)
+    randomState = np.random.RandomState(13)
+    # monitors inside the raster, near its edges and outside it
+    pointX = randomState.uniform(originX - 400.0, originX + 150 * cellSize + 400.0, 30)
+    pointY = randomState.uniform(originY - 120 * cellSize - 400.0, originY + 400.0, 30)
+    expectedSums, expectedWeights = bruteForceCoverageSums(rasterValues, originX, originY, cellSize, pointX, pointY, RADII, SUB_SAMPLES)
+    bufferSums, bufferWeights = zonalStatistics.rasterBufferStatistics(rasterFile, pointX, pointY, RADII, SUB_SAMPLES)
+    np.testing.assert_allclose(bufferSums[:, 0, :], expectedSums, rtol=1e-9, atol=1e-6)
+    np.testing.assert_allclose(bufferWeights[:, 0, :], expectedWeights, rtol=1e-9, atol=1e-9)
+
+
+def test_bufferTableMeans(randomRaster, monkeypatch):
+    rasterFile, rasterValues, originX, originY, cellSize = randomRaster
+    monkeypatch.setattr(values, 'USE_INTEGRAL_IMAGE', False)
+    pointX = np.asarray([originX + 70.3 * cellSize, originX - 5000.0])
+    pointY = np.asarray([originY - 55.8 * cellSize, originY + 5000.0])
+    expectedSums, expectedWeights = bruteForceCoverageSums(rasterValues, originX, originY, cellSize, pointX, pointY, RADII,
+                                                           values.COVERAGE_SUBSAMPLES)
+    bufferMeans = zonalStatistics.rasterBufferMeans(rasterFile, pointX, pointY, RADII)
+    np.testing.assert_allclose(bufferMeans[0], expectedSums[0] / expectedWeights[0], rtol=1e-9)
+    # a monitor whose buffers contain no valid cells has no mean
+    assert np.all(np.isnan(bufferMeans[1]))
+
+################# end of functions ############################
+
+
+############### end of test_zonalStatistics.py ###############
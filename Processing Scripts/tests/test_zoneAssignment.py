@@ -0,0 +1,158 @@
+################# test_zoneAssignment.py ##################
+#
+# Brute-force regression tests for the polygon grid index in zoneAssignment_Canada_LUR.py.  Points are located
+# with an even-odd ray test against every polygon edge, including points on grid lines, polygon edges through
+# grid corners, overlapping polygons and points outside all polygons, which are assigned to the closest polygon.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pytest, numpy, scipy
+
+
+############## import required modules ###############
+import numpy as np
+import pytest
+import zoneAssignment_Canada_LUR as zoneAssignment
+############## end of module import ##################
+
+
+BLOCK_SIZE = 1000.0
+
+
+################# functions ##################################
+
+# create non-overlapping star shaped polygons, one within each block of a grid of blocks
+# INPUTS:
+#    randomState (numpy RandomState) - random number generator
+#    numBlocks (int) - number of blocks along each side of the grid
+# OUTPUTS:
+#    edges (float array) - polygon edges with shape (number of edges, 4)
+#    featureIds (int array) - polygon number of each edge
+def makeTestPolygons(randomState, numBlocks):
+    edgeList = []
+    idList = []
+    for polygonNum in range(numBlocks * numBlocks):
+        centreX = (polygonNum % numBlocks + 0.5) * BLOCK_SIZE
+        centreY = (polygonNum // numBlocks + 0.5) * BLOCK_SIZE
+        numVertices = randomState.randint(3, 12)
+        angles = np.sort(randomState.uniform(0, 2 * np.pi, numVertices))
+        radii = randomState.uniform(0.1, 0.49, numVertices) * BLOCK_SIZE
+        vertices = np.column_stack((centreX + radii * np.cos(angles), centreY + radii * np.sin(angles)))
+        edgeList.append(np.hstack((vertices, np.roll(vertices, -1, axis=0))))
+        idList.append(np.full(numVertices, polygonNum))
+    return np.vstack(edgeList), np.concatenate(idList)
+### end of makeTestPolygons ###
+
+
+# locate points with an even-odd ray test against every edge of every polygon
+# INPUTS:
+#    edges (float array) - polygon edges with shape (number of edges, 4)
+#    featureIds (int array) - polygon number of each edge
+#    pointX, pointY (float arrays) - point coordinates
+# OUTPUTS:
+#    pointPolygons (int array) - first polygon containing each point, -1 outside all polygons
+def bruteForceLocate(edges, featureIds, pointX, pointY):
+    pointPolygons = np.full(len(pointX), -1, dtype=np.int64)
+    straddles = (edges[:, 1] > pointY[:, np.newaxis]) != (edges[:, 3] > pointY[:, np.newaxis])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crossX = edges[:, 0] + (pointY[:, np.newaxis] - edges[:, 1]) * (edges[:, 2] - edges[:, 0]) / (edges[:, 3] - edges[:, 1])
+    crossings = straddles & (crossX > pointX[:, np.newaxis])
+    for polygonNum in np.unique(featureIds)[::-1]:
+        inside = np.sum(crossings[:, featureIds == polygonNum], axis=1) % 2 == 1
+        pointPolygons[inside] = polygonNum
+    return pointPolygons
+### end of bruteForceLocate ###
+
+
+@pytest.mark.parametrize('cellSize', [150.0, 400.0, 1000.0, 3000.0])
+def test_locatePointsMatchesBruteForce(cellSize):
+    randomState = np.random.RandomState(23)
+    edges, featureIds = makeTestPolygons(randomState, 6)
+    zoneIndex = zoneAssignment.buildZoneIndex(edges, featureIds, np.arange(36) + 100, cellSize)
+    pointX = randomState.uniform(-500, 6500, 5000)
+    pointY = randomState.uniform(-500, 6500, 5000)
+    # points on the grid lines of the index
+    pointX[0:500] = zoneIndex['originX'] + randomState.randint(0, zoneIndex['numCols'], 500) * cellSize
+    pointY[500:1000] = zoneIndex['originY'] + randomState.randint(0, zoneIndex['numRows'], 500) * cellSize
+    expected = bruteForceLocate(edges, featureIds, pointX, pointY)
+    np.testing.assert_array_equal(zoneAssignment.locatePoints(zoneIndex, pointX, pointY, useClosest=False), expected)
+
+
+# draw points within a rectangle, with some on the grid lines and grid corners of a zone index
+# INPUTS:
+#    randomState (numpy RandomState) - random number generator
+#    zoneIndex (dict) - index returned by zoneAssignment.buildZoneIndex
+#    bounds (float list) - west, south, east and north limits of the points
+#    numPoints (int) - number of points
+# OUTPUTS:
+#    pointX, pointY (float arrays) - point coordinates
+def makeGridPoints(randomState, zoneIndex, bounds, numPoints):
+    pointX = randomState.uniform(bounds[0], bounds[2], numPoints)
+    pointY = randomState.uniform(bounds[1], bounds[3], numPoints)
+    cellSize = zoneIndex['cellSize']
+    gridCols = randomState.randint(0, zoneIndex['numCols'], numPoints // 5)
+    gridRows = randomState.randint(0, zoneIndex['numRows'], numPoints // 5)
+    pointX[0:numPoints // 5] = zoneIndex['originX'] + gridCols * cellSize
+    pointY[numPoints // 10:numPoints // 5 + numPoints // 10] = zoneIndex['originY'] + gridRows * cellSize
+    return pointX, pointY
+### end of makeGridPoints ###
+
+
+@pytest.mark.parametrize('cellSize', [500.0, 3000.0])
+def test_gridCornersOnPolygonEdges(cellSize):
+    # with a vertex at the data minimum, the grid origin is half a cell from it and edges with slope 1 or 1/3
+    # pass exactly through grid corners
+    vertices = np.asarray([[0.0, 0.0], [6000.0, 2000.0], [3000.0, 3000.0]])
+    edges = np.hstack((vertices, np.roll(vertices, -1, axis=0)))
+    featureIds = np.zeros(3, dtype=np.int64)
+    zoneIndex = zoneAssignment.buildZoneIndex(edges, featureIds, np.asarray([7]), cellSize)
+    cornerX = zoneIndex['originX'] + cellSize * np.arange(zoneIndex['numCols'])
+    assert np.any(np.isin(cornerX, zoneIndex['originY'] + cellSize * np.arange(zoneIndex['numRows'])))
+    pointX, pointY = makeGridPoints(np.random.RandomState(31), zoneIndex, [0, 0, 6000, 3000], 5000)
+    expected = bruteForceLocate(edges, featureIds, pointX, pointY)
+    assert np.sum(expected == 0) > 1000
+    np.testing.assert_array_equal(zoneAssignment.locatePoints(zoneIndex, pointX, pointY, useClosest=False), expected)
+
+
+@pytest.mark.parametrize('cellSize', [250.0, 1000.0, 3000.0])
+def test_overlappingPolygons(cellSize):
+    # each polygon overlaps its neighbours, and points in an overlap go to the first polygon
+    randomState = np.random.RandomState(37)
+    edges, featureIds = makeTestPolygons(randomState, 3)
+    edges = np.vstack((edges, edges * 1.6 - 300.0))
+    featureIds = np.concatenate((featureIds + 9, featureIds))
+    zoneIndex = zoneAssignment.buildZoneIndex(edges, featureIds, np.arange(18), cellSize)
+    pointX, pointY = makeGridPoints(randomState, zoneIndex, [-500, -500, 4500, 4500], 5000)
+    expected = bruteForceLocate(edges, featureIds, pointX, pointY)
+    assert np.sum(expected >= 9) > 100
+    np.testing.assert_array_equal(zoneAssignment.locatePoints(zoneIndex, pointX, pointY, useClosest=False), expected)
+
+
+def test_pointsOutsideAreAssignedToClosestPolygon():
+    randomState = np.random.RandomState(29)
+    edges, featureIds = makeTestPolygons(randomState, 4)
+    zoneIndex = zoneAssignment.buildZoneIndex(edges, featureIds, np.arange(16), 500.0)
+    pointX = randomState.uniform(-2000, 6000, 2000)
+    pointY = randomState.uniform(-2000, 6000, 2000)
+    inside = bruteForceLocate(edges, featureIds, pointX, pointY)
+    pointPolygons = zoneAssignment.locatePoints(zoneIndex, pointX, pointY, useClosest=True)
+    np.testing.assert_array_equal(pointPolygons[inside >= 0], inside[inside >= 0])
+
+    # the assigned polygon is one whose boundary is closest to the point
+    outside = np.nonzero(inside < 0)[0]
+    deltaX = edges[:, 2] - edges[:, 0]
+    deltaY = edges[:, 3] - edges[:, 1]
+    along = np.clip(((pointX[outside, np.newaxis] - edges[:, 0]) * deltaX + (pointY[outside, np.newaxis] - edges[:, 1]) * deltaY) /
+                    (deltaX ** 2 + deltaY ** 2), 0, 1)
+    edgeDistances = np.hypot(edges[:, 0] + along * deltaX - pointX[outside, np.newaxis],
+                             edges[:, 1] + along * deltaY - pointY[outside, np.newaxis])
+    closestDistances = edgeDistances.min(axis=1)
+    assignedDistances = np.asarray([edgeDistances[pointNum, featureIds == pointPolygons[outside[pointNum]]].min()
+                                    for pointNum in range(len(outside))])
+    np.testing.assert_allclose(assignedDistances, closestDistances, rtol=1e-9, atol=1e-6)
+
+################# end of functions ############################
+
+
+############### end of test_zoneAssignment.py ###############
@@ -0,0 +1,160 @@
+################# tilePlanner_Canada_LUR.py ##################
+#
+# Plans raster downloads on a fixed tile grid.  downloadSinglePoint requested a rectangle of +/- 0.51 degrees
+# around every station, so clustered stations (e.g. Toronto, Montreal, Vancouver) downloaded heavily
+# overlapping rasters again and again, and mergeRasters then had to mosaic all of the duplicates.
+#
+# Here the extent requested around each station is snapped outwards to a fine grid of TILE_SIZE_DEGREES cells,
+# and the cells needed by all stations are merged into non-overlapping request rectangles.  A rectangle is never
+# wider or taller than one snapped station window, so an isolated station is still a single request of about
+# the original size, while a cluster of stations downloads the union of its windows once instead of every
+# window separately.  Request rectangles never overlap, so mosaicking them is also much cheaper.  The station
+# to rectangle mapping is saved as a csv file so later steps can find the rasters that cover a station.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# pandas
+
+
+############## import required modules ###############
+import math
+import pandas as pd
+############## end of module import ##################
+
+
+TILE_SIZE_DEGREES = 0.05 # width and height of grid cells that station windows are snapped to, in decimal degrees
+TILE_PREFIX = "tile"
+
+
+################# functions ##################################
+
+# determine the grid cells that cover a rectangle around a point.  Edges that fall exactly on a grid line do
+# not pull in the neighbouring cell
+# INPUTS:
+#    lat (float) - latitude of the point
+#    longit (float) - longitude of the point
+#    padding (float) - half the width and height of the rectangle, in decimal degrees
+#    tileSize (float) - width and height of grid cells, in decimal degrees
+# OUTPUTS:
+#    tileKeys (tuple list) - (column, row) grid index of each cell covering the rectangle
+def determineTileKeys(lat, longit, padding, tileSize=TILE_SIZE_DEGREES):
+    startColumn = int(math.floor((longit - padding) / tileSize))
+    endColumn = int(math.ceil((longit + padding) / tileSize))
+    startRow = int(math.floor((lat - padding) / tileSize))
+    endRow = int(math.ceil((lat + padding) / tileSize))
+    tileKeys = []
+    for column in range(startColumn, max(endColumn, startColumn + 1)):
+        for row in range(startRow, max(endRow, startRow + 1)):
+            tileKeys.append((column, row))
+    return tileKeys
+### end of determineTileKeys ###
+
+
+# determine the boundaries of a request rectangle
+# INPUTS:
+#    tileRect (tuple) - (column, row, number of columns, number of rows) of the rectangle on the grid
+#    tileSize (float) - width and height of grid cells, in decimal degrees
+# OUTPUTS:
+#    tileBounds (tuple) - (west, south, east, north) boundaries of the rectangle, in decimal degrees
+def determineTileBounds(tileRect, tileSize=TILE_SIZE_DEGREES):
+    tileBounds = (tileRect[0] * tileSize, tileRect[1] * tileSize, (tileRect[0] + tileRect[2]) * tileSize,
+                  (tileRect[1] + tileRect[3]) * tileSize)
+    return tileBounds
+### end of determineTileBounds ###
+
+
+# determine the name used for a request rectangle's files, e.g. tile_-1600_980_22x21.  The size is part of the
+# name, so rasters downloaded for a different plan are not mistaken for this rectangle
+# INPUTS:
+#    tileRect (tuple) - (column, row, number of columns, number of rows) of the rectangle on the grid
+# OUTPUTS:
+#    tileName (str) - name of the rectangle
+def determineTileName(tileRect):
+    tileName = TILE_PREFIX + "_" + str(tileRect[0]) + "_" + str(tileRect[1]) + "_" + str(tileRect[2]) + "x" + str(tileRect[3])
+    return tileName
+### end of determineTileName ###
+
+
+# merge grid cells into non-overlapping rectangles that cover exactly the given cells.  Starting from the lowest
+# uncovered cell, each rectangle grows along its row and then upwards while all of its cells are needed
+# INPUTS:
+#    tileKeys (tuple set) - (column, row) grid index of every needed cell
+#    maxTiles (int) - largest number of cells along either side of a rectangle
+# OUTPUTS:
+#    tileRects (dict) - maps the (column, row) of each cell to the (column, row, number of columns, number of
+#                       rows) rectangle that contains it
+def mergeTileKeys(tileKeys, maxTiles):
+    tileRects = {}
+    for column, row in sorted(tileKeys, key=lambda tileKey: (tileKey[1], tileKey[0])):
+        if (column, row) in tileRects:
+            continue
+        numColumns = 1
+        while (numColumns < maxTiles and (column + numColumns, row) in tileKeys and
+               (column + numColumns, row) not in tileRects):
+            numColumns += 1
+        numRows = 1
+        while numRows < maxTiles and all([(column + offset, row + numRows) in tileKeys and
+                                          (column + offset, row + numRows) not in tileRects
+                                          for offset in range(numColumns)]):
+            numRows += 1
+        tileRect = (column, row, numColumns, numRows)
+        for columnOffset in range(numColumns):
+            for rowOffset in range(numRows):
+                tileRects[(column + columnOffset, row + rowOffset)] = tileRect
+    return tileRects
+### end of mergeTileKeys ###
+
+
+# plan the request rectangles needed to cover a rectangle around every station
+# INPUTS:
+#    stations (dict list) - station data as returned by getRowData in downloadEnvRasters, with randID, lat and longit
+#    padding (float) - half the width and height of the rectangle around each station, in decimal degrees
+#    tileSize (float) - width and height of grid cells, in decimal degrees
+# OUTPUTS:
+#    tilePlan (dict)
+#        tiles (dict) - maps the name of each request rectangle to its (west, south, east, north) boundaries
+#        stationTiles (dict) - maps the randID of each station to the names of the rectangles covering it
+def planTiles(stations, padding, tileSize=TILE_SIZE_DEGREES):
+    stationKeys = {}
+    for station in stations:
+        stationKeys[station['randID']] = determineTileKeys(station['lat'], station['longit'], padding, tileSize)
+    tileKeys = set([tileKey for randID in stationKeys for tileKey in stationKeys[randID]])
+
+    # a snapped station window spans at most this many cells, so no request is larger than one station window
+    maxTiles = int(math.ceil(2.0 * padding / tileSize)) + 1
+    tileRects = mergeTileKeys(tileKeys, maxTiles)
+    tiles = {}
+    stationTiles = {}
+    for randID in stationKeys:
+        stationTiles[randID] = []
+        for tileKey in stationKeys[randID]:
+            tileName = determineTileName(tileRects[tileKey])
+            if tileName not in tiles:
+                tiles[tileName] = determineTileBounds(tileRects[tileKey], tileSize)
+            if tileName not in stationTiles[randID]:
+                stationTiles[randID].append(tileName)
+    numRequested = sum([len(stationTiles[randID]) for randID in stationTiles])
+    print("planned " + str(len(tiles)) + " unique tiles for " + str(len(stations)) + " stations (" +
+          str(numRequested) + " station tiles before removing overlaps)")
+    return {'tiles': tiles, 'stationTiles': stationTiles}
+### end of planTiles ###
+
+
+# save the station to tile mapping of a tile plan, one row per station and tile
+# INPUTS:
+#    tilePlan (dict) - tile plan created by planTiles
+#    outputFile (str) - full filepath of the csv file to write
+def writeTilePlan(tilePlan, outputFile):
+    rows = []
+    for randID in sorted(tilePlan['stationTiles'].keys()):
+        for tileName in tilePlan['stationTiles'][randID]:
+            west, south, east, north = tilePlan['tiles'][tileName]
+            rows.append({'randID': randID, 'tile': tileName, 'west': west, 'south': south, 'east': east, 'north': north})
+    pd.DataFrame(rows, columns=['randID', 'tile', 'west', 'south', 'east', 'north']).to_csv(outputFile, index=False)
+### end of writeTilePlan ###
+
+################# end of functions ############################
+
+
+############### end of tilePlanner_Canada_LUR.py ###############
@@ -0,0 +1,324 @@
+################# zonalStatistics_Canada_LUR.py ##################
+#
+# Pure NumPy zonal statistics backend for raster buffer variables.  Replaces the ArcGIS/NOAA
+# StatisticsForOverlappingZones workflow used by rasterBufferIntersect: GeoTIFFs listed in RASTER_LIST
+# are read directly with rasterio, a circular buffer is built around each air monitor, and the sum and mean
+# of the raster within every buffer distance are returned as an in-memory table.
+#
+# Cells entirely inside a buffer receive a weight of 1.  Cells crossed by the buffer edge are split into
+# COVERAGE_SUBSAMPLES x COVERAGE_SUBSAMPLES sub-cells and weighted by the fraction of sub-cell centres inside
+# the buffer, which reproduces the meanCellHeight/10 resampling used by the ArcGIS workflow without writing
+# any intermediate shapefiles.  NoData cells are excluded.
+#
+# Large radii can optionally be answered from a summed-area table (integralImage_Canada_LUR.py), which makes
+# the cost of a buffer independent of its radius.  Multi-band rasters such as yearly cubes
+# (rasterCube_Canada_LUR.py) are read once per monitor and return a value for every band.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, pandas, rasterio, fiona (no ArcGIS license or extension is required)
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+import numpy as np
+import pandas as ps
+import rasterio
+from rasterio.windows import Window
+import fiona
+import time
+import constantValues as values
+import bufferEngine_Canada_LUR as bufferEngine
+import integralImage_Canada_LUR as integralImage
+import resultCache_Canada_LUR as resultCache
+import rasterCube_Canada_LUR as rasterCube
+############## end of module import ##################
+
+
+
+################# functions ##################################
+
+# read the identifiers and coordinates of all air monitors in a shapefile without ArcGIS
+# INPUTS:
+#    airMonitorFile (str) - full filepath to the air monitor shapefile
+# OUTPUTS:
+#    monitorIds (int array) - air monitor identifiers (shapefile FIDs)
+#    monitorX, monitorY (float arrays) - air monitor coordinates, in the units of the shapefile projection
+def readAirMonitorPoints(airMonitorFile):
+    monitorIds = []
+    monitorX = []
+    monitorY = []
+    with fiona.open(airMonitorFile) as source:
+        for feature in source:
+            coordinates = feature['geometry']['coordinates']
+            monitorIds.append(int(feature['id']))
+            monitorX.append(coordinates[0])
+            monitorY.append(coordinates[1])
+    return np.asarray(monitorIds), np.asarray(monitorX, dtype=np.float64), np.asarray(monitorY, dtype=np.float64)
+### end of readAirMonitorPoints ###
+
+
+# read the window of raster cells that covers a circle around a single point.  All bands are read at once
+# INPUTS:
+#    dataset (rasterio dataset) - open raster to read from
+#    centreX, centreY (float) - coordinates of the circle centre
+#    radius (float) - circle radius, in meters
+# OUTPUTS:
+#    windowValues (float array) - raster values in the window with shape (bands, rows, columns), NoData cells are NaN
+#    offsetX, offsetY (float arrays) - offset of each cell centre from the circle centre, with shape (rows, columns)
+def readRasterWindow(dataset, centreX, centreY, radius):
+    transform = dataset.transform
+    cellWidth = transform.a
+    cellHeight = -transform.e
+    firstCol = max(0, int(np.floor((centreX - radius - transform.c) / cellWidth)))
+    lastCol = min(dataset.width, int(np.ceil((centreX + radius - transform.c) / cellWidth)))
+    firstRow = max(0, int(np.floor((transform.f - centreY - radius) / cellHeight)))
+    lastRow = min(dataset.height, int(np.ceil((transform.f - centreY + radius) / cellHeight)))
+    if lastCol <= firstCol or lastRow <= firstRow:
+        emptyWindow = np.zeros((0, 0))
+        return np.zeros((dataset.count, 0, 0)), emptyWindow, emptyWindow
+    window = Window(firstCol, firstRow, lastCol - firstCol, lastRow - firstRow)
+    windowValues = dataset.read(window=window).astype(np.float64)
+    if dataset.nodata is not None:
+        windowValues[windowValues == dataset.nodata] = np.nan
+    colOffsets = transform.c + (firstCol + np.arange(lastCol - firstCol) + 0.5) * cellWidth - centreX
+    rowOffsets = transform.f - (firstRow + np.arange(lastRow - firstRow) + 0.5) * cellHeight - centreY
+    offsetX, offsetY = np.meshgrid(colOffsets, rowOffsets)
+    return windowValues, offsetX, offsetY
+### end of readRasterWindow ###
+
+
+# calculate the fraction of each cell covered by a circle, using sub-cell centres
+# INPUTS:
+#    offsetX, offsetY (float arrays) - offset of each cell centre from the circle centre
+#    cellWidth, cellHeight (float) - cell dimensions, in meters
+#    radius (float) - circle radius, in meters
+#    subSamples (int) - number of sub-cells along each side of a cell
+# OUTPUTS:
+#    coverage (float array) - fraction of each cell inside the circle, ranging from 0 to 1
+def subCellCoverage(offsetX, offsetY, cellWidth, cellHeight, radius, subSamples):
+    subOffsets = (np.arange(subSamples) + 0.5) / subSamples - 0.5
+    subX = offsetX[..., np.newaxis, np.newaxis] + subOffsets[np.newaxis, :] * cellWidth
+    subY = offsetY[..., np.newaxis, np.newaxis] + subOffsets[:, np.newaxis] * cellHeight
+    inside = (subX ** 2 + subY ** 2) <= radius ** 2
+    coverage = inside.reshape(inside.shape[0:-2] + (subSamples * subSamples,)).mean(axis=-1)
+    return coverage
+### end of subCellCoverage ###
+
+
+# calculate coverage weighted sums within every buffer distance for a single window of raster cells.  Cells
+# fully inside a radius are accumulated ring by ring, so only the cells crossed by each buffer edge need
+# sub-cell coverage weights.  Coverage weights depend only on the cell positions, so they are calculated once
+# and shared by all bands
+# INPUTS:
+#    windowValues (float array) - raster values with shape (bands, rows, columns), NoData cells are NaN
+#    offsetX, offsetY (float arrays) - offset of each cell centre from the buffer centre
+#    cellWidth, cellHeight (float) - cell dimensions, in meters
+#    ringEdges (float array) - buffer radii in ascending order
+#    subSamples (int) - number of sub-cells along each side of a cell
+# OUTPUTS:
+#    bufferSums (float array) - weighted sum of raster values within each radius, with shape (bands, radii)
+#    bufferWeights (float array) - sum of weights (number of valid cells) within each radius, with shape (bands, radii)
+def diskStatistics(windowValues, offsetX, offsetY, cellWidth, cellHeight, ringEdges, subSamples):
+    numRings = len(ringEdges)
+    numBands = windowValues.shape[0]
+    validCells = np.isfinite(windowValues)
+    anyValid = validCells.any(axis=0)
+    cellValues = np.where(validCells, windowValues, 0)[:, anyValid]
+    cellValid = validCells[:, anyValid].astype(np.float64)
+    absX = np.abs(offsetX[anyValid])
+    absY = np.abs(offsetY[anyValid])
+    nearDist = np.hypot(np.maximum(absX - cellWidth / 2.0, 0), np.maximum(absY - cellHeight / 2.0, 0))
+    farDist = np.hypot(absX + cellWidth / 2.0, absY + cellHeight / 2.0)
+
+    # cells entirely within a radius, accumulated ring by ring
+    ringIndex = bufferEngine.assignRings(farDist, ringEdges)
+    bufferSums = np.zeros((numBands, numRings))
+    bufferWeights = np.zeros((numBands, numRings))
+    for bandNum in range(numBands):
+        bufferSums[bandNum] = bufferEngine.accumulateRings(ringIndex, cellValues[bandNum], numRings)
+        bufferWeights[bandNum] = bufferEngine.accumulateRings(ringIndex, cellValid[bandNum], numRings)
+
+    # cells crossed by the edge of each buffer
+    for ringNum in range(numRings):
+        edgeCells = (nearDist < ringEdges[ringNum]) & (farDist > ringEdges[ringNum])
+        if edgeCells.any():
+            coverage = subCellCoverage(offsetX[anyValid][edgeCells], offsetY[anyValid][edgeCells],
+                                       cellWidth, cellHeight, ringEdges[ringNum], subSamples)
+            bufferSums[:, ringNum] += np.dot(cellValues[:, edgeCells], coverage)
+            bufferWeights[:, ringNum] += np.dot(cellValid[:, edgeCells], coverage)
+    return bufferSums, bufferWeights
+### end of diskStatistics ###
+
+
+# calculate weighted sums and cell counts for every air monitor, band and buffer distance in a single raster.
+# Multi-band rasters (e.g. yearly cubes from rasterCube_Canada_LUR.py) are read once per monitor for all bands.
+# If USE_INTEGRAL_IMAGE is set, radii of at least INTEGRAL_IMAGE_MIN_RADIUS are answered from the raster's
+# tiled integral image index, so the raster window read for each monitor only covers the smaller radii
+# INPUTS:
+#    rasterFile (str) - full filepath to the GeoTIFF
+#    monitorX, monitorY (float arrays) - air monitor coordinates, in the raster projection
+#    ringEdges (float array) - buffer radii in ascending order
+#    subSamples (int) - number of sub-cells along each side of a cell crossed by a buffer edge
+# OUTPUTS:
+#    bufferSums (float array) - weighted raster sums, with shape (number of monitors, number of bands, number of radii)
+#    bufferWeights (float array) - weighted cell counts, with the same shape as bufferSums
+def rasterBufferStatistics(rasterFile, monitorX, monitorY, ringEdges, subSamples=values.COVERAGE_SUBSAMPLES):
+    with rasterio.open(rasterFile) as dataset:
+        numBands = dataset.count
+    bufferSums = np.zeros((len(monitorX), numBands, len(ringEdges)))
+    bufferWeights = np.zeros((len(monitorX), numBands, len(ringEdges)))
+    numExactRings = len(ringEdges)
+    if values.USE_INTEGRAL_IMAGE:
+        numExactRings = int(np.searchsorted(ringEdges, values.INTEGRAL_IMAGE_MIN_RADIUS, side='left'))
+        if numExactRings < len(ringEdges):
+            bufferSums[:, :, numExactRings:], bufferWeights[:, :, numExactRings:] = integralImage.tiledCircleSums(
+                rasterFile, monitorX, monitorY, ringEdges[numExactRings:])
+    if numExactRings == 0:
+        return bufferSums, bufferWeights
+    exactEdges = ringEdges[0:numExactRings]
+    with rasterio.open(rasterFile) as dataset:
+        cellWidth = dataset.transform.a
+        cellHeight = -dataset.transform.e
+        for monitorIndex in range(len(monitorX)):
+            windowValues, offsetX, offsetY = readRasterWindow(dataset, monitorX[monitorIndex], monitorY[monitorIndex], exactEdges[-1])
+            if windowValues.size == 0:
+                continue
+            bufferSums[monitorIndex, :, 0:numExactRings], bufferWeights[monitorIndex, :, 0:numExactRings] = diskStatistics(
+                windowValues, offsetX, offsetY, cellWidth, cellHeight, exactEdges, subSamples)
+    return bufferSums, bufferWeights
+### end of rasterBufferStatistics ###
+
+
+# calculate the buffer sum and mean of the first band of a raster for every air monitor and buffer distance
+# INPUTS:
+#    rasterFile (str) - full filepath to the GeoTIFF
+#    monitorIds (int array) - air monitor identifiers
+#    monitorX, monitorY (float arrays) - air monitor coordinates, in the raster projection
+#    bufferDistances (int list) - buffer radii, in meters
+# OUTPUTS:
+#    statsTable (pandas dataframe) - one row per monitor and buffer distance, with columns AIRMONITOR_ID,
+#                                    BUFF_DIST, COUNT, SUM and MEAN.  MEAN is NaN if a buffer has no valid cells
+def rasterBufferTable(rasterFile, monitorIds, monitorX, monitorY, bufferDistances):
+    ringEdges = bufferEngine.makeRingEdges(bufferDistances)
+    bufferSums, bufferWeights = rasterBufferStatistics(rasterFile, monitorX, monitorY, ringEdges)
+    bufferSums = bufferSums[:, 0, :]
+    bufferWeights = bufferWeights[:, 0, :]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bufferMeans = np.where(bufferWeights > 0, bufferSums / bufferWeights, np.nan)
+    statsTable = ps.DataFrame({
+        values.AIRMONITOR_ID: np.repeat(monitorIds, len(ringEdges)),
+        'BUFF_DIST': np.tile(ringEdges, len(monitorIds)),
+        'COUNT': bufferWeights.ravel(),
+        'SUM': bufferSums.ravel(),
+        'MEAN': bufferMeans.ravel()
+    })
+    return statsTable
+### end of rasterBufferTable ###
+
+
+# calculate the buffer mean of a raster for every air monitor and buffer distance.  For multi-band rasters the
+# means of every band are returned side by side, in the order of determineResultIdentifiers
+# INPUTS:
+#    rasterFile (str) - full filepath to the GeoTIFF
+#    monitorX, monitorY (float arrays) - air monitor coordinates, in the raster projection
+#    ringEdges (float array) - buffer radii in ascending order
+# OUTPUTS:
+#    bufferMeans (float array) - buffer means, with shape (number of monitors, number of bands x number of radii).
+#                                NaN if a buffer has no valid cells
+def rasterBufferMeans(rasterFile, monitorX, monitorY, ringEdges):
+    bufferSums, bufferWeights = rasterBufferStatistics(rasterFile, monitorX, monitorY, ringEdges)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bufferMeans = np.where(bufferWeights > 0, bufferSums / bufferWeights, np.nan)
+    return bufferMeans.reshape(len(monitorX), -1)
+### end of rasterBufferMeans ###
+
+
+# determine the variable identifier of each column returned by rasterBufferMeans.  Cubes have one column per
+# band and buffer distance, other rasters one column per buffer distance
+# INPUTS:
+#    variable (str) - raster variable, relative to INPUT_FOLDER
+#    ringEdges (float array) - buffer radii in ascending order
+# OUTPUTS:
+#    variableIdents (str list) - variable identifier of each column, e.g. N6500m or N3500m
+def determineResultIdentifiers(variable, ringEdges):
+    bandLabels = rasterCube.readBandLabels(values.INPUT_FOLDER + variable)
+    if bandLabels is None:
+        return [bufferEngine.determineVariableIdentifier(variable, radius) for radius in ringEdges]
+    return [rasterCube.determineCubeIdentifier(variable, bandLabel, radius) for bandLabel in bandLabels for radius in ringEdges]
+### end of determineResultIdentifiers ###
+
+
+# determine the number of bands in a raster
+# INPUTS:
+#    rasterFile (str) - full filepath to the GeoTIFF
+# OUTPUTS:
+#    numBands (int) - number of bands
+def determineBandCount(rasterFile):
+    with rasterio.open(rasterFile) as dataset:
+        numBands = dataset.count
+    return numBands
+### end of determineBandCount ###
+
+
+# determine the statistic label used to cache raster buffer means.  The label includes every setting that
+# changes the calculated value
+# OUTPUTS:
+#    statistic (str) - cache statistic label
+def determineCacheStatistic():
+    statistic = "MEAN|" + str(values.COVERAGE_SUBSAMPLES)
+    if values.USE_INTEGRAL_IMAGE:
+        statistic += "|SAT" + str(values.INTEGRAL_IMAGE_MIN_RADIUS)
+    return statistic
+### end of determineCacheStatistic ###
+
+
+# calculate buffer means for all rasters in RASTER_LIST and all buffer distances, without ArcGIS.  If
+# USE_RESULT_CACHE is set, only monitors missing from the result cache are calculated
+# INPUTS:
+#    airMonitorFile (str) - full filepath to the air monitor shapefile
+#    rasterList (str list) - raster variables to process, relative to INPUT_FOLDER
+# OUTPUTS:
+#    monitorIds (int array) - air monitor identifiers
+#    results (dict) - maps each variable identifier (e.g. N6500m) to an array of buffer means, one per monitor
+def runZonalStatistics(airMonitorFile, rasterList):
+    ringEdges = bufferEngine.makeRingEdges(values.BUFFER_DISTANCE)
+    monitorIds, monitorX, monitorY = readAirMonitorPoints(airMonitorFile)
+    if values.USE_RESULT_CACHE:
+        cacheConnection = resultCache.openResultCache()
+    results = {}
+    for variable in rasterList:
+        startTime = time.time()
+        if values.USE_RESULT_CACHE:
+            bufferMeans = resultCache.cachedBufferStatistics(cacheConnection, values.INPUT_FOLDER + variable, monitorX, monitorY,
+                                                             ringEdges, determineCacheStatistic(), rasterBufferMeans,
+                                                             determineBandCount(values.INPUT_FOLDER + variable))
+        else:
+            bufferMeans = rasterBufferMeans(values.INPUT_FOLDER + variable, monitorX, monitorY, ringEdges)
+        variableIdents = determineResultIdentifiers(variable, ringEdges)
+        for columnNum in range(len(variableIdents)):
+            results[variableIdents[columnNum]] = bufferMeans[:, columnNum]
+        print("completed all buffer distances for " + variable + " in " + str(time.time() - startTime) + " seconds")
+    if values.USE_RESULT_CACHE:
+        cacheConnection.close()
+    return monitorIds, results
+### end of runZonalStatistics ###
+
+
+def main():
+    monitorIds, results = runZonalStatistics(values.INPUT_FOLDER + values.MONITOR_FILE, values.RASTER_LIST)
+    resultsTable = ps.DataFrame(results, index=monitorIds)
+    resultsTable.index.name = values.AIRMONITOR_ID
+    resultsTable.to_csv(values.RESULTS_FOLDER + "rasterBufferMeans.csv")
+    print("completed zonal statistics for " + str(len(monitorIds)) + " air monitors")
+
+################# end of functions ############################
+
+
+# run the main function
+if __name__ == '__main__':
+    main()
+
+
+############### end of zonalStatistics_Canada_LUR.py ###############
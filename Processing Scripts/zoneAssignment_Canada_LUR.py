@@ -0,0 +1,394 @@
+################# zoneAssignment_Canada_LUR.py ##################
+#
+# In-memory zone assignment.  Replaces the SpatialJoin_analysis(..., "CLOSEST") of assignZones, which joined
+# every monitor to zoneDef.shp on disk and was too slow to zone the millions of prediction points of a
+# national grid.
+#
+# The edges of the zone polygons are registered in a uniform grid.  The zone at the lower left corner of every
+# grid cell is calculated once when the index is built, by counting edge crossings along the bottom line of
+# each grid row.  A point is then located by counting the edges crossed on a short path inside its own cell,
+# from the cell corner up the left side of the cell and across to the point, so only the edges of one cell are
+# tested per point.  Crossings are counted separately for each zone polygon, so polygons with holes, multipart
+# polygons, shared zone borders and overlapping polygons are all handled.  Crossings are decided with the sides
+# of each edge that the path's corners lie on, with points exactly on an edge treated as lying just to its
+# right and above it, so grid corners or points that fall exactly on a polygon edge are located consistently.  Points that are not inside any zone polygon (e.g. offshore
+# monitors) are assigned to the closest polygon, as with the CLOSEST match option, using the nearest feature
+# engine of nearestDistance_Canada_LUR.py.
+#
+# Developed for Perry Hystad, Oregon State University
+#
+# Requirements:
+# numpy, scipy, fiona (no ArcGIS license is required)
+# constantValues.py conatins all modifiable input values (e.g. input files, folder locations)
+
+
+############## import required modules ###############
+import time
+import numpy as np
+import fiona
+import constantValues as values
+import zonalStatistics_Canada_LUR as zonalStatistics
+import nearestDistance_Canada_LUR as nearestDistance
+############## end of module import ##################
+
+
+# zone indices that have already been built, keyed by zone polygon filepath
+ZONE_INDEX_CACHE = {}
+LOCATE_CHUNK_PAIRS = 5000000 # (point, edge) pairs tested together
+
+
+################# functions ##################################
+
+# read the zone value of every zone polygon
+# INPUTS:
+#    zoneFile (str) - full filepath to the zone polygon shapefile
+#    zoneField (str) - attribute holding the zone value
+# OUTPUTS:
+#    zoneValues (array) - zone value of each polygon, in record order
+def readZoneValues(zoneFile, zoneField=values.ZONE_FIELD):
+    with fiona.open(zoneFile) as source:
+        zoneValues = [feature['properties'][zoneField] for feature in source]
+    return np.asarray(zoneValues)
+### end of readZoneValues ###
+
+
+# find the polygon edges that cross a horizontal line.  Vertices on the line count as below it
+# INPUTS:
+#    edges (float array) - polygon edges with shape (number of edges, 4)
+#    lineY (float array) - y coordinate of the line for each edge
+# OUTPUTS:
+#    crosses (bool array) - True for edges that cross the line
+def crossHorizontal(edges, lineY):
+    crosses = (edges[:, 1] > lineY) != (edges[:, 3] > lineY)
+    return crosses
+### end of crossHorizontal ###
+
+
+# find the polygon edges that cross a vertical line.  Vertices on the line count as left of it
+# INPUTS:
+#    edges (float array) - polygon edges with shape (number of edges, 4)
+#    lineX (float array) - x coordinate of the line for each edge
+# OUTPUTS:
+#    crosses (bool array) - True for edges that cross the line
+def crossVertical(edges, lineX):
+    crosses = (edges[:, 0] > lineX) != (edges[:, 2] > lineX)
+    return crosses
+### end of crossVertical ###
+
+
+# determine the side of each edge a point is on.  Points exactly on the line of an edge are treated as if they
+# were moved right by a tiny distance and up by a much tinier one, the same convention as crossHorizontal and
+# crossVertical, so no point is ever on an edge and grid corners on polygon edges need no special case
+# INPUTS:
+#    edges (float array) - polygon edges with shape (number of edges, 4)
+#    pointX, pointY (float arrays) - point coordinates for each edge
+# OUTPUTS:
+#    onLeft (bool array) - True where the point is left of the edge, looking from its first to its second vertex
+def pointSides(edges, pointX, pointY):
+    deltaX = edges[:, 2] - edges[:, 0]
+    deltaY = edges[:, 3] - edges[:, 1]
+    orientation = deltaX * (pointY - edges[:, 1]) - deltaY * (pointX - edges[:, 0])
+    tieBreak = np.where(deltaY != 0, -deltaY, deltaX)
+    onLeft = np.where(orientation != 0, orientation > 0, tieBreak > 0)
+    return onLeft
+### end of pointSides ###
+
+
+# determine whether each point is right of the crossing of an edge with the horizontal line through the point.
+# Edges must cross the line (crossHorizontal).  Edges that do not cross the vertical line through the point are
+# decided by their vertices alone, so the result is always consistent with crossVertical
+# INPUTS:
+#    edges (float array) - polygon edges with shape (number of edges, 4)
+#    pointX, pointY (float arrays) - point coordinates for each edge
+# OUTPUTS:
+#    rightOf (bool array) - True where the crossing is left of (or at) the point
+def rightOfCrossing(edges, pointX, pointY):
+    firstRight = edges[:, 0] > pointX
+    secondRight = edges[:, 2] > pointX
+    upward = edges[:, 3] > edges[:, 1]
+    rightOf = np.where(firstRight == secondRight, ~firstRight, pointSides(edges, pointX, pointY) != upward)
+    return rightOf
+### end of rightOfCrossing ###
+
+
+# register polygon edges in every grid cell their bounding box (widened by XY_TOLERANCE) touches
+# INPUTS:
+#    zoneIndex (dict) - zone index with the grid origin, cellSize, numRows and numCols already set
+#    edges (float array) - polygon edges with shape (number of edges, 4)
+# OUTPUTS:
+#    cellKeys (int array) - sorted grid cell keys (row * numCols + column), one entry per edge and cell
+#    edgeIds (int array) - edge id for each entry in cellKeys
+def registerEdges(zoneIndex, edges):
+    margin = values.XY_TOLERANCE
+    cellSize = zoneIndex['cellSize']
+    firstCol = np.floor((np.minimum(edges[:, 0], edges[:, 2]) - margin - zoneIndex['originX']) / cellSize).astype(np.int64)
+    lastCol = np.floor((np.maximum(edges[:, 0], edges[:, 2]) + margin - zoneIndex['originX']) / cellSize).astype(np.int64)
+    firstRow = np.floor((np.minimum(edges[:, 1], edges[:, 3]) - margin - zoneIndex['originY']) / cellSize).astype(np.int64)
+    lastRow = np.floor((np.maximum(edges[:, 1], edges[:, 3]) + margin - zoneIndex['originY']) / cellSize).astype(np.int64)
+    firstCol, lastCol = np.maximum(firstCol, 0), np.minimum(lastCol, zoneIndex['numCols'] - 1)
+    firstRow, lastRow = np.maximum(firstRow, 0), np.minimum(lastRow, zoneIndex['numRows'] - 1)
+    numCols = lastCol - firstCol + 1
+    numCells = numCols * (lastRow - firstRow + 1)
+    edgeIds = np.repeat(np.arange(len(edges)), numCells)
+    cellNumber = np.arange(len(edgeIds)) - np.repeat(np.cumsum(numCells) - numCells, numCells)
+    cellKeys = ((firstRow[edgeIds] + cellNumber // numCols[edgeIds]) * zoneIndex['numCols'] +
+                firstCol[edgeIds] + cellNumber % numCols[edgeIds])
+    sortOrder = np.argsort(cellKeys, kind='mergesort')
+    return cellKeys[sortOrder], edgeIds[sortOrder]
+### end of registerEdges ###
+
+
+# calculate the polygons containing the lower left corner of every grid cell.  Crossings of the bottom line of
+# each grid row are counted from the left edge of the grid, which is outside every polygon.  Overlapping
+# polygons are tracked separately, so a corner can be inside more than one polygon
+# INPUTS:
+#    zoneIndex (dict) - zone index with the edges and grid registration already set
+# OUTPUTS:
+#    cornerKeys (int array) - sorted grid cell keys (row * numCols + column) of the corners inside a polygon,
+#                             one entry per corner and polygon
+#    cornerPolygons (int array) - polygon number for each entry in cornerKeys
+def calcCornerPolygons(zoneIndex):
+    numCols = zoneIndex['numCols']
+    cellSize = zoneIndex['cellSize']
+    cellRows = zoneIndex['cellKeys'] // numCols
+    cellCols = zoneIndex['cellKeys'] % numCols
+    edges = zoneIndex['edges'][zoneIndex['edgeIds']]
+    lineY = zoneIndex['originY'] + cellRows * cellSize
+    crosses = crossHorizontal(edges, lineY)
+
+    # each crossing is counted in the one cell whose left corner is left of the crossing and whose right
+    # corner is not.  Both corners are tested with rightOfCrossing, as the points of locateChunk are
+    inCell = np.where(crosses)[0]
+    cornerLeft = zoneIndex['originX'] + cellCols[inCell] * cellSize
+    cornerRight = zoneIndex['originX'] + (cellCols[inCell] + 1) * cellSize
+    inCell = inCell[rightOfCrossing(edges[inCell], cornerRight, lineY[inCell]) &
+                    ~rightOfCrossing(edges[inCell], cornerLeft, lineY[inCell])]
+    rows = cellRows[inCell]
+    polygons = zoneIndex['featureIds'][zoneIndex['edgeIds'][inCell]]
+    cols = cellCols[inCell]
+
+    # consecutive crossings of the same polygon along a row enter and leave it.  The corners of the cells
+    # after the entering crossing, up to and including the cell of the leaving crossing, are inside
+    sortOrder = np.lexsort((cols, polygons, rows))
+    rows, polygons, cols = rows[sortOrder], polygons[sortOrder], cols[sortOrder]
+    newGroup = np.ones(len(rows), dtype=bool)
+    newGroup[1:] = (rows[1:] != rows[:-1]) | (polygons[1:] != polygons[:-1])
+    groupStart = np.maximum.accumulate(np.where(newGroup, np.arange(len(rows)), 0))
+    entering = np.where(((np.arange(len(rows)) - groupStart) % 2 == 0)[:-1] & ~newGroup[1:])[0]
+    firstCorner = cols[entering] + 1
+    numCorners = cols[entering + 1] - cols[entering]
+    paintCols = (np.repeat(firstCorner, numCorners) + np.arange(numCorners.sum()) -
+                 np.repeat(np.cumsum(numCorners) - numCorners, numCorners))
+    cornerKeys = np.repeat(rows[entering], numCorners) * numCols + paintCols
+    cornerPolygons = np.repeat(polygons[entering], numCorners)
+    sortOrder = np.argsort(cornerKeys, kind='mergesort')
+    return cornerKeys[sortOrder], cornerPolygons[sortOrder]
+### end of calcCornerPolygons ###
+
+
+# build the grid index over the edges of a set of zone polygons
+# INPUTS:
+#    edges (float array) - polygon edges with shape (number of edges, 4), x0, y0, x1, y1 for each edge
+#    featureIds (int array) - polygon number of each edge
+#    zoneValues (array) - zone value of each polygon
+#    cellSize (float) - grid cell size, in meters
+# OUTPUTS:
+#    zoneIndex (dict)
+#        edges, featureIds, zoneValues - the indexed polygons
+#        originX, originY, cellSize, numRows, numCols - grid definition.  The origin lies outside all polygons
+#        cellKeys, edgeIds (int arrays) - grid registration of the edges, as returned by registerEdges
+#        cornerKeys, cornerPolygons (int arrays) - polygons at the lower left corner of each cell, as returned
+#                                                  by calcCornerPolygons
+#        nearestIndex (dict) - nearest feature index over the edges, built when first needed
+def buildZoneIndex(edges, featureIds, zoneValues, cellSize=values.ZONE_GRID_SIZE):
+    if len(edges) == 0:
+        raise Exception("cannot assign zones without zone polygons")
+    originX = min(edges[:, 0].min(), edges[:, 2].min()) - cellSize / 2.0
+    originY = min(edges[:, 1].min(), edges[:, 3].min()) - cellSize / 2.0
+    zoneIndex = {'edges': edges, 'featureIds': featureIds, 'zoneValues': np.asarray(zoneValues),
+                 'originX': originX, 'originY': originY, 'cellSize': float(cellSize),
+                 'numCols': int(np.floor((max(edges[:, 0].max(), edges[:, 2].max()) - originX) / cellSize)) + 1,
+                 'numRows': int(np.floor((max(edges[:, 1].max(), edges[:, 3].max()) - originY) / cellSize)) + 1,
+                 'nearestIndex': None}
+    zoneIndex['cellKeys'], zoneIndex['edgeIds'] = registerEdges(zoneIndex, edges)
+    zoneIndex['cornerKeys'], zoneIndex['cornerPolygons'] = calcCornerPolygons(zoneIndex)
+    return zoneIndex
+### end of buildZoneIndex ###
+
+
+# load and index a zone polygon shapefile, reusing the index if the file was already loaded
+# INPUTS:
+#    zoneFile (str) - full filepath to the zone polygon shapefile
+# OUTPUTS:
+#    zoneIndex (dict) - index returned by buildZoneIndex
+def loadZoneIndex(zoneFile):
+    if zoneFile not in ZONE_INDEX_CACHE:
+        edges, featureIds = nearestDistance.loadFeatureSegments(zoneFile)
+        ZONE_INDEX_CACHE[zoneFile] = buildZoneIndex(edges, featureIds, readZoneValues(zoneFile))
+        print("indexed " + str(len(edges)) + " edges of " + str(len(ZONE_INDEX_CACHE[zoneFile]['zoneValues'])) +
+              " zone polygons from " + zoneFile)
+    return ZONE_INDEX_CACHE[zoneFile]
+### end of loadZoneIndex ###
+
+
+# find the grid cell of each point and the edges registered in it
+# INPUTS:
+#    zoneIndex (dict) - index returned by buildZoneIndex
+#    pointX, pointY (float arrays) - point coordinates, in the zone projection
+# OUTPUTS:
+#    inGrid (int array) - numbers of the points inside the grid
+#    pointRows, pointCols (int arrays) - grid cell of each point inside the grid
+#    firstEntry, numEntries (int arrays) - position and number of the cell entries in cellKeys of each point
+#                                         inside the grid
+def findPointCells(zoneIndex, pointX, pointY):
+    pointCols = np.floor((pointX - zoneIndex['originX']) / zoneIndex['cellSize']).astype(np.int64)
+    pointRows = np.floor((pointY - zoneIndex['originY']) / zoneIndex['cellSize']).astype(np.int64)
+    inGrid = np.where((pointCols >= 0) & (pointCols < zoneIndex['numCols']) &
+                      (pointRows >= 0) & (pointRows < zoneIndex['numRows']))[0]
+    pointCols, pointRows = pointCols[inGrid], pointRows[inGrid]
+    queryKeys = pointRows * zoneIndex['numCols'] + pointCols
+    firstEntry = np.searchsorted(zoneIndex['cellKeys'], queryKeys, side='left')
+    numEntries = np.searchsorted(zoneIndex['cellKeys'], queryKeys, side='right') - firstEntry
+    return inGrid, pointRows, pointCols, firstEntry, numEntries
+### end of findPointCells ###
+
+
+# find the polygon containing each point of a chunk of points.  Points inside more than one overlapping polygon
+# are assigned to the first of them, in record order
+# INPUTS:
+#    zoneIndex (dict) - index returned by buildZoneIndex
+#    pointX, pointY (float arrays) - point coordinates, in the zone projection
+# OUTPUTS:
+#    pointPolygons (int array) - polygon number containing each point, -1 outside all polygons
+def locateChunk(zoneIndex, pointX, pointY):
+    cellSize = zoneIndex['cellSize']
+    inGrid, pointRows, pointCols, firstEntry, numEntries = findPointCells(zoneIndex, pointX, pointY)
+
+    # polygons containing the lower left corner of the cell of each point
+    queryKeys = pointRows * zoneIndex['numCols'] + pointCols
+    firstCorner = np.searchsorted(zoneIndex['cornerKeys'], queryKeys, side='left')
+    numCorners = np.searchsorted(zoneIndex['cornerKeys'], queryKeys, side='right') - firstCorner
+    cornerPoints = np.repeat(np.arange(len(inGrid)), numCorners)
+    cornerNumber = np.arange(len(cornerPoints)) - np.repeat(np.cumsum(numCorners) - numCorners, numCorners)
+    cornerPolygons = zoneIndex['cornerPolygons'][np.repeat(firstCorner, numCorners) + cornerNumber]
+
+    # edges registered in the cell of each point
+    pairPoints = np.repeat(np.arange(len(inGrid)), numEntries)
+    entryNumber = np.arange(len(pairPoints)) - np.repeat(np.cumsum(numEntries) - numEntries, numEntries)
+    edgeIds = zoneIndex['edgeIds'][np.repeat(firstEntry, numEntries) + entryNumber]
+    edges = zoneIndex['edges'][edgeIds]
+    cellLeft = zoneIndex['originX'] + pointCols[pairPoints] * cellSize
+    cellBottom = zoneIndex['originY'] + pointRows[pairPoints] * cellSize
+    pairX, pairY = pointX[inGrid][pairPoints], pointY[inGrid][pairPoints]
+
+    # crossings from the cell corner up the left side of the cell, then across to the point.  An edge crosses
+    # the left side if its ends are on either side of it and the corner and the turning point are on either
+    # side of the edge
+    upCrosses = crossVertical(edges, cellLeft)
+    upCrosses[upCrosses] = (pointSides(edges[upCrosses], cellLeft[upCrosses], cellBottom[upCrosses]) !=
+                            pointSides(edges[upCrosses], cellLeft[upCrosses], pairY[upCrosses]))
+    acrossCrosses = crossHorizontal(edges, pairY)
+    acrossCrosses[acrossCrosses] = (rightOfCrossing(edges[acrossCrosses], pairX[acrossCrosses], pairY[acrossCrosses]) &
+                                    ~rightOfCrossing(edges[acrossCrosses], cellLeft[acrossCrosses], pairY[acrossCrosses]))
+
+    # a point is inside the polygon crossed (or started in) an odd number of times
+    numPolygons = len(zoneIndex['zoneValues'])
+    crossingKeys = np.concatenate([pairPoints[upCrosses] * numPolygons + zoneIndex['featureIds'][edgeIds[upCrosses]],
+                                   pairPoints[acrossCrosses] * numPolygons + zoneIndex['featureIds'][edgeIds[acrossCrosses]],
+                                   cornerPoints * numPolygons + cornerPolygons])
+    uniqueKeys, keyCounts = np.unique(crossingKeys, return_counts=True)
+    insideKeys = uniqueKeys[keyCounts % 2 == 1]
+
+    # keys are sorted, so the first key of each point holds its first polygon
+    insidePoints, firstKeys = np.unique(insideKeys // numPolygons, return_index=True)
+    pointPolygons = np.full(len(pointX), -1, dtype=np.int64)
+    pointPolygons[inGrid[insidePoints]] = insideKeys[firstKeys] % numPolygons
+    return pointPolygons
+### end of locateChunk ###
+
+
+# assign every point to the zone polygon containing it, or to the closest zone polygon for points outside all
+# polygons
+# INPUTS:
+#    zoneIndex (dict) - index returned by buildZoneIndex
+#    pointX, pointY (float arrays) - point coordinates, in the zone projection
+#    useClosest (bool) - assign points outside all polygons to the closest polygon.  Otherwise they have no zone
+# OUTPUTS:
+#    pointPolygons (int array) - polygon number of each point, -1 for points without a zone
+def locatePoints(zoneIndex, pointX, pointY, useClosest=True):
+    pointX = np.asarray(pointX, dtype=np.float64)
+    pointY = np.asarray(pointY, dtype=np.float64)
+    pointPolygons = np.full(len(pointX), -1, dtype=np.int64)
+
+    # chunks hold about LOCATE_CHUNK_PAIRS (point, edge) pairs, so memory does not depend on the number of points
+    pointPairs = np.ones(len(pointX), dtype=np.int64)
+    inGrid, pointRows, pointCols, firstEntry, numEntries = findPointCells(zoneIndex, pointX, pointY)
+    pointPairs[inGrid] += numEntries
+    chunkEnds = np.searchsorted(np.cumsum(pointPairs), np.arange(1, pointPairs.sum() // LOCATE_CHUNK_PAIRS + 1) *
+                                LOCATE_CHUNK_PAIRS)
+    chunkBounds = np.unique(np.concatenate([[0], chunkEnds + 1, [len(pointX)]]).clip(0, len(pointX)))
+    for chunkStart, chunkEnd in zip(chunkBounds[:-1], chunkBounds[1:]):
+        chunk = slice(chunkStart, chunkEnd)
+        pointPolygons[chunk] = locateChunk(zoneIndex, pointX[chunk], pointY[chunk])
+    outside = np.where(pointPolygons < 0)[0]
+    if useClosest and len(outside) > 0:
+        if zoneIndex['nearestIndex'] is None:
+            zoneIndex['nearestIndex'] = nearestDistance.buildFeatureIndex(zoneIndex['edges'], zoneIndex['featureIds'])
+        pointPolygons[outside] = nearestDistance.nearestFeatures(zoneIndex['nearestIndex'], pointX[outside],
+                                                                 pointY[outside], 1)[1][:, 0]
+        print(str(len(outside)) + " points outside all zone polygons were assigned to the closest zone")
+    return pointPolygons
+### end of locatePoints ###
+
+
+# assign a zone value to every point
+# INPUTS:
+#    pointX, pointY (float arrays) - point coordinates, in the zone projection
+#    zoneFile (str) - full filepath to the zone polygon shapefile
+# OUTPUTS:
+#    pointZones (array) - zone value of each point
+def assignPointZones(pointX, pointY, zoneFile=values.INPUT_FOLDER + values.ZONE_DEFINITIONS):
+    startTime = time.time()
+    zoneIndex = loadZoneIndex(zoneFile)
+    pointZones = zoneIndex['zoneValues'][locatePoints(zoneIndex, pointX, pointY)]
+    print("assigned zones to " + str(len(pointZones)) + " points in " + str(time.time() - startTime) + " seconds")
+    return pointZones
+### end of assignPointZones ###
+
+
+# copy the air monitor shapefile with a zone field holding the zone of each monitor
+# INPUTS:
+#    airMonitorFile (str) - full filepath to the air monitor shapefile
+#    zoneFile (str) - full filepath to the zone polygon shapefile
+#    outputFile (str) - full filepath of the air monitor shapefile with zones to write
+def writeMonitorZones(airMonitorFile, zoneFile, outputFile):
+    monitorIds, monitorX, monitorY = zonalStatistics.readAirMonitorPoints(airMonitorFile)
+    monitorZones = assignPointZones(monitorX, monitorY, zoneFile)
+    with fiona.open(zoneFile) as zoneSource:
+        zoneFieldType = zoneSource.schema['properties'][values.ZONE_FIELD]
+    with fiona.open(airMonitorFile) as source:
+        schema = source.schema.copy()
+        schema['properties'] = schema['properties'].copy()
+        schema['properties'][values.ZONE_FIELD] = zoneFieldType
+        with fiona.open(outputFile, 'w', driver=source.driver, crs=source.crs, schema=schema) as output:
+            for monitorIndex, feature in enumerate(source):
+                properties = dict(feature['properties'])
+                properties[values.ZONE_FIELD] = monitorZones[monitorIndex].item()
+                output.write({'geometry': feature['geometry'], 'properties': properties})
+### end of writeMonitorZones ###
+
+
+# read the zone of every air monitor from a shapefile written by writeMonitorZones
+# INPUTS:
+#    zonesDefined (str) - full filepath to the air monitor shapefile with zones
+# OUTPUTS:
+#    monitorZones (array) - zone of each air monitor, in record order
+def readMonitorZones(zonesDefined):
+    monitorZones = readZoneValues(zonesDefined, values.ZONE_FIELD)
+    return monitorZones
+### end of readMonitorZones ###
+
+################# end of functions ############################
+
+
+############### end of zoneAssignment_Canada_LUR.py ###############